@@ -0,0 +1,108 @@
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import PdfBlob
+
+
+def acquire_blob(sha256, uploaded_file):
+    """
+    Returns the shared PdfBlob for this content hash with one more reference,
+    storing `uploaded_file` only if no blob exists for the hash yet. Storage
+    therefore grows with unique papers, not uploads.
+    """
+    while True:
+        blob = PdfBlob.objects.filter(sha256=sha256).first()
+        if blob is None:
+            blob = PdfBlob(sha256=sha256, size=uploaded_file.size or 0)
+            # Upload outside of any transaction: it can take a while
+            blob.pdf_file.save(uploaded_file.name, uploaded_file, save=False)
+            try:
+                with transaction.atomic():
+                    blob.save()
+            except IntegrityError:
+                # A concurrent upload of the same PDF created the blob first
+                _delete_stored_file(blob.pdf_file.name)
+                continue
+        # Zero rows updated means the blob was garbage-collected in between
+        if PdfBlob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1):
+            blob.refresh_from_db(fields=['ref_count'])
+            return blob
+
+
+def adopt_stored_pdf(sha256, file_name, size):
+    """
+    acquire_blob for a PDF that is already in storage (a direct upload):
+    the stored file becomes the new blob's if there's no blob for the hash
+    yet. Otherwise the caller should delete it, as the blob returned keeps
+    its own copy.
+    """
+    while True:
+        blob = PdfBlob.objects.filter(sha256=sha256).first()
+        if blob is None:
+            blob = PdfBlob(sha256=sha256, size=size, pdf_file=file_name)
+            try:
+                with transaction.atomic():
+                    blob.save()
+            except IntegrityError:
+                # A concurrent upload of the same PDF created the blob first
+                continue
+        if PdfBlob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1):
+            blob.refresh_from_db(fields=['ref_count'])
+            return blob
+
+
+def release_blob(blob_id):
+    """
+    Drops one reference to a blob, deleting the blob row and its stored file
+    once no Paper points at it anymore.
+    """
+    with transaction.atomic():
+        blob = PdfBlob.objects.select_for_update().filter(pk=blob_id).first()
+        if blob is None:
+            return
+        if blob.ref_count > 1:
+            PdfBlob.objects.filter(pk=blob_id).update(ref_count=F('ref_count') - 1)
+            return
+        if blob.papers.exists():
+            # Counter drifted (e.g. a crash between writes); trust the rows
+            PdfBlob.objects.filter(pk=blob_id).update(ref_count=blob.papers.count())
+            return
+        file_name = blob.pdf_file.name
+        blob.delete()
+    _delete_stored_file(file_name)
+
+
+def collect_garbage(dry_run=False):
+    """
+    Recounts references from the Paper rows and deletes every blob (older
+    than an hour) nothing points at. Returns (blobs_deleted, bytes_freed).
+    """
+    deleted, freed = 0, 0
+    # Skip brand-new blobs: an upload may be between creating the blob and its Paper
+    cutoff = timezone.now() - timedelta(hours=1)
+    for blob in PdfBlob.objects.filter(created_at__lt=cutoff).iterator():
+        actual = blob.papers.count()
+        if actual:
+            if actual != blob.ref_count and not dry_run:
+                PdfBlob.objects.filter(pk=blob.pk).update(ref_count=actual)
+            continue
+        deleted += 1
+        freed += blob.size
+        if not dry_run:
+            file_name = blob.pdf_file.name
+            blob.delete()
+            _delete_stored_file(file_name)
+    return deleted, freed
+
+
+def _delete_stored_file(file_name):
+    if not file_name:
+        return
+    storage = PdfBlob._meta.get_field('pdf_file').storage
+    try:
+        storage.delete(file_name)
+    except Exception as e:
+        print(f"Error deleting blob file {file_name}: {e}")
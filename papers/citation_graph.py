@@ -0,0 +1,173 @@
+import json
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F
+
+from .models import CitationEdge, CitedWork, Paper
+
+# SQLite caps the parameters of one query; IN lists are sent in slices
+_IN_BATCH = 500
+
+
+def paper_citations(references_json):
+    """
+    {canonical_id: title} of the works a stored references list cites.
+    """
+    try:
+        references = json.loads(references_json) if references_json else []
+    except ValueError:
+        return {}
+    cited = {}
+    for ref in references:
+        canonical_id = ref.get("canonical_id") if isinstance(ref, dict) else None
+        if canonical_id:
+            cited.setdefault(canonical_id, ref.get("title") or "")
+    return cited
+
+
+def sync_paper_citations(paper):
+    """
+    Brings the paper's edges (and its owner's citation counts) in line with
+    its references_json. Only the difference is written, so re-saving a
+    paper whose references didn't change costs one indexed read.
+    """
+    cited = paper_citations(paper.references_json)
+    existing = set(CitationEdge.objects.filter(paper_id=paper.pk).values_list("canonical_id", flat=True))
+    added = [cid for cid in cited if cid not in existing]
+    removed = [cid for cid in existing if cid not in cited]
+    if not added and not removed:
+        return
+
+    with transaction.atomic():
+        for batch in _batches(removed):
+            CitationEdge.objects.filter(paper_id=paper.pk, canonical_id__in=batch).delete()
+        CitationEdge.objects.bulk_create(
+            [CitationEdge(owner_id=paper.owner_id, paper_id=paper.pk, canonical_id=cid) for cid in added],
+            ignore_conflicts=True,
+        )
+        _adjust_counts(paper.owner_id, {cid: cited[cid] for cid in added}, +1)
+        _adjust_counts(paper.owner_id, dict.fromkeys(removed, ""), -1)
+
+
+def remove_paper_citations(paper):
+    """
+    Drops a deleted paper's edges and their contribution to the counts.
+    """
+    with transaction.atomic():
+        cited = list(CitationEdge.objects.filter(paper_id=paper.pk).values_list("canonical_id", flat=True))
+        CitationEdge.objects.filter(paper_id=paper.pk).delete()
+        _adjust_counts(paper.owner_id, dict.fromkeys(cited, ""), -1)
+
+
+def rebuild_citation_graph(owner_ids=None):
+    """
+    Recomputes edges and counts from scratch, for the given owners or for
+    everyone. Returns the number of edges written.
+    """
+    papers = Paper.objects.exclude(references_json="")
+    edges, counts = CitationEdge.objects.all(), CitedWork.objects.all()
+    if owner_ids is not None:
+        papers = papers.filter(owner_id__in=owner_ids)
+        edges, counts = edges.filter(owner_id__in=owner_ids), counts.filter(owner_id__in=owner_ids)
+
+    written = 0
+    with transaction.atomic():
+        edges.delete()
+        counts.delete()
+        citations = defaultdict(Counter)
+        titles = {}
+        batch = []
+        for pk, owner_id, references_json in papers.values_list("pk", "owner_id", "references_json").iterator():
+            for cid, title in paper_citations(references_json).items():
+                batch.append(CitationEdge(owner_id=owner_id, paper_id=pk, canonical_id=cid))
+                citations[owner_id][cid] += 1
+                titles.setdefault(cid, title)
+            if len(batch) >= 5000:
+                CitationEdge.objects.bulk_create(batch)
+                written += len(batch)
+                batch = []
+        CitationEdge.objects.bulk_create(batch)
+        written += len(batch)
+        CitedWork.objects.bulk_create(
+            [CitedWork(owner_id=owner_id, canonical_id=cid, title=titles[cid], citations=n)
+             for owner_id, counter in citations.items() for cid, n in counter.items()],
+            batch_size=5000,
+        )
+    return written
+
+
+def library_citations(owner):
+    """
+    Citations between papers of the owner's library, as
+    [{"citing": paper id, "cited": paper id, "mutual": bool}].
+    """
+    papers_by_work = defaultdict(list)
+    for cid, pk in Paper.objects.filter(owner=owner).exclude(canonical_id="").values_list("canonical_id", "pk"):
+        papers_by_work[cid].append(pk)
+
+    pairs = set()
+    library_works = Paper.objects.filter(owner=owner).exclude(canonical_id="").values("canonical_id")
+    for citing, cid in (CitationEdge.objects.filter(owner=owner, canonical_id__in=library_works)
+                        .values_list("paper_id", "canonical_id")):
+        pairs.update((citing, cited) for cited in papers_by_work[cid] if cited != citing)
+
+    return [
+        {"citing": citing, "cited": cited, "mutual": (cited, citing) in pairs}
+        for citing, cited in sorted(pairs)
+    ]
+
+
+def most_cited_works(owner, limit=20):
+    """
+    The works cited by the most papers in the owner's library, with the
+    library papers that are those works (if any).
+    """
+    works = list(CitedWork.objects.filter(owner=owner).order_by("-citations", "canonical_id")
+                 .values("canonical_id", "title", "citations")[:limit])
+    return _with_library_papers(owner, works)
+
+
+def cocited_works(owner, canonical_id, limit=20):
+    """
+    Co-citation neighbours of a work: the works most often cited together
+    with it by papers of the owner's library, with how many papers do so.
+    """
+    citing = CitationEdge.objects.filter(owner=owner, canonical_id=canonical_id).values("paper_id")
+    rows = list(CitationEdge.objects.filter(paper_id__in=citing).exclude(canonical_id=canonical_id)
+                .values("canonical_id").annotate(cocitations=Count("id"))
+                .order_by("-cocitations", "canonical_id")[:limit])
+    titles = dict(CitedWork.objects.filter(owner=owner, canonical_id__in=[r["canonical_id"] for r in rows])
+                  .values_list("canonical_id", "title"))
+    works = [dict(row, title=titles.get(row["canonical_id"], "")) for row in rows]
+    return _with_library_papers(owner, works)
+
+
+def _with_library_papers(owner, works):
+    papers_by_work = defaultdict(list)
+    for cid, pk in Paper.objects.filter(owner=owner, canonical_id__in=[w["canonical_id"] for w in works]) \
+            .values_list("canonical_id", "pk"):
+        papers_by_work[cid].append(pk)
+    for work in works:
+        work["papers"] = papers_by_work[work["canonical_id"]]
+    return works
+
+
+def _adjust_counts(owner_id, titles_by_work, delta):
+    if not titles_by_work:
+        return
+    if delta > 0:
+        CitedWork.objects.bulk_create(
+            [CitedWork(owner_id=owner_id, canonical_id=cid, title=title) for cid, title in titles_by_work.items()],
+            ignore_conflicts=True,
+        )
+    for batch in _batches(list(titles_by_work)):
+        works = CitedWork.objects.filter(owner_id=owner_id, canonical_id__in=batch)
+        works.update(citations=F("citations") + delta)
+        if delta < 0:
+            works.filter(citations=0).delete()
+
+
+def _batches(items):
+    for start in range(0, len(items), _IN_BATCH):
+        yield items[start:start + _IN_BATCH]
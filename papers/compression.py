@@ -0,0 +1,94 @@
+import functools
+import re
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_string
+
+from ResearchParsing.parsing.metrics import describe, inc, observe
+
+_CODING_RE = re.compile(r"^\s*([\w*-]+)\s*(?:;\s*q\s*=\s*([0-9.]+))?\s*$")
+
+
+def compress_response(view):
+    """
+    Compresses the view's response with brotli or gzip, whichever the client
+    prefers among those it accepts (brotli on ties: smaller for JSON), when
+    the body is at least COMPRESS_MIN_BYTES. Brotli needs the optional
+    `brotli` package; without it only gzip is offered.
+    """
+    @functools.wraps(view)
+    def wrapped(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        return compress(request, response)
+    return wrapped
+
+
+def compress(request, response):
+    if response.streaming or response.has_header("Content-Encoding"):
+        return response
+    patch_vary_headers(response, ("Accept-Encoding",))
+    if len(response.content) < getattr(settings, "COMPRESS_MIN_BYTES", 1024):
+        return response
+
+    coding = negotiate_encoding(request.headers.get("Accept-Encoding", ""))
+    if coding is None:
+        return response
+
+    original = len(response.content)
+    if coding == "br":
+        import brotli
+        compressed = brotli.compress(response.content, quality=getattr(settings, "BROTLI_QUALITY", 5))
+    else:
+        compressed = compress_string(response.content)
+    if len(compressed) >= original:
+        return response
+
+    response.content = compressed
+    response["Content-Length"] = str(len(compressed))
+    response["Content-Encoding"] = coding
+    # The representation changed, so a strong ETag no longer applies
+    etag = response.get("ETag")
+    if etag and etag.startswith('"'):
+        response["ETag"] = "W/" + etag
+    inc("response_compression_total", encoding=coding)
+    observe("response_compression_ratio", len(compressed) / original, encoding=coding)
+    return response
+
+
+def negotiate_encoding(accept_encoding):
+    """
+    "br", "gzip" or None for an Accept-Encoding header, honouring q-values.
+    """
+    weights = {}
+    for part in accept_encoding.split(","):
+        match = _CODING_RE.match(part)
+        if not match:
+            continue
+        try:
+            weights[match.group(1).lower()] = float(match.group(2) or 1)
+        except ValueError:
+            continue
+
+    available = ["gzip"]
+    if _brotli_available():
+        available.insert(0, "br")
+    best, best_weight = None, 0.0
+    for coding in available:
+        weight = weights.get(coding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = coding, weight
+    return best
+
+
+@functools.lru_cache(maxsize=None)
+def _brotli_available():
+    try:
+        import brotli  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+describe("response_compression_total", "counter", "API responses compressed, by content encoding.")
+describe("response_compression_ratio", "summary", "Compressed / original size of compressed API responses.")
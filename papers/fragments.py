@@ -0,0 +1,51 @@
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from ResearchParsing.parsing.metrics import describe, inc
+
+# Rendered parts of the paper detail page that are cached server-side
+FRAGMENTS = ("references", "tables")
+
+# Kept well past any realistic editing session; staleness is handled by the
+# version check and the post_save invalidation in models.py, not by expiry
+FRAGMENT_TTL = 24 * 3600
+
+
+def paper_version(paper):
+    """
+    Opaque token that changes whenever the paper's stored results change.
+    """
+    return f"{paper.pk}-{int(paper.updated_at.timestamp() * 1_000_000)}"
+
+
+def render_fragment(paper, name, template_name, build_context):
+    """
+    Returns the rendered HTML of one fragment of the paper's page, from the
+    cache when it was rendered for the current version of the paper.
+    `build_context` is only called on a miss, so decoding the stored JSON is
+    skipped along with the rendering.
+    """
+    key = _fragment_key(paper.pk, name)
+    version = paper_version(paper)
+    cached = cache.get(key)
+    if cached is not None and cached[0] == version:
+        inc("fragment_cache_requests_total", fragment=name, result="hit")
+        return mark_safe(cached[1])
+
+    inc("fragment_cache_requests_total", fragment=name, result="miss")
+    html = render_to_string(template_name, build_context())
+    cache.set(key, (version, str(html)), FRAGMENT_TTL)
+    return html
+
+
+def invalidate_paper_fragments(paper_id):
+    cache.delete_many([_fragment_key(paper_id, name) for name in FRAGMENTS])
+
+
+def _fragment_key(paper_id, name):
+    return f"paper-fragment:{paper_id}:{name}"
+
+
+describe("fragment_cache_requests_total", "counter",
+         "Paper page fragments served from the cache (hit) or rendered (miss).")
@@ -0,0 +1,77 @@
+import json
+import random
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ResearchParsing.papers.citation_graph import (
+    cocited_works, library_citations, most_cited_works, rebuild_citation_graph,
+)
+from ResearchParsing.papers.models import Paper
+
+
+class Command(BaseCommand):
+    help = (
+        "Times the citation-graph queries on a synthetic library created in a "
+        "transaction that is rolled back afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--papers", type=int, default=10_000)
+        parser.add_argument("--references", type=int, default=40, help="References per paper")
+        parser.add_argument("--works", type=int, default=200_000, help="Distinct cited works")
+        parser.add_argument("--repeat", type=int, default=20, help="Runs per query; the median is reported")
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--json", dest="json_out", default="",
+                            help="Also write the results to this JSON file")
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        works = [f"ref_{i:016x}" for i in range(options["works"])]
+        # Work popularity is Zipf-like, as in real bibliographies
+        weights = [1 / rank for rank in range(1, len(works) + 1)]
+
+        with transaction.atomic():
+            owner = User.objects.create_user(f"citation-benchmark-{rng.random()}")
+            papers = []
+            for i in range(options["papers"]):
+                cited = set(rng.choices(works, weights=weights, k=options["references"]))
+                papers.append(Paper(
+                    owner=owner, pdf_file=f"benchmark/{i}.pdf", pdf_hash=f"{i:064x}",
+                    # A third of the library are works the others cite
+                    canonical_id=rng.choice(works[:50_000]) if rng.random() < 0.33 else "",
+                    references_json=json.dumps([{"title": cid, "canonical_id": cid} for cid in cited]),
+                ))
+            Paper.objects.bulk_create(papers, batch_size=2000)
+
+            start = time.perf_counter()
+            edges = rebuild_citation_graph([owner.id])
+            build_seconds = time.perf_counter() - start
+
+            sample = Paper.objects.filter(owner=owner).exclude(canonical_id="").first()
+            queries = {
+                "library_citations": lambda: library_citations(owner),
+                "most_cited_works": lambda: most_cited_works(owner, 20),
+                "cocited_works": lambda: cocited_works(owner, sample.canonical_id, 20),
+            }
+            results = {"papers": options["papers"], "edges": edges, "build_seconds": round(build_seconds, 2)}
+            for name, query in queries.items():
+                timings = []
+                for _ in range(max(1, options["repeat"])):
+                    start = time.perf_counter()
+                    rows = query()
+                    timings.append(time.perf_counter() - start)
+                results[f"{name}_ms"] = round(statistics.median(timings) * 1000, 2)
+                results[f"{name}_rows"] = len(rows)
+
+            transaction.set_rollback(True)
+
+        for key, value in results.items():
+            self.stdout.write(f"{key:<24} {value}")
+        if options["json_out"]:
+            with open(options["json_out"], "w") as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f"Wrote {options['json_out']}")
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from ResearchParsing.papers.blobs import collect_garbage
+from ResearchParsing.parsing.consolidation import expire_stalled_consolidations
+from ResearchParsing.parsing.direct_upload import discard_abandoned_uploads
+
+
+class Command(BaseCommand):
+    help = (
+        "Recounts PdfBlob references from the Paper rows and deletes blobs "
+        "(and their stored PDFs) that no paper points at anymore, plus direct "
+        "uploads that were never posted to a parse form before their token expired. "
+        "Also fails reference consolidations stuck pending past GROBID_CONSOLIDATION_TIMEOUT."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true",
+                            help="Only report what would be deleted")
+
+    def handle(self, *args, **options):
+        deleted, freed = collect_garbage(dry_run=options["dry_run"])
+        verb = "Would delete" if options["dry_run"] else "Deleted"
+        self.stdout.write(f"{verb} {deleted} unreferenced blob(s), {freed / 1e6:.1f} MB")
+        deleted, freed = discard_abandoned_uploads(dry_run=options["dry_run"])
+        self.stdout.write(f"{verb} {deleted} abandoned direct upload(s), {freed / 1e6:.1f} MB")
+        if not options["dry_run"]:
+            self.stdout.write(f"Failed {expire_stalled_consolidations()} stalled reference consolidation(s)")
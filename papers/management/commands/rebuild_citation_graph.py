@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from ResearchParsing.papers.citation_graph import rebuild_citation_graph
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes the citation graph (CitationEdge, CitedWork) from the "
+        "papers' stored references. Parsing keeps it up to date; this is for "
+        "backfills, e.g. after `manage.py canonicalize_references`."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--owner", type=int, action="append", dest="owners",
+                            help="Only rebuild this user id's library (repeatable)")
+
+    def handle(self, *args, **options):
+        written = rebuild_citation_graph(options["owners"])
+        self.stdout.write(f"Wrote {written} citation edge(s)")
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.5 on 2026-10-19 11:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('papers', '0003_paper_methods_text_paper_references_json_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paper',
+            name='parse_timings_json',
+            field=models.TextField(blank=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.5 on 2026-10-19 11:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('papers', '0004_paper_parse_timings_json'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paper',
+            name='references_consolidation',
+            field=models.CharField(blank=True, choices=[('pending', 'Enrichment Pending'), ('done', 'Enriched'), ('failed', 'Enrichment Failed')], max_length=20),
+        ),
+    ]
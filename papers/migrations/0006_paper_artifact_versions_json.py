@@ -0,0 +1,18 @@
+# Generated by Django 5.1.5 on 2026-10-19 11:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('papers', '0005_paper_references_consolidation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paper',
+            name='artifact_versions_json',
+            field=models.TextField(blank=True),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.5 on 2026-10-19 11:08
+
+import ResearchParsing.papers.models
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('papers', '0006_paper_artifact_versions_json'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PdfBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True)),
+                ('pdf_file', models.FileField(upload_to=ResearchParsing.papers.models.blob_upload_path)),
+                ('size', models.BigIntegerField(default=0)),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('references_json', models.TextField(blank=True)),
+                ('methods_text', models.TextField(blank=True)),
+                ('tables_json', models.TextField(blank=True)),
+                ('summary_text', models.TextField(blank=True)),
+                ('artifact_versions_json', models.TextField(blank=True)),
+                ('references_consolidation', models.CharField(blank=True, max_length=20)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='paper',
+            name='blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='papers', to='papers.pdfblob'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+from django.db import migrations
+
+
+def backfill_blobs(apps, schema_editor):
+    """
+    Points every existing Paper at a PdfBlob for its hash. The blob reuses the
+    first paper's already-stored file, so nothing is copied; duplicate uploads
+    keep their own (now unreferenced by the blob) files until deleted.
+    """
+    Paper = apps.get_model('papers', 'Paper')
+    PdfBlob = apps.get_model('papers', 'PdfBlob')
+    for paper in Paper.objects.filter(blob__isnull=True).exclude(pdf_hash='').order_by('id').iterator():
+        blob = PdfBlob.objects.filter(sha256=paper.pdf_hash).first()
+        if blob is None:
+            blob = PdfBlob.objects.create(sha256=paper.pdf_hash, pdf_file=paper.pdf_file.name)
+        blob.ref_count += 1
+        blob.save(update_fields=['ref_count'])
+        paper.blob_id = blob.pk
+        paper.save(update_fields=['blob'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('papers', '0007_pdfblob_paper_blob'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_blobs, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.1.5 on 2026-10-19 11:10
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def merge_duplicate_papers(apps, schema_editor):
+    """
+    Keeps the oldest Paper per (owner, pdf_hash) so the unique constraint can
+    be added. Results missing on the kept row are taken from the duplicates,
+    whose blob references are released.
+    """
+    Paper = apps.get_model('papers', 'Paper')
+    PdfBlob = apps.get_model('papers', 'PdfBlob')
+    result_fields = ['references_json', 'methods_text', 'tables_json', 'summary_text']
+
+    duplicates = (
+        Paper.objects.exclude(pdf_hash='')
+        .values('owner_id', 'pdf_hash')
+        .annotate(n=Count('id'))
+        .filter(n__gt=1)
+    )
+    for dup in duplicates:
+        papers = list(Paper.objects.filter(owner_id=dup['owner_id'], pdf_hash=dup['pdf_hash']).order_by('id'))
+        keep, extras = papers[0], papers[1:]
+        for extra in extras:
+            for field in result_fields:
+                if not getattr(keep, field) and getattr(extra, field):
+                    setattr(keep, field, getattr(extra, field))
+            if extra.blob_id:
+                blob = PdfBlob.objects.get(pk=extra.blob_id)
+                blob.ref_count = max(0, blob.ref_count - 1)
+                blob.save(update_fields=['ref_count'])
+            extra.delete()
+        keep.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('papers', '0008_backfill_pdf_blobs'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_papers, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='paper',
+            constraint=models.UniqueConstraint(condition=models.Q(('pdf_hash', ''), _negated=True), fields=('owner', 'pdf_hash'), name='unique_paper_per_owner_and_hash'),
+        ),
+    ]
@@ -0,0 +1,82 @@
+# Generated by Django 5.1.5 on 2026-10-19 11:39
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('papers', '0010_paper_updated_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CitationEdge',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('canonical_id', models.CharField(max_length=32)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CitedWork',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('canonical_id', models.CharField(max_length=32)),
+                ('title', models.TextField(blank=True)),
+                ('citations', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='paper',
+            name='canonical_id',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='pdfblob',
+            name='canonical_id',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='pdfblob',
+            name='title',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='paper',
+            index=models.Index(fields=['owner', 'canonical_id'], name='paper_owner_canonical_idx'),
+        ),
+        migrations.AddField(
+            model_name='citationedge',
+            name='owner',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='citationedge',
+            name='paper',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='citation_edges', to='papers.paper'),
+        ),
+        migrations.AddField(
+            model_name='citedwork',
+            name='owner',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='citationedge',
+            index=models.Index(fields=['owner', 'canonical_id'], name='citation_owner_work_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='citationedge',
+            constraint=models.UniqueConstraint(fields=('paper', 'canonical_id'), name='unique_citation_edge'),
+        ),
+        migrations.AddIndex(
+            model_name='citedwork',
+            index=models.Index(fields=['owner', '-citations'], name='cited_work_ranking_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='citedwork',
+            constraint=models.UniqueConstraint(fields=('owner', 'canonical_id'), name='unique_cited_work'),
+        ),
+    ]
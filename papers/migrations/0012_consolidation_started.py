@@ -0,0 +1,23 @@
+# Generated by Django 5.1.5 on 2026-10-19 13:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('papers', '0011_citation_graph'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paper',
+            name='references_consolidation_started',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='pdfblob',
+            name='references_consolidation_started',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,7 +1,52 @@
 # Create your models here.
 import hashlib
+from datetime import timedelta
+
+from django.conf import settings
 from django.db import models
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
 from django.contrib.auth.models import User
+from django.utils import timezone
+
+def blob_upload_path(instance, filename):
+    # Content-addressed: one object per unique PDF, keeping the first uploader's file name
+    return f"pdf_blobs/{instance.sha256}/{filename}"
+
+
+def consolidation_timeout():
+    return timedelta(seconds=getattr(settings, "GROBID_CONSOLIDATION_TIMEOUT", 1800))
+
+
+class PdfBlob(models.Model):
+    """
+    One stored PDF per unique sha256, shared by every Paper (of any owner)
+    that uploaded the same file, together with the owner-independent parse
+    artifacts. `ref_count` is the number of Papers pointing at the blob; the
+    blob and its file are deleted when it drops to zero (see papers/blobs.py).
+    """
+    sha256 = models.CharField(max_length=64, unique=True)
+    pdf_file = models.FileField(upload_to=blob_upload_path)
+    size = models.BigIntegerField(default=0)
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    # Shared parse results, stamped with the pipeline version that produced them
+    references_json = models.TextField(blank=True)
+    methods_text = models.TextField(blank=True)
+    tables_json = models.TextField(blank=True)
+    summary_text = models.TextField(blank=True)
+    artifact_versions_json = models.TextField(blank=True)
+    references_consolidation = models.CharField(max_length=20, blank=True)
+    references_consolidation_started = models.DateTimeField(null=True, blank=True)
+    # The paper's own title and canonical reference ID, from GROBID's TEI
+    # header; shared along with the references
+    title = models.CharField(max_length=255, blank=True)
+    canonical_id = models.CharField(max_length=32, blank=True)
+
+    def __str__(self):
+        return f"{self.sha256[:12]} ({self.ref_count} refs)"
+
 
 class Paper(models.Model):
     owner = models.ForeignKey(
@@ -10,8 +55,19 @@ class Paper(models.Model):
         related_name='papers'
     )
     pdf_file = models.FileField(upload_to='uploaded_pdfs/')
+    # Shared content-addressed copy of the PDF; pdf_file points at the blob's file
+    blob = models.ForeignKey(
+        PdfBlob,
+        on_delete=models.PROTECT,
+        related_name='papers',
+        null=True,
+        blank=True
+    )
     pdf_hash = models.CharField(max_length=64, blank=True, db_index=True)
     title = models.CharField(max_length=255, blank=True)
+    # The work this paper is, as other papers' references identify it
+    # (parsing/reference_index.py); links papers in the citation graph
+    canonical_id = models.CharField(max_length=32, blank=True)
     parse_type = models.CharField(
         max_length=50,
         choices=[
@@ -22,6 +78,10 @@ class Paper(models.Model):
         blank=True
     )
     created_at = models.DateTimeField(auto_now_add=True)
+    # Bumped on every change to the paper; drives the detail page's ETag and
+    # fragment cache (see papers/fragments.py). Code writing with update()
+    # must set it explicitly.
+    updated_at = models.DateTimeField(auto_now=True)
 
     # Fields to store parse results
     references_json = models.TextField(blank=True)
@@ -29,14 +89,99 @@ class Paper(models.Model):
     tables_json = models.TextField(blank=True)
     summary_text = models.TextField(blank=True)
 
+    # Background citation consolidation of references_json (see parsing/consolidation.py)
+    references_consolidation = models.CharField(
+        max_length=20,
+        choices=[
+            ('pending', 'Enrichment Pending'),
+            ('done', 'Enriched'),
+            ('failed', 'Enrichment Failed')
+        ],
+        blank=True
+    )
+    # When the pass was queued: 'pending' for longer than
+    # GROBID_CONSOLIDATION_TIMEOUT means the task was lost (worker recycled,
+    # CPU throttled after the response) and counts as failed
+    references_consolidation_started = models.DateTimeField(null=True, blank=True)
+
+    # Pipeline version that produced each stored artifact, as JSON, e.g.
+    # {"references": "1/standard", "tables": "1"} (see parsing/versions.py)
+    artifact_versions_json = models.TextField(blank=True)
+
+    # Seconds spent in each pipeline stage (GROBID, storage fetch, tabula, OpenAI...)
+    # as JSON, e.g. {"grobid_references": 12.4, "openai_filter_references": 8.1}
+    parse_timings_json = models.TextField(blank=True)
+
+    class Meta:
+        constraints = [
+            # Backs the get-or-create in the parse views: concurrent uploads of
+            # the same PDF by one owner end up on a single Paper
+            models.UniqueConstraint(
+                fields=['owner', 'pdf_hash'],
+                condition=~models.Q(pdf_hash=''),
+                name='unique_paper_per_owner_and_hash',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['owner', 'canonical_id'], name='paper_owner_canonical_idx'),
+        ]
+
     def __str__(self):
         return (self.title or self.pdf_file.name) + " (Owner: " + self.owner.username + ")"
 
+    @property
+    def consolidation_in_progress(self):
+        """
+        True while the background consolidation may still update the references.
+        """
+        started = self.references_consolidation_started
+        return (self.references_consolidation == 'pending' and started is not None
+                and timezone.now() - started < consolidation_timeout())
+
     def save(self, *args, **kwargs):
         if self.pdf_file and not self.pdf_hash:
             self.pdf_hash = compute_file_hash(self.pdf_file)
         super().save(*args, **kwargs)
 
+class CitationEdge(models.Model):
+    """
+    "paper cites the work canonical_id": the citation graph's adjacency,
+    derived from the paper's references_json (see papers/citation_graph.py).
+    The owner is denormalized so library queries never join through Paper.
+    """
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    paper = models.ForeignKey(Paper, on_delete=models.CASCADE, related_name='citation_edges')
+    canonical_id = models.CharField(max_length=32)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['paper', 'canonical_id'], name='unique_citation_edge'),
+        ]
+        indexes = [
+            models.Index(fields=['owner', 'canonical_id'], name='citation_owner_work_idx'),
+        ]
+
+
+class CitedWork(models.Model):
+    """
+    How many papers in the owner's library cite a work, maintained with the
+    edges so "most cited" is an index scan rather than a GROUP BY.
+    """
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    canonical_id = models.CharField(max_length=32)
+    # Title as first cited, for display
+    title = models.TextField(blank=True)
+    citations = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'canonical_id'], name='unique_cited_work'),
+        ]
+        indexes = [
+            models.Index(fields=['owner', '-citations'], name='cited_work_ranking_idx'),
+        ]
+
+
 def compute_file_hash(file_field):
     hasher = hashlib.sha256()
     for chunk in file_field.chunks():
@@ -44,3 +189,33 @@ def compute_file_hash(file_field):
     return hasher.hexdigest()
 
 
+@receiver(post_delete, sender=Paper)
+def release_paper_blob(sender, instance, **kwargs):
+    # Deleting a paper drops its reference; the last one garbage-collects the blob
+    if instance.blob_id:
+        from .blobs import release_blob
+        release_blob(instance.blob_id)
+
+
+@receiver(post_save, sender=Paper)
+def invalidate_paper_fragments_on_save(sender, instance, **kwargs):
+    # Cached detail-page fragments are also keyed by updated_at; dropping them
+    # here just frees the memory of the superseded renderings
+    from .fragments import invalidate_paper_fragments
+    invalidate_paper_fragments(instance.pk)
+
+
+@receiver(post_save, sender=Paper)
+def sync_citation_graph_on_save(sender, instance, update_fields=None, **kwargs):
+    # Saves that can't have touched the references leave the graph alone
+    if update_fields is not None and 'references_json' not in update_fields:
+        return
+    from .citation_graph import sync_paper_citations
+    sync_paper_citations(instance)
+
+
+@receiver(pre_delete, sender=Paper)
+def remove_paper_from_citation_graph(sender, instance, **kwargs):
+    # Before the cascade removes the edges, so the counts can be decremented
+    from .citation_graph import remove_paper_citations
+    remove_paper_citations(instance)
@@ -1,3 +1,317 @@
-from django.test import TestCase
+import gzip
+import hashlib
+import io
+import json
+import os
+import tempfile
+import zipfile
+from datetime import timedelta
 
-# Create your tests here.
+import brotli
+
+import pandas as pd
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from ResearchParsing.parsing import metrics
+from ResearchParsing.parsing.table_extraction import tables_to_json
+from ResearchParsing.parsing.table_formats import decode_tables, load_tables
+from ResearchParsing.parsing.versions import adopt_shared_artifacts, clear_versions, publish_shared_artifacts, \
+    stale_artifacts, stamp_versions, stored_versions
+from .blobs import acquire_blob, release_blob
+from .citation_graph import cocited_works, library_citations, most_cited_works
+from .models import CitedWork, Paper, PdfBlob
+
+
+class PaperDetailCachingTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+        self.user = User.objects.create_user("reader")
+        self.client.force_login(self.user)
+        self.paper = Paper.objects.create(
+            owner=self.user,
+            pdf_file="uploaded_pdfs/paper.pdf",
+            pdf_hash="a" * 64,
+            parse_type="both",
+            references_json=json.dumps([{"title": "Notes on the Engine", "last_name": "Lovelace"}]),
+            tables_json=json.dumps([[{"Dose": "5 mg", "n": 12}]]),
+        )
+        self.url = f"/papers/detail/{self.paper.pk}/"
+
+    def _fragment_count(self, result):
+        return sum(value for (name, labels), value in metrics.snapshot()["counters"].items()
+                   if name == "fragment_cache_requests_total" and ("result", result) in labels)
+
+    def test_conditional_get_returns_not_modified(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Notes on the Engine")
+        self.assertContains(response, "5 mg")
+        etag = response["ETag"]
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.paper.summary_text = "New summary"
+        self.paper.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_fragments_are_reused_until_the_paper_changes(self):
+        self.client.get(self.url)
+        self.client.get(self.url)
+        self.assertEqual(self._fragment_count("miss"), 2)
+        self.assertEqual(self._fragment_count("hit"), 2)
+
+        self.paper.references_json = json.dumps([{"title": "Sketch of the Analytical Engine"}])
+        self.paper.save()
+        response = self.client.get(self.url)
+        self.assertContains(response, "Sketch of the Analytical Engine")
+        self.assertNotContains(response, "Notes on the Engine")
+
+    def test_other_owners_get_not_found(self):
+        self.client.force_login(User.objects.create_user("intruder"))
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+
+class PaperTablesDownloadTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user("exporter")
+        self.client.force_login(self.user)
+        df = pd.DataFrame({0: ["Dose", "Age"], 1: [5.0, float("nan")], 2: ["p < 0.05", 3]})
+        self.paper = Paper.objects.create(
+            owner=self.user, pdf_file="uploaded_pdfs/trial.pdf", pdf_hash="b" * 64,
+            parse_type="methods_tables_only", tables_json=tables_to_json([df, df]),
+        )
+
+    def test_stored_tables_round_trip_with_types(self):
+        table = decode_tables(self.paper.tables_json)[0]
+        self.assertEqual(list(table.columns), ["0", "1", "2"])
+        self.assertEqual(table["1"].tolist()[0], 5)
+        self.assertTrue(pd.isna(table["1"].tolist()[1]))
+        self.assertEqual(table["2"].tolist(), ["p < 0.05", "3"])
+
+    def test_legacy_records_layout_is_still_read(self):
+        legacy = json.dumps([[{"0": "Dose", "1": 5}]], indent=2)
+        self.assertEqual(load_tables(legacy), [{"columns": ["0", "1"], "types": ["str", "str"],
+                                                "rows": [["Dose", 5]]}])
+
+    def test_download_single_table_and_whole_paper(self):
+        base = f"/papers/download/{self.paper.pk}"
+        response = self.client.get(f"{base}/tables/2.csv")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content.decode().splitlines()[1], "Dose,5,p < 0.05")
+
+        response = self.client.get(f"{base}/tables.csv")
+        self.assertContains(response, "--- Table 2 ---")
+
+        response = self.client.get(f"{base}/tables.parquet")
+        self.assertEqual(response["Content-Type"], "application/zip")
+        with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+            self.assertEqual(archive.namelist(), ["table_1.parquet", "table_2.parquet"])
+
+        self.assertEqual(self.client.get(f"{base}/tables/3.arrow").status_code, 404)
+        self.assertEqual(self.client.get(f"{base}/tables.xlsx").status_code, 404)
+
+
+class CitationGraphTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("grapher")
+        self.client.force_login(self.user)
+
+    def _paper(self, number, canonical_id, cites):
+        return Paper.objects.create(
+            owner=self.user, pdf_file=f"uploaded_pdfs/{number}.pdf", pdf_hash=f"{number:064x}",
+            canonical_id=canonical_id,
+            references_json=json.dumps([{"title": f"Work {cid}", "canonical_id": cid} for cid in cites]),
+        )
+
+    def test_graph_follows_saved_and_deleted_papers(self):
+        a = self._paper(1, "ref_a", ["ref_b", "ref_x", "ref_y"])
+        b = self._paper(2, "ref_b", ["ref_a", "ref_x"])
+        c = self._paper(3, "", ["ref_x", "ref_y", "ref_b"])
+
+        self.assertEqual(library_citations(self.user), [
+            {"citing": a.id, "cited": b.id, "mutual": True},
+            {"citing": b.id, "cited": a.id, "mutual": True},
+            {"citing": c.id, "cited": b.id, "mutual": False},
+        ])
+        top = most_cited_works(self.user, 2)
+        self.assertEqual([(w["canonical_id"], w["citations"]) for w in top], [("ref_x", 3), ("ref_b", 2)])
+        self.assertEqual(top[1]["papers"], [b.id])
+        # a and c cite ref_b, both together with ref_x and ref_y
+        neighbours = {w["canonical_id"]: w["cocitations"] for w in cocited_works(self.user, "ref_b")}
+        self.assertEqual(neighbours, {"ref_x": 2, "ref_y": 2})
+
+        c.references_json = json.dumps([{"title": "Work ref_z", "canonical_id": "ref_z"}])
+        c.save()
+        a.delete()
+        self.assertEqual(
+            dict(CitedWork.objects.filter(owner=self.user).values_list("canonical_id", "citations")),
+            {"ref_a": 1, "ref_x": 1, "ref_z": 1},
+        )
+
+    def test_json_endpoints(self):
+        paper = self._paper(1, "ref_a", ["ref_b"])
+        self._paper(2, "ref_b", ["ref_a", "ref_c"])
+
+        links = self.client.get("/papers/graph/citations.json").json()["links"]
+        self.assertEqual(len(links), 2)
+        works = self.client.get("/papers/graph/most-cited.json?limit=1").json()["works"]
+        self.assertEqual(len(works), 1)
+        response = self.client.get(f"/papers/graph/cocited/{paper.id}.json")
+        self.assertEqual([w["canonical_id"] for w in response.json()["works"]], ["ref_c"])
+
+
+class PaperJsonApiTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("scripter")
+        self.client.force_login(self.user)
+        self.papers = [
+            Paper.objects.create(
+                owner=self.user, pdf_file=f"uploaded_pdfs/{n}.pdf", pdf_hash=f"{n:064x}",
+                references_json=json.dumps([{"title": f"Reference {i} of paper {n}"} for i in range(50)]),
+                methods_text="Randomized trial.", summary_text=f"Summary {n}",
+                tables_json=tables_to_json([pd.DataFrame({"Dose": ["5 mg"], "n": [12]})]),
+            )
+            for n in range(3)
+        ]
+
+    def test_sparse_fieldsets_and_bulk_lookup(self):
+        first, second, third = self.papers
+        data = self.client.get(f"/papers/api/papers/{first.id}.json").json()
+        self.assertEqual(len(data["references"]), 50)
+        self.assertNotIn("tables", data)
+
+        data = self.client.get(f"/papers/api/papers/{first.id}.json?fields=tables,summary").json()
+        self.assertEqual(set(data), {"id", "tables", "summary"})
+        self.assertEqual(data["tables"][0]["rows"], [["5 mg", 12]])
+
+        other = Paper.objects.create(owner=User.objects.create_user("other"), pdf_file="uploaded_pdfs/x.pdf",
+                                     pdf_hash="f" * 64)
+        with self.assertNumQueries(3):  # session, user, papers
+            response = self.client.get(f"/papers/api/papers.json?ids={third.id},{other.id},{first.id}&fields=summary")
+        data = response.json()
+        self.assertEqual([p["summary"] for p in data["papers"]], ["Summary 2", "Summary 0"])
+        self.assertEqual(data["missing"], [other.id])
+
+        response = self.client.get("/papers/api/papers.json?fields=tabels")
+        self.assertEqual(response.status_code, 400)
+
+    def test_large_responses_are_compressed(self):
+        url = "/papers/api/papers.json"
+        plain = self.client.get(url).content
+
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING="gzip, deflate, br")
+        self.assertEqual(response["Content-Encoding"], "br")
+        self.assertEqual(brotli.decompress(response.content), plain)
+
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING="br;q=0.5, gzip")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(response.content), plain)
+        self.assertIn("Accept-Encoding", response["Vary"])
+
+
+class SharedBlobTests(TestCase):
+    """
+    The content-addressed PDF store (blobs.py) and the parse results shared
+    through it (parsing/versions.py).
+    """
+    ARTIFACTS = ["references", "methods", "tables", "summary"]
+
+    def setUp(self):
+        self.media = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(STORAGES={
+            "default": {"BACKEND": "django.core.files.storage.FileSystemStorage",
+                        "OPTIONS": {"location": self.media}},
+            "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+        }))
+        self.owners = [User.objects.create_user(f"uploader{i}") for i in range(2)]
+
+    def _upload(self, data=b"%PDF-1.4 shared"):
+        return acquire_blob(hashlib.sha256(data).hexdigest(), SimpleUploadedFile("paper.pdf", data))
+
+    def _paper(self, owner, blob):
+        return Paper.objects.create(owner=owner, pdf_file=blob.pdf_file.name, pdf_hash=blob.sha256, blob=blob)
+
+    def _stored_files(self):
+        return sorted(os.path.relpath(os.path.join(root, name), self.media)
+                      for root, _, names in os.walk(self.media) for name in names)
+
+    def test_one_stored_file_per_pdf_freed_with_its_last_reference(self):
+        first, second = self._upload(), self._upload()
+        self.assertEqual((first.pk, second.ref_count), (second.pk, 2))
+        self.assertEqual(len(self._stored_files()), 1)
+
+        release_blob(first.pk)
+        self.assertEqual(PdfBlob.objects.get().ref_count, 1)
+        release_blob(first.pk)
+        self.assertFalse(PdfBlob.objects.exists())
+        self.assertEqual(self._stored_files(), [])
+
+    def test_release_trusts_paper_rows_over_a_drifted_count(self):
+        blob = self._upload()
+        for owner in self.owners:
+            self._paper(owner, blob)
+
+        release_blob(blob.pk)  # the count says 1, two papers say otherwise
+        self.assertEqual(PdfBlob.objects.get().ref_count, 2)
+        self.assertEqual(len(self._stored_files()), 1)
+
+    def test_garbage_collection_recounts_and_deletes_unreferenced_blobs(self):
+        kept = self._upload(b"%PDF-1.4 kept")
+        self._paper(self.owners[0], kept)
+        PdfBlob.objects.filter(pk=kept.pk).update(ref_count=5)
+        self._upload(b"%PDF-1.4 orphan")
+        recent = self._upload(b"%PDF-1.4 still being uploaded")
+        PdfBlob.objects.exclude(pk=recent.pk).update(created_at=timezone.now() - timedelta(hours=2))
+
+        out = io.StringIO()
+        call_command("gc_pdf_blobs", "--dry-run", stdout=out)
+        self.assertIn("Would delete 1 unreferenced blob(s)", out.getvalue())
+        self.assertEqual((PdfBlob.objects.count(), len(self._stored_files())), (3, 3))
+
+        call_command("gc_pdf_blobs", stdout=out)
+        self.assertIn("Deleted 1 unreferenced blob(s)", out.getvalue())
+        self.assertEqual(set(PdfBlob.objects.values_list("pk", flat=True)), {kept.pk, recent.pk})
+        self.assertEqual(PdfBlob.objects.get(pk=kept.pk).ref_count, 1)
+        self.assertEqual(len(self._stored_files()), 2)
+
+    def test_only_complete_results_are_shared_and_adopted(self):
+        blob = self._upload()
+        first = self._paper(self.owners[0], blob)
+        first.references_json = json.dumps([{"title": "Notes on the Engine"}])
+        first.title = "Thinking Machines"
+        first.tables_json = "[]"
+        stamp_versions(first, ["references", "tables"])
+        # Methods extraction failed: stored unstamped, and so is the summary built on it
+        first.summary_text = "A summary without methods."
+        stamp_versions(first, ["summary"])
+        first.save()
+        publish_shared_artifacts(first, self.ARTIFACTS)
+
+        blob.refresh_from_db()
+        self.assertEqual(set(stored_versions(blob)), {"references", "tables"})
+        self.assertEqual((blob.title, blob.summary_text), ("Thinking Machines", ""))
+
+        # A later degraded parse never replaces what was shared
+        first.references_json = "[]"
+        clear_versions(first, ["references"])
+        first.save()
+        publish_shared_artifacts(first, self.ARTIFACTS)
+        blob.refresh_from_db()
+        self.assertEqual(json.loads(blob.references_json), [{"title": "Notes on the Engine"}])
+
+        second = self._paper(self.owners[1], blob)
+        self.assertEqual(adopt_shared_artifacts(second, self.ARTIFACTS), ["references", "tables"])
+        self.assertEqual((second.references_json, second.title), (blob.references_json, "Thinking Machines"))
+        self.assertEqual(stale_artifacts(second, self.ARTIFACTS), {"methods", "summary"})
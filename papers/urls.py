@@ -1,6 +1,6 @@
 from django.urls import path
 from . import views
-from .views import my_papers, paper_detail, paper_download
+from .views import my_papers, paper_detail, paper_download, paper_tables_download
 
 app_name = 'papers'
 
@@ -8,4 +8,12 @@ urlpatterns = [
     path('my-papers/', views.my_papers, name='my_papers'),
     path('detail/<int:paper_id>/', views.paper_detail, name='paper_detail'),
     path('download/<int:paper_id>/', paper_download, name='paper_download'),
+    path('download/<int:paper_id>/tables.<str:fmt>', paper_tables_download, name='paper_tables_download'),
+    path('download/<int:paper_id>/tables/<int:table_number>.<str:fmt>', paper_tables_download,
+         name='paper_table_download'),
+    path('api/papers.json', views.api_papers, name='api_papers'),
+    path('api/papers/<int:paper_id>.json', views.api_paper, name='api_paper'),
+    path('graph/citations.json', views.citation_links, name='citation_links'),
+    path('graph/most-cited.json', views.most_cited, name='most_cited'),
+    path('graph/cocited/<int:paper_id>.json', views.cocited, name='cocited'),
 ]
@@ -3,8 +3,17 @@ import os.path
 
 from django.shortcuts import render, get_object_or_404
 from django.contrib.auth.decorators import login_required
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+from ResearchParsing.parsing.consolidation import expire_stalled_consolidations
+from ResearchParsing.parsing.table_extraction import tables_to_csv
+from ResearchParsing.parsing.table_formats import EXPORT_FORMATS, decode_tables, export_table, export_tables_zip, load_tables
+from .compression import compress_response
+from .citation_graph import cocited_works, library_citations, most_cited_works
+from .fragments import paper_version, render_fragment
 from .models import Paper
-from django.http import HttpResponse
+from django.conf import settings
+from django.http import Http404, HttpResponse, JsonResponse
 import json
 
 @login_required
@@ -13,22 +22,93 @@ def my_papers(request):
     return render(request, 'papers/paper_list.html', {'papers': user_papers})
 
 
+def _owned_paper_stamp(request, paper_id):
+    # Cheap lookup run before the view to answer conditional GETs
+    papers = Paper.objects.filter(id=paper_id, owner=request.user)
+    paper = papers.only('id', 'updated_at', 'pdf_hash', 'references_consolidation',
+                        'references_consolidation_started').first()
+    if paper and paper.references_consolidation == 'pending' and not paper.consolidation_in_progress:
+        # Its pass was lost: failing it changes the page, which stops refreshing
+        expire_stalled_consolidations()
+        paper = papers.only('id', 'updated_at', 'pdf_hash').first()
+    return paper
+
+
+def _paper_detail_etag(request, paper_id):
+    paper = _owned_paper_stamp(request, paper_id)
+    return paper_version(paper) if paper else None
+
+
+def _paper_detail_last_modified(request, paper_id):
+    paper = _owned_paper_stamp(request, paper_id)
+    return paper.updated_at if paper else None
+
+
 @login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=_paper_detail_etag, last_modified_func=_paper_detail_last_modified)
 def paper_detail(request, paper_id):
+    """
+    Paper page. Browsers revalidate it with If-None-Match / If-Modified-Since
+    (answered with a 304 from one indexed lookup), and the references and
+    tables sections are rendered from the fragment cache until the paper
+    changes.
+    """
     paper = get_object_or_404(Paper, id=paper_id, owner=request.user)
-    refs = []
-    if paper.references_json:
-        try:
-            refs = json.loads(paper.references_json)
-        except:
-            refs = []
+
+    references_html = ""
+    if paper.parse_type in ('references_only', 'both'):
+        references_html = render_fragment(
+            paper, "references", "papers/references_fragment.html",
+            lambda: {'paper': paper, 'references': _load_json_list(paper.references_json)},
+        )
+
+    tables_html = ""
+    if paper.parse_type in ('methods_tables_only', 'both'):
+        tables_html = render_fragment(
+            paper, "tables", "papers/tables_fragment.html",
+            lambda: {'paper': paper, 'tables': _tables_for_display(paper.tables_json)},
+        )
+
     return render(request, 'papers/paper_detail.html', {
         'paper': paper,
-        'references': refs
+        'references_html': references_html,
+        'tables_html': tables_html,
     })
 
 
+def _load_json_list(raw):
+    if not raw:
+        return []
+    try:
+        return json.loads(raw)
+    except ValueError:
+        return []
+
+
+def _tables_for_display(tables_json):
+    """
+    Stored tables as header + rows lists, blanks for missing cells.
+    """
+    tables = []
+    # Numbered like the download endpoints, even when empty tables are skipped
+    for number, table in enumerate(load_tables(tables_json), start=1):
+        if not table['rows']:
+            continue
+        rows = [["" if cell is None else cell for cell in row] for row in table['rows']]
+        tables.append({'number': number, 'columns': table['columns'], 'rows': rows})
+    return tables
+
+
+def _paper_download_etag(request, paper_id):
+    # The file behind a paper never changes: its content hash is a strong ETag
+    paper = _owned_paper_stamp(request, paper_id)
+    return paper.pdf_hash if paper and paper.pdf_hash else None
+
+
 @login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=_paper_download_etag)
 def paper_download(request, paper_id):
     """
     Securely serves the PDF from GCS by reading it and returning as HttpResponse.
@@ -52,3 +132,180 @@ def paper_download(request, paper_id):
     # 'attachment' triggers a download; if you want inline view in browser, use 'inline'
     response['Content-Disposition'] = f'attachment; filename="{clean_name}"'
     return response
+
+
+def _paper_tables_etag(request, paper_id, **kwargs):
+    return _paper_detail_etag(request, paper_id)
+
+
+@login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=_paper_tables_etag)
+def paper_tables_download(request, paper_id, fmt, table_number=None):
+    """
+    Downloads the paper's extracted tables as CSV, Parquet or Arrow IPC:
+    one table (numbered from 1, as on the detail page) or all of them. All
+    tables come as a zip with one file per table, except CSV, which uses the
+    single-file layout of table_extraction.tables_to_csv.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise Http404("Unknown table format")
+    paper = get_object_or_404(Paper, id=paper_id, owner=request.user)
+    df_list = decode_tables(paper.tables_json)
+
+    content_type, extension = EXPORT_FORMATS[fmt]
+    base_name = os.path.splitext(os.path.basename(paper.pdf_file.name))[0].rstrip("_")
+    try:
+        if table_number is not None:
+            if not 1 <= table_number <= len(df_list):
+                raise Http404("No such table")
+            data = export_table(df_list[table_number - 1], fmt)
+            file_name = f"{base_name}_table_{table_number}.{extension}"
+        elif fmt == "csv":
+            data = tables_to_csv(df_list).encode("utf-8")
+            file_name = f"{base_name}_tables.csv"
+        else:
+            data = export_tables_zip(df_list, fmt)
+            content_type, file_name = "application/zip", f"{base_name}_tables_{extension}.zip"
+    except ImportError:
+        # pyarrow missing from this deployment
+        return HttpResponse(f"{fmt} export is not available on this server.", status=501)
+
+    response = HttpResponse(data, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{file_name}"'
+    return response
+
+
+def _limit(request, default=20, maximum=200):
+    try:
+        return max(1, min(int(request.GET.get("limit", default)), maximum))
+    except ValueError:
+        return default
+
+
+@login_required
+def citation_links(request):
+    """
+    JSON: which papers in the user's library cite each other.
+    """
+    return JsonResponse({"links": library_citations(request.user)})
+
+
+@login_required
+def most_cited(request):
+    """
+    JSON: the works cited by the most papers in the user's library (?limit=).
+    """
+    return JsonResponse({"works": most_cited_works(request.user, _limit(request))})
+
+
+@login_required
+def cocited(request, paper_id):
+    """
+    JSON: co-citation neighbours of a paper, i.e. the works the user's
+    papers most often cite together with it (?limit=).
+    """
+    paper = get_object_or_404(Paper, id=paper_id, owner=request.user)
+    if not paper.canonical_id:
+        return JsonResponse({"error": "This paper's own title wasn't identified, so it has no citations."},
+                            status=404)
+    return JsonResponse({
+        "paper": paper.id,
+        "canonical_id": paper.canonical_id,
+        "works": cocited_works(request.user, paper.canonical_id, _limit(request)),
+    })
+
+
+# JSON API fields -> the model field each one is read from
+API_FIELDS = {
+    "title": "title",
+    "canonical_id": "canonical_id",
+    "parse_type": "parse_type",
+    "created_at": "created_at",
+    "updated_at": "updated_at",
+    "references": "references_json",
+    "consolidation": "references_consolidation",
+    "methods": "methods_text",
+    "tables": "tables_json",
+    "summary": "summary_text",
+}
+# Tables can be megabytes per paper: only sent when asked for with ?fields=
+DEFAULT_API_FIELDS = tuple(name for name in API_FIELDS if name != "tables")
+
+
+def _api_fields(request):
+    """
+    The fields requested with ?fields=a,b (sparse fieldset), or the defaults.
+    Raises ValueError naming unknown fields.
+    """
+    requested = [f.strip() for f in request.GET.get("fields", "").split(",") if f.strip()]
+    unknown = [f for f in requested if f not in API_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(unknown)}. Available: {', '.join(API_FIELDS)}")
+    return requested or list(DEFAULT_API_FIELDS)
+
+
+def _api_queryset(request, fields):
+    # Only the requested columns are read, so unrequested tables never leave the database
+    return Paper.objects.filter(owner=request.user).only("id", *(API_FIELDS[f] for f in fields))
+
+
+def _paper_json(paper, fields):
+    data = {"id": paper.id}
+    for field in fields:
+        value = getattr(paper, API_FIELDS[field])
+        if field == "references":
+            value = _load_json_list(value)
+        elif field == "tables":
+            value = load_tables(value)
+        data[field] = value
+    return data
+
+
+@login_required
+@compress_response
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=_paper_detail_etag)
+def api_paper(request, paper_id):
+    """
+    JSON: one paper's parse results. ?fields= selects them (default: all
+    but tables). Responses are brotli/gzip compressed when large.
+    """
+    try:
+        fields = _api_fields(request)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    paper = get_object_or_404(_api_queryset(request, fields), id=paper_id)
+    return JsonResponse(_paper_json(paper, fields))
+
+
+@login_required
+@compress_response
+def api_papers(request):
+    """
+    JSON: several papers in one query, either ?ids=1,2,3 (returned in that
+    order; ids that aren't the user's papers are listed under "missing") or
+    the user's papers newest first, paged with ?offset= and ?limit=.
+    ?fields= works as for a single paper.
+    """
+    max_papers = getattr(settings, "API_MAX_PAPERS", 500)
+    try:
+        fields = _api_fields(request)
+        ids = [int(i) for i in request.GET.get("ids", "").split(",") if i.strip()]
+        offset = int(request.GET.get("offset", 0))
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    if len(ids) > max_papers:
+        return JsonResponse({"error": f"At most {max_papers} ids per request."}, status=400)
+
+    queryset = _api_queryset(request, fields)
+    if ids:
+        by_id = {paper.id: paper for paper in queryset.filter(id__in=ids)}
+        papers = [by_id[i] for i in dict.fromkeys(ids) if i in by_id]
+        missing = [i for i in dict.fromkeys(ids) if i not in by_id]
+    else:
+        limit = _limit(request, default=100, maximum=max_papers)
+        papers = list(queryset.order_by('-created_at')[max(0, offset):max(0, offset) + limit])
+        missing = []
+
+    return JsonResponse({"papers": [_paper_json(paper, fields) for paper in papers], "missing": missing})
@@ -1,8 +1,6 @@
-import os
-import requests
-import lxml.etree as ET
-from django.conf import settings
-from .grobid_auth import get_id_token
+from .grobid_client import post_pdf_to_grobid
+from .grobid_profiles import get_grobid_call
+from .metrics import stage_timer
 
 # Adjust if GROBID is at a different base URL/port
 #GROBID_FULLTEXT_URL = "http://localhost:8070/api/processFulltextDocument"
@@ -40,52 +38,22 @@ from .grobid_auth import get_id_token
 #     methods_text = parse_tei_for_methods(tei_xml)
 #     return methods_text
 
-def grobid_extract_methods(pdf_path):
+def grobid_extract_methods(pdf_path, profile=None):
     """
     Calls GROBID's /api/processFulltextDocument endpoint with multipart/form-data:
       - field name 'input'
       - Accept: application/xml
     Then parses the TEI XML to find 'methods' sections or a 'div' whose head is 'method'.
+    Parameters come from the extraction profile (see grobid_profiles.py).
+    The request is admission-controlled by the shared GROBID limiter.
     """
+    endpoint, params = get_grobid_call("methods", profile)
+    tei_xml = post_pdf_to_grobid(pdf_path, endpoint, params, stage="grobid_methods")
 
-    if not os.path.exists(pdf_path):
-        raise FileNotFoundError(f"PDF file not found: {pdf_path}")
-
-    # Fetch base URL and token for service-to-service auth
-    grobid_base = getattr(settings, "GROBID_BASE_URL", "")
-    if not grobid_base:
-        raise ValueError("No GROBID_BASE_URL set in Django settings.")
-    token = get_id_token(grobid_base)
-
-    # Set headers with ID token + prefer TEI XML
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Accept": "application/xml"
-    }
-
-    # POST the PDF as multipart/form-data under key 'input'
-    with open(pdf_path, "rb") as f:
-        files = {"input": (os.path.basename(pdf_path), f, "application/pdf")}
-        params = {
-            "consolidateHeader": 1,
-            "consolidateCitations": 0,
-            "segmentation": "detailed",
-            "generateTeiIds": 1
-        }
-        response = requests.post(
-            f"{grobid_base}/api/processFulltextDocument",
-            files=files,
-            params=params,
-            headers=headers,
-            timeout=120
-        )
-        if response.status_code != 200:
-            raise Exception(f"GROBID error: {response.status_code} - {response.text}")
-
-    tei_xml = response.text
     # Optional debug:
     print("DEBUG => TEI excerpt:", tei_xml[:2000], "...")
-    return parse_tei_for_methods(tei_xml)
+    with stage_timer("tei_parse_methods"):
+        return parse_tei_for_methods(tei_xml)
 
 
 # def parse_tei_for_methods(tei_xml):
@@ -130,6 +98,8 @@ def parse_tei_for_methods(tei_xml):
       - If not found, we look for a <div><head> containing 'method'
     We gather *all* text in that div (including <formula> text if present).
     """
+    import lxml.etree as ET
+
     root = ET.fromstring(tei_xml.encode('utf-8'))
 
     # 1) Attempt direct <div type="method" or "methods">
@@ -1,8 +1,6 @@
-import os
-import requests
-import lxml.etree as ET
-from django.conf import settings
-from .grobid_auth import get_id_token
+from .grobid_client import post_pdf_to_grobid
+from .grobid_profiles import get_grobid_call, CONSOLIDATION_CALL
+from .metrics import stage_timer
 
 #GROBID_FULLTEXT_URL = "http://localhost:8070/api/processFulltextDocument"
 
@@ -43,55 +41,100 @@ from .grobid_auth import get_id_token
 #     references_list = parse_tei_xml_for_references(tei_xml)
 #     return references_list
 
-def grobid_extract_references(pdf_path):
+def grobid_extract_references(pdf_path, profile=None):
     """
-    Calls GROBID's /api/processFulltextDocument endpoint with multipart/form-data:
+    Sends the PDF to GROBID with multipart/form-data:
       - field name 'input'
       - Accept: application/xml
+    The endpoint and parameters come from the extraction profile (see
+    grobid_profiles.py): "fast"/"standard" use /api/processReferences without
+    citation consolidation, "full" uses /api/processFulltextDocument with it.
+    The request is admission-controlled by the shared GROBID limiter.
     """
-    if not os.path.exists(pdf_path):
-        raise FileNotFoundError(f"PDF file not found: {pdf_path}")
-
-    # GROBID base URL & service-to-service token
-    grobid_base = getattr(settings, "GROBID_BASE_URL", "")
-    if not grobid_base:
-        raise ValueError("No GROBID_BASE_URL set in Django settings.")
-    token = get_id_token(grobid_base)
-
-    # Additional headers:
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Accept": "application/xml",  # TEI XML
-    }
-
-    # Open local PDF
-    with open(pdf_path, "rb") as f:
-        # GROBID expects a form field named 'input'
-        files = {
-            "input": (os.path.basename(pdf_path), f, "application/pdf")
-        }
-        params = {
-            "consolidateCitations": 1,
-            "consolidateHeader": 1,
-            "includeRawCitations": 1,
-            "generateIDs": 1,
-            "teiCoordinates": "biblStruct",
-            "segmentation": "detailed",
-        }
-        response = requests.post(
-            f"{grobid_base}/api/processFulltextDocument",
-            params=params,
-            files=files,
-            headers=headers,
-            timeout=120,  # extra time if needed
-        )
-        if response.status_code != 200:
-            raise Exception(f"GROBID error: {response.status_code} - {response.text}")
+    return grobid_extract_bibliography(pdf_path, profile)[0]
+
+
+def grobid_extract_bibliography(pdf_path, profile=None):
+    """
+    Same GROBID call as grobid_extract_references, also returning the paper's
+    own metadata from the TEI header: (references, header), where header is
+    a dict with title, last_name (first author) and year, empty strings when
+    GROBID didn't find them.
+
+    Only the full-text call of the "full" profile carries the header; the
+    references-only endpoint of the others leaves it empty, see
+    grobid_extract_header.
+    """
+    endpoint, params = get_grobid_call("references", profile)
+    tei_xml = post_pdf_to_grobid(pdf_path, endpoint, params, stage="grobid_references")
 
     # TEI XML from GROBID
-    tei_xml = response.text
     print("DEBUG: GROBID TEI output:\n", tei_xml[:2000], "...")
-    return parse_tei_xml_for_references(tei_xml)
+    with stage_timer("tei_parse_references"):
+        return parse_tei_xml_for_references(tei_xml), parse_tei_xml_for_header(tei_xml)
+
+
+def grobid_extract_header(pdf_path, profile=None):
+    """
+    The paper's own title/author/year (as in grobid_extract_bibliography)
+    from /api/processHeaderDocument; None for the profiles without a header
+    call ("full" returns it with the references, "fast" skips it). GROBID
+    answers 204 when it finds no header: all fields are then empty.
+    """
+    call = get_grobid_call("header", profile)
+    if call is None:
+        return None
+    endpoint, params = call
+    # A header takes GROBID seconds; don't hold the references page for long
+    tei_xml = post_pdf_to_grobid(pdf_path, endpoint, params, stage="grobid_header", timeout=30)
+    return parse_tei_xml_for_header(tei_xml)
+
+
+def grobid_extract_consolidated_references(pdf_path):
+    """
+    Asks GROBID's /api/processReferences for the bibliography with citation
+    consolidation on. Much slower than the profile calls, so it only runs as
+    the background enrichment pass (see consolidation.py).
+    """
+    endpoint, params = CONSOLIDATION_CALL
+    tei_xml = post_pdf_to_grobid(pdf_path, endpoint, dict(params),
+                                 stage="grobid_consolidation", timeout=300)
+    with stage_timer("tei_parse_references"):
+        return parse_tei_xml_for_references(tei_xml)
+
+
+def parse_tei_xml_for_header(tei_xml):
+    """
+    The document's own title, first-author surname and year from the TEI
+    <teiHeader> (<fileDesc>'s <titleStmt> and <sourceDesc>/<biblStruct>).
+    """
+    import lxml.etree as ET
+
+    header = {'title': '', 'last_name': '', 'year': ''}
+    if not tei_xml:
+        return header
+    root = ET.fromstring(tei_xml.encode('utf-8'))
+    file_desc = root.find('./{*}teiHeader/{*}fileDesc')
+    if file_desc is None:
+        return header
+
+    title_el = file_desc.find('./{*}titleStmt/{*}title')
+    if title_el is not None:
+        header['title'] = (''.join(title_el.itertext()) or '').strip()
+
+    source = file_desc.find('./{*}sourceDesc/{*}biblStruct')
+    if source is not None:
+        surname_el = source.find('.//{*}author//{*}surname')
+        if surname_el is not None:
+            header['last_name'] = (surname_el.text or '').strip()
+        date_el = source.find('.//{*}date')
+        if date_el is not None:
+            header['year'] = (date_el.get('when') or date_el.text or '').strip()
+    if not header['year']:
+        date_el = file_desc.find('./{*}publicationStmt/{*}date')
+        if date_el is not None:
+            header['year'] = (date_el.get('when') or date_el.text or '').strip()
+    return header
 
 
 def parse_tei_xml_for_references(tei_xml):
@@ -109,6 +152,8 @@ def parse_tei_xml_for_references(tei_xml):
 
     Returns a list of dictionaries with these fields.
     """
+    import lxml.etree as ET
+
     root = ET.fromstring(tei_xml.encode('utf-8'))
 
     # Try to locate references in <div type="references"> or <listBibl>
@@ -1,9 +1,71 @@
 import os
-from openai import OpenAI
 import json
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+
+from .grobid_limiter import AdaptiveLimiter, ServiceSaturated
+from .metrics import stage_timer, record_token_usage, inc, describe
+
+_client = None
+_client_lock = threading.Lock()
+_limiter = None
+_limiter_lock = threading.Lock()
+
+# Returned instead of a summary when the OpenAI call fails (never cached as a result)
+SUMMARY_FAILED_MESSAGE = "LLM summarization failed or encountered an error."
+
+
+def get_openai_client():
+    """
+    The worker's OpenAI client, created on first use: importing `openai` takes
+    about half a second, which every cold start would pay before serving even
+    the home page if the client were created at import.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            from openai import OpenAI
+            # Initialize the OpenAI client with your environment variable
+            _client = OpenAI(api_key=os.environ.get('OPENAI_API_KEY', ''))
+        return _client
+
+
+class OpenAISaturated(ServiceSaturated):
+    """
+    Raised when no OpenAI slot frees up within the queue timeout.
+    """
+
+    def __init__(self, retry_after=5):
+        super().__init__("OpenAI is saturated, try again shortly.", retry_after)
+
+
+def get_openai_limiter():
+    """
+    Admission control in front of OpenAI, shared by the instance's workers
+    like GROBID's (same AIMD cap, priority lanes and per-user fair sharing),
+    so a backfill's LLM calls queue behind the interactive ones.
+    """
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            state_dir = getattr(settings, "GROBID_LIMITER_STATE_DIR", "") or tempfile.gettempdir()
+            _limiter = AdaptiveLimiter(
+                state_path=os.path.join(state_dir, "openai_limiter.json"),
+                min_limit=getattr(settings, "OPENAI_CONCURRENCY_MIN", 1),
+                max_limit=getattr(settings, "OPENAI_CONCURRENCY_MAX", 32),
+                initial_limit=getattr(settings, "OPENAI_CONCURRENCY_INITIAL", 8),
+                target_latency=getattr(settings, "OPENAI_TARGET_LATENCY", 60.0),
+                queue_timeout=getattr(settings, "OPENAI_QUEUE_TIMEOUT", 60.0),
+                name="openai",
+                saturated=OpenAISaturated,
+                reserve=getattr(settings, "PARSE_INTERACTIVE_RESERVE", 0.25),
+                bulk_queue_timeout=getattr(settings, "PARSE_BULK_QUEUE_TIMEOUT", 600.0),
+            )
+        return _limiter
 
-# Initialize the OpenAI client with your environment variable
-client = OpenAI(api_key=os.environ.get('OPENAI_API_KEY', ''))
 
 def filter_grobid_references_with_chatgpt(references_list):
     """
@@ -16,12 +78,37 @@ def filter_grobid_references_with_chatgpt(references_list):
     5) Adds only valid references to final_references.
     6) Prints debug info about ChatGPT calls and final output.
     """
+    return check_references_with_chatgpt(references_list)[0]
+
+
+def check_references_with_chatgpt(references_list):
+    """
+    filter_grobid_references_with_chatgpt, also telling whether the result is
+    complete: (final_references, complete), where complete is False when a
+    chunk's call failed and its references were dropped unchecked.
+    """
     # Debug: Print out what GROBID gave us
     print("DEBUG: references_list before ChatGPT:", references_list)
 
-    chunk_size = 10
     final_references = []
+    complete = True
+    for _start, _chunk, validated_chunk in iter_reference_verdicts(references_list):
+        complete = complete and validated_chunk is not None
+        final_references.extend(valid_references(validated_chunk))
+
+    # Debug: Show what we ended up with after all chunks
+    print("DEBUG: final_references after ChatGPT:", final_references)
+    return final_references, complete
+
 
+def iter_reference_verdicts(references_list, chunk_size=10):
+    """
+    Runs the ChatGPT validity check chunk by chunk, yielding
+    (chunk_start, chunk, validated_chunk) as each verdict arrives, so callers
+    can show progress. validated_chunk is ChatGPT's JSON list (the references
+    with a 'valid' key added), or None if the call or its JSON failed.
+    Raises OpenAISaturated when no OpenAI slot frees up in time.
+    """
     for i in range(0, len(references_list), chunk_size):
         chunk = references_list[i : i + chunk_size]
         # Debug: Show which references are in this chunk
@@ -41,21 +128,24 @@ def filter_grobid_references_with_chatgpt(references_list):
             f"References:\n{json.dumps(chunk, indent=2)}"
         )
 
+        validated_chunk = None
         try:
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",  # or "gpt-4", if your account has access
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are an extremely helpful assistant for checking references."
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt_content
-                    }
-                ],
-                temperature=0.0
-            )
+            with get_openai_limiter().slot(), stage_timer("openai_filter_references"):
+                response = get_openai_client().chat.completions.create(
+                    model="gpt-4o-mini",  # or "gpt-4", if your account has access
+                    messages=[
+                        {
+                            "role": "system",
+                            "content": "You are an extremely helpful assistant for checking references."
+                        },
+                        {
+                            "role": "user",
+                            "content": prompt_content
+                        }
+                    ],
+                    temperature=0.0
+                )
+            record_token_usage("filter_references", getattr(response, "usage", None))
 
             # Debug: Print out ChatGPT's raw response text
             content = response.choices[0].message.content.strip()
@@ -66,22 +156,31 @@ def filter_grobid_references_with_chatgpt(references_list):
 
             # Attempt to parse the JSON
             validated_chunk = json.loads(content)
-            if isinstance(validated_chunk, list):
-                for ref in validated_chunk:
-                    if ref.get("valid") is True:
-                        ref.pop("valid", None)
-                        final_references.append(ref)
-            else:
+            if not isinstance(validated_chunk, list):
                 print("DEBUG: ChatGPT returned something other than a list:", validated_chunk)
+                validated_chunk = None
 
+        except OpenAISaturated:
+            # Not a verdict: the caller answers 503 rather than drop the chunk
+            raise
         except json.JSONDecodeError as e:
             print("DEBUG: JSONDecodeError while parsing ChatGPT response:", e)
         except Exception as e:
             print("DEBUG: Other error calling ChatGPT or reading response:", e)
 
-    # Debug: Show what we ended up with after all chunks
-    print("DEBUG: final_references after ChatGPT:", final_references)
-    return final_references
+        yield i, chunk, validated_chunk
+
+
+def valid_references(validated_chunk):
+    """
+    The references ChatGPT marked valid, without the 'valid' key.
+    """
+    kept = []
+    for ref in validated_chunk or []:
+        if isinstance(ref, dict) and ref.get("valid") is True:
+            ref.pop("valid", None)
+            kept.append(ref)
+    return kept
 
 
 def summarize_methods_and_tables_with_chatgpt(methods_text, tables_json_str):
@@ -89,8 +188,84 @@ def summarize_methods_and_tables_with_chatgpt(methods_text, tables_json_str):
     Passes both the methods text and tables data (in JSON form) to ChatGPT,
     asking for a concise summary covering main methods + key findings.
 
-    Returns a single string containing the summary from GPT.
+    Returns a single string containing the summary from GPT (or
+    SUMMARY_FAILED_MESSAGE); raises OpenAISaturated.
+    """
+    # For safety, chunk the prompt or handle large data if needed.
+    # But here's a simple one-shot approach:
+    try:
+        with get_openai_limiter().slot(), stage_timer("openai_summarize"):
+            response = get_openai_client().chat.completions.create(
+                model="gpt-4o-mini",  # or "gpt-4" if available
+                messages=_summary_messages(methods_text, tables_json_str),
+                temperature=0.0
+            )
+        record_token_usage("summarize_methods_tables", getattr(response, "usage", None))
+
+        # Extract the final content
+        summary_text = response.choices[0].message.content.strip()
+        return summary_text
+    except OpenAISaturated:
+        raise
+    except Exception as e:
+        print(f"Error calling OpenAI for methods/tables summary: {e}")
+        return SUMMARY_FAILED_MESSAGE
+
+
+def stream_summary_of_methods_and_tables(methods_text, tables_json_str):
     """
+    Streaming variant of summarize_methods_and_tables_with_chatgpt: yields the
+    summary text piece by piece as the model generates it. API errors (and
+    OpenAISaturated) are raised to the caller.
+
+    Closing the generator early (the client disconnected) closes the HTTP
+    stream, which makes OpenAI stop generating, so no more tokens are billed.
+    """
+    # The slot is held while the summary streams; its latency for the limiter
+    # is the time until the stream opened, not the length of the summary
+    limiter = get_openai_limiter()
+    slot_id, started = limiter.acquire()
+    latency = None
+    failed = True
+    try:
+        stream = get_openai_client().chat.completions.create(
+            model="gpt-4o-mini",
+            messages=_summary_messages(methods_text, tables_json_str),
+            temperature=0.0,
+            stream=True,
+            stream_options={"include_usage": True},  # usage arrives in the last chunk
+        )
+        latency = time.time() - started
+        usage = None
+        pieces = 0
+        completed = False
+        try:
+            with stage_timer("openai_summarize"):
+                for chunk in stream:
+                    if chunk.usage is not None:
+                        usage = chunk.usage
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        pieces += 1
+                        yield chunk.choices[0].delta.content
+            completed = True
+        finally:
+            stream.close()
+            if completed:
+                record_token_usage("summarize_methods_tables", usage)
+            else:
+                # No usage report on a cancelled stream; each piece is about one token
+                inc("openai_stream_cancellations_total", call="summarize_methods_tables")
+                inc("openai_tokens_total", pieces, call="summarize_methods_tables", kind="completion_cancelled")
+        failed = False
+    except GeneratorExit:
+        # The client went away, which says nothing about OpenAI's load
+        failed = False
+        raise
+    finally:
+        limiter.release(slot_id, started, time.time() - started if latency is None else latency, failed)
+
+
+def _summary_messages(methods_text, tables_json_str):
     # Build a prompt that instructs ChatGPT on how to summarize
     prompt_content = f"""
 You are an expert at reading research methods and analyzing table data to extract main findings.
@@ -108,28 +283,17 @@ Please produce a summary that addresses:
 2) The key takeaways or findings from the data of each table.
 3) Present the information in a medium-length, coherent report without code fences or raw JSON.
     """
+    return [
+        {
+            "role": "system",
+            "content": "You are a helpful assistant that summarizes academic methods and table findings."
+        },
+        {
+            "role": "user",
+            "content": prompt_content
+        }
+    ]
 
-    # For safety, chunk the prompt or handle large data if needed.
-    # But here's a simple one-shot approach:
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",  # or "gpt-4" if available
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a helpful assistant that summarizes academic methods and table findings."
-                },
-                {
-                    "role": "user",
-                    "content": prompt_content
-                }
-            ],
-            temperature=0.0
-        )
 
-        # Extract the final content
-        summary_text = response.choices[0].message.content.strip()
-        return summary_text
-    except Exception as e:
-        print(f"Error calling OpenAI for methods/tables summary: {e}")
-        return "LLM summarization failed or encountered an error."
+describe("openai_stream_cancellations_total", "counter",
+         "Streamed completions stopped early because the client disconnected.")
@@ -0,0 +1,65 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .grobid_limiter import ServiceSaturated
+from .lanes import current_lane, parse_lane
+from .metrics import inc, describe
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, "BACKGROUND_WORKERS", 2),
+                thread_name_prefix="parse-background",
+            )
+        return _executor
+
+
+def run_in_background(func, *args, **kwargs):
+    """
+    Runs `func(*args, **kwargs)` on the worker's background thread pool after
+    the current request has been answered, e.g. to enrich stored results.
+
+    Each task gets its own database connection (closed when it finishes) and
+    exceptions are logged rather than lost. Its GROBID and OpenAI calls queue
+    in the bulk lane, on behalf of the user whose request scheduled it (see
+    lanes.py). With BACKGROUND_TASKS_EAGER = True the task runs inline
+    instead, which keeps tests deterministic.
+
+    Note: on Cloud Run this needs "CPU always allocated", otherwise the
+    instance is throttled as soon as the response has been sent.
+    """
+    _lane, user = current_lane()
+    if getattr(settings, "BACKGROUND_TASKS_EAGER", False):
+        _run_task(user, func, args, kwargs)
+        return None
+    return _get_executor().submit(_run_task, user, func, args, kwargs)
+
+
+def _run_task(user, func, args, kwargs):
+    close_old_connections()
+    try:
+        with parse_lane("bulk", user):
+            func(*args, **kwargs)
+        inc("background_tasks_total", task=func.__name__, outcome="ok")
+    except ServiceSaturated as e:
+        # Waited out the bulk lane's queue timeout: the service stayed busy
+        inc("background_tasks_total", task=func.__name__, outcome="saturated")
+        print(f"Background task {func.__name__} gave up: {e}")
+    except Exception as e:
+        inc("background_tasks_total", task=func.__name__, outcome="error")
+        print(f"Error in background task {func.__name__}: {e}")
+    finally:
+        close_old_connections()
+
+
+describe("background_tasks_total", "counter",
+         "Background tasks run by this worker, by task and outcome (ok, saturated or error).")
@@ -0,0 +1,150 @@
+import json
+import os
+
+from django.db.models import Q
+from django.utils import timezone
+
+from ResearchParsing.papers.models import Paper, PdfBlob, consolidation_timeout
+
+from .advanced_references_extraction import grobid_extract_consolidated_references
+from .background import run_in_background
+from .metrics import describe, inc, stage_timer
+
+REFERENCE_FIELDS = ("first_name", "last_name", "title", "year", "journal")
+
+
+def schedule_reference_consolidation(paper_obj, pdf_path):
+    """
+    Marks the paper's references as pending enrichment and queues the
+    consolidation pass. The caller has already stored (and shown) the
+    unconsolidated references; the task owns `pdf_path` and deletes it.
+    """
+    now = timezone.now()
+    Paper.objects.filter(pk=paper_obj.pk).update(references_consolidation='pending',
+                                                 references_consolidation_started=now, updated_at=now)
+    if paper_obj.blob_id:
+        # Papers adopting the shared references meanwhile are updated by the task too
+        PdfBlob.objects.filter(pk=paper_obj.blob_id).update(references_consolidation='pending',
+                                                            references_consolidation_started=now)
+    paper_obj.references_consolidation = 'pending'
+    paper_obj.references_consolidation_started = now
+    run_in_background(consolidate_paper_references, paper_obj.pk, pdf_path, paper_obj.blob_id)
+
+
+def consolidate_paper_references(paper_id, pdf_path, blob_id=None):
+    """
+    Background task: fetches consolidated references from GROBID and merges
+    them into the references already stored on the paper, and on its shared
+    blob `blob_id` along with the papers that adopted them meanwhile.
+    """
+    try:
+        with stage_timer("consolidation_total"):
+            consolidated = grobid_extract_consolidated_references(pdf_path)
+    except Exception:
+        _finish(paper_id, blob_id, 'failed')
+        raise
+    finally:
+        if os.path.exists(pdf_path):
+            os.remove(pdf_path)
+
+    # The paper may have been deleted while we were waiting on GROBID; its
+    # adopters then get the blob's copy enriched
+    source = Paper.objects.filter(pk=paper_id).only('references_json').first()
+    if source is None:
+        source = PdfBlob.objects.filter(pk=blob_id).only('references_json').first()
+    if source is None:
+        return
+
+    stored = []
+    if source.references_json:
+        try:
+            stored = json.loads(source.references_json)
+        except ValueError:
+            stored = []
+
+    merged, updated = merge_consolidated_references(stored, consolidated)
+    inc("references_consolidated_total", updated, outcome="updated")
+    inc("references_consolidated_total", len(merged) - updated, outcome="unchanged")
+    _finish(paper_id, blob_id, 'done', json.dumps(merged))
+
+
+def _finish(paper_id, blob_id, state, references_json=None):
+    # update() rather than save() so a concurrent methods/tables parse of the
+    # same paper doesn't get its fields overwritten with stale values; bumping
+    # updated_at by hand invalidates the detail page's ETag and fragments.
+    # Papers that adopted the blob's pending references meanwhile go along.
+    fields = {"references_consolidation": state}
+    if references_json is not None:
+        fields["references_json"] = references_json
+    papers = Q(pk=paper_id)
+    if blob_id:
+        papers |= Q(blob_id=blob_id, references_consolidation='pending')
+        PdfBlob.objects.filter(pk=blob_id).update(**fields)
+    Paper.objects.filter(papers).update(updated_at=timezone.now(), **fields)
+
+
+def expire_stalled_consolidations():
+    """
+    Marks as failed the consolidation passes still pending after
+    GROBID_CONSOLIDATION_TIMEOUT, whose task was lost (worker recycled or
+    killed, CPU throttled after the response), so their pages stop
+    refreshing. Returns the number of papers updated.
+    """
+    stalled = Q(references_consolidation='pending') & (
+        Q(references_consolidation_started__isnull=True)
+        | Q(references_consolidation_started__lt=timezone.now() - consolidation_timeout())
+    )
+    PdfBlob.objects.filter(stalled).update(references_consolidation='failed')
+    expired = Paper.objects.filter(stalled).update(references_consolidation='failed', updated_at=timezone.now())
+    if expired:
+        inc("references_consolidation_expired_total", expired)
+    return expired
+
+
+def merge_consolidated_references(stored, consolidated):
+    """
+    Updates the stored references in place with the consolidated metadata.
+
+    The stored list was already filtered by the LLM, so we never add entries;
+    each stored reference is matched to a consolidated one by normalized title,
+    falling back to (first author surname, year). Non-empty consolidated
+    fields win. Returns (references, number_of_references_updated).
+    """
+    by_title = {}
+    by_author_year = {}
+    for ref in consolidated:
+        title_key = _normalize(ref.get("title"))
+        if title_key:
+            by_title.setdefault(title_key, ref)
+        author_key = (_normalize(ref.get("last_name")), (ref.get("year") or "")[:4])
+        if all(author_key):
+            by_author_year.setdefault(author_key, ref)
+
+    updated = 0
+    for ref in stored:
+        match = by_title.get(_normalize(ref.get("title")))
+        if match is None:
+            match = by_author_year.get(
+                (_normalize(ref.get("last_name")), (ref.get("year") or "")[:4])
+            )
+        if match is None:
+            continue
+        changed = False
+        for field in REFERENCE_FIELDS:
+            value = match.get(field)
+            if value and value != ref.get(field):
+                ref[field] = value
+                changed = True
+        if changed:
+            updated += 1
+    return stored, updated
+
+
+def _normalize(text):
+    return "".join(ch for ch in (text or "").lower() if ch.isalnum())
+
+
+describe("references_consolidated_total", "counter",
+         "References the consolidation pass updated with GROBID's metadata, or left unchanged.")
+describe("references_consolidation_expired_total", "counter",
+         "Papers whose consolidation stayed pending past GROBID_CONSOLIDATION_TIMEOUT and was marked failed.")
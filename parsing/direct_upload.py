@@ -0,0 +1,178 @@
+"""
+Direct-to-storage uploads: instead of posting the PDF through a worker, the
+browser asks the app for a resumable upload session on the bucket, PUTs the
+file straight to it (in chunks, resuming after network errors), and then
+posts the parse form with the signed upload token and the PDF's sha256. No
+worker waits on the browser's upload; the one answering the parse form then
+reads the object back from the bucket once, to check its hash and count its
+pages for the quota, before keeping it.
+
+The session URL GCS returns when the app opens the session is the upload's
+credential: it is bound to the object name, content type, size and the
+page's origin, and expires after a week. The upload token (signed with
+SECRET_KEY) ties the object to the user it was issued to, so the parse form
+can only claim uploads of its own user, once, and the claimed hash is
+checked against the object before it is shared with other uploads of the
+same PDF.
+"""
+import hashlib
+import os
+import tempfile
+import uuid
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django.core import signing
+from django.core.files.storage import default_storage
+from django.utils.text import get_valid_filename
+
+from .metrics import describe, inc, record_bytes, stage_timer
+
+UPLOAD_PREFIX = "direct_uploads"
+_TOKEN_SALT = "parsing.direct_upload"
+_READ_CHUNK = 8 * 2 ** 20
+
+# A finished upload: its object, size and sha256, plus a local copy of it
+# (for the page quota) that the caller deletes
+VerifiedUpload = namedtuple("VerifiedUpload", "object_name size sha256 path")
+
+
+class DirectUploadError(Exception):
+    """
+    A direct upload that can't be started or accepted; `status` is the HTTP
+    status to answer with.
+    """
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def direct_uploads_enabled():
+    """
+    True with DIRECT_UPLOADS on and a storage backend that can open upload
+    sessions (the GCS one, or the emulator behind STORAGE_EMULATOR_HOST).
+    """
+    return getattr(settings, "DIRECT_UPLOADS", False) and hasattr(default_storage, "bucket")
+
+
+def start_upload(user, filename, size, origin=None):
+    """
+    Opens a resumable upload session for a PDF of `size` bytes and returns
+    what the browser needs: {"upload_url", "object_name", "upload_token",
+    "expires_in"}. `origin` is the page's origin, which GCS then allows in
+    its CORS answers for this session.
+    """
+    max_bytes = getattr(settings, "DIRECT_UPLOAD_MAX_BYTES", 0)
+    if size <= 0:
+        raise DirectUploadError("The file is empty.")
+    if max_bytes and size > max_bytes:
+        raise DirectUploadError(f"PDFs are limited to {max_bytes // 2 ** 20} MB.", status=413)
+
+    name = get_valid_filename(os.path.basename(filename or "")) or "paper.pdf"
+    object_name = f"{UPLOAD_PREFIX}/{user.pk}/{uuid.uuid4().hex}/{name}"
+    with stage_timer("direct_upload_start"):
+        # ifGenerationMatch=0: the session can only create the object, never
+        # overwrite it once it exists
+        upload_url = default_storage.bucket.blob(object_name).create_resumable_upload_session(
+            content_type="application/pdf", size=size, origin=origin, if_generation_match=0,
+        )
+    inc("direct_uploads_total", outcome="started")
+    return {
+        "upload_url": upload_url,
+        "object_name": object_name,
+        "upload_token": signing.dumps({"user": user.pk, "object": object_name, "size": size}, salt=_TOKEN_SALT),
+        "expires_in": getattr(settings, "DIRECT_UPLOAD_TTL", 86400),
+    }
+
+
+def finish_upload(user, upload_token, sha256):
+    """
+    Accepts an upload the browser reports as complete: the token must be
+    valid, `user`'s and not used yet, the object complete, and its content
+    must hash to `sha256` (otherwise the object is deleted). Returns a
+    VerifiedUpload.
+    """
+    from ResearchParsing.papers.models import PdfBlob
+
+    try:
+        claim = signing.loads(upload_token, salt=_TOKEN_SALT, max_age=getattr(settings, "DIRECT_UPLOAD_TTL", 86400))
+    except signing.BadSignature:
+        inc("direct_uploads_total", outcome="rejected")
+        raise DirectUploadError("The upload token is invalid or has expired.")
+    if claim["user"] != user.pk:
+        inc("direct_uploads_total", outcome="rejected")
+        raise DirectUploadError("This upload belongs to another user.", status=403)
+    if PdfBlob.objects.filter(pdf_file=claim["object"]).exists():
+        # A replayed form would download the object and charge the quota again
+        inc("direct_uploads_total", outcome="rejected")
+        raise DirectUploadError("This upload has already been used.", status=409)
+
+    blob = default_storage.bucket.get_blob(claim["object"])
+    if blob is None or blob.size != claim["size"]:
+        # Possibly still uploading (or resumable later): leave it be
+        raise DirectUploadError("The upload has not finished.", status=409)
+
+    # 1) Hash the object as stored, keeping a local copy for the page count
+    hasher = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
+        try:
+            with stage_timer("direct_upload_verify"), blob.open("rb", chunk_size=_READ_CHUNK) as stored:
+                for chunk in iter(lambda: stored.read(_READ_CHUNK), b""):
+                    hasher.update(chunk)
+                    tmp.write(chunk)
+        except Exception:
+            tmp.close()
+            os.remove(tmp.name)
+            raise
+    record_bytes("direct_upload", "in", blob.size)
+
+    # 2) A hash that doesn't match would let the upload pose as another PDF
+    if hasher.hexdigest() != (sha256 or "").strip().lower():
+        os.remove(tmp.name)
+        discard_upload(claim["object"])
+        inc("direct_uploads_total", outcome="rejected")
+        raise DirectUploadError("The uploaded file does not match its sha256.")
+
+    inc("direct_uploads_total", outcome="completed")
+    return VerifiedUpload(claim["object"], blob.size, hasher.hexdigest(), tmp.name)
+
+
+def discard_upload(object_name):
+    """
+    Deletes an uploaded object that won't be kept (a duplicate of a stored
+    PDF, or a rejected upload).
+    """
+    try:
+        default_storage.delete(object_name)
+    except Exception as e:
+        print(f"Error deleting direct upload {object_name}: {e}")
+
+
+def discard_abandoned_uploads(dry_run=False):
+    """
+    Deletes uploads that were never claimed by a parse form (tab closed,
+    upload abandoned) once their token has expired. Returns
+    (objects_deleted, bytes_freed).
+    """
+    from ResearchParsing.papers.models import PdfBlob
+
+    if not direct_uploads_enabled():
+        return 0, 0
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=getattr(settings, "DIRECT_UPLOAD_TTL", 86400) + 3600)
+    deleted, freed = 0, 0
+    for blob in default_storage.bucket.list_blobs(prefix=f"{UPLOAD_PREFIX}/"):
+        if blob.time_created is None or blob.time_created >= cutoff:
+            continue
+        if PdfBlob.objects.filter(pdf_file=blob.name).exists():
+            continue
+        deleted += 1
+        freed += blob.size or 0
+        if not dry_run:
+            discard_upload(blob.name)
+    return deleted, freed
+
+
+describe("direct_uploads_total", "counter",
+         "Direct-to-storage uploads by outcome (started, completed, rejected).")
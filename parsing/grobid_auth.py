@@ -1,15 +1,36 @@
-import google.auth
-import google.auth.transport.requests
-import google.oauth2.id_token
+import threading
+import time
+
+from django.conf import settings
+
+# ID tokens are valid for an hour; refresh well before that
+_tokens = {}
+_tokens_lock = threading.Lock()
+
 
 def get_id_token(target_audience: str) -> str:
     """
     Returns an ID token used to call a private Cloud Run service.
     `target_audience` should be the base URL of the GROBID service, e.g.
     'https://grobid-service-xxxx-uc.a.run.app'.
+
+    Tokens are reused for GROBID_TOKEN_TTL seconds, so only the first call of
+    a worker (or the startup warm-up) pays for the metadata-server round trip.
     """
+    ttl = getattr(settings, "GROBID_TOKEN_TTL", 3000)
+    with _tokens_lock:
+        token, expires = _tokens.get(target_audience, (None, 0))
+        if token is not None and time.monotonic() < expires:
+            return token
+
+    # google.auth is imported here rather than at module load (cold starts)
+    import google.auth
+    import google.auth.transport.requests
+    import google.oauth2.id_token
+
     creds, _ = google.auth.default()
     auth_req = google.auth.transport.requests.Request()
     token = google.oauth2.id_token.fetch_id_token(auth_req, target_audience)
+    with _tokens_lock:
+        _tokens[target_audience] = (token, time.monotonic() + ttl)
     return token
-
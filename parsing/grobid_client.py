@@ -0,0 +1,99 @@
+import os
+import threading
+
+import requests
+from django.conf import settings
+
+from .grobid_auth import get_id_token
+from .grobid_limiter import get_grobid_limiter
+from .grobid_pool import get_grobid_pool
+from .metrics import stage_timer, record_bytes
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def post_pdf_to_grobid(pdf_path, endpoint, params, stage, timeout=120):
+    """
+    Sends a PDF to a GROBID endpoint (e.g. "processFulltextDocument") as
+    multipart/form-data under the field name 'input' and returns the TEI XML
+    ("" when GROBID answers 204: it found nothing to extract).
+
+    The call goes through the shared admission limiter, so it may wait for a
+    slot or raise GrobidSaturated when GROBID is overloaded, and then to the
+    least busy healthy GROBID instance (grobid_pool.py). Timeouts, 429s and
+    5xx responses count as congestion signals for the limiter; connection
+    errors, timeouts and 5xx responses as failures of the instance.
+    """
+    if not os.path.exists(pdf_path):
+        raise FileNotFoundError(f"PDF file not found: {pdf_path}")
+    pool = get_grobid_pool()
+
+    record_bytes(stage, "in", os.path.getsize(pdf_path))
+    with open(pdf_path, "rb") as f:
+        files = {"input": (os.path.basename(pdf_path), f, "application/pdf")}
+        with get_grobid_limiter().slot() as outcome, pool.route() as instance:
+            headers = {"Accept": "application/xml"}  # TEI XML
+            if getattr(settings, "GROBID_AUTH", True):
+                # Service-to-service token for this instance
+                with stage_timer("grobid_auth"):
+                    headers.update(_auth_headers(instance["audience"]))
+            with stage_timer(stage):
+                response = get_grobid_session().post(
+                    f"{instance['url']}/api/{endpoint}",
+                    params=params,
+                    files=files,
+                    headers=headers,
+                    timeout=timeout,
+                )
+            outcome["error"] = response.status_code == 429 or response.status_code >= 500
+            instance["error"] = response.status_code >= 500
+
+    if response.status_code == 204:
+        return ""
+    if response.status_code != 200:
+        raise Exception(f"GROBID error: {response.status_code} - {response.text}")
+
+    record_bytes(stage, "out", len(response.content))
+    return response.text
+
+
+def get_grobid_session():
+    """
+    The worker's HTTP session for GROBID, so calls reuse open TLS connections
+    instead of each paying a handshake. The pool holds, per GROBID instance,
+    as many connections as the admission limiter may ever let through to it.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize=getattr(settings, "GROBID_CONCURRENCY_MAX", 16))
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+
+def probe_grobid_instance(url, audience, timeout):
+    """
+    Health probe of one GROBID instance (GROBID's /api/isalive).
+    """
+    return get_grobid_session().get(f"{url}/api/isalive", headers=_auth_headers(audience), timeout=timeout)
+
+
+def warm_grobid_connection(timeout=60):
+    """
+    Fetches the GROBID tokens and opens a pooled connection to each instance
+    by asking it whether it is alive, which also wakes the service if it
+    scaled to zero.
+    """
+    pool = get_grobid_pool()
+    for url in pool.urls:
+        probe_grobid_instance(url, pool.audiences[url], timeout).raise_for_status()
+
+
+def _auth_headers(audience):
+    if not getattr(settings, "GROBID_AUTH", True):
+        return {}
+    return {"Authorization": f"Bearer {get_id_token(audience)}"}
@@ -0,0 +1,283 @@
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from .lanes import LANES, admissible_waiters, current_lane
+from .metrics import observe, inc, set_gauge, describe
+
+
+class ServiceSaturated(Exception):
+    """
+    Raised when no slot of an AdaptiveLimiter frees up within the queue
+    timeout. Views turn this into a 503 with a Retry-After header; it must
+    never be mistaken for a failed call (and a degraded result stored).
+    """
+
+    def __init__(self, message, retry_after=5):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class GrobidSaturated(ServiceSaturated):
+    """
+    Raised when no GROBID slot frees up within the queue timeout.
+    """
+
+    def __init__(self, retry_after=5):
+        super().__init__("GROBID is saturated, try again shortly.", retry_after)
+
+
+class AdaptiveLimiter:
+    """
+    Admission control in front of GROBID, shared by every gunicorn worker on
+    the instance through a small JSON state file guarded by an flock.
+
+    The state file holds the current concurrency cap and the in-flight slots:
+        {"limit": 4.0, "last_decrease": 0.0,
+         "inflight": {"<slot id>": {"pid": 123, "started": 1700000000.0}}}
+
+    The cap is adjusted AIMD-style from what each request observed:
+      - success under `target_latency`: limit += 1 / limit
+        (roughly +1 once a full window of requests completes)
+      - error, timeout or a response slower than `target_latency`:
+        limit *= backoff, at most once per congestion event (requests that
+        started before the last decrease don't shrink it again)
+
+    When every slot is taken, callers wait up to `queue_timeout` seconds for
+    one to free up and then get GrobidSaturated (queue_timeout=0 fails fast);
+    calls in the bulk lane wait up to `bulk_queue_timeout`. Waiters are
+    queued in the state file too ("waiting", same shape as "inflight" plus
+    their lane and user) and free slots go to them in lane order, bulk ones
+    never taking the `reserve` share of the cap (see lanes.py).
+
+    The same limiter guards OpenAI (ai_postprocess.py): `name` prefixes its
+    metrics and `saturated` is the exception raised on a queue timeout.
+
+    `scale` (a callable) multiplies the initial and max limits, e.g. by the
+    number of healthy GROBID instances (grobid_pool.py), so the cap grows as
+    replicas are added and shrinks when one is ejected.
+    """
+
+    def __init__(self, state_path, min_limit=1, max_limit=16, initial_limit=4,
+                 target_latency=30.0, backoff=0.5, queue_timeout=30.0,
+                 poll_interval=0.05, slot_ttl=600, name="grobid", saturated=GrobidSaturated,
+                 reserve=0.25, bulk_queue_timeout=600.0, scale=None):
+        self.state_path = state_path
+        self.lock_path = state_path + ".lock"
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.initial_limit = initial_limit
+        self.target_latency = target_latency
+        self.backoff = backoff
+        self.queue_timeout = queue_timeout
+        self.poll_interval = poll_interval
+        self.slot_ttl = slot_ttl
+        self.name = name
+        self.saturated = saturated
+        self.reserve = reserve
+        self.bulk_queue_timeout = bulk_queue_timeout
+        self.scale = scale
+
+    @contextmanager
+    def slot(self):
+        """
+        Holds one GROBID slot for the duration of the block:
+
+            with limiter.slot() as outcome:
+                response = requests.post(...)
+                outcome["error"] = response.status_code >= 500
+
+        An exception escaping the block counts as an error.
+        """
+        slot_id, started = self.acquire()
+        outcome = {"error": False}
+        try:
+            yield outcome
+        except BaseException:
+            outcome["error"] = True
+            raise
+        finally:
+            self.release(slot_id, started, time.time() - started, outcome["error"])
+
+    def acquire(self):
+        lane, user = current_lane()
+        timeout = self.queue_timeout if lane == LANES[0] else self.bulk_queue_timeout
+        deadline = time.monotonic() + timeout
+        wait_start = time.perf_counter()
+        slot_id = uuid.uuid4().hex
+        waiter = {"pid": os.getpid(), "since": time.time(), "lane": lane, "user": user}
+        granted = False
+        try:
+            while True:
+                with self._locked_state() as state:
+                    state["waiting"][slot_id] = waiter
+                    if slot_id in admissible_waiters(state["waiting"], state["inflight"], self._cap(state), self.reserve):
+                        del state["waiting"][slot_id]
+                        started = time.time()
+                        state["inflight"][slot_id] = dict(waiter, started=started)
+                        granted = True
+                        self._publish(state)
+                        waited = time.perf_counter() - wait_start
+                        observe(f"{self.name}_limiter_wait_seconds", waited)
+                        observe("parse_lane_wait_seconds", waited, service=self.name, lane=lane)
+                        return slot_id, started
+                    if time.monotonic() >= deadline:
+                        del state["waiting"][slot_id]
+                        self._publish(state)
+                        inc(f"{self.name}_limiter_rejections_total")
+                        inc("parse_lane_rejections_total", service=self.name, lane=lane)
+                        raise self.saturated(retry_after=max(1, int(self.target_latency // 2)))
+                    self._publish(state)
+                time.sleep(self.poll_interval)
+        finally:
+            if not granted:
+                # Interrupted (or timed out) while queued
+                with self._locked_state() as state:
+                    state["waiting"].pop(slot_id, None)
+
+    def release(self, slot_id, started, latency, error):
+        with self._locked_state() as state:
+            state["inflight"].pop(slot_id, None)
+            limit = state["limit"]
+            if error or latency > self.target_latency:
+                # Multiplicative decrease, once per congestion event
+                if started >= state["last_decrease"]:
+                    state["limit"] = max(self.min_limit, limit * self.backoff)
+                    state["last_decrease"] = time.time()
+            else:
+                # Additive increase
+                state["limit"] = min(self._max_limit(), limit + 1.0 / max(limit, 1.0))
+            self._publish(state)
+
+    def current_limit(self):
+        with self._locked_state() as state:
+            return self._cap(state)
+
+    def _cap(self, state):
+        return max(self.min_limit, min(int(state["limit"]), self._max_limit()))
+
+    def _max_limit(self):
+        return self.max_limit * self._scale()
+
+    def _scale(self):
+        return max(1, self.scale()) if self.scale is not None else 1
+
+    def _publish(self, state):
+        set_gauge(f"{self.name}_limiter_limit", round(state["limit"], 3))
+        set_gauge(f"{self.name}_limiter_inflight", len(state["inflight"]))
+        for lane in LANES:
+            set_gauge("parse_lane_queue_depth", sum(1 for w in state["waiting"].values() if w["lane"] == lane),
+                      service=self.name, lane=lane)
+            set_gauge("parse_lane_inflight", sum(1 for s in state["inflight"].values() if s.get("lane", LANES[0]) == lane),
+                      service=self.name, lane=lane)
+
+    @contextmanager
+    def _locked_state(self):
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                state = self._read_state()
+                yield state
+                self._write_state(state)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_state(self):
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        scale = self._scale()
+        state.setdefault("limit", float(self.initial_limit * scale))
+        # An instance added or ejected: keep the limit per instance
+        if state.setdefault("scale", scale) != scale:
+            state["limit"] = max(float(self.min_limit), state["limit"] * scale / state["scale"])
+            state["scale"] = scale
+        state.setdefault("last_decrease", 0.0)
+        state.setdefault("inflight", {})
+        state.setdefault("waiting", {})
+
+        # Drop slots held (and places queued) by workers that died or hung past the TTL
+        now = time.time()
+        for key, held in list(state["inflight"].items()):
+            if now - held["started"] > self.slot_ttl or not pid_alive(held["pid"]):
+                del state["inflight"][key]
+        for key, waiter in list(state["waiting"].items()):
+            if now - waiter["since"] > max(self.slot_ttl, self.bulk_queue_timeout) or not pid_alive(waiter["pid"]):
+                del state["waiting"][key]
+        return state
+
+    def _write_state(self, state):
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_grobid_limiter():
+    """
+    Returns the process-wide limiter configured from Django settings.
+    """
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            state_dir = getattr(settings, "GROBID_LIMITER_STATE_DIR", "") or tempfile.gettempdir()
+            _limiter = AdaptiveLimiter(
+                state_path=os.path.join(state_dir, "grobid_limiter.json"),
+                min_limit=getattr(settings, "GROBID_CONCURRENCY_MIN", 1),
+                max_limit=getattr(settings, "GROBID_CONCURRENCY_MAX", 16),
+                initial_limit=getattr(settings, "GROBID_CONCURRENCY_INITIAL", 4),
+                target_latency=getattr(settings, "GROBID_TARGET_LATENCY", 30.0),
+                queue_timeout=getattr(settings, "GROBID_QUEUE_TIMEOUT", 30.0),
+                reserve=getattr(settings, "PARSE_INTERACTIVE_RESERVE", 0.25),
+                bulk_queue_timeout=getattr(settings, "PARSE_BULK_QUEUE_TIMEOUT", 600.0),
+                # The concurrency settings are per GROBID instance
+                scale=_healthy_grobid_instances,
+            )
+        return _limiter
+
+
+def _healthy_grobid_instances():
+    from .grobid_pool import get_grobid_pool
+
+    return get_grobid_pool().healthy_count()
+
+
+describe("grobid_limiter_wait_seconds", "summary",
+         "Time spent queued for a GROBID admission slot.")
+describe("grobid_limiter_rejections_total", "counter",
+         "GROBID requests rejected because every slot stayed busy.")
+describe("grobid_limiter_limit", "gauge",
+         "Current adaptive GROBID concurrency cap.")
+describe("grobid_limiter_inflight", "gauge",
+         "GROBID requests currently in flight on this instance.")
+describe("parse_lane_queue_depth", "gauge",
+         "Calls queued for a GROBID or OpenAI slot on this instance, by service and lane.")
+describe("parse_lane_inflight", "gauge",
+         "Calls holding a GROBID or OpenAI slot on this instance, by service and lane.")
+describe("parse_lane_wait_seconds", "summary",
+         "Time calls spent queued for a GROBID or OpenAI slot, by service and lane.")
+describe("parse_lane_rejections_total", "counter",
+         "Calls that gave up waiting for a GROBID or OpenAI slot, by service and lane.")
@@ -0,0 +1,304 @@
+"""
+The GROBID instances calls are spread over (GROBID_BASE_URLS, e.g. several
+containers built from grobid/Dockerfile). Each call goes to the healthy
+instance with the fewest requests outstanding, counted across all gunicorn
+workers through a state file like the admission limiter's:
+
+    {"last_probe": 1700000000.0,
+     "instances": {"http://grobid-1:8070": {
+         "outstanding": {"<call id>": {"pid": 123, "started": 1700000000.0}},
+         "failures": {"requests": 0, "probe": 0}, "ejections": 0, "ejected_until": 0.0,
+         "probe_ok": true, "last_routed": 1700000000.0}}}
+
+Instances are ejected for a while (GROBID_EJECT_SECONDS, doubling with each
+ejection in a row, at most 10x) after GROBID_EJECT_AFTER failures in a row:
+calls that failed to connect, timed out or got a 5xx, and health probes
+(/api/isalive, every GROBID_PROBE_INTERVAL seconds on one worker at a time)
+that failed or took over GROBID_PROBE_SLOW seconds. An ejected instance
+returns once its time is up and its last probe passed. If every instance is
+ejected, calls go to all of them rather than nowhere.
+
+With GROBID_AUTH, each instance's calls carry an ID token for its own
+audience: its base URL, or the one set in GROBID_TOKEN_AUDIENCES (e.g. the
+run.app URL of a service reached through a custom domain).
+"""
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from .grobid_limiter import pid_alive
+from .metrics import describe, inc, observe, set_gauge
+
+# How long a worker reuses the healthy-instance count (read by the limiter)
+_HEALTHY_CACHE_SECONDS = 1.0
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class GrobidEndpointPool:
+    """
+    Least-outstanding routing over `urls`, with passive (failed calls) and
+    active (probes) ejection of failing or slow instances:
+
+        with pool.route() as instance:
+            response = session.post(f"{instance['url']}/api/...", ...)
+            instance["error"] = response.status_code >= 500
+
+    An exception escaping the block counts as a failure of the instance.
+    """
+
+    def __init__(self, state_path, urls, audiences=None, probe_interval=10.0, probe_timeout=5.0,
+                 probe_slow=2.0, eject_after=2, eject_seconds=30.0, outstanding_ttl=600):
+        self.state_path = state_path
+        self.lock_path = state_path + ".lock"
+        self.urls = list(urls)
+        self.audiences = {url: (audiences or {}).get(url) or url for url in self.urls}
+        self.probe_interval = probe_interval
+        self.probe_timeout = probe_timeout
+        self.probe_slow = probe_slow
+        self.eject_after = eject_after
+        self.eject_seconds = eject_seconds
+        self.outstanding_ttl = outstanding_ttl
+        self._healthy = (0.0, len(self.urls))
+        self._stop = threading.Event()
+        self._prober = None
+
+    @contextmanager
+    def route(self):
+        call_id = uuid.uuid4().hex
+        with self._locked_state() as state:
+            url = self._pick(state)
+            entry = state["instances"][url]
+            entry["outstanding"][call_id] = {"pid": os.getpid(), "started": time.time()}
+            entry["last_routed"] = time.time()
+            self._publish(state)
+        instance = {"url": url, "audience": self.audiences[url], "error": False}
+        try:
+            yield instance
+        except BaseException:
+            instance["error"] = True
+            raise
+        finally:
+            with self._locked_state() as state:
+                entry = state["instances"].get(url)
+                if entry is not None:
+                    entry["outstanding"].pop(call_id, None)
+                    self._record(url, entry, ok=not instance["error"], reason="requests")
+                self._publish(state)
+            inc("grobid_pool_requests_total", instance=url, outcome="error" if instance["error"] else "ok")
+
+    def healthy_count(self):
+        """
+        Instances in rotation (at least 1), as seen a moment ago.
+        """
+        checked, count = self._healthy
+        if time.monotonic() - checked > _HEALTHY_CACHE_SECONDS:
+            with self._locked_state() as state:
+                count = max(1, len(self._in_rotation(state)))
+            self._healthy = (time.monotonic(), count)
+        return count
+
+    def status(self):
+        """
+        [{"url", "healthy", "outstanding", "failures", "ejected_for"}] per instance.
+        """
+        with self._locked_state() as state:
+            rotation = self._in_rotation(state)
+            now = time.time()
+            return [{
+                "url": url,
+                "healthy": url in rotation,
+                "outstanding": len(entry["outstanding"]),
+                "failures": sum(entry["failures"].values()),
+                "ejected_for": max(0.0, round(entry["ejected_until"] - now, 1)),
+            } for url, entry in state["instances"].items()]
+
+    def probe(self, get):
+        """
+        Probes every instance once with `get(url, audience, timeout)`, which
+        raises or returns a response; a slow or failed probe counts as a
+        failure of the instance.
+        """
+        def check(url):
+            start = time.perf_counter()
+            try:
+                response = get(url, self.audiences[url], self.probe_timeout)
+                ok = response.status_code == 200
+            except Exception:
+                ok = False
+            seconds = time.perf_counter() - start
+            observe("grobid_pool_probe_seconds", seconds, instance=url)
+            return url, ok and seconds <= self.probe_slow
+
+        with ThreadPoolExecutor(max_workers=len(self.urls)) as probes:
+            results = list(probes.map(check, self.urls))
+        with self._locked_state() as state:
+            for url, ok in results:
+                state["instances"][url]["probe_ok"] = ok
+                self._record(url, state["instances"][url], ok=ok, reason="probe")
+            self._publish(state)
+        return dict(results)
+
+    def start_probing(self, get):
+        """
+        Probes the instances every probe_interval seconds from a daemon
+        thread; each round is claimed in the state file, so the instance's
+        workers take turns rather than all probing.
+        """
+        if self._prober is not None or self.probe_interval <= 0:
+            return
+        self._prober = threading.Thread(target=self._probe_loop, args=(get,), name="grobid-probe", daemon=True)
+        self._prober.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _probe_loop(self, get):
+        while not self._stop.wait(self.probe_interval):
+            with self._locked_state() as state:
+                due = time.time() - state["last_probe"] >= self.probe_interval * 0.9
+                if due:
+                    state["last_probe"] = time.time()
+            if due:
+                try:
+                    self.probe(get)
+                except Exception as e:
+                    print(f"Error probing GROBID instances: {e}")
+
+    def _pick(self, state):
+        # Fewest outstanding; on a tie, the one that waited longest for a call
+        candidates = self._in_rotation(state) or list(state["instances"])
+        return min(candidates, key=lambda url: (len(state["instances"][url]["outstanding"]),
+                                                state["instances"][url]["last_routed"]))
+
+    def _in_rotation(self, state):
+        now = time.time()
+        return [url for url, entry in state["instances"].items()
+                if entry["ejected_until"] <= now and (entry["ejected_until"] == 0.0 or entry["probe_ok"])]
+
+    def _record(self, url, entry, ok, reason):
+        # Failures in a row are counted apart for calls and probes: a slow
+        # instance still answers calls, and those mustn't clear its probes
+        failures = entry["failures"]
+        if ok:
+            failures[reason] = 0
+            if entry["ejected_until"] and entry["ejected_until"] <= time.time():
+                # Back in rotation
+                entry["ejected_until"] = 0.0
+            elif not entry["ejected_until"] and reason == "requests":
+                entry["ejections"] = 0
+            return
+        failures[reason] = failures.get(reason, 0) + 1
+        if failures[reason] >= self.eject_after and entry["ejected_until"] <= time.time():
+            entry["ejected_until"] = time.time() + self.eject_seconds * min(2 ** entry["ejections"], 10)
+            entry["ejections"] += 1
+            entry["failures"] = {}
+            inc("grobid_pool_ejections_total", instance=url, reason=reason)
+            print(f"Ejected GROBID instance {url} for {entry['ejected_until'] - time.time():.0f}s ({reason})")
+
+    def _publish(self, state):
+        rotation = self._in_rotation(state)
+        for url, entry in state["instances"].items():
+            set_gauge("grobid_pool_outstanding", len(entry["outstanding"]), instance=url)
+            set_gauge("grobid_pool_healthy", int(url in rotation), instance=url)
+
+    @contextmanager
+    def _locked_state(self):
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                state = self._read_state()
+                yield state
+                self._write_state(state)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_state(self):
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        state.setdefault("last_probe", 0.0)
+        known = state.get("instances", {})
+        # Only the configured instances, keeping what is known about them
+        state["instances"] = {url: known.get(url, {}) for url in self.urls}
+        now = time.time()
+        for entry in state["instances"].values():
+            entry.setdefault("outstanding", {})
+            entry.setdefault("failures", {})
+            entry.setdefault("ejections", 0)
+            entry.setdefault("ejected_until", 0.0)
+            entry.setdefault("probe_ok", True)
+            entry.setdefault("last_routed", 0.0)
+            # Drop calls of workers that died or hung past the TTL
+            for key, call in list(entry["outstanding"].items()):
+                if now - call["started"] > self.outstanding_ttl or not pid_alive(call["pid"]):
+                    del entry["outstanding"][key]
+        return state
+
+    def _write_state(self, state):
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+
+def grobid_urls():
+    """
+    The configured GROBID base URLs: GROBID_BASE_URLS, else GROBID_BASE_URL.
+    """
+    urls = getattr(settings, "GROBID_BASE_URLS", None) or [getattr(settings, "GROBID_BASE_URL", "")]
+    return [url.rstrip("/") for url in urls if url]
+
+
+def get_grobid_pool():
+    """
+    Returns the process-wide pool of the configured GROBID instances (a new
+    one if the configuration changed), probing them when there are several.
+    """
+    global _pool
+    urls = grobid_urls()
+    if not urls:
+        raise ValueError("No GROBID_BASE_URL set in Django settings.")
+    with _pool_lock:
+        if _pool is None or _pool.urls != urls:
+            if _pool is not None:
+                _pool.stop()
+            state_dir = getattr(settings, "GROBID_LIMITER_STATE_DIR", "") or tempfile.gettempdir()
+            _pool = GrobidEndpointPool(
+                state_path=os.path.join(state_dir, "grobid_pool.json"),
+                urls=urls,
+                audiences={url.rstrip("/"): audience
+                           for url, audience in getattr(settings, "GROBID_TOKEN_AUDIENCES", {}).items()},
+                probe_interval=getattr(settings, "GROBID_PROBE_INTERVAL", 10.0),
+                probe_timeout=getattr(settings, "GROBID_PROBE_TIMEOUT", 5.0),
+                probe_slow=getattr(settings, "GROBID_PROBE_SLOW", 2.0),
+                eject_after=getattr(settings, "GROBID_EJECT_AFTER", 2),
+                eject_seconds=getattr(settings, "GROBID_EJECT_SECONDS", 30.0),
+            )
+            if len(urls) > 1:
+                from .grobid_client import probe_grobid_instance
+                _pool.start_probing(probe_grobid_instance)
+        return _pool
+
+
+describe("grobid_pool_requests_total", "counter",
+         "GROBID calls by instance and outcome (ok or error).")
+describe("grobid_pool_outstanding", "gauge",
+         "GROBID calls outstanding per instance, across this instance's workers.")
+describe("grobid_pool_healthy", "gauge",
+         "1 while a GROBID instance is in rotation, 0 while it is ejected.")
+describe("grobid_pool_ejections_total", "counter",
+         "GROBID instances ejected, by instance and reason (requests or probe).")
+describe("grobid_pool_probe_seconds", "summary",
+         "Latency of GROBID health probes (/api/isalive), by instance.")
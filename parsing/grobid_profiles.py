@@ -0,0 +1,112 @@
+from django.conf import settings
+
+# Background enrichment pass for profiles that skip consolidation up front:
+# GROBID looks every citation up externally (CrossRef/biblio-glutton), which
+# is what made the original reference parse slow.
+CONSOLIDATION_CALL = ("processReferences", {
+    "consolidateCitations": 1,
+})
+
+# The paper's own title/author/year for profiles whose references call doesn't
+# return them: /api/processReferences answers with an empty <teiHeader/>.
+# Only GROBID's header model runs, on the first pages, so it's a quick call.
+HEADER_CALL = ("processHeaderDocument", {
+    "consolidateHeader": 0,
+})
+
+# Named GROBID extraction profiles. Each maps a parse artifact to the GROBID
+# endpoint and parameters used to produce it, or None when the profile skips it:
+#   - "references" serves parse_type 'references_only' (and the references half of 'both')
+#   - "header" gives the paper's own title/author/year alongside the references
+#   - "consolidation" is the background pass enriching the references afterwards
+#   - "methods" serves parse_type 'methods_tables_only' (and the methods half of 'both')
+#
+# "fast"     – one GROBID call per artifact: the bibliography-only endpoint with
+#              no external lookups, and full text without header consolidation.
+#              Trades away the paper's title/author/year (no header call), the
+#              CrossRef/biblio-glutton metadata of the citations (no background
+#              pass) and the element IDs of the full text.
+# "standard" – the "fast" calls, plus a quick header call made alongside the
+#              references and a background consolidation pass that sends the
+#              PDF to GROBID again; generated IDs in the full text. Trades away
+#              the citation coordinates and raw strings, and shows unconsolidated
+#              citations until the background pass is done.
+# "full"     – the original configuration: full-text processing with citation
+#              and header consolidation, coordinates and generated IDs. Trades
+#              away latency: GROBID looks every citation up externally before
+#              answering the references page.
+#
+# Use `python manage.py benchmark_grobid_profiles <pdf>...` to compare latency
+# and extraction quality of the profiles against a GROBID instance.
+GROBID_PROFILES = {
+    "fast": {
+        "references": ("processReferences", {
+            "consolidateCitations": 0,
+        }),
+        "header": None,
+        "consolidation": None,
+        "methods": ("processFulltextDocument", {
+            "consolidateHeader": 0,
+            "consolidateCitations": 0,
+        }),
+    },
+    "standard": {
+        "references": ("processReferences", {
+            "consolidateCitations": 0,
+        }),
+        "header": HEADER_CALL,
+        "consolidation": CONSOLIDATION_CALL,
+        "methods": ("processFulltextDocument", {
+            "consolidateHeader": 0,
+            "consolidateCitations": 0,
+            "generateIDs": 1,
+        }),
+    },
+    "full": {
+        "references": ("processFulltextDocument", {
+            "consolidateCitations": 1,
+            "consolidateHeader": 1,
+            "includeRawCitations": 1,
+            "generateIDs": 1,
+            "teiCoordinates": "biblStruct",
+            "segmentation": "detailed",
+        }),
+        # The full text carries the header, with consolidated citations
+        "header": None,
+        "consolidation": None,
+        "methods": ("processFulltextDocument", {
+            "consolidateHeader": 1,
+            "consolidateCitations": 0,
+            "segmentation": "detailed",
+            "generateTeiIds": 1,
+        }),
+    },
+}
+
+DEFAULT_PROFILE = "standard"
+
+
+def get_grobid_call(artifact, profile=None):
+    """
+    Returns (endpoint, params) for an artifact ("references", "header",
+    "consolidation" or "methods") under the given profile, falling back to
+    settings.GROBID_PROFILE; None when the profile makes no such call.
+    """
+    name = profile or getattr(settings, "GROBID_PROFILE", DEFAULT_PROFILE)
+    if name not in GROBID_PROFILES:
+        raise ValueError(f"Unknown GROBID profile: {name!r} (expected one of {sorted(GROBID_PROFILES)})")
+    call = GROBID_PROFILES[name][artifact]
+    if call is None:
+        return None
+    endpoint, params = call
+    return endpoint, dict(params)
+
+
+def defers_consolidation(profile=None):
+    """
+    True when references parsed with this profile come back unconsolidated
+    and should be enriched by the background consolidation pass.
+    """
+    if not getattr(settings, "GROBID_DEFER_CONSOLIDATION", True):
+        return False
+    return get_grobid_call("consolidation", profile) is not None
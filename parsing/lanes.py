@@ -0,0 +1,146 @@
+"""
+Priority lanes for parse work. Every call to GROBID or OpenAI runs in a lane:
+
+- "interactive": uploads from the web form and the parse endpoints, whose
+  users are waiting on the page;
+- "bulk": backfills and background enrichment (consolidation), where only
+  the overall throughput matters.
+
+The admission limiters in front of GROBID and OpenAI (grobid_limiter.py)
+queue the calls of all workers and hand out free slots in lane order:
+interactive calls go first, and bulk calls may only fill the cap minus a
+reserve (PARSE_INTERACTIVE_RESERVE, a share of it), so a backfill never takes
+the slots an upload would have to wait for. Within a lane, slots go to the
+user holding the fewest of them for their weight (PARSE_USER_WEIGHTS), then
+first come first served: one user's 1,000-PDF backfill shares the service
+evenly with another's single paper.
+
+Requests are interactive unless they ask for the bulk lane (X-Parse-Lane:
+bulk, e.g. a backfill script) or come from a PARSE_BULK_USERS identity.
+"""
+import math
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from .rate_limits import client_identity
+
+LANES = ("interactive", "bulk")
+
+_local = threading.local()
+
+
+@contextmanager
+def parse_lane(lane, user=None):
+    """
+    Runs the block's GROBID and OpenAI calls in `lane`, on behalf of `user`
+    (an identity such as "user:42", for fair sharing within the lane):
+
+        with parse_lane("bulk", f"user:{paper.owner_id}"):
+            run_parse(...)
+    """
+    if lane not in LANES:
+        raise ValueError(f"Unknown parse lane {lane!r}; expected one of {LANES}")
+    saved = current_lane()
+    _local.lane, _local.user = lane, user or ""
+    try:
+        yield
+    finally:
+        _local.lane, _local.user = saved
+
+
+def current_lane():
+    """
+    (lane, user) of this thread; work outside any parse_lane() is interactive.
+    """
+    return getattr(_local, "lane", LANES[0]), getattr(_local, "user", "")
+
+
+def user_weight(user):
+    return max(float(getattr(settings, "PARSE_USER_WEIGHTS", {}).get(user, 1)), 0.01)
+
+
+def next_waiter(waiting, inflight, cap, reserve):
+    """
+    The ticket of the waiter that gets the next free slot, or None if no
+    waiter may have one now.
+
+    waiting: {ticket: {"lane", "user", "since"}} of the callers queued
+    inflight: {slot: {"lane", "user", ...}} of the slots taken
+    cap: the current concurrency cap; reserve: the share of it kept for
+    interactive calls (bulk calls still get one slot when the cap is 1)
+    """
+    if len(inflight) >= cap or not waiting:
+        return None
+    bulk_cap = max(1, cap - math.ceil(cap * reserve))
+    held = Counter(slot.get("user", "") for slot in inflight.values())
+    bulk_inflight = sum(1 for slot in inflight.values() if slot.get("lane", LANES[0]) != LANES[0])
+    for lane in LANES:
+        if lane != LANES[0] and bulk_inflight >= bulk_cap:
+            return None
+        queued = [ticket for ticket, waiter in waiting.items() if waiter["lane"] == lane]
+        if queued:
+            return min(queued, key=lambda t: (
+                (held[waiting[t]["user"]] + 1) / user_weight(waiting[t]["user"]), waiting[t]["since"]))
+    return None
+
+
+def admissible_waiters(waiting, inflight, cap, reserve):
+    """
+    The tickets of the waiters getting the slots free right now, in order
+    (each takes its own when it next polls).
+    """
+    waiting, inflight = dict(waiting), dict(inflight)
+    admitted = []
+    while True:
+        ticket = next_waiter(waiting, inflight, cap, reserve)
+        if ticket is None:
+            return admitted
+        admitted.append(ticket)
+        inflight[ticket] = waiting.pop(ticket)
+
+
+class ParseLaneMiddleware:
+    """
+    Puts each request (and the streaming response it returns) in its lane,
+    on behalf of its user or client address.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        identity = client_identity(request)
+        lane = request_lane(request, identity)
+        with parse_lane(lane, identity):
+            response = self.get_response(request)
+        if response.streaming:
+            response.streaming_content = _in_lane(response.streaming_content, lane, identity)
+        return response
+
+
+def request_lane(request, identity):
+    if identity in getattr(settings, "PARSE_BULK_USERS", ()):
+        return "bulk"
+    # A client may always ask to be served after the interactive traffic
+    return "bulk" if request.headers.get("X-Parse-Lane", "").strip().lower() == "bulk" else "interactive"
+
+
+def _in_lane(stream, lane, user):
+    # The body of a streaming response is generated after the middleware returned
+    iterator = iter(stream)
+    try:
+        while True:
+            with parse_lane(lane, user):
+                try:
+                    piece = next(iterator)
+                except StopIteration:
+                    return
+            yield piece
+    finally:
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            with parse_lane(lane, user):
+                close()
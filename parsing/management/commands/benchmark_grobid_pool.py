@@ -0,0 +1,152 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ResearchParsing.parsing.stubs import start_grobid_stub
+
+# Run in a fresh interpreter per scenario, with the pool and limiter state of
+# its own: `clients` threads send PDFs through post_pdf_to_grobid (limiter,
+# pool, pooled session) for `seconds`
+MEASURE_SCRIPT = """
+import json, sys, tempfile, threading, time
+import django
+django.setup()
+from ResearchParsing.parsing.grobid_client import post_pdf_to_grobid
+from ResearchParsing.parsing.grobid_pool import get_grobid_pool
+
+clients, seconds = int(sys.argv[1]), float(sys.argv[2])
+with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as pdf:
+    pdf.write(b"%PDF-1.4 benchmark")
+latencies, errors = [], []
+lock = threading.Lock()
+get_grobid_pool()  # starts the probes
+deadline = time.monotonic() + seconds
+
+
+def client():
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        try:
+            post_pdf_to_grobid(pdf.name, "processReferences", {}, stage="benchmark_pool", timeout=30)
+        except Exception as e:
+            with lock:
+                errors.append(type(e).__name__)
+            continue
+        if time.monotonic() < deadline:
+            # Calls finishing after the deadline waited out the queue alone
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+
+threads = [threading.Thread(target=client) for _ in range(clients)]
+for thread in threads:
+    thread.start()
+for thread in threads:
+    thread.join()
+latencies.sort()
+pick = lambda q: round(latencies[min(len(latencies) - 1, int(q * len(latencies)))], 3) if latencies else None
+print(json.dumps({
+    "requests": len(latencies),
+    "errors": len(errors),
+    "throughput": round(len(latencies) / seconds, 1),
+    "p50": pick(0.5),
+    "p95": pick(0.95),
+    "ejected": [s["url"] for s in get_grobid_pool().status() if not s["healthy"]],
+}))
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures GROBID throughput through the endpoint pool as instances are "
+        "added (local GROBID stubs of fixed capacity, so a perfect pool scales "
+        "linearly), and with one instance slow and one down, which the health "
+        "probes and failed calls should eject."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--instances", default="1,2,4",
+                            help="Comma-separated instance counts to measure")
+        parser.add_argument("--latency", type=float, default=0.2, help="Mean seconds per stub call")
+        parser.add_argument("--capacity", type=int, default=4, help="Calls each stub serves at once")
+        parser.add_argument("--clients", type=int, default=0,
+                            help="Concurrent callers (default: twice what the most instances can serve)")
+        parser.add_argument("--seconds", type=float, default=10.0, help="Duration of each scenario")
+        parser.add_argument("--no-degraded", dest="degraded", action="store_false",
+                            help="Skip the scenario with a slow and a stopped instance")
+        parser.add_argument("--json", dest="json_out", default="",
+                            help="Also write the results to this JSON file")
+
+    def handle(self, *args, **options):
+        try:
+            counts = [int(n) for n in options["instances"].split(",") if n.strip()]
+        except ValueError:
+            raise CommandError("--instances must be a comma-separated list of integers")
+        clients = options["clients"] or 2 * options["capacity"] * max(counts)
+
+        scenarios = [(f"{n} healthy", n, False) for n in counts]
+        if options["degraded"] and max(counts) >= 3:
+            scenarios.append((f"{max(counts)}, 1 slow + 1 down", max(counts), True))
+
+        results = []
+        for label, count, degraded in scenarios:
+            result = _measure(count, degraded, clients, options)
+            result.update(scenario=label, instances=count)
+            results.append(result)
+        baseline = results[0]["throughput"] / results[0]["instances"] if results[0]["throughput"] else 0
+
+        header = (f"{'scenario':<24} {'req/s':>7} {'per inst':>8} {'p50 s':>6} {'p95 s':>6} "
+                  f"{'errors':>6} {'ejected':>7}  calls per instance")
+        self.stdout.write(header)
+        self.stdout.write("-" * len(header))
+        for r in results:
+            r["scaling"] = round(r["throughput"] / (baseline * r["instances"]), 2) if baseline else None
+            self.stdout.write(f"{r['scenario']:<24} {r['throughput']:>7} {r['throughput'] / r['instances']:>8.1f} "
+                              f"{r['p50'] or '-':>6} {r['p95'] or '-':>6} {r['errors']:>6} "
+                              f"{len(r['ejected']):>7}  {r['served']}")
+        self.stdout.write(f"Linear scaling = {baseline:.1f} req/s per healthy instance; "
+                          f"{clients} clients, {options['capacity']} calls at once per instance")
+
+        if options["json_out"]:
+            with open(options["json_out"], "w") as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f"Wrote {options['json_out']}")
+
+
+def _measure(count, degraded, clients, options):
+    stubs = [start_grobid_stub(options["latency"], options["capacity"], seed=i) for i in range(count)]
+    try:
+        if degraded:
+            # One instance ten times slower (probes included), one gone
+            stubs[-2].latency *= 10
+            stubs[-2].probe_delay = 3.0
+            stubs[-1].stop()
+        with tempfile.TemporaryDirectory() as state_dir:
+            env = dict(
+                os.environ,
+                DJANGO_SETTINGS_MODULE=os.environ.get("DJANGO_SETTINGS_MODULE", "ResearchParsing.settings"),
+                GROBID_BASE_URLS=",".join(stub.url for stub in stubs),
+                GROBID_AUTH="0",
+                GROBID_LIMITER_STATE_DIR=state_dir,
+                GROBID_CONCURRENCY_INITIAL=str(options["capacity"]),
+                GROBID_CONCURRENCY_MAX=str(options["capacity"]),
+                GROBID_PROBE_INTERVAL="1",
+                GROBID_PROBE_SLOW="1",
+                GROBID_EJECT_SECONDS=str(options["seconds"]),
+            )
+            completed = subprocess.run(
+                [sys.executable, "-c", MEASURE_SCRIPT, str(clients), str(options["seconds"])],
+                env=env, capture_output=True, text=True,
+            )
+        if completed.returncode != 0:
+            raise CommandError(f"Measuring {count} instances failed:\n{completed.stderr[-2000:]}")
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        result["served"] = [stub.requests_served for stub in stubs]
+        return result
+    finally:
+        for stub in stubs[:-1] if degraded else stubs:
+            stub.stop()
@@ -0,0 +1,126 @@
+import json
+import statistics
+import time
+from difflib import SequenceMatcher
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ResearchParsing.parsing.advanced_methods_extraction import parse_tei_for_methods
+from ResearchParsing.parsing.advanced_references_extraction import parse_tei_xml_for_references
+from ResearchParsing.parsing.grobid_client import post_pdf_to_grobid
+from ResearchParsing.parsing.grobid_profiles import GROBID_PROFILES, get_grobid_call
+
+REFERENCE_FIELDS = ("last_name", "title", "year", "journal")
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks the GROBID extraction profiles on sample PDFs: latency per "
+        "artifact and extraction quality relative to the 'full' profile."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("pdfs", nargs="+", help="PDF files to send to GROBID")
+        parser.add_argument("--profiles", default=",".join(GROBID_PROFILES),
+                            help="Comma-separated profiles to compare (default: all)")
+        parser.add_argument("--repeat", type=int, default=1,
+                            help="Calls per PDF/profile/artifact; latency is the median")
+        parser.add_argument("--json", dest="json_out", default="",
+                            help="Also write the raw results to this JSON file")
+
+    def handle(self, *args, **options):
+        profiles = [p.strip() for p in options["profiles"].split(",") if p.strip()]
+        unknown = [p for p in profiles if p not in GROBID_PROFILES]
+        if unknown:
+            raise CommandError(f"Unknown profiles: {unknown}")
+        # Quality is measured against the most thorough configuration
+        if "full" not in profiles:
+            profiles.append("full")
+
+        results = []
+        for pdf_path in options["pdfs"]:
+            runs = {}
+            for profile in profiles:
+                runs[profile] = self._run_profile(pdf_path, profile, options["repeat"])
+            baseline = runs["full"]
+            for profile, run in runs.items():
+                run["reference_recall"] = _title_recall(run["references"], baseline["references"])
+                run["methods_similarity"] = round(
+                    SequenceMatcher(None, run["methods_text"], baseline["methods_text"]).ratio(), 3
+                )
+                results.append({
+                    "pdf": pdf_path,
+                    "profile": profile,
+                    "references_latency_s": run["references_latency_s"],
+                    "methods_latency_s": run["methods_latency_s"],
+                    "references_found": len(run["references"]),
+                    "reference_field_completeness": _field_completeness(run["references"]),
+                    "reference_recall_vs_full": run["reference_recall"],
+                    "methods_chars": len(run["methods_text"]),
+                    "methods_similarity_vs_full": run["methods_similarity"],
+                })
+
+        self._print_table(results)
+        if options["json_out"]:
+            with open(options["json_out"], "w") as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f"Wrote {options['json_out']}")
+
+    def _run_profile(self, pdf_path, profile, repeat):
+        run = {"references": [], "methods_text": ""}
+        for artifact in ("references", "methods"):
+            endpoint, params = get_grobid_call(artifact, profile)
+            # The references page also waits on the profile's header call, if any
+            header_call = get_grobid_call("header", profile) if artifact == "references" else None
+            latencies = []
+            tei_xml = ""
+            for _ in range(repeat):
+                start = time.perf_counter()
+                tei_xml = post_pdf_to_grobid(pdf_path, endpoint, params, stage=f"benchmark_{artifact}")
+                if header_call:
+                    post_pdf_to_grobid(pdf_path, *header_call, stage="benchmark_header")
+                latencies.append(time.perf_counter() - start)
+            run[f"{artifact}_latency_s"] = round(statistics.median(latencies), 3)
+            if artifact == "references":
+                run["references"] = parse_tei_xml_for_references(tei_xml)
+            else:
+                run["methods_text"] = parse_tei_for_methods(tei_xml)
+        return run
+
+    def _print_table(self, results):
+        header = (f"{'pdf':<30} {'profile':<9} {'refs s':>7} {'meth s':>7} "
+                  f"{'#refs':>6} {'fields':>6} {'recall':>6} {'meth sim':>8}")
+        self.stdout.write(header)
+        self.stdout.write("-" * len(header))
+        for r in results:
+            self.stdout.write(
+                f"{r['pdf'][-30:]:<30} {r['profile']:<9} "
+                f"{r['references_latency_s']:>7.2f} {r['methods_latency_s']:>7.2f} "
+                f"{r['references_found']:>6} {r['reference_field_completeness']:>6.2f} "
+                f"{r['reference_recall_vs_full']:>6.2f} {r['methods_similarity_vs_full']:>8.2f}"
+            )
+
+
+def _normalize_title(title):
+    return "".join(ch for ch in (title or "").lower() if ch.isalnum())
+
+
+def _title_recall(references, baseline):
+    """
+    Share of the baseline's reference titles that this run also found.
+    """
+    wanted = {_normalize_title(r.get("title")) for r in baseline} - {""}
+    if not wanted:
+        return 1.0
+    found = {_normalize_title(r.get("title")) for r in references}
+    return round(len(wanted & found) / len(wanted), 3)
+
+
+def _field_completeness(references):
+    """
+    Share of (reference, field) pairs that are non-empty.
+    """
+    if not references:
+        return 0.0
+    filled = sum(1 for r in references for f in REFERENCE_FIELDS if r.get(f))
+    return round(filled / (len(references) * len(REFERENCE_FIELDS)), 3)
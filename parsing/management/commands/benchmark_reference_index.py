@@ -0,0 +1,143 @@
+import json
+import random
+import resource
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+
+from ResearchParsing.parsing.reference_index import ReferenceIndex, blocking_key, prepare_reference
+
+SYLLABLES = ["al", "an", "ar", "be", "co", "de", "di", "en", "er", "es", "ga", "in", "is", "ka", "la", "li",
+             "lo", "ma", "me", "mi", "na", "ne", "no", "or", "pa", "pe", "ra", "re", "ri", "ro", "sa", "se",
+             "si", "ta", "te", "ti", "to", "tu", "va", "ve", "vi", "za"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Builds the MinHash/LSH reference index over a synthetic corpus of "
+        "GROBID-style reference variants and reports throughput, memory and "
+        "pairwise precision/recall against the known works."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--references", type=int, default=1_000_000,
+                            help="Number of references to index")
+        parser.add_argument("--variants", type=float, default=4.0,
+                            help="Average number of references per cited work")
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--json", dest="json_out", default="",
+                            help="Also write the results to this JSON file")
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        count = options["references"]
+        works = _synthetic_works(rng, max(1, int(count / options["variants"])))
+
+        index = ReferenceIndex()
+        pairs = Counter()       # (work, canonical id) -> references
+        assigned = Counter()    # canonical id -> references
+        per_work = Counter()    # work -> references
+        candidates = 0
+        skipped = 0
+        rss_before = _max_rss_mb()
+        seconds = 0.0
+        for n in range(count):
+            work = rng.randrange(len(works))
+            reference = _variant(rng, works[work])
+            start = time.perf_counter()
+            prepared = prepare_reference(reference)
+            canonical_id = index.assign(reference, prepared)
+            seconds += time.perf_counter() - start
+            if canonical_id is None:
+                skipped += 1
+                continue
+            pairs[work, canonical_id] += 1
+            assigned[canonical_id] += 1
+            per_work[work] += 1
+            candidates += len(index.candidates(prepared[3]))
+            index.created.clear()  # only canonicalize_references() persists them
+            if (n + 1) % 100_000 == 0:
+                self.stdout.write(f"  {n + 1:>9} references, {len(index):>8} clusters, {seconds:7.1f}s")
+
+        # An exhaustive matcher would compare each reference with its whole block
+        blocks = Counter(blocking_key(work) for work in works)
+
+        true_pairs = sum(n * (n - 1) // 2 for n in per_work.values())
+        found_pairs = sum(n * (n - 1) // 2 for n in assigned.values())
+        correct_pairs = sum(n * (n - 1) // 2 for n in pairs.values())
+        result = {
+            "references": count,
+            "works": len(per_work),
+            "clusters": len(assigned),
+            "skipped": skipped,
+            "seconds": round(seconds, 1),
+            "references_per_second": round((count - skipped) / seconds) if seconds else None,
+            "max_rss_growth_mb": round(_max_rss_mb() - rss_before),
+            "precision": round(correct_pairs / found_pairs, 4) if found_pairs else 1.0,
+            "recall": round(correct_pairs / true_pairs, 4) if true_pairs else 1.0,
+            "candidates_per_reference": round(candidates / (count - skipped), 2) if count > skipped else 0.0,
+            "largest_block_works": max(blocks.values()),
+        }
+
+        for key, value in result.items():
+            self.stdout.write(f"{key:<24} {value}")
+        if options["json_out"]:
+            with open(options["json_out"], "w") as f:
+                json.dump(result, f, indent=2)
+            self.stdout.write(f"Wrote {options['json_out']}")
+
+
+def _synthetic_works(rng, count):
+    words = sorted({"".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))) for _ in range(8000)})
+    surnames = sorted({"".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 3))).capitalize()
+                       for _ in range(20000)})
+    # Surnames are Zipf-distributed, so some year/surname blocks get large
+    weights = [1 / rank for rank in range(1, len(surnames) + 1)]
+    authors = rng.choices(surnames, weights=weights, k=count)
+    return [
+        {
+            "title": " ".join(rng.choice(words) for _ in range(rng.randint(4, 14))).capitalize(),
+            "last_name": author,
+            "year": str(rng.randint(1980, 2025)),
+        }
+        for author in authors
+    ]
+
+
+def _variant(rng, work):
+    """
+    The work as GROBID might extract it from one citing paper.
+    """
+    words = work["title"].split()
+    roll = rng.random()
+    if roll < 0.15 and len(words) >= 8:
+        words = words[:int(len(words) * rng.uniform(0.6, 0.9))]   # truncated title
+    elif roll < 0.25 and len(words) >= 5:
+        del words[rng.randrange(len(words))]                      # dropped word
+    elif roll < 0.35:
+        i = rng.randrange(len(words))                             # typo
+        w = words[i]
+        if len(w) > 3:
+            j = rng.randrange(len(w) - 1)
+            words[i] = w[:j] + w[j + 1] + w[j] + w[j + 2:]
+    title = " ".join(words)
+    if rng.random() < 0.3:
+        title = title.replace(" ", ": ", 1).upper() if rng.random() < 0.3 else title.title()
+    if rng.random() < 0.1:
+        title = title.replace("e", "é")
+
+    surname = work["last_name"]
+    roll = rng.random()
+    if roll < 0.2:
+        surname = f"{rng.choice('ABCDEFGHJKLMNPRS')}. {surname}"
+    elif roll < 0.3:
+        surname = f"{surname}, {rng.choice('ABCDEFGHJKLMNPRS')}."
+    elif roll < 0.35:
+        surname = surname.upper()
+    year = work["year"] if rng.random() > 0.03 else ""   # GROBID missed the date
+    return {"title": title + rng.choice(["", ".", " ."]), "last_name": surname, "year": year}
+
+
+def _max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
@@ -0,0 +1,71 @@
+import json
+import os
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ResearchParsing.parsing import table_extraction
+from ResearchParsing.parsing.process_pool import get_process_pool
+
+
+class Command(BaseCommand):
+    help = (
+        "Times parse_tables_comprehensive on sample PDFs with different "
+        "process-pool widths and reports the speedup over one process."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("pdfs", nargs="+", help="PDF files to extract tables from")
+        parser.add_argument("--workers", default=f"1,2,4,{os.cpu_count() or 1}",
+                            help="Comma-separated pool widths to compare (1 = in-process)")
+        parser.add_argument("--repeat", type=int, default=1,
+                            help="Runs per PDF and width; the median is reported")
+        parser.add_argument("--json", dest="json_out", default="",
+                            help="Also write the raw results to this JSON file")
+
+    def handle(self, *args, **options):
+        try:
+            widths = sorted({int(w) for w in options["workers"].split(",") if w.strip()})
+        except ValueError:
+            raise CommandError("--workers must be a comma-separated list of integers")
+        if 1 not in widths:
+            widths.insert(0, 1)
+
+        results = []
+        for pdf_path in options["pdfs"]:
+            pages = len(table_extraction._resolve_pages(pdf_path, "all"))
+            baseline = None
+            for width in widths:
+                if width > 1:
+                    # Warm the pool so process and JVM start-up aren't counted
+                    pool = get_process_pool("tabula", width)
+                    list(pool.map(table_extraction.warm_tabula, range(width)))
+                timings, tables = [], []
+                for _ in range(max(1, options["repeat"])):
+                    start = time.perf_counter()
+                    tables = table_extraction.parse_tables_comprehensive(pdf_path, pages="all", workers=width)
+                    timings.append(time.perf_counter() - start)
+                seconds = statistics.median(timings)
+                baseline = baseline or seconds
+                results.append({
+                    "pdf": pdf_path,
+                    "pages": pages,
+                    "workers": width,
+                    "seconds": round(seconds, 2),
+                    "speedup": round(baseline / seconds, 2) if seconds else None,
+                    "tables": len(tables),
+                })
+
+        header = f"{'pdf':<30} {'pages':>5} {'workers':>7} {'seconds':>8} {'speedup':>7} {'tables':>6}"
+        self.stdout.write(header)
+        self.stdout.write("-" * len(header))
+        for r in results:
+            self.stdout.write(
+                f"{r['pdf'][-30:]:<30} {r['pages']:>5} {r['workers']:>7} "
+                f"{r['seconds']:>8.2f} {r['speedup']:>7.2f} {r['tables']:>6}"
+            )
+        if options["json_out"]:
+            with open(options["json_out"], "w") as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f"Wrote {options['json_out']}")
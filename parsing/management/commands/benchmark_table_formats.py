@@ -0,0 +1,129 @@
+import gzip
+import json
+import random
+import statistics
+import time
+
+import pandas as pd
+from django.core.management.base import BaseCommand, CommandError
+
+from ResearchParsing.papers.models import Paper
+from ResearchParsing.parsing.table_formats import decode_tables, encode_tables, export_table
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares table serializations: stored size (raw and gzipped) and "
+        "encode/decode time of the columnar tables_json against the old "
+        "records layout, plus the CSV, Parquet and Arrow exports."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("pdfs", nargs="*", help="PDFs to extract tables from with tabula")
+        parser.add_argument("--from-db", type=int, default=0, metavar="N",
+                            help="Also use the tables stored on the N most recent papers")
+        parser.add_argument("--synthetic", type=int, default=0, metavar="N",
+                            help="Also use N generated tables shaped like tabula output")
+        parser.add_argument("--repeat", type=int, default=5,
+                            help="Timing runs per format; the median is reported")
+        parser.add_argument("--json", dest="json_out", default="",
+                            help="Also write the raw results to this JSON file")
+
+    def handle(self, *args, **options):
+        df_list = self._load_tables(options)
+        if not df_list:
+            raise CommandError("No tables to benchmark: pass PDFs, --from-db or --synthetic")
+        self.stdout.write(f"{len(df_list)} tables, {sum(len(df) for df in df_list)} rows\n")
+
+        formats = {
+            "records (old)": (_encode_records, _decode_records),
+            "columnar": (encode_tables, decode_tables),
+            "csv": (lambda dfs: b"".join(export_table(df, "csv") for df in dfs), None),
+            "parquet": (lambda dfs: b"".join(export_table(df, "parquet") for df in dfs), None),
+            "arrow": (lambda dfs: b"".join(export_table(df, "arrow") for df in dfs), None),
+        }
+
+        results = []
+        for name, (encode, decode) in formats.items():
+            try:
+                encode_s, payload = _median_time(lambda: encode(df_list), options["repeat"])
+            except ImportError as e:
+                self.stderr.write(f"Skipping {name}: {e}")
+                continue
+            data = payload.encode("utf-8") if isinstance(payload, str) else payload
+            decode_s = None
+            if decode is not None:
+                decode_s, _ = _median_time(lambda: decode(payload), options["repeat"])
+            results.append({
+                "format": name,
+                "bytes": len(data),
+                "gzip_bytes": len(gzip.compress(data)),
+                "encode_ms": round(encode_s * 1000, 2),
+                "decode_ms": round(decode_s * 1000, 2) if decode_s is not None else None,
+            })
+
+        self._print_table(results)
+        if options["json_out"]:
+            with open(options["json_out"], "w") as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f"Wrote {options['json_out']}")
+
+    def _load_tables(self, options):
+        df_list = []
+        if options["pdfs"]:
+            from ResearchParsing.parsing.table_extraction import parse_tables_comprehensive
+            for pdf_path in options["pdfs"]:
+                df_list.extend(parse_tables_comprehensive(pdf_path, pages="all"))
+        if options["from_db"]:
+            papers = Paper.objects.exclude(tables_json="").order_by("-created_at")[:options["from_db"]]
+            for paper in papers:
+                df_list.extend(decode_tables(paper.tables_json))
+        if options["synthetic"]:
+            rng = random.Random(0)
+            df_list.extend(_synthetic_table(rng) for _ in range(options["synthetic"]))
+        return df_list
+
+    def _print_table(self, results):
+        header = f"{'format':<14} {'bytes':>10} {'gzip':>10} {'encode ms':>10} {'decode ms':>10}"
+        self.stdout.write(header)
+        self.stdout.write("-" * len(header))
+        for r in results:
+            decode_ms = f"{r['decode_ms']:>10.2f}" if r["decode_ms"] is not None else f"{'-':>10}"
+            self.stdout.write(
+                f"{r['format']:<14} {r['bytes']:>10} {r['gzip_bytes']:>10} {r['encode_ms']:>10.2f} {decode_ms}"
+            )
+
+
+def _encode_records(df_list):
+    # The layout tables_to_json produced before the columnar format
+    return json.dumps([df.fillna("").to_dict(orient="records") for df in df_list], indent=2)
+
+
+def _decode_records(payload):
+    return [pd.DataFrame.from_records(records) for records in json.loads(payload)]
+
+
+def _median_time(func, repeat):
+    timings, result = [], None
+    for _ in range(max(1, repeat)):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), result
+
+
+def _synthetic_table(rng):
+    """
+    A table like tabula returns with header=None: integer column labels, a
+    text label column, numeric columns with blanks and a mixed text column.
+    """
+    rows = rng.randint(5, 60)
+    columns = rng.randint(3, 9)
+    data = {0: [f"Variable {rng.randint(1, 500)}" for _ in range(rows)]}
+    for c in range(1, columns - 1):
+        if c % 2:
+            data[c] = [float(rng.randint(0, 400)) if rng.random() > 0.1 else float("nan") for _ in range(rows)]
+        else:
+            data[c] = [round(rng.uniform(0, 100), 2) if rng.random() > 0.1 else float("nan") for _ in range(rows)]
+    data[columns - 1] = [rng.choice(["p < 0.05", "n.s.", "12 (34%)", 3]) for _ in range(rows)]
+    return pd.DataFrame(data)
@@ -0,0 +1,111 @@
+import json
+import os
+import subprocess
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+# Run in a fresh interpreter per measurement, so each peak RSS is its own.
+# "list" holds every table before serializing (parse_tables_comprehensive +
+# tables_to_json); "stream" serializes them as they are extracted.
+MEASURE_SCRIPT = """
+import json, resource, sys, time
+import django
+django.setup()
+import pandas as pd
+from ResearchParsing.parsing import table_extraction
+
+mode, pdf_path, synthetic = sys.argv[1], sys.argv[2], json.loads(sys.argv[3])
+if synthetic:
+    pages, tables_per_page, rows, columns = synthetic
+
+    def synthetic_tabula(pdf_path, pages="all", lattice=True, stream=False, rotate=False):
+        # Rotated passes find the same tables again, as tabula's often do
+        return [
+            pd.DataFrame([[f"{page}.{n}.{lattice}.{r}.{c}" if c % 2 else page * r * c * 0.5
+                           for c in range(columns)] for r in range(rows)])
+            for page in pages for n in range(tables_per_page)
+        ]
+
+    page_numbers = list(range(1, pages + 1))
+    table_extraction._read_pdf_tabula = synthetic_tabula
+    table_extraction._resolve_pages = lambda pdf_path, pages: page_numbers
+
+baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+start = time.perf_counter()
+if mode == "list":
+    tables_json = table_extraction.tables_to_json(table_extraction.parse_tables_comprehensive(pdf_path, workers=1))
+else:
+    tables_json = table_extraction.tables_to_json(table_extraction.iter_tables(pdf_path, workers=1))
+seconds = time.perf_counter() - start
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({
+    "seconds": round(seconds, 2),
+    "tables": len(json.loads(tables_json)["tables"]),
+    "json_mb": round(len(tables_json) / 2 ** 20, 1),
+    "peak_growth_mb": round((peak - baseline) / 1024),
+}))
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures the peak memory of table extraction + serialization when "
+        "every table is held at once versus streamed one by one, on sample "
+        "PDFs or on synthetic tabula output of growing size (no Java needed)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("pdfs", nargs="*", help="PDF files to extract tables from")
+        parser.add_argument("--synthetic-pages", default="50,200,800",
+                            help="Without PDFs: comma-separated page counts of synthetic documents")
+        parser.add_argument("--tables-per-page", type=int, default=2)
+        parser.add_argument("--rows", type=int, default=40)
+        parser.add_argument("--columns", type=int, default=8)
+        parser.add_argument("--json", dest="json_out", default="",
+                            help="Also write the results to this JSON file")
+
+    def handle(self, *args, **options):
+        if options["pdfs"]:
+            cases = [(pdf_path, os.path.basename(pdf_path), None) for pdf_path in options["pdfs"]]
+        else:
+            try:
+                page_counts = [int(p) for p in options["synthetic_pages"].split(",") if p.strip()]
+            except ValueError:
+                raise CommandError("--synthetic-pages must be a comma-separated list of integers")
+            # The synthetic extractor never opens it, but the pipeline checks it exists
+            pdf_path = os.path.abspath(__file__)
+            cases = [
+                (pdf_path, f"synthetic {pages} pages",
+                 [pages, options["tables_per_page"], options["rows"], options["columns"]])
+                for pages in page_counts
+            ]
+
+        results = []
+        for pdf_path, label, synthetic in cases:
+            for mode in ("list", "stream"):
+                result = _measure(mode, pdf_path, synthetic)
+                results.append(dict(result, document=label, mode=mode))
+
+        header = f"{'document':<28} {'mode':<6} {'tables':>7} {'JSON MB':>8} {'peak growth MB':>14} {'seconds':>8}"
+        self.stdout.write(header)
+        self.stdout.write("-" * len(header))
+        for r in results:
+            self.stdout.write(f"{r['document'][:28]:<28} {r['mode']:<6} {r['tables']:>7} {r['json_mb']:>8} "
+                              f"{r['peak_growth_mb']:>14} {r['seconds']:>8}")
+
+        if options["json_out"]:
+            with open(options["json_out"], "w") as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f"Wrote {options['json_out']}")
+
+
+def _measure(mode, pdf_path, synthetic):
+    env = dict(os.environ, TABLE_PREPASS="0" if synthetic else os.environ.get("TABLE_PREPASS", "1"))
+    completed = subprocess.run(
+        [sys.executable, "-c", MEASURE_SCRIPT, mode, pdf_path, json.dumps(synthetic)],
+        env=env, capture_output=True, text=True,
+    )
+    if completed.returncode != 0:
+        raise CommandError(f"Measuring {mode} on {pdf_path} failed:\n{completed.stderr[-2000:]}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
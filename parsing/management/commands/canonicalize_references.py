@@ -0,0 +1,39 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from ResearchParsing.papers.models import Paper, PdfBlob
+from ResearchParsing.parsing.reference_index import canonicalize_references
+
+
+class Command(BaseCommand):
+    help = (
+        "Assigns canonical reference IDs to the references of papers parsed "
+        "before canonicalization existed (or all papers with --all). Papers "
+        "are processed oldest first, so the IDs match what parsing them in "
+        "upload order would have given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true",
+                            help="Also re-check papers whose references already have IDs")
+
+    def handle(self, *args, **options):
+        updated = 0
+        for model in (Paper, PdfBlob):
+            rows = model.objects.exclude(references_json="").order_by("pk").values_list("pk", "references_json")
+            for pk, references_json in rows.iterator():
+                try:
+                    references = json.loads(references_json)
+                except ValueError:
+                    continue
+                if not references or (not options["all"] and all("canonical_id" in r for r in references)):
+                    continue
+                canonicalize_references(references)
+                fields = {"references_json": json.dumps(references)}
+                if model is Paper:
+                    fields["updated_at"] = timezone.now()
+                model.objects.filter(pk=pk).update(**fields)
+                updated += 1
+        self.stdout.write(f"Canonicalized the references of {updated} papers and blobs")
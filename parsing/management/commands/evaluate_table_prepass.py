@@ -0,0 +1,84 @@
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ResearchParsing.parsing.table_prepass import find_table_pages
+
+
+class Command(BaseCommand):
+    help = (
+        "Evaluates the table-presence pre-pass on a labelled sample: share of "
+        "pages it lets tabula skip and recall of the pages that hold tables."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "labels",
+            help='JSON file mapping PDF paths (relative to the file) to their table pages, '
+                 'e.g. {"trial.pdf": [4, 7]}',
+        )
+        parser.add_argument("--json", dest="json_out", default="",
+                            help="Also write the raw results to this JSON file")
+
+    def handle(self, *args, **options):
+        with open(options["labels"]) as f:
+            labels = json.load(f)
+        base_dir = os.path.dirname(os.path.abspath(options["labels"]))
+
+        results = []
+        for pdf_name, table_pages in labels.items():
+            pdf_path = os.path.join(base_dir, pdf_name)
+            start = time.perf_counter()
+            flagged = find_table_pages(pdf_path)
+            seconds = time.perf_counter() - start
+            if flagged is None:
+                raise CommandError(f"Pre-pass could not analyse {pdf_path}")
+            page_count = _page_count(pdf_path)
+            table_pages = set(table_pages)
+            missed = sorted(table_pages - set(flagged))
+            results.append({
+                "pdf": pdf_name,
+                "pages": page_count,
+                "table_pages": len(table_pages),
+                "flagged": len(flagged),
+                "skip_rate": round(1 - len(flagged) / page_count, 3) if page_count else 0.0,
+                "recall": round(1 - len(missed) / len(table_pages), 3) if table_pages else 1.0,
+                "missed_pages": missed,
+                "seconds": round(seconds, 3),
+            })
+
+        header = f"{'pdf':<30} {'pages':>5} {'tables':>6} {'flagged':>7} {'skip':>6} {'recall':>6} {'s':>6}"
+        self.stdout.write(header)
+        self.stdout.write("-" * len(header))
+        for r in results:
+            self.stdout.write(
+                f"{r['pdf'][-30:]:<30} {r['pages']:>5} {r['table_pages']:>6} {r['flagged']:>7} "
+                f"{r['skip_rate']:>6.2f} {r['recall']:>6.2f} {r['seconds']:>6.2f}"
+                + (f"  missed {r['missed_pages']}" if r["missed_pages"] else "")
+            )
+
+        total_pages = sum(r["pages"] for r in results)
+        total_tables = sum(r["table_pages"] for r in results)
+        total_missed = sum(len(r["missed_pages"]) for r in results)
+        skipped = total_pages - sum(r["flagged"] for r in results)
+        self.stdout.write("-" * len(header))
+        self.stdout.write(
+            f"Overall: {skipped}/{total_pages} pages skipped "
+            f"({skipped / total_pages:.1%}), table-page recall "
+            f"{(total_tables - total_missed) / total_tables if total_tables else 1:.1%}"
+        )
+        if options["json_out"]:
+            with open(options["json_out"], "w") as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f"Wrote {options['json_out']}")
+
+
+def _page_count(pdf_path):
+    import pypdfium2
+    document = pypdfium2.PdfDocument(pdf_path)
+    try:
+        return len(document)
+    finally:
+        document.close()
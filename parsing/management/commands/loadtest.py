@@ -0,0 +1,452 @@
+import json
+import os
+import random
+import secrets
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+from ResearchParsing.parsing.stubs import start_grobid_stub, start_openai_stub
+
+# Creates the simulated users and logged-in sessions in the load test's
+# database; prints their session keys
+SETUP_SCRIPT = """
+import json, sys
+import django
+django.setup()
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.db import SessionStore
+keys = []
+for i in range(int(sys.argv[1])):
+    user = User.objects.create_user(f"loadtest{i}")
+    session = SessionStore()
+    session[SESSION_KEY] = str(user.pk)
+    session[BACKEND_SESSION_KEY] = "django.contrib.auth.backends.ModelBackend"
+    session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+    session.create()
+    keys.append(session.session_key)
+print(json.dumps(keys))
+"""
+
+ACTIONS = ("upload", "list", "detail", "download", "api")
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-tests the real app under gunicorn against local GROBID and OpenAI "
+        "stubs, on-disk storage and a scratch SQLite database. For each worker "
+        "configuration, simulated users are ramped up in stages while doing "
+        "uploads, list/detail views, API calls and downloads; reports "
+        "throughput, latency percentiles, errors and memory per stage, and the "
+        "saturation throughput of each configuration."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--configs", default="sync:2x1,gthread:2x4,gthread:4x4",
+                            help="Comma-separated gunicorn configurations, <worker class>:<workers>x<threads>, "
+                                 "e.g. sync:4x1, gthread:2x8, uvicorn.workers.UvicornWorker:2x1 (served via asgi)")
+        parser.add_argument("--users", default="1,2,4,8,16,32",
+                            help="Concurrent users at each ramp stage")
+        parser.add_argument("--stage-seconds", type=float, default=20.0)
+        parser.add_argument("--mix", default="upload=2,list=3,detail=2,download=1,api=2",
+                            help="Relative weights of the user actions (" + ", ".join(ACTIONS) + ")")
+        parser.add_argument("--accounts", type=int, default=20,
+                            help="Distinct logged-in accounts the users are spread over")
+        parser.add_argument("--pages", type=int, default=12, help="Pages per uploaded PDF")
+        parser.add_argument("--grobid-latency", type=float, default=2.0,
+                            help="Mean seconds per GROBID stub call")
+        parser.add_argument("--grobid-capacity", type=int, default=8,
+                            help="GROBID stub calls served at once (the rest queue)")
+        parser.add_argument("--openai-latency", type=float, default=1.0,
+                            help="Mean seconds per OpenAI stub call")
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--json", dest="json_out", default="",
+                            help="Also write the results to this JSON file")
+        parser.add_argument("--keep", action="store_true",
+                            help="Keep the scratch directory (database, uploads, server logs)")
+
+    def handle(self, *args, **options):
+        configs = [_parse_config(c) for c in options["configs"].split(",") if c.strip()]
+        stages = [int(u) for u in options["users"].split(",") if u.strip()]
+        mix = _parse_mix(options["mix"])
+
+        scratch = tempfile.mkdtemp(prefix="loadtest-")
+        grobid = start_grobid_stub(options["grobid_latency"], options["grobid_capacity"], options["seed"])
+        openai = start_openai_stub(options["openai_latency"], seed=options["seed"])
+        env = dict(
+            os.environ,
+            SQLITE_PATH=os.path.join(scratch, "db.sqlite3"),
+            MEDIA_ROOT=os.path.join(scratch, "media"),
+            LOCAL_MEDIA_STORAGE="1",
+            GROBID_BASE_URL=grobid.url,
+            GROBID_AUTH="0",
+            GROBID_LIMITER_STATE_DIR=scratch,
+            OPENAI_BASE_URL=f"{openai.url}/v1",
+            OPENAI_API_KEY="stub",
+            DJANGO_DEBUG="0",
+            # Measure capacity, not the per-user limits and quotas
+            RATE_LIMIT_BURST="1000000",
+            RATE_LIMIT_PER_MINUTE="1000000",
+            DAILY_PAGE_QUOTA="0",
+            DAILY_TOKEN_QUOTA="0",
+            STARTUP_WARMUP="imports",
+        )
+        env.pop("RATE_LIMIT_REDIS_URL", None)
+
+        results = []
+        try:
+            template = _prepare_database(env, scratch, options["accounts"])
+            for worker_class, workers, threads in configs:
+                label = f"{worker_class}:{workers}x{threads}"
+                self.stdout.write(f"== {label}")
+                shutil.copy(template["db"], env["SQLITE_PATH"])
+                shutil.rmtree(env["MEDIA_ROOT"], ignore_errors=True)
+                with _gunicorn(env, scratch, label, worker_class, workers, threads) as server:
+                    run = _LoadRun(server, template["sessions"], mix, options["pages"], options["seed"])
+                    run.seed_papers()
+                    stage_results = run.ramp(stages, options["stage_seconds"], self.stdout)
+                results.append({
+                    "config": label,
+                    "stages": stage_results,
+                    "saturation_throughput": max(s["throughput"] for s in stage_results),
+                    "knee_users": _knee(stage_results),
+                })
+        finally:
+            grobid.stop()
+            openai.stop()
+            if options["keep"]:
+                self.stdout.write(f"Kept {scratch}")
+            else:
+                shutil.rmtree(scratch, ignore_errors=True)
+
+        self.stdout.write("")
+        self.stdout.write(f"{'config':<34} {'saturation req/s':>16} {'knee users':>10} {'peak RSS MB':>11}")
+        for result in results:
+            peak = max(s["rss_mb"] for s in result["stages"])
+            self.stdout.write(f"{result['config']:<34} {result['saturation_throughput']:>16} "
+                              f"{result['knee_users']:>10} {peak:>11}")
+        self.stdout.write(f"GROBID stub calls: {grobid.requests_served}, OpenAI stub calls: {openai.requests_served}")
+
+        if options["json_out"]:
+            with open(options["json_out"], "w") as f:
+                json.dump({"options": {k: options[k] for k in (
+                    "configs", "users", "stage_seconds", "mix", "accounts", "pages",
+                    "grobid_latency", "grobid_capacity", "openai_latency")}, "results": results}, f, indent=2)
+            self.stdout.write(f"Wrote {options['json_out']}")
+
+
+class _LoadRun:
+    """
+    Simulated users against one running server. Users are added stage by
+    stage and keep going until the end of the ramp; a request counts towards
+    the stage in which it completed.
+    """
+
+    def __init__(self, server, sessions, mix, pages, seed):
+        self.server = server
+        self.sessions = sessions
+        self.mix = mix
+        self.pdf = _blank_pdf(pages)
+        self.rng = random.Random(seed)
+        self.papers = {}          # session key -> paper ids
+        self.samples = []         # (completed at, action, seconds, ok)
+        self.lock = threading.Lock()
+        self.stop = threading.Event()
+
+    def seed_papers(self):
+        """
+        One upload per account, so the views have something to show.
+        """
+        threads = [threading.Thread(target=self._seed, args=(key,)) for key in self.sessions]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if not any(self.papers.values()):
+            raise CommandError("No paper could be uploaded; see the server log")
+
+    def _seed(self, key):
+        http = self._client(key)
+        self._upload(http)
+        response = http.get(f"{self.server.url}/papers/api/papers.json", params={"fields": "title"}, timeout=600)
+        self.papers[key] = [p["id"] for p in response.json()["papers"]] if response.ok else []
+
+    def ramp(self, stages, stage_seconds, out):
+        users, results = [], []
+        out.write(f"{'users':>5} {'req/s':>7} {'errors':>6} {'upload p50':>10} {'p95':>7} "
+                  f"{'pages p50':>9} {'p95':>7} {'p99':>7} {'RSS MB':>7}")
+        memory = _MemorySampler(self.server.pid)
+        try:
+            for count in stages:
+                while len(users) < count:
+                    user = threading.Thread(target=self._user, args=(len(users),), daemon=True)
+                    user.start()
+                    users.append(user)
+                start = time.time()
+                memory.reset()
+                time.sleep(stage_seconds)
+                result = self._stage_result(count, start, time.time(), memory.peak())
+                results.append(result)
+                out.write(f"{count:>5} {result['throughput']:>7} {result['errors']:>6} "
+                          f"{_ms(result['latency']['upload'], 'p50'):>10} {_ms(result['latency']['upload'], 'p95'):>7} "
+                          f"{_ms(result['latency']['pages'], 'p50'):>9} {_ms(result['latency']['pages'], 'p95'):>7} "
+                          f"{_ms(result['latency']['pages'], 'p99'):>7} {result['rss_mb']:>7}")
+        finally:
+            self.stop.set()
+            memory.stop()
+            for user in users:
+                user.join(timeout=120)
+        return results
+
+    def _stage_result(self, users, start, end, rss):
+        with self.lock:
+            window = [s for s in self.samples if start <= s[0] < end]
+        latency = {}
+        for group, actions in (("upload", {"upload"}), ("pages", set(ACTIONS) - {"upload"})):
+            latency[group] = _percentiles(sorted(s[2] for s in window if s[1] in actions and s[3]))
+        for action in ACTIONS:
+            latency[action] = _percentiles(sorted(s[2] for s in window if s[1] == action and s[3]))
+        ok = sum(1 for s in window if s[3])
+        return {
+            "users": users,
+            "requests": len(window),
+            "throughput": round(ok / (end - start), 2),
+            "errors": len(window) - ok,
+            "latency": latency,
+            "rss_mb": rss["total"],
+            "rss_mb_per_worker": rss["per_process"],
+        }
+
+    def _user(self, number):
+        key = self.sessions[number % len(self.sessions)]
+        http = self._client(key)
+        actions, weights = zip(*self.mix.items())
+        with self.lock:
+            rng = random.Random(self.rng.random())
+        while not self.stop.is_set():
+            action = rng.choices(actions, weights)[0]
+            paper = rng.choice(self.papers.get(key) or [0])
+            start = time.perf_counter()
+            try:
+                if action == "upload":
+                    ok = self._upload(http)
+                else:
+                    path = {
+                        "list": "/papers/my-papers/",
+                        "detail": f"/papers/detail/{paper}/",
+                        "download": f"/papers/download/{paper}/",
+                        "api": "/papers/api/papers.json",
+                    }[action]
+                    ok = http.get(self.server.url + path, timeout=600).status_code == 200
+            except requests.RequestException:
+                ok = False
+            with self.lock:
+                self.samples.append((time.time(), action, time.perf_counter() - start, ok))
+
+    def _upload(self, http):
+        # Every upload is a new PDF (a different hash), so each one is parsed
+        pdf = self.pdf + f"\n% {uuid.uuid4()}\n".encode()
+        response = http.post(f"{self.server.url}/api/parsing/parse-references-html/",
+                             files={"pdf_file": ("paper.pdf", pdf, "application/pdf")}, timeout=600)
+        return response.status_code == 200
+
+    def _client(self, session_key):
+        http = requests.Session()
+        # Set directly: the app marks its cookies Secure, which plain HTTP would drop
+        csrf_token = secrets.token_hex(16)
+        http.cookies.set("sessionid", session_key)
+        http.cookies.set("csrftoken", csrf_token)
+        http.headers["X-CSRFToken"] = csrf_token
+        return http
+
+
+class _gunicorn:
+    """
+    gunicorn serving the app on a free port, until the warm-up probe passes.
+    """
+
+    def __init__(self, env, scratch, label, worker_class, workers, threads):
+        self.port = _free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        app = "ResearchParsing.asgi:application" if "uvicorn" in worker_class.lower() else "ResearchParsing.wsgi"
+        self.command = [sys.executable, "-m", "gunicorn", app, f"--bind=127.0.0.1:{self.port}",
+                        f"--worker-class={worker_class}", f"--workers={workers}", f"--threads={threads}",
+                        "--timeout=600"]
+        self.env = env
+        self.log_path = os.path.join(scratch, f"gunicorn-{label.replace(':', '-')}.log")
+
+    def __enter__(self):
+        self.log = open(self.log_path, "w")
+        env = dict(self.env, GUNICORN_CMD_ARGS="")
+        self.process = subprocess.Popen(self.command, env=env, stdout=self.log, stderr=subprocess.STDOUT)
+        self.pid = self.process.pid
+        deadline = time.time() + 120
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise CommandError(f"gunicorn exited with {self.process.returncode}; see {self.log_path}")
+            try:
+                if requests.get(f"{self.url}/startup", params={"warm": 1}, timeout=5).status_code == 200:
+                    return self
+            except requests.RequestException:
+                pass
+            time.sleep(0.5)
+        self.__exit__(None, None, None)
+        raise CommandError(f"gunicorn did not become ready; see {self.log_path}")
+
+    def __exit__(self, *exc):
+        self.process.send_signal(signal.SIGTERM)
+        try:
+            self.process.wait(timeout=60)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.log.close()
+
+
+class _MemorySampler:
+    """
+    Peak resident memory of a process tree (gunicorn master and workers),
+    sampled twice a second from /proc.
+    """
+
+    def __init__(self, root_pid):
+        self.root_pid = root_pid
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        self.reset()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def reset(self):
+        with self.lock:
+            self.total = 0
+            self.per_process = {}
+
+    def peak(self):
+        with self.lock:
+            return {"total": round(self.total), "per_process": sorted(round(v) for v in self.per_process.values())}
+
+    def stop(self):
+        self.done.set()
+
+    def _run(self):
+        while not self.done.wait(0.5):
+            sizes = {pid: _rss_mb(pid) for pid in _process_tree(self.root_pid)}
+            with self.lock:
+                self.total = max(self.total, sum(sizes.values()))
+                for pid, size in sizes.items():
+                    self.per_process[pid] = max(self.per_process.get(pid, 0), size)
+
+
+def _prepare_database(env, scratch, accounts):
+    """
+    Migrates a scratch database and creates the accounts; the result is
+    copied for each configuration so every run starts from the same state.
+    """
+    for command in (["migrate", "--noinput"], ["createcachetable"]):
+        subprocess.run([sys.executable, "-m", "django", *command], env=env, check=True,
+                       stdout=subprocess.DEVNULL)
+    completed = subprocess.run([sys.executable, "-c", SETUP_SCRIPT, str(accounts)], env=env, check=True,
+                               capture_output=True, text=True)
+    sessions = json.loads(completed.stdout.strip().splitlines()[-1])
+    template = os.path.join(scratch, "template.sqlite3")
+    shutil.copy(env["SQLITE_PATH"], template)
+    return {"db": template, "sessions": sessions}
+
+
+def _parse_config(text):
+    try:
+        worker_class, shape = text.strip().rsplit(":", 1)
+        workers, threads = (int(n) for n in shape.split("x"))
+    except ValueError:
+        raise CommandError(f"Bad configuration {text!r}: expected <worker class>:<workers>x<threads>")
+    return worker_class, workers, threads
+
+
+def _parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in ACTIONS:
+            raise CommandError(f"Unknown action {name.strip()!r} in --mix")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def _knee(stages):
+    """
+    Fewest users reaching 90% of the saturation throughput: beyond it, more
+    users mostly add latency.
+    """
+    best = max(s["throughput"] for s in stages)
+    return next(s["users"] for s in stages if s["throughput"] >= 0.9 * best)
+
+
+def _percentiles(values):
+    if not values:
+        return {}
+    pick = lambda q: values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+    return {"count": len(values), "p50": round(pick(0.5), 3), "p95": round(pick(0.95), 3),
+            "p99": round(pick(0.99), 3), "max": round(values[-1], 3)}
+
+
+def _ms(latency, key):
+    return f"{latency[key] * 1000:.0f}" if key in latency else "-"
+
+
+def _blank_pdf(pages):
+    import pypdfium2
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "blank.pdf")
+        document = pypdfium2.PdfDocument.new()
+        for _ in range(pages):
+            document.new_page(612, 792)
+        document.save(path)
+        document.close()
+        with open(path, "rb") as f:
+            return f.read()
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _process_tree(root_pid):
+    children = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(ppid, []).append(int(entry))
+    tree, pending = [], [root_pid]
+    while pending:
+        pid = pending.pop()
+        tree.append(pid)
+        pending.extend(children.get(pid, []))
+    return tree
+
+
+def _rss_mb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
@@ -0,0 +1,94 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.core.management.base import BaseCommand
+
+# Run in a fresh interpreter: what a cold worker does before its first
+# response (Django set-up plus the URLconf, which imports every view module)
+STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import django
+django.setup()
+from django.urls import get_resolver
+get_resolver().url_patterns
+lazy = time.perf_counter() - start
+if "--eager" in sys.argv:
+    # Everything the parse paths load on first use, as a worker did at import
+    from ResearchParsing.parsing.warmup import warm_imports
+    warm_imports()
+heavy = [m for m in %r if m in sys.modules]
+print(json.dumps({"lazy": lazy, "total": time.perf_counter() - start, "heavy": heavy}))
+"""
+
+HEAVY_MODULES = ("openai", "pandas", "numpy", "tabula", "lxml.etree", "google.auth")
+
+
+class Command(BaseCommand):
+    help = (
+        "Profiles the imports a cold worker pays before serving its first "
+        "request (python -X importtime), with the heavy parse dependencies "
+        "deferred as they are now and loaded eagerly as they used to be."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--runs", type=int, default=5,
+                            help="Fresh interpreters per variant; the median is reported")
+        parser.add_argument("--top", type=int, default=10,
+                            help="Slowest top-level imports to list per variant")
+        parser.add_argument("--json", dest="json_out", default="",
+                            help="Also write the results to this JSON file")
+
+    def handle(self, *args, **options):
+        results = {}
+        for variant in ("deferred", "eager"):
+            timings, modules, heavy = [], {}, []
+            for _ in range(max(1, options["runs"])):
+                seconds, heavy, run_modules = _profile(variant == "eager")
+                timings.append(seconds)
+                for name, micros in run_modules.items():
+                    modules.setdefault(name, []).append(micros)
+            slowest = sorted(((statistics.median(v), k) for k, v in modules.items()), reverse=True)
+            results[variant] = {
+                "seconds": round(statistics.median(timings), 3),
+                "heavy_modules_loaded": heavy,
+                "slowest_imports_ms": {name: round(micros / 1000) for micros, name in slowest[:options["top"]]},
+            }
+
+        for variant, result in results.items():
+            self.stdout.write(f"{variant}: {result['seconds']}s, heavy modules loaded: "
+                              f"{', '.join(result['heavy_modules_loaded']) or 'none'}")
+            for name, ms in result["slowest_imports_ms"].items():
+                self.stdout.write(f"  {ms:>6} ms  {name}")
+        saved = results["eager"]["seconds"] - results["deferred"]["seconds"]
+        self.stdout.write(f"Deferring the parse dependencies saves {saved:.3f}s per cold start")
+
+        if options["json_out"]:
+            with open(options["json_out"], "w") as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f"Wrote {options['json_out']}")
+
+
+def _profile(eager):
+    """
+    (seconds, heavy modules loaded, {top-level module: cumulative µs}) for one
+    fresh interpreter.
+    """
+    command = [sys.executable, "-X", "importtime", "-c", STARTUP_SCRIPT % (HEAVY_MODULES,)]
+    if eager:
+        command.append("--eager")
+    completed = subprocess.run(command, capture_output=True, text=True, env=os.environ.copy(), check=True)
+    report = json.loads(completed.stdout.strip().splitlines()[-1])
+
+    modules = {}
+    for line in completed.stderr.splitlines():
+        # "import time: self [us] | cumulative | imported package"
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split(":", 1)[1].split("|")
+        if not name[1:].startswith(" "):  # top level: nothing else imported it
+            modules[name.strip()] = int(cumulative)
+    return report["total" if eager else "lazy"], report["heavy"], modules
@@ -0,0 +1,485 @@
+"""
+In-process metrics registry, rendered in the Prometheus text format.
+
+Every gunicorn worker records into its own registry. With METRICS_DIR set
+(like prometheus_client's PROMETHEUS_MULTIPROC_DIR), each worker also writes
+its series to a file of its own there (named by its pid and a random id, so
+a worker reusing an exited one's pid doesn't overwrite it) every
+METRICS_FLUSH_SECONDS and on exit, and a scrape of any worker renders all of
+them merged:
+
+- counters, and summary counts and sums, add up over every file, including
+  those of workers that have exited, so totals don't drop when a worker is
+  replaced;
+- summary quantiles are computed over the samples of the live workers;
+- gauges (views of the limiter and pool state files, the same in every
+  worker) take the value set last by a live worker.
+
+Empty the directory when the server starts (the Docker image does).
+"""
+import atexit
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+from django.conf import settings
+
+# Number of recent observations kept per series for the p50/p95/p99 quantiles.
+# Counts and sums are exact; quantiles are computed over this sliding window.
+SAMPLE_WINDOW = 2048
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+_lock = threading.Lock()
+_summaries = {}   # (metric_name, labels) -> _Summary
+_counters = {}    # (metric_name, labels) -> float
+_gauges = {}      # (metric_name, labels) -> float
+_gauge_times = {}  # (metric_name, labels) -> time.time() it was set
+_help = {}        # metric_name -> (type, help text)
+
+# Per-thread collector so a view can gather the stage timings of the parse it runs
+_local = threading.local()
+
+# Process whose series are written to METRICS_DIR by a flusher thread (None
+# until the first series is recorded), and whether they changed since
+_flusher_pid = None
+_dirty = False
+
+
+def _new_process_id():
+    # Names this process's file: a pid alone is reused by a later worker, whose
+    # file would then overwrite the counters of the exited one
+    return f"{os.getpid()}-{uuid.uuid4().hex[:12]}"
+
+
+_process_id = _new_process_id()
+
+
+class _Summary:
+    __slots__ = ("count", "total", "samples")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.samples = deque(maxlen=SAMPLE_WINDOW)
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        self.samples.append(value)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def describe(name, metric_type, help_text):
+    """
+    Registers the Prometheus TYPE/HELP lines for a metric name.
+    """
+    _help[name] = (metric_type, help_text)
+
+
+def observe(name, value, **labels):
+    """
+    Records one observation (a duration, a byte count...) in a summary series.
+    """
+    key = (name, _label_key(labels))
+    with _lock:
+        summary = _summaries.get(key)
+        if summary is None:
+            summary = _summaries[key] = _Summary()
+        summary.observe(value)
+    _changed()
+
+
+def inc(name, amount=1, **labels):
+    """
+    Increments a monotonically increasing counter.
+    """
+    key = (name, _label_key(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+    _changed()
+
+
+def set_gauge(name, value, **labels):
+    """
+    Sets a gauge to its current value (e.g. an in-flight request count).
+    """
+    key = (name, _label_key(labels))
+    with _lock:
+        _gauges[key] = value
+        _gauge_times[key] = time.time()
+    _changed()
+
+
+@contextmanager
+def stage_timer(stage):
+    """
+    Times a pipeline stage, e.g.:
+
+        with stage_timer("grobid_references"):
+            response = requests.post(...)
+
+    The duration goes into the `parse_stage_duration_seconds` summary and,
+    when the current thread is inside `collect_timings()`, into the dict
+    that ends up on the Paper record. Failed stages are counted separately.
+    A stage cut short by GeneratorExit (a streaming response whose client
+    disconnected) is counted as cancelled: neither a failure nor a duration.
+    """
+    start = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except GeneratorExit:
+        outcome = "cancelled"
+        raise
+    except BaseException:
+        outcome = "failed"
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        if outcome == "cancelled":
+            inc("parse_stage_cancellations_total", stage=stage)
+        else:
+            observe("parse_stage_duration_seconds", elapsed, stage=stage)
+        if outcome == "failed":
+            inc("parse_stage_failures_total", stage=stage)
+        timings = getattr(_local, "timings", None)
+        if timings is not None:
+            # Pipeline stages running in parallel share the request's dict
+            with _lock:
+                timings[stage] = round(timings.get(stage, 0.0) + elapsed, 4)
+
+
+@contextmanager
+def collect_timings():
+    """
+    Collects the stage timings recorded on this thread into a dict:
+
+        with collect_timings() as timings:
+            refs = grobid_extract_references(tmp_path)
+        paper_obj.parse_timings_json = json.dumps(timings)
+
+    Nested collectors share the outermost dict.
+    """
+    outer = getattr(_local, "timings", None)
+    if outer is not None:
+        yield outer
+        return
+    _local.timings = {}
+    try:
+        yield _local.timings
+    finally:
+        _local.timings = None
+
+
+@contextmanager
+def collect_token_usage():
+    """
+    Counts the OpenAI tokens recorded on this thread, e.g. to charge them to
+    the user whose request spent them (see rate_limits.py):
+
+        with collect_token_usage() as usage:
+            response = view(request)
+        charge(usage["tokens"])
+
+    Nested collectors share the outermost tally.
+    """
+    outer = getattr(_local, "token_usage", None)
+    if outer is not None:
+        yield outer
+        return
+    _local.token_usage = {"tokens": 0}
+    try:
+        yield _local.token_usage
+    finally:
+        _local.token_usage = None
+
+
+def current_collectors():
+    """
+    The timing and token-usage collectors of this thread, for work it hands
+    to other threads (see use_collectors).
+    """
+    return getattr(_local, "timings", None), getattr(_local, "token_usage", None)
+
+
+@contextmanager
+def use_collectors(collectors):
+    """
+    Records this thread's stage timings and token usage into the collectors
+    of the thread that handed it the work (from current_collectors()).
+    """
+    saved = current_collectors()
+    _local.timings, _local.token_usage = collectors
+    try:
+        yield
+    finally:
+        _local.timings, _local.token_usage = saved
+
+
+def record_bytes(stage, direction, num_bytes):
+    """
+    Records the size of a payload sent to or received from a stage.
+    `direction` is "in" (sent to the service) or "out" (returned by it).
+    """
+    observe("parse_stage_bytes", num_bytes, stage=stage, direction=direction)
+
+
+def record_token_usage(call, usage):
+    """
+    Records the token usage reported by an OpenAI completion.
+    `usage` is the `response.usage` object (may be None for some responses).
+    """
+    if usage is None:
+        return
+    prompt = getattr(usage, "prompt_tokens", 0) or 0
+    completion = getattr(usage, "completion_tokens", 0) or 0
+    inc("openai_tokens_total", prompt, call=call, kind="prompt")
+    inc("openai_tokens_total", completion, call=call, kind="completion")
+    observe("openai_tokens_per_call", prompt + completion, call=call)
+    token_usage = getattr(_local, "token_usage", None)
+    if token_usage is not None:
+        with _lock:
+            token_usage["tokens"] += prompt + completion
+
+
+def _quantile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels)
+    if extra:
+        items.extend(extra)
+    if not items:
+        return ""
+    inner = ",".join(f'{k}="{_escape(v)}"' for k, v in items)
+    return "{" + inner + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value):
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def snapshot():
+    """
+    Returns a point-in-time copy of every series:
+    {"summaries": {(name, labels): (count, total, sorted_samples)},
+     "counters": {(name, labels): value},
+     "gauges": {(name, labels): value}}
+    """
+    with _lock:
+        summaries = {
+            key: (s.count, s.total, sorted(s.samples))
+            for key, s in _summaries.items()
+        }
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+    return {"summaries": summaries, "counters": counters, "gauges": gauges}
+
+
+def shared_snapshot(directory):
+    """
+    snapshot() of this process merged with the series the other processes
+    wrote to `directory` (see the module docstring).
+    """
+    from .grobid_limiter import pid_alive
+
+    snap = snapshot()
+    with _lock:
+        gauge_times = dict(_gauge_times)
+    files = []
+    for path in glob.glob(os.path.join(directory, "metrics-*.json")):
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if data.get("process") != _process_id:
+            files.append(data)
+    # Of the files of one pid, only the last written can be a live process's:
+    # the others are those of exited processes the pid was reused after
+    latest = {}
+    for data in files:
+        latest[data["pid"]] = max(latest.get(data["pid"], 0.0), data.get("written", 0.0))
+    for data in files:
+        alive = (data["pid"] != os.getpid() and data.get("written", 0.0) == latest[data["pid"]]
+                 and pid_alive(data["pid"]))
+        for name, labels, value in data["counters"]:
+            key = (name, _labels_from_json(labels))
+            snap["counters"][key] = snap["counters"].get(key, 0) + value
+        for name, labels, count, total, samples in data["summaries"]:
+            key = (name, _labels_from_json(labels))
+            merged_count, merged_total, merged_samples = snap["summaries"].get(key, (0, 0.0, []))
+            snap["summaries"][key] = (merged_count + count, merged_total + total,
+                                      merged_samples + samples if alive else merged_samples)
+        if not alive:
+            continue
+        for name, labels, value, set_at in data["gauges"]:
+            key = (name, _labels_from_json(labels))
+            if set_at > gauge_times.get(key, 0.0):
+                snap["gauges"][key], gauge_times[key] = value, set_at
+    for key, (count, total, samples) in snap["summaries"].items():
+        snap["summaries"][key] = (count, total, sorted(samples))
+    return snap
+
+
+def write_process_series(directory):
+    """
+    Writes this process's series to its file in `directory`.
+    """
+    global _dirty
+    with _lock:
+        _dirty = False
+        data = {
+            "pid": os.getpid(),
+            "process": _process_id,
+            "written": time.time(),
+            "summaries": [[name, labels, s.count, s.total, list(s.samples)]
+                          for (name, labels), s in _summaries.items()],
+            "counters": [[name, labels, value] for (name, labels), value in _counters.items()],
+            "gauges": [[name, labels, value, _gauge_times.get((name, labels), 0.0)]
+                       for (name, labels), value in _gauges.items()],
+        }
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile("w", dir=directory, prefix=".metrics-", delete=False) as f:
+        json.dump(data, f)
+    os.replace(f.name, os.path.join(directory, f"metrics-{_process_id}.json"))
+
+
+def render_prometheus(snap=None):
+    """
+    Renders all metrics in the Prometheus text exposition format (0.0.4):
+    those of every worker with METRICS_DIR set, else this worker's own.
+    """
+    if snap is None:
+        directory = _metrics_dir()
+        snap = shared_snapshot(directory) if directory else snapshot()
+    lines = []
+
+    by_name = {}
+    for (name, labels), data in sorted(snap["summaries"].items()):
+        by_name.setdefault(name, []).append((labels, data))
+    for name, series in by_name.items():
+        metric_type, help_text = _help.get(name, ("summary", name))
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for labels, (count, total, samples) in series:
+            for q in QUANTILES:
+                lines.append(
+                    f"{name}{_format_labels(labels, [('quantile', q)])} "
+                    f"{_format_value(_quantile(samples, q))}"
+                )
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+
+    for kind in ("counters", "gauges"):
+        by_name = {}
+        for (name, labels), value in sorted(snap[kind].items()):
+            by_name.setdefault(name, []).append((labels, value))
+        for name, series in by_name.items():
+            metric_type, help_text = _help.get(name, (kind[:-1], name))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in series:
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    """
+    Clears every series (used by tests and benchmarks).
+    """
+    with _lock:
+        _summaries.clear()
+        _counters.clear()
+        _gauges.clear()
+        _gauge_times.clear()
+
+
+def _labels_from_json(labels):
+    return tuple((k, v) for k, v in labels)
+
+
+def _metrics_dir():
+    return getattr(settings, "METRICS_DIR", "") if settings.configured else ""
+
+
+def _changed():
+    global _dirty
+    _dirty = True
+    if _flusher_pid != os.getpid():
+        _start_flusher()
+
+
+def _start_flusher():
+    global _flusher_pid
+    with _lock:
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+    directory = _metrics_dir()
+    if not directory:
+        return
+    interval = getattr(settings, "METRICS_FLUSH_SECONDS", 5.0)
+    threading.Thread(target=_flush_loop, args=(directory, interval), name="metrics-flush", daemon=True).start()
+    atexit.register(_flush, directory)
+
+
+def _flush_loop(directory, interval):
+    while True:
+        time.sleep(interval)
+        if _dirty:
+            _flush(directory)
+
+
+def _flush(directory):
+    try:
+        write_process_series(directory)
+    except Exception as e:
+        print(f"Error writing metrics to {directory}: {e}")
+
+
+def _forget_parent_series():
+    # A forked child (gunicorn worker, process pool) starts from an empty
+    # registry; otherwise it would write its parent's series again. The lock
+    # is new too: another thread of the parent may have held it at the fork.
+    global _lock, _flusher_pid, _dirty, _process_id
+    _lock = threading.Lock()
+    _flusher_pid, _dirty = None, False
+    _process_id = _new_process_id()
+    reset()
+
+
+os.register_at_fork(after_in_child=_forget_parent_series)
+
+
+describe("parse_stage_duration_seconds", "summary",
+         "Wall-clock duration of each parse pipeline stage in seconds.")
+describe("parse_stage_failures_total", "counter",
+         "Number of pipeline stage runs that raised an exception.")
+describe("parse_stage_cancellations_total", "counter",
+         "Pipeline stage runs cut short by a client disconnecting from a streaming response.")
+describe("parse_stage_bytes", "summary",
+         "Payload size in bytes sent to (in) or returned by (out) a stage.")
+describe("openai_tokens_total", "counter",
+         "OpenAI tokens consumed, by call site and prompt/completion.")
+describe("openai_tokens_per_call", "summary",
+         "Total OpenAI tokens (prompt + completion) per API call.")
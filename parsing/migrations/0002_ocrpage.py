@@ -0,0 +1,26 @@
+# Generated by Django 5.1.5 on 2026-10-19 11:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parsing', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OcrPage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pdf_hash', models.CharField(max_length=64)),
+                ('page', models.PositiveIntegerField()),
+                ('text', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('pdf_hash', 'page'), name='unique_ocr_page')],
+            },
+        ),
+    ]
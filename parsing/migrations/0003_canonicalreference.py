@@ -0,0 +1,34 @@
+# Generated by Django 5.1.5 on 2026-10-19 11:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parsing', '0002_ocrpage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CanonicalReference',
+            fields=[
+                ('canonical_id', models.CharField(max_length=32, primary_key=True, serialize=False)),
+                ('block', models.CharField(max_length=128)),
+                ('title', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ReferenceBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.BigIntegerField()),
+                ('reference', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='buckets', to='parsing.canonicalreference')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('key', 'reference'), name='unique_reference_bucket')],
+            },
+        ),
+    ]
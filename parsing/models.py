@@ -1,3 +1,67 @@
 from django.db import models
 
 # Create your models here.
+
+
+class ParseLease(models.Model):
+    """
+    Cross-worker single-flight lock for parsing one PDF (see single_flight.py).
+    The unique key makes inserting the row the atomic "I'm parsing it" step;
+    the row is deleted when the parse finishes and taken over once expired.
+    """
+    key = models.CharField(max_length=128, unique=True)
+    holder = models.CharField(max_length=64)
+    acquired_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.key} (held by {self.holder})"
+
+
+class OcrPage(models.Model):
+    """
+    Tesseract output for one page of a scanned PDF (see ocr.py), shared by
+    every upload of the same file so scans are only OCR'd once.
+    """
+    pdf_hash = models.CharField(max_length=64)
+    page = models.PositiveIntegerField()
+    text = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['pdf_hash', 'page'], name='unique_ocr_page'),
+        ]
+
+    def __str__(self):
+        return f"{self.pdf_hash[:12]} p{self.page}"
+
+
+class CanonicalReference(models.Model):
+    """
+    One cited work, as identified across papers by reference_index.py. The
+    stored references of every paper carry the canonical_id of their work.
+    """
+    canonical_id = models.CharField(max_length=32, primary_key=True)
+    # "year|surname" blocking key and normalized title of the first sighting
+    block = models.CharField(max_length=128)
+    title = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.canonical_id} ({self.block}) {self.title[:60]}"
+
+
+class ReferenceBucket(models.Model):
+    """
+    An LSH band key of a canonical reference: references whose band keys hit
+    a bucket are compared against its canonical reference.
+    """
+    key = models.BigIntegerField()
+    reference = models.ForeignKey(CanonicalReference, on_delete=models.CASCADE, related_name='buckets')
+
+    class Meta:
+        # Its index (key first) serves the lookups by key
+        constraints = [
+            models.UniqueConstraint(fields=['key', 'reference'], name='unique_reference_bucket'),
+        ]
@@ -0,0 +1,168 @@
+import hashlib
+import re
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+
+from .metrics import describe, inc, stage_timer
+from .process_pool import get_process_pool, shutdown_process_pool
+
+# Section headings that open / close the methods section in OCR'd text
+METHODS_HEADING_RE = re.compile(
+    r"^\s*(?:\d+(?:\.\d+)*\.?\s+|[IVX]+\.\s+)?"
+    r"(materials?\s+and\s+methods|methods?|methodology|patients\s+and\s+methods|"
+    r"experimental(?:\s+(?:section|procedures?))?|study\s+design)\s*:?\s*$",
+    re.IGNORECASE | re.MULTILINE,
+)
+NEXT_SECTION_RE = re.compile(
+    r"^\s*(?:\d+(?:\.\d+)*\.?\s+|[IVX]+\.\s+)?"
+    r"(results?(?:\s+and\s+discussion)?|discussion|conclusions?|references|acknowledge?ments?)\s*:?\s*$",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+
+def ocr_methods_fallback(pdf_path, pdf_hash=None):
+    """
+    Methods text for a scanned PDF, for when GROBID found none: OCRs the
+    image-only pages (cached per pdf_hash and page) and cuts out the methods
+    section. Returns "" for PDFs with a text layer or without a methods heading.
+    """
+    if not getattr(settings, "OCR_ENABLED", True):
+        return ""
+    try:
+        text = ocr_scanned_pages(pdf_path, pdf_hash)
+    except Exception as e:
+        print(f"ERROR running OCR fallback for {pdf_path}: {e}")
+        return ""
+    return extract_methods_from_text(text)
+
+
+def ocr_scanned_pages(pdf_path, pdf_hash=None):
+    """
+    Text of the PDF's image-only pages, in page order. Pages already OCR'd for
+    this file (by any upload) come from the OcrPage table; the rest are
+    rasterized and run through tesseract on the OCR process pool.
+    """
+    from .models import OcrPage
+
+    pages = image_only_pages(pdf_path)
+    if not pages:
+        return ""
+    pdf_hash = pdf_hash or _file_hash(pdf_path)
+
+    texts = dict(OcrPage.objects.filter(pdf_hash=pdf_hash, page__in=pages).values_list("page", "text"))
+    missing = [page for page in pages if page not in texts]
+    inc("ocr_pages_total", len(pages) - len(missing), result="cached")
+
+    if missing:
+        with stage_timer("ocr"):
+            fresh = _ocr_pages(pdf_path, missing)
+        inc("ocr_pages_total", len(fresh), result="ocr")
+        inc("ocr_pages_total", len(missing) - len(fresh), result="failed")
+        OcrPage.objects.bulk_create(
+            [OcrPage(pdf_hash=pdf_hash, page=page, text=text) for page, text in fresh.items()],
+            ignore_conflicts=True,  # a concurrent parse of the same scan got there first
+        )
+        texts.update(fresh)
+
+    return "\n\n".join(texts[page] for page in pages if texts.get(page))
+
+
+def image_only_pages(pdf_path):
+    """
+    Page numbers (from 1) with (almost) no text layer but at least one image.
+    """
+    import pypdfium2
+    import pypdfium2.raw as pdfium_c
+
+    min_chars = getattr(settings, "OCR_MIN_CHARS", 20)
+    pages = []
+    document = pypdfium2.PdfDocument(pdf_path)
+    try:
+        for index in range(len(document)):
+            page = document[index]
+            try:
+                text_page = page.get_textpage()
+                chars = text_page.count_chars()
+                text_page.close()
+                if chars < min_chars and any(page.get_objects(filter=[pdfium_c.FPDF_PAGEOBJ_IMAGE], max_depth=2)):
+                    pages.append(index + 1)
+            finally:
+                page.close()
+    finally:
+        document.close()
+    return pages
+
+
+def extract_methods_from_text(text):
+    """
+    The methods section of plain (OCR'd) text: from a methods heading line to
+    the next results/discussion/references heading or the end of the text.
+    """
+    start = METHODS_HEADING_RE.search(text or "")
+    if start is None:
+        return ""
+    end = NEXT_SECTION_RE.search(text, start.end())
+    return text[start.end():end.start() if end else len(text)].strip()
+
+
+def _ocr_pages(pdf_path, pages):
+    """
+    {page: text} for the pages that OCR'd successfully. Runs on the process
+    pool when there is more than one page and more than one OCR worker.
+    """
+    width = min(getattr(settings, "OCR_WORKERS", 2), len(pages))
+    dpi = getattr(settings, "OCR_DPI", 300)
+    language = getattr(settings, "OCR_LANGUAGE", "eng")
+
+    if width <= 1:
+        results = [_ocr_page_safely(pdf_path, page, dpi, language) for page in pages]
+    else:
+        try:
+            pool = get_process_pool("ocr", width)
+            results = list(pool.map(_ocr_page_safely, [pdf_path] * len(pages), pages,
+                                    [dpi] * len(pages), [language] * len(pages)))
+        except BrokenProcessPool as e:
+            print(f"ERROR in OCR process pool, OCR'ing in-process instead: {e}")
+            shutdown_process_pool("ocr")
+            results = [_ocr_page_safely(pdf_path, page, dpi, language) for page in pages]
+
+    return {page: text for page, text in zip(pages, results) if text is not None}
+
+
+def _ocr_page_safely(pdf_path, page, dpi, language):
+    try:
+        return _ocr_page(pdf_path, page, dpi, language)
+    except Exception as e:
+        print(f"ERROR in OCR of {pdf_path} page {page}: {e}")
+        return None
+
+
+def _ocr_page(pdf_path, page, dpi, language):
+    """
+    Rasterizes one page and runs tesseract on it. Executed in pool workers,
+    which open the PDF themselves so no images cross process boundaries.
+    """
+    import pypdfium2
+    import pytesseract
+
+    document = pypdfium2.PdfDocument(pdf_path)
+    try:
+        pdf_page = document[page - 1]
+        image = pdf_page.render(scale=dpi / 72, grayscale=True).to_pil()
+        pdf_page.close()
+    finally:
+        document.close()
+    return pytesseract.image_to_string(image, lang=language)
+
+
+def _file_hash(pdf_path):
+    hasher = hashlib.sha256()
+    with open(pdf_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+describe("ocr_pages_total", "counter",
+         "Image-only pages served from the OCR cache (cached), OCR'd (ocr) or failed.")
@@ -0,0 +1,346 @@
+"""
+A small declarative executor for the parse pipeline (the stages themselves
+are in stages.py). A stage is a function from named inputs to one named
+output; the names wire the stages into a DAG. Callers ask for the artifacts
+they need, and only the stages on the way whose results aren't cached run,
+independent ones in parallel.
+
+Results are cached by content: a stage's key hashes its name and version
+with the keys of its inputs, which come down from the PDF's sha256 (or from
+the content of values given directly). Every key is therefore known before
+anything runs, and a cached summary skips GROBID, tabula and the LLM
+altogether. Only complete results are cached: a value standing in for a
+failed step (a fallback, a Degraded value) is used for this run and
+reported in the result's `degraded`, as is everything computed from it.
+"""
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import close_old_connections
+
+from .grobid_limiter import ServiceSaturated
+from .lanes import current_lane, parse_lane
+from .metrics import current_collectors, describe, inc, stage_timer, use_collectors
+
+_NO_FALLBACK = object()
+
+
+class Degraded:
+    """
+    Returned by a stage whose value stands in for a step that failed (e.g.
+    references the LLM only partly checked): the value is used, but neither
+    cached nor reported as complete.
+    """
+
+    def __init__(self, value):
+        self.value = value
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class Stage:
+    """
+    One step of a Pipeline: `func(**inputs)` computes the value of `name`.
+
+    - inputs: names of other stages or of values given to Pipeline.run()
+    - returns: the type the value must have (checked after every run)
+    - version: an int, or a callable returning one; changing it
+      invalidates cached results of the stage and everything after it
+    - cache: False for values that only make sense in this process (a
+      temporary file); a value for which `cache_if(value)` is false is
+      degraded, like one the stage returned wrapped in Degraded
+    - retries, retry_on, backoff: runs again after one of the `retry_on`
+      exceptions, waiting backoff * 2**attempt seconds in between
+    - fallback: degraded value used when the stage still fails; without
+      one the failure is reported in the result's `errors` and the stages
+      depending on it are skipped
+
+    ServiceSaturated (GROBID's or OpenAI's) is never retried or replaced: it
+    aborts the whole run, so the view can answer 503.
+    """
+
+    def __init__(self, name, func, inputs=(), returns=object, version=1, cache=True, cache_if=None,
+                 retries=0, retry_on=(), backoff=0.5, fallback=_NO_FALLBACK):
+        self.name = name
+        self.func = func
+        self.inputs = tuple(inputs)
+        self.returns = returns
+        self.version = version
+        self.cache = cache
+        self.cache_if = cache_if
+        self.retries = retries
+        self.retry_on = tuple(retry_on)
+        self.backoff = backoff
+        self.fallback = fallback
+
+    def current_version(self):
+        return self.version() if callable(self.version) else self.version
+
+    def __repr__(self):
+        return f"Stage({self.name!r}, inputs={self.inputs!r})"
+
+
+class PipelineResult(dict):
+    """
+    The values produced by a run (those asked for and any other on the way),
+    with `errors` ({stage: exception}) for the stages that failed, the names
+    of the stages served from the cache (`cached`) or run (`ran`), and of
+    those whose value is degraded or built on one (`degraded`): callers
+    must not store these as current results.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.errors = {}
+        self.degraded = set()
+        self.cached = set()
+        self.ran = set()
+
+
+class Pipeline:
+    """
+    A DAG of Stages plus the inputs callers provide (`given`, as
+    {name: type}); checked for unknown inputs and cycles when built.
+    """
+
+    def __init__(self, stages, given):
+        self.stages = {}
+        for stage in stages:
+            if stage.name in self.stages or stage.name in given:
+                raise ValueError(f"Pipeline output {stage.name!r} is defined twice")
+            self.stages[stage.name] = stage
+        self.given = dict(given)
+        for stage in stages:
+            unknown = [name for name in stage.inputs if name not in self.stages and name not in self.given]
+            if unknown:
+                raise ValueError(f"Stage {stage.name!r} has unknown inputs {unknown}")
+        self._check_acyclic()
+
+    def run(self, needs, given, keys=None, refresh=False):
+        """
+        Produces the `needs` artifacts from the `given` values. A given
+        value may also stand in for a stage's output (e.g. a methods text
+        already stored), which then isn't run. `keys` holds the cache keys of
+        given values that can't be hashed by content (an uploaded file: its
+        sha256); stages depending on a value without a key aren't cached.
+        `refresh` ignores (but still rewrites) cached results.
+
+        Raises ServiceSaturated; other failures end up in the result's errors.
+        """
+        result = PipelineResult()
+        values = {}
+        for name, value in given.items():
+            if name not in self.given and name not in self.stages:
+                raise ValueError(f"Unknown pipeline input {name!r}")
+            expected = self.given.get(name) or self.stages[name].returns
+            if not isinstance(value, expected):
+                raise TypeError(f"Pipeline input {name!r} must be {expected.__name__}, not {type(value).__name__}")
+            values[name] = value
+        value_keys = {name: (keys or {}).get(name) or _content_key(value) for name, value in values.items()}
+
+        plan = set()
+        cache = caches[getattr(settings, "PIPELINE_CACHE", "default")]
+
+        def key_of(name):
+            if name not in value_keys:
+                stage = self.stages[name]
+                input_keys = [key_of(i) for i in stage.inputs]
+                value_keys[name] = None if None in input_keys else _digest(
+                    [stage.name, stage.current_version(), input_keys])
+            return value_keys[name]
+
+        def require(name):
+            # What has to run for `name`: nothing if given or cached
+            if name in values or name in plan:
+                return
+            if name not in self.stages:
+                raise ValueError(f"Pipeline input {name!r} was not given")
+            stage = self.stages[name]
+            key = key_of(name)
+            if stage.cache and key and not refresh:
+                hit = cache.get(f"pipeline:{name}:{key}")
+                if hit is not None:
+                    values[name] = result[name] = hit[0]
+                    result.cached.add(name)
+                    inc("pipeline_stage_runs_total", stage=name, outcome="cached")
+                    return
+            plan.add(name)
+            for dependency in stage.inputs:
+                require(dependency)
+
+        for name in needs:
+            require(name)
+        self._execute(plan, values, value_keys, cache, result)
+        for name, value in values.items():
+            if name in needs or name not in given:
+                result[name] = value
+        return result
+
+    def _execute(self, plan, values, value_keys, cache, result):
+        pending = set(plan)
+        in_flight = {}
+        pool = _get_executor() if getattr(settings, "PIPELINE_WORKERS", 4) > 1 else None
+        collectors = current_collectors()
+        lane = current_lane()
+        try:
+            while pending or in_flight:
+                ready = []
+                for name in sorted(pending):
+                    stage = self.stages[name]
+                    if any(i in result.errors for i in stage.inputs):
+                        pending.discard(name)
+                        result.errors[name] = RuntimeError(f"skipped: an input of {name!r} failed")
+                        inc("pipeline_stage_runs_total", stage=name, outcome="skipped")
+                    elif all(i in values for i in stage.inputs):
+                        pending.discard(name)
+                        ready.append(name)
+
+                # Independent stages go to the pool; one runs here meanwhile
+                if pool is not None:
+                    for name in ready[1:]:
+                        in_flight[pool.submit(_in_worker, collectors, lane, self._run_stage,
+                                              self.stages[name], values, value_keys[name], cache,
+                                              self._tainted(name, result))] = name
+                    ready = ready[:1]
+                else:
+                    pending.update(ready[1:])
+                    ready = ready[:1]
+                for name in ready:
+                    self._store(name, self._run_stage(self.stages[name], values, value_keys[name], cache,
+                                                      self._tainted(name, result)),
+                                values, result)
+
+                if in_flight and not ready:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self._store(in_flight.pop(future), future.result(), values, result)
+                elif not ready and not in_flight and pending:
+                    raise RuntimeError(f"Pipeline stages {sorted(pending)} can't run")
+        finally:
+            # On ServiceSaturated: let stages already running finish (and cache)
+            for future in in_flight:
+                future.cancel()
+            wait(in_flight)
+
+    def _tainted(self, name, result):
+        return any(i in result.degraded for i in self.stages[name].inputs)
+
+    @staticmethod
+    def _store(name, outcome, values, result):
+        value, error, degraded = outcome
+        result.ran.add(name)
+        if error is None:
+            values[name] = value
+        else:
+            result.errors[name] = error
+        if degraded:
+            result.degraded.add(name)
+
+    @staticmethod
+    def _run_stage(stage, values, key, cache, tainted=False):
+        """
+        (value, None, degraded) or (None, exception, False) for one run of
+        `stage`, with its retries; caches the value unless it is degraded
+        (or `tainted`: computed from a degraded input).
+        """
+        kwargs = {name: values[name] for name in stage.inputs}
+        attempt = 0
+        with stage_timer(f"pipeline_{stage.name}"):
+            while True:
+                try:
+                    value = stage.func(**kwargs)
+                    degraded = isinstance(value, Degraded)
+                    if degraded:
+                        value = value.value
+                    if not isinstance(value, stage.returns):
+                        raise TypeError(f"Stage {stage.name!r} returned {type(value).__name__}, "
+                                        f"not {stage.returns.__name__}")
+                    break
+                except ServiceSaturated:
+                    raise
+                except Exception as e:
+                    if attempt < stage.retries and isinstance(e, stage.retry_on):
+                        inc("pipeline_stage_runs_total", stage=stage.name, outcome="retried")
+                        time.sleep(stage.backoff * 2 ** attempt)
+                        attempt += 1
+                        continue
+                    print(f"Error in pipeline stage {stage.name}: {e}")
+                    if stage.fallback is not _NO_FALLBACK:
+                        inc("pipeline_stage_runs_total", stage=stage.name, outcome="fallback")
+                        return stage.fallback, None, True
+                    inc("pipeline_stage_runs_total", stage=stage.name, outcome="error")
+                    return None, e, False
+
+        degraded = degraded or tainted or (stage.cache_if is not None and not stage.cache_if(value))
+        if degraded:
+            inc("pipeline_stage_runs_total", stage=stage.name, outcome="degraded")
+            return value, None, True
+        if stage.cache and key:
+            cache.set(f"pipeline:{stage.name}:{key}", (value,), getattr(settings, "PIPELINE_CACHE_TTL", 86400))
+        inc("pipeline_stage_runs_total", stage=stage.name, outcome="ok")
+        return value, None, False
+
+    def _check_acyclic(self):
+        state = {}
+
+        def visit(name, path):
+            if state.get(name) == "done" or name not in self.stages:
+                return
+            if state.get(name) == "visiting":
+                raise ValueError(f"Pipeline has a cycle: {' -> '.join(path + [name])}")
+            state[name] = "visiting"
+            for dependency in self.stages[name].inputs:
+                visit(dependency, path + [name])
+            state[name] = "done"
+
+        for name in self.stages:
+            visit(name, [])
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, "PIPELINE_WORKERS", 4),
+                thread_name_prefix="parse-pipeline",
+            )
+        return _executor
+
+
+def _in_worker(collectors, lane, func, *args):
+    # The stage's timings and token usage count towards the request's, and
+    # its GROBID and OpenAI calls queue in the request's lane
+    try:
+        with use_collectors(collectors), parse_lane(*lane):
+            return func(*args)
+    finally:
+        close_old_connections()
+
+
+def _content_key(value):
+    """
+    Cache key of a given value from its content, or None if it has none
+    (e.g. a file object: the caller passes its hash instead).
+    """
+    if isinstance(value, bytes):
+        return hashlib.sha256(value).hexdigest()
+    if isinstance(value, str):
+        return hashlib.sha256(value.encode()).hexdigest()
+    if isinstance(value, (list, tuple, dict, int, float)):
+        return _digest(value)
+    return None
+
+
+def _digest(value):
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()
+
+
+describe("pipeline_stage_runs_total", "counter",
+         "Parse pipeline stages by outcome: ok, cached, retried, fallback, degraded, error or skipped.")
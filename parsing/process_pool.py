@@ -0,0 +1,33 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_process_pool(name, width):
+    """
+    Process-wide pool for CPU-heavy stages (tabula, OCR), kept alive between
+    requests so worker start-up (imports, the JVM) is paid once per worker.
+    Workers are spawned rather than forked: forking a process that already
+    hosts a JVM (tabula via jpype) or other threads is not safe.
+    """
+    with _pools_lock:
+        pool, pool_width = _pools.get(name, (None, 0))
+        if pool is None or pool_width != width:
+            if pool is not None:
+                pool.shutdown(wait=False)
+            pool = ProcessPoolExecutor(max_workers=width, mp_context=multiprocessing.get_context("spawn"))
+            _pools[name] = (pool, width)
+        return pool
+
+
+def shutdown_process_pool(name):
+    """
+    Drops a pool, e.g. after a worker died; the next call starts a fresh one.
+    """
+    with _pools_lock:
+        pool, _ = _pools.pop(name, (None, 0))
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,238 @@
+import math
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.urls import Resolver404, resolve
+
+from .metrics import collect_token_usage, describe, inc
+
+# How long to wait for another worker's update of the same bucket before
+# going ahead without the lock (failing open rather than stalling uploads)
+LOCK_ATTEMPTS = 50
+LOCK_WAIT = 0.005
+
+
+class RateLimitMiddleware:
+    """
+    Admission control for the parse endpoints listed in PARSE_RATE_LIMITS,
+    applied to POSTs per user (per client address for anonymous requests):
+
+    - a token bucket per user and endpoint: `burst` requests at once,
+      refilled at `per_minute`;
+    - a daily quota of PDF pages (DAILY_PAGE_QUOTA), charged on admission;
+    - a daily quota of OpenAI tokens (DAILY_TOKEN_QUOTA), charged with what
+      the request actually used once it has finished (or finished streaming).
+
+    State lives in the RATE_LIMIT_CACHE cache, which must be shared by all
+    workers for the limits to hold. Rejections are 429s with Retry-After,
+    counted in rate_limit_rejections_total.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        endpoint = self._limited_endpoint(request)
+        if endpoint is None:
+            return self.get_response(request)
+
+        identity = client_identity(request)
+        rejection = admit(identity, endpoint, _upload_pages(request))
+        if rejection is not None:
+            return rejection
+
+        with collect_token_usage() as usage:
+            response = self.get_response(request)
+        if response.streaming:
+            response.streaming_content = _charging_stream(response.streaming_content, identity)
+        else:
+            charge_tokens(identity, usage["tokens"])
+        return response
+
+    @staticmethod
+    def _limited_endpoint(request):
+        if request.method != "POST":
+            return None
+        try:
+            view_name = resolve(request.path_info).view_name
+        except Resolver404:
+            return None
+        return view_name if view_name in getattr(settings, "PARSE_RATE_LIMITS", {}) else None
+
+
+def admit(identity, endpoint, pages):
+    """
+    None if the request may proceed (its pages are then charged), else the
+    429 response to return.
+    """
+    cache = _cache()
+    burst, per_minute = settings.PARSE_RATE_LIMITS[endpoint]
+    wait = take_token(cache, f"bucket:{endpoint}:{identity}", burst, per_minute / 60)
+    if wait:
+        return _reject(endpoint, "rate", wait, "Too many parse requests. Please slow down.")
+
+    until_midnight = _seconds_until_midnight()
+    token_quota = getattr(settings, "DAILY_TOKEN_QUOTA", 0)
+    if token_quota and cache.get(_quota_key("tokens", identity), 0) >= token_quota:
+        return _reject(endpoint, "tokens", until_midnight, "Daily AI usage quota reached.")
+
+    return _charge_pages(cache, identity, endpoint, pages)
+
+
+def charge_upload_pages(request, pdf_path):
+    """
+    Charges the daily page quota for a PDF that reached a limited endpoint
+    without passing through the middleware as a file (a direct upload, see
+    direct_upload.py); None if within the quota, else the 429 to return.
+    """
+    endpoint = RateLimitMiddleware._limited_endpoint(request)
+    if endpoint is None:
+        return None
+    return _charge_pages(_cache(), client_identity(request), endpoint, _pdf_pages(pdf_path))
+
+
+def _charge_pages(cache, identity, endpoint, pages):
+    page_quota = getattr(settings, "DAILY_PAGE_QUOTA", 0)
+    if not (page_quota and pages):
+        return None
+    key = _quota_key("pages", identity)
+    until_midnight = _seconds_until_midnight()
+    with _locked(cache, key):
+        used = cache.get(key, 0)
+        if used + pages > page_quota:
+            return _reject(endpoint, "pages", until_midnight,
+                           f"Daily page quota reached ({used} of {page_quota} pages used).")
+        cache.set(key, used + pages, until_midnight + 3600)
+    return None
+
+
+def take_token(cache, key, capacity, refill_per_second):
+    """
+    Takes one token from the bucket at `key`; returns 0 on success, else the
+    seconds until a token will be available. A missing bucket is full, so
+    state only needs to outlive the time it takes to refill completely.
+    """
+    ttl = math.ceil(capacity / refill_per_second) + 60
+    with _locked(cache, key):
+        now = time.time()
+        tokens, updated = cache.get(key) or (capacity, now)
+        tokens = min(capacity, tokens + (now - updated) * refill_per_second)
+        if tokens >= 1:
+            cache.set(key, (tokens - 1, now), ttl)
+            return 0
+        cache.set(key, (tokens, now), ttl)
+        return (1 - tokens) / refill_per_second
+
+
+def charge_tokens(identity, tokens):
+    if not tokens or not getattr(settings, "DAILY_TOKEN_QUOTA", 0):
+        return
+    cache = _cache()
+    key = _quota_key("tokens", identity)
+    with _locked(cache, key):
+        cache.set(key, cache.get(key, 0) + tokens, _seconds_until_midnight() + 3600)
+
+
+def _charging_stream(content, identity):
+    # Streaming views do their work (and spend tokens) while being iterated
+    with collect_token_usage() as usage:
+        try:
+            yield from content
+        finally:
+            charge_tokens(identity, usage["tokens"])
+
+
+@contextmanager
+def _locked(cache, key):
+    """
+    Serializes read-modify-write of `key` across workers with an add()-based
+    lock (add is atomic in every cache backend).
+    """
+    lock_key = f"lock:{key}"
+    acquired = False
+    for _ in range(LOCK_ATTEMPTS):
+        if cache.add(lock_key, 1, 2):
+            acquired = True
+            break
+        time.sleep(LOCK_WAIT)
+    try:
+        yield
+    finally:
+        if acquired:
+            cache.delete(lock_key)
+
+
+def _reject(endpoint, reason, retry_after, message):
+    inc("rate_limit_rejections_total", endpoint=endpoint, reason=reason)
+    response = HttpResponse(message, status=429, content_type="text/plain; charset=utf-8")
+    response["Retry-After"] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+def client_identity(request):
+    """
+    "user:<pk>" for signed-in users, else "ip:<client address>".
+    """
+    if request.user.is_authenticated:
+        return f"user:{request.user.pk}"
+    # Anonymous requests (the csrf_exempt endpoints) are limited per address.
+    # Behind RATE_LIMIT_PROXY_HOPS trusted proxies, that's the entry they added
+    # to X-Forwarded-For; earlier entries can be forged by the client.
+    hops = getattr(settings, "RATE_LIMIT_PROXY_HOPS", 0)
+    forwarded = [a.strip() for a in request.META.get("HTTP_X_FORWARDED_FOR", "").split(",") if a.strip()]
+    if hops and len(forwarded) >= hops:
+        return f"ip:{forwarded[-hops]}"
+    return f"ip:{request.META.get('REMOTE_ADDR', '')}"
+
+
+def _upload_pages(request):
+    """
+    Pages of the uploaded PDF (1 if it can't be read as one, 0 without upload).
+    """
+    pdf_file = request.FILES.get("pdf_file")
+    if pdf_file is None:
+        return 0
+    try:
+        if hasattr(pdf_file, "temporary_file_path"):
+            return _pdf_pages(pdf_file.temporary_file_path())
+        return _pdf_pages(pdf_file.read())
+    finally:
+        pdf_file.seek(0)
+
+
+def _pdf_pages(source):
+    """
+    Pages of a PDF given as a path or bytes (1 if it can't be read as one).
+    """
+    try:
+        import pypdfium2
+
+        document = pypdfium2.PdfDocument(source)
+        try:
+            return len(document)
+        finally:
+            document.close()
+    except Exception:
+        return 1
+
+
+def _quota_key(kind, identity):
+    return f"quota:{kind}:{identity}:{datetime.now(timezone.utc).date().isoformat()}"
+
+
+def _seconds_until_midnight():
+    now = datetime.now(timezone.utc)
+    midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time(), tzinfo=timezone.utc)
+    return (midnight - now).total_seconds()
+
+
+def _cache():
+    return caches[getattr(settings, "RATE_LIMIT_CACHE", "default")]
+
+
+describe("rate_limit_rejections_total", "counter",
+         "Parse requests refused with a 429, by endpoint and reason (rate, pages or tokens).")
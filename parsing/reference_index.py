@@ -0,0 +1,256 @@
+import functools
+import hashlib
+import re
+import unicodedata
+import zlib
+
+from django.db import transaction
+
+from .metrics import describe, inc, stage_timer
+
+# Titles are compared as sets of character shingles of this length
+SHINGLE_SIZE = 3
+# MinHash signature = BANDS bands of ROWS values; two titles become LSH
+# candidates when any band matches, i.e. with probability 1 - (1 - J^ROWS)^BANDS
+# for Jaccard similarity J (0.94 at J=0.4, 0.99 at J=0.5). The blocking key
+# keeps the buckets small, so a permissive banding costs little.
+BANDS = 16
+ROWS = 2
+NUM_PERM = BANDS * ROWS
+
+# A candidate is the same work when the shingle sets' Jaccard similarity
+# reaches MATCH_JACCARD, or when one title is (nearly) contained in the other
+# (GROBID truncates long titles) and the shorter one isn't trivially short
+MATCH_JACCARD = 0.5
+MATCH_CONTAINMENT = 0.8
+MIN_CONTAINMENT_SHINGLES = 15
+
+# Universal hashing (a * x + b) mod p over 31-bit shingle hashes; a * x stays
+# below 2**62, so numpy's uint64 never overflows. Fixed seed: signatures (and
+# therefore canonical IDs) must not change between processes or releases.
+_PRIME = (1 << 31) - 1
+_SEED = 20261019
+
+_NON_ALNUM_RE = re.compile(r"[^a-z0-9]+")
+_YEAR_RE = re.compile(r"(1[5-9]|20)\d\d")
+
+
+def normalize_title(title):
+    """
+    Lower-case ASCII letters and digits separated by single spaces, so that
+    case, accents and punctuation differences don't count.
+    """
+    text = unicodedata.normalize("NFKD", title or "").encode("ascii", "ignore").decode()
+    return _NON_ALNUM_RE.sub(" ", text.lower()).strip()
+
+
+def blocking_key(reference):
+    """
+    "year|surname" of a reference dict. Only references sharing it are ever
+    compared. The surname is the last word of two or more letters, so
+    "J. Smith", "Smith J" and "smith" all give "smith".
+    """
+    match = _YEAR_RE.search(reference.get("year") or "")
+    words = [w for w in normalize_title(reference.get("last_name")).split() if len(w) > 1 and w.isalpha()]
+    return f"{match.group(0) if match else ''}|{words[-1][:100] if words else ''}"
+
+
+def shingles(normalized_title):
+    text = normalized_title
+    if len(text) <= SHINGLE_SIZE:
+        return {text} if text else set()
+    return {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+
+def minhash_signature(shingle_set):
+    import numpy as np
+
+    a, b = _hash_coefficients()
+    hashes = np.fromiter((zlib.crc32(s.encode()) & _PRIME for s in shingle_set),
+                         dtype=np.uint64, count=len(shingle_set))
+    return ((a[:, None] * hashes[None, :] + b[:, None]) % _PRIME).min(axis=1)
+
+
+@functools.lru_cache(maxsize=None)
+def _hash_coefficients():
+    # Drawn on first use, so importing this module (as the views do) doesn't import numpy
+    import numpy as np
+
+    rng = np.random.RandomState(_SEED)
+    a = rng.randint(1, _PRIME, size=NUM_PERM).astype(np.uint64)
+    b = rng.randint(0, _PRIME, size=NUM_PERM).astype(np.uint64)
+    return a, b
+
+
+def band_keys(block, signature):
+    """
+    One signed 64-bit key per band (what ReferenceBucket stores), covering
+    the blocking key too, so a bucket only ever holds one block's titles.
+    """
+    prefix = block.encode() + b"\0"
+    keys = []
+    for band in range(BANDS):
+        rows = signature[band * ROWS:(band + 1) * ROWS].tobytes()
+        digest = hashlib.blake2b(prefix + bytes([band]) + rows, digest_size=8).digest()
+        keys.append(int.from_bytes(digest, "big", signed=True))
+    return keys
+
+
+def canonical_id_for(block, normalized_title):
+    """
+    ID of a new cluster, derived from its first reference: re-indexing the
+    same papers in the same order gives the same IDs.
+    """
+    digest = hashlib.blake2b(f"{block}\0{normalized_title}".encode(), digest_size=8).hexdigest()
+    return f"ref_{digest}"
+
+
+def is_same_work(a, b):
+    """
+    Whether two shingle sets are titles of the same work.
+    """
+    common = len(a & b)
+    if not common:
+        return False
+    if common / (len(a) + len(b) - common) >= MATCH_JACCARD:
+        return True
+    shorter = min(len(a), len(b))
+    return shorter >= MIN_CONTAINMENT_SHINGLES and common / shorter >= MATCH_CONTAINMENT
+
+
+def prepare_reference(reference):
+    """
+    (blocking key, normalized title, shingles, band keys) of a reference
+    dict, or None when its title is too short to match on.
+    """
+    title = normalize_title(reference.get("title"))
+    shingle_set = shingles(title)
+    if len(shingle_set) < 2:
+        return None
+    block = blocking_key(reference)
+    return block, title, shingle_set, band_keys(block, minhash_signature(shingle_set))
+
+
+class ReferenceIndex:
+    """
+    In-memory MinHash/LSH index of canonical references (clusters).
+
+    Each cluster is represented by the normalized title of the reference that
+    created it; its LSH band keys map to it in `buckets`. `assign` finds the
+    cluster of a new reference in expected O(1), or starts a new one.
+    canonicalize_references() runs it over a small index seeded from the
+    database; benchmark_reference_index runs it over a whole corpus.
+    """
+
+    def __init__(self):
+        self.buckets = {}   # band key -> canonical id, or list of ids on collision
+        self.titles = {}    # canonical id -> normalized representative title
+        self.created = []   # (canonical id, block, normalized title, band keys) added since construction
+
+    def __len__(self):
+        return len(self.titles)
+
+    def add_cluster(self, canonical_id, block, normalized_title, keys=None):
+        self.titles[canonical_id] = normalized_title
+        if keys is None:
+            keys = band_keys(block, minhash_signature(shingles(normalized_title)))
+        for key in keys:
+            existing = self.buckets.get(key)
+            if existing is None:
+                self.buckets[key] = canonical_id
+            elif isinstance(existing, list):
+                if canonical_id not in existing:
+                    existing.append(canonical_id)
+            elif existing != canonical_id:
+                self.buckets[key] = [existing, canonical_id]
+        return keys
+
+    def candidates(self, keys):
+        found = []
+        for key in keys:
+            hit = self.buckets.get(key)
+            if hit is None:
+                continue
+            for canonical_id in (hit if isinstance(hit, list) else (hit,)):
+                if canonical_id not in found:
+                    found.append(canonical_id)
+        return found
+
+    def assign(self, reference, prepared=False):
+        """
+        Canonical ID for a reference dict (None for references without a
+        usable title), creating a cluster when no existing one matches.
+        `prepared` is the reference's prepare_reference() result, if known.
+        """
+        if prepared is False:
+            prepared = prepare_reference(reference)
+        if prepared is None:
+            return None
+        block, title, shingle_set, keys = prepared
+
+        best, best_overlap = None, 0
+        for canonical_id in self.candidates(keys):
+            candidate = shingles(self.titles[canonical_id])
+            overlap = len(shingle_set & candidate)
+            if overlap > best_overlap and is_same_work(shingle_set, candidate):
+                best, best_overlap = canonical_id, overlap
+        if best is not None:
+            return best
+
+        canonical_id = canonical_id_for(block, title)
+        self.add_cluster(canonical_id, block, title, keys)
+        self.created.append((canonical_id, block, title, keys))
+        return canonical_id
+
+
+def canonicalize_references(references):
+    """
+    Sets "canonical_id" on each reference dict in place, so the same cited
+    work gets the same ID in every paper. Loads only the clusters sharing an
+    LSH bucket with these references and stores the clusters created for them.
+    """
+    from .models import CanonicalReference, ReferenceBucket
+
+    with stage_timer("reference_canonicalization"):
+        prepared = [prepare_reference(ref) for ref in references]
+        all_keys = sorted({key for p in prepared if p is not None for key in p[3]})
+
+        # Seed an index with the stored clusters that can match (SQLite caps query parameters)
+        index = ReferenceIndex()
+        bucket_rows = []
+        for start in range(0, len(all_keys), 500):
+            bucket_rows.extend(ReferenceBucket.objects.filter(key__in=all_keys[start:start + 500])
+                               .values_list("key", "reference_id"))
+        cluster_ids = sorted({reference_id for _, reference_id in bucket_rows})
+        clusters = dict(CanonicalReference.objects.filter(canonical_id__in=cluster_ids)
+                        .values_list("canonical_id", "title"))
+        for key, reference_id in bucket_rows:
+            index.add_cluster(reference_id, "", clusters[reference_id], keys=[key])
+
+        matched = 0
+        for ref, ref_prepared in zip(references, prepared):
+            ref["canonical_id"] = index.assign(ref, ref_prepared)
+            matched += ref["canonical_id"] is not None
+
+        # ignore_conflicts: a concurrent parse citing the same new work
+        # derives the same ID for it
+        with transaction.atomic():
+            CanonicalReference.objects.bulk_create(
+                [CanonicalReference(canonical_id=cid, block=block, title=title)
+                 for cid, block, title, _ in index.created],
+                ignore_conflicts=True,
+            )
+            ReferenceBucket.objects.bulk_create(
+                [ReferenceBucket(key=key, reference_id=cid) for cid, _, _, keys in index.created for key in keys],
+                ignore_conflicts=True,
+            )
+
+    inc("reference_canonicalization_total", len(index.created), result="new")
+    inc("reference_canonicalization_total", matched - len(index.created), result="matched")
+    inc("reference_canonicalization_total", len(references) - matched, result="skipped")
+    return references
+
+
+describe("reference_canonicalization_total", "counter",
+         "References matched to an existing canonical reference (matched), starting a new one (new) "
+         "or without a usable title (skipped).")
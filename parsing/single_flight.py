@@ -0,0 +1,78 @@
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .metrics import inc, observe, describe
+from .models import ParseLease
+
+
+@contextmanager
+def parse_lease(key, wait_timeout=None, lease_seconds=None, poll_interval=0.25):
+    """
+    Single-flight section keyed by e.g. the PDF's sha256, shared by every
+    gunicorn worker (and instance) through the ParseLease table:
+
+        with parse_lease(paper_obj.pdf_hash) as lease:
+            ...  # only one request per key runs this at a time
+
+    The first request inserts the lease row and runs; concurrent duplicates
+    poll until it is released and then run themselves, by which time the
+    stored results are current and they return them without reparsing.
+    `lease["waited"]` tells whether we had to wait for someone else.
+
+    Leases expire after `lease_seconds` so a crashed worker can't block a PDF
+    forever; after `wait_timeout` seconds a waiter gives up and proceeds
+    without the lease rather than failing the request.
+    """
+    if wait_timeout is None:
+        wait_timeout = getattr(settings, "PARSE_LEASE_WAIT_TIMEOUT", 600)
+    if lease_seconds is None:
+        lease_seconds = getattr(settings, "PARSE_LEASE_SECONDS", 900)
+
+    holder = uuid.uuid4().hex
+    deadline = time.monotonic() + wait_timeout
+    wait_start = time.perf_counter()
+    waited = False
+    acquired = False
+
+    while True:
+        now = timezone.now()
+        # Take over a lease abandoned by a crashed or killed worker
+        ParseLease.objects.filter(key=key, expires_at__lt=now).delete()
+        try:
+            with transaction.atomic():
+                ParseLease.objects.create(
+                    key=key, holder=holder, expires_at=now + timedelta(seconds=lease_seconds)
+                )
+            acquired = True
+            break
+        except IntegrityError:
+            pass
+        if time.monotonic() >= deadline:
+            inc("single_flight_timeouts_total")
+            break
+        waited = True
+        time.sleep(poll_interval)
+
+    if waited:
+        inc("single_flight_waits_total")
+        observe("single_flight_wait_seconds", time.perf_counter() - wait_start)
+
+    try:
+        yield {"waited": waited, "acquired": acquired}
+    finally:
+        if acquired:
+            ParseLease.objects.filter(key=key, holder=holder).delete()
+
+
+describe("single_flight_waits_total", "counter",
+         "Parses that waited for a concurrent parse of the same PDF.")
+describe("single_flight_wait_seconds", "summary",
+         "Time spent waiting for a concurrent parse of the same PDF.")
+describe("single_flight_timeouts_total", "counter",
+         "Waits for a concurrent parse that timed out and parsed anyway.")
@@ -0,0 +1,125 @@
+"""
+The parse pipeline (see pipeline.py): every artifact the parse endpoints
+ask for, and the stages producing it from an uploaded or stored PDF.
+
+    pdf_file -> pdf_path -+-> bibliography -> references
+                          +-> header
+                          +-> grobid_methods -> methods --+-> summary
+                          +-> tables ---------------------+
+
+GROBID and tabula stages run in parallel when both are needed. Stage
+versions follow the stored artifacts' (versions.py), so bumping an artifact
+also invalidates its cached stage results. Artifacts in the result's
+`degraded` (a GROBID fallback, references the LLM only partly checked, a
+failed summary) must be stored unstamped, so the next upload parses again.
+"""
+import os
+import tempfile
+
+import requests
+from django.core.files.base import File
+
+from .advanced_methods_extraction import grobid_extract_methods
+from .advanced_references_extraction import grobid_extract_bibliography, grobid_extract_header
+from .ai_postprocess import check_references_with_chatgpt, summarize_methods_and_tables_with_chatgpt, \
+    SUMMARY_FAILED_MESSAGE
+from .metrics import record_bytes, stage_timer
+from .ocr import ocr_methods_fallback
+from .pipeline import Degraded, Pipeline, Stage
+from .table_extraction import iter_tables, tables_to_json
+from .versions import current_version
+
+
+def fetch_pdf(pdf_file):
+    """
+    Copies the PDF (an upload, or a Paper's file in storage: GCS in
+    production) into a local NamedTemporaryFile and returns its path.
+    """
+    with stage_timer("storage_fetch"):
+        pdf_file.open('rb')  # ensure file-like object is ready
+        with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as tmp:
+            for chunk in pdf_file.chunks():
+                tmp.write(chunk)
+            tmp_path = tmp.name
+        pdf_file.close()
+    record_bytes("storage_fetch", "out", os.path.getsize(tmp_path))
+    return tmp_path
+
+
+def extract_bibliography(pdf_path):
+    # (references, header) as GROBID parsed them
+    return grobid_extract_bibliography(pdf_path)
+
+
+def extract_header(pdf_path):
+    # The paper's own title/author/year; {} when the bibliography has them
+    return grobid_extract_header(pdf_path) or {}
+
+
+def paper_header(result):
+    """
+    The paper's own title/author/year from a run that produced the
+    bibliography and header stages.
+    """
+    return result.get("header") or result["bibliography"][1]
+
+
+def check_references(bibliography):
+    # References of a chunk the LLM failed to check are dropped: not a result to keep
+    references, complete = check_references_with_chatgpt(bibliography[0])
+    return references if complete else Degraded(references)
+
+
+def extract_grobid_methods(pdf_path):
+    # Methods text including GROBID's formula text
+    return grobid_extract_methods(pdf_path)
+
+
+def methods_or_ocr(grobid_methods, pdf_path, pdf_hash):
+    # Scanned PDFs have no text layer for GROBID: OCR them (cached per page)
+    return grobid_methods or ocr_methods_fallback(pdf_path, pdf_hash)
+
+
+def extract_tables(pdf_path):
+    # Extracted and converted to JSON one table at a time
+    return tables_to_json(iter_tables(pdf_path, pages="all"))
+
+
+def summarize(methods, tables):
+    return summarize_methods_and_tables_with_chatgpt(methods, tables)
+
+
+PARSE_PIPELINE = Pipeline([
+    Stage("pdf_path", fetch_pdf, inputs=["pdf_file"], returns=str, cache=False),
+    Stage("bibliography", extract_bibliography, inputs=["pdf_path"], returns=tuple,
+          version=lambda: current_version("references"),
+          retries=2, retry_on=[requests.RequestException]),
+    # Side by side with the bibliography; without a header the references
+    # are still kept, the paper only goes untitled
+    Stage("header", extract_header, inputs=["pdf_path"], returns=dict,
+          version=lambda: current_version("references"),
+          retries=1, retry_on=[requests.RequestException], fallback={}),
+    Stage("references", check_references, inputs=["bibliography"], returns=list,
+          version=lambda: current_version("references")),
+    Stage("grobid_methods", extract_grobid_methods, inputs=["pdf_path"], returns=str,
+          version=lambda: current_version("methods"),
+          retries=2, retry_on=[requests.RequestException], fallback=""),
+    # No methods text even after OCR is more likely a failure than a paper without methods
+    Stage("methods", methods_or_ocr, inputs=["grobid_methods", "pdf_path", "pdf_hash"], returns=str,
+          version=lambda: current_version("methods"), cache_if=bool),
+    Stage("tables", extract_tables, inputs=["pdf_path"], returns=str,
+          version=lambda: current_version("tables")),
+    Stage("summary", summarize, inputs=["methods", "tables"], returns=str,
+          version=lambda: current_version("summary"), cache_if=lambda summary: summary != SUMMARY_FAILED_MESSAGE),
+], given={"pdf_file": File, "pdf_hash": str})
+
+
+def run_parse(needs, pdf_file, pdf_hash, stored=None, refresh=False):
+    """
+    Runs the parse pipeline for the `needs` artifacts of a PDF (an upload or
+    a Paper's stored file) whose sha256 is `pdf_hash`. `stored` holds
+    artifacts already stored and current ({"methods": ...}), used instead of
+    recomputing them. Returns a PipelineResult; raises ServiceSaturated.
+    """
+    given = dict(stored or {}, pdf_file=pdf_file, pdf_hash=pdf_hash)
+    return PARSE_PIPELINE.run(needs, given, keys={"pdf_file": pdf_hash}, refresh=refresh)
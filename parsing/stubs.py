@@ -0,0 +1,408 @@
+"""
+Local stand-ins for GROBID, the OpenAI API and Cloud Storage, for load tests
+and offline runs of the real app (see the `loadtest` management command).
+Point the app at them with GROBID_BASE_URL (plus GROBID_AUTH=0),
+OPENAI_BASE_URL and STORAGE_EMULATOR_HOST.
+
+Both answer every call with plausible output after a simulated latency, so
+the app does all its own work (TEI parsing, canonicalization, storage) while
+the remote services cost only time.
+"""
+import base64
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+import zlib
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+from xml.sax.saxutils import escape
+
+_REFERENCES_RE = re.compile(r"References:\n(\[.*\])\s*$", re.S)
+
+
+class StubServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server with a simulated service time: log-normal around
+    `latency` seconds, with at most `capacity` requests served at once (the
+    rest queue, like a saturated backend). Health checks answer after
+    `probe_delay` seconds (raise it, with `latency`, to mimic a sick instance).
+    """
+    daemon_threads = True
+
+    def __init__(self, handler, latency, capacity, seed=None):
+        super().__init__(("127.0.0.1", 0), handler)
+        self.latency = latency
+        self.slots = threading.BoundedSemaphore(capacity)
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+        self.requests_served = 0
+        self.probe_delay = 0.0
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name=type(self).__name__, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def simulate_work(self):
+        with self.rng_lock:
+            delay = self.latency * self.rng.lognormvariate(0, 0.5) / 1.13  # mean = latency
+        with self.slots:
+            time.sleep(delay)
+            self.requests_served += 1
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def _send(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class GrobidStubHandler(_Handler):
+    """
+    /api/isalive, and any other /api/<service> POST answered with a TEI
+    document: a header, a short Methods section and `REFERENCES` references
+    drawn from a fixed pool, so different uploads cite overlapping works.
+    Like GROBID, processReferences leaves the header empty and
+    processHeaderDocument only returns the header.
+    """
+    REFERENCES = 25
+    WORKS = 400
+
+    def do_GET(self):
+        if self.path.startswith("/api/isalive"):
+            time.sleep(self.server.probe_delay)
+            self._send(200, b"true", "text/plain")
+        else:
+            self._send(404, b"", "text/plain")
+
+    def do_POST(self):
+        body = self._body()
+        if not self.path.startswith("/api/"):
+            self._send(404, b"", "text/plain")
+            return
+        self.server.simulate_work()
+        service = self.path[len("/api/"):].split("?")[0]
+        tei = _tei_document(random.Random(zlib.crc32(body)), self.REFERENCES, self.WORKS, service)
+        self._send(200, tei.encode(), "application/xml")
+
+
+class OpenAIStubHandler(_Handler):
+    """
+    POST /v1/chat/completions, streamed or not. The reference check returns
+    the references it was sent, all marked valid; anything else gets a
+    summary-sized text. Usage is reported like the real API.
+    """
+    SUMMARY_WORDS = 300
+
+    def do_POST(self):
+        request = json.loads(self._body() or b"{}")
+        if not self.path.endswith("/chat/completions"):
+            self._send(404, b"{}", "application/json")
+            return
+        self.server.simulate_work()
+
+        prompt = request.get("messages", [{}])[-1].get("content", "")
+        match = _REFERENCES_RE.search(prompt)
+        if match:
+            content = json.dumps([dict(ref, valid=True) for ref in json.loads(match.group(1))])
+        else:
+            content = " ".join(["The study enrolled patients and measured outcomes."] * (self.SUMMARY_WORDS // 7))
+        usage = {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4,
+                 "total_tokens": (len(prompt) + len(content)) // 4}
+        completion = {"id": "chatcmpl-stub", "created": int(time.time()), "model": request.get("model", "")}
+
+        if not request.get("stream"):
+            body = dict(completion, object="chat.completion", usage=usage, choices=[{
+                "index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}])
+            self._send(200, json.dumps(body).encode(), "application/json")
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        chunk = dict(completion, object="chat.completion.chunk", usage=None)
+        for piece in re.findall(r"\S+\s*", content):
+            event = dict(chunk, choices=[{"index": 0, "finish_reason": None, "delta": {"content": piece}}])
+            self.wfile.write(f"data: {json.dumps(event)}\n\n".encode())
+        self.wfile.write(f"data: {json.dumps(dict(chunk, choices=[], usage=usage))}\n\ndata: [DONE]\n\n".encode())
+        self.close_connection = True
+
+
+class GcsStubServer(StubServer):
+    """
+    StubServer holding the objects and open resumable-upload sessions of an
+    in-memory Cloud Storage.
+    """
+
+    def __init__(self, handler, latency, capacity, seed=None):
+        super().__init__(handler, latency, capacity, seed)
+        self.objects = {}  # (bucket, name) -> (bytes, metadata)
+        self.sessions = {}  # upload_id -> {"bucket", "name", "size", "origin", "data", ...}
+        self.store_lock = threading.Lock()
+
+
+class GcsStubHandler(_Handler):
+    """
+    The parts of the Cloud Storage JSON API the app and google-cloud-storage
+    use: multipart and resumable uploads (including browser PUTs to a session
+    URL, with CORS), object metadata, listing, ranged downloads and deletes.
+    Set STORAGE_EMULATOR_HOST to the server's URL to use it.
+    """
+    OBJECT_RE = re.compile(r"^(?:/download)?/storage/v1/b/([^/]+)/o/(.+)$")
+    LIST_RE = re.compile(r"^/storage/v1/b/([^/]+)/o$")
+    UPLOAD_RE = re.compile(r"^/upload/storage/v1/b/([^/]+)/o$")
+    CONTENT_RANGE_RE = re.compile(r"^bytes (?:\*|(\d+)-(\d+))/(\*|\d+)$")
+
+    def do_OPTIONS(self):
+        # CORS preflight of a browser upload to a session URL
+        self._send(204, b"", "text/plain", {
+            "Access-Control-Allow-Origin": self.headers.get("Origin", "*"),
+            "Access-Control-Allow-Methods": "PUT, POST, GET, DELETE",
+            "Access-Control-Allow-Headers": "Content-Type, Content-Range, X-Goog-Resumable",
+            "Access-Control-Max-Age": "3600",
+        })
+
+    def do_GET(self):
+        path, query = self._route()
+        match = self.OBJECT_RE.match(path)
+        if match:
+            stored = self._object(match.group(1), unquote(match.group(2)))
+            if stored is None:
+                self._json(404, {"error": {"code": 404, "message": "No such object"}})
+            elif query.get("alt") == ["media"]:
+                self._media(*stored)
+            else:
+                self._json(200, stored[1])
+            return
+        match = self.LIST_RE.match(path)
+        if match:
+            prefix = query.get("prefix", [""])[0]
+            with self.server.store_lock:
+                items = [meta for (bucket, name), (_, meta) in sorted(self.server.objects.items())
+                         if bucket == match.group(1) and name.startswith(prefix)]
+            self._json(200, {"kind": "storage#objects", "items": items})
+            return
+        self._json(404, {})
+
+    def do_DELETE(self):
+        path, _ = self._route()
+        match = self.OBJECT_RE.match(path)
+        with self.server.store_lock:
+            removed = match and self.server.objects.pop((match.group(1), unquote(match.group(2))), None)
+        if removed:
+            self._send(204, b"", "application/json")
+        else:
+            self._json(404, {"error": {"code": 404, "message": "No such object"}})
+
+    def do_POST(self):
+        body = self._body()
+        path, query = self._route()
+        match = self.UPLOAD_RE.match(path)
+        if not match:
+            self._json(404, {})
+            return
+        self.server.simulate_work()
+        bucket, upload_type = match.group(1), query.get("uploadType", [""])[0]
+        if upload_type == "multipart":
+            metadata, data = _split_multipart(body, self.headers.get("Content-Type", ""))
+            name = query.get("name", [metadata.get("name", "")])[0]
+            content_type = metadata.get("contentType", "application/octet-stream")
+            self._finish(bucket, name, data, content_type, query)
+        elif upload_type == "resumable":
+            metadata = json.loads(body or b"{}")
+            upload_id = uuid.uuid4().hex
+            size = self.headers.get("X-Upload-Content-Length")
+            with self.server.store_lock:
+                self.server.sessions[upload_id] = {
+                    "bucket": bucket,
+                    "name": query.get("name", [metadata.get("name", "")])[0],
+                    "content_type": (self.headers.get("X-Upload-Content-Type")
+                                     or metadata.get("contentType", "application/octet-stream")),
+                    "size": int(size) if size else None,
+                    "origin": self.headers.get("Origin", "*"),
+                    "query": query,
+                    "data": b"",
+                }
+            location = f"{self.server.url}/upload/storage/v1/b/{bucket}/o?uploadType=resumable&upload_id={upload_id}"
+            self._send(200, b"", "text/plain", {"Location": location})
+        else:
+            self._json(400, {"error": {"code": 400, "message": f"Unsupported uploadType {upload_type!r}"}})
+
+    def do_PUT(self):
+        # A chunk of a resumable upload, or a status query ("bytes */size")
+        body = self._body()
+        _, query = self._route()
+        upload_id = query.get("upload_id", [""])[0]
+        with self.server.store_lock:
+            session = self.server.sessions.get(upload_id)
+        if session is None:
+            self._json(404, {"error": {"code": 404, "message": "No such upload session"}})
+            return
+        cors = {"Access-Control-Allow-Origin": session["origin"], "Access-Control-Expose-Headers": "Range"}
+
+        match = self.CONTENT_RANGE_RE.match(self.headers.get("Content-Range", f"bytes 0-{len(body) - 1}/{len(body)}"))
+        if not match:
+            self._json(400, {"error": {"code": 400, "message": "Bad Content-Range"}}, cors)
+            return
+        start, _, total = match.groups()
+        with self.server.store_lock:
+            data = session["data"]
+            if start is not None:
+                if int(start) > len(data):
+                    self._json(400, {"error": {"code": 400, "message": "Chunk does not follow the stored bytes"}}, cors)
+                    return
+                data = session["data"] = data[:int(start)] + body
+        total = int(total) if total != "*" else None
+        expected = session["size"] if session["size"] is not None else total
+        if expected is not None and (len(data) > expected or (total is not None and total != expected)):
+            self._json(400, {"error": {"code": 400, "message": "Upload larger than declared"}}, cors)
+            return
+        if total is not None and len(data) == total:
+            with self.server.store_lock:
+                self.server.sessions.pop(upload_id, None)
+            self._finish(session["bucket"], session["name"], data, session["content_type"], session["query"], cors)
+            return
+        headers = dict(cors, Range=f"bytes=0-{len(data) - 1}") if data else cors
+        self._send(308, b"", "text/plain", headers)
+
+    def _route(self):
+        parts = urlsplit(self.path)
+        return parts.path, parse_qs(parts.query)
+
+    def _json(self, status, payload, headers=None):
+        self._send(status, json.dumps(payload).encode(), "application/json", headers)
+
+    def _object(self, bucket, name):
+        with self.server.store_lock:
+            return self.server.objects.get((bucket, name))
+
+    def _media(self, data, metadata):
+        match = re.match(r"^bytes=(\d+)-(\d*)$", self.headers.get("Range", ""))
+        if not match:
+            self._send(200, data, metadata["contentType"])
+            return
+        start = int(match.group(1))
+        end = min(int(match.group(2)) if match.group(2) else len(data) - 1, len(data) - 1)
+        self._send(206, data[start:end + 1], metadata["contentType"],
+                   {"Content-Range": f"bytes {start}-{end}/{len(data)}"})
+
+    def _finish(self, bucket, name, data, content_type, query, headers=None):
+        with self.server.store_lock:
+            if query.get("ifGenerationMatch") == ["0"] and (bucket, name) in self.server.objects:
+                precondition_failed = True
+            else:
+                precondition_failed = False
+                metadata = _object_metadata(self.server.url, bucket, name, data, content_type)
+                self.server.objects[(bucket, name)] = (data, metadata)
+        if precondition_failed:
+            self._json(412, {"error": {"code": 412, "message": "Object already exists"}}, headers)
+        else:
+            self._json(200, metadata, headers)
+
+
+def start_grobid_stub(latency=2.0, capacity=8, seed=None):
+    return StubServer(GrobidStubHandler, latency, capacity, seed).start()
+
+
+def start_openai_stub(latency=1.0, capacity=64, seed=None):
+    return StubServer(OpenAIStubHandler, latency, capacity, seed).start()
+
+
+def start_gcs_stub(latency=0.0, capacity=64, seed=None):
+    return GcsStubServer(GcsStubHandler, latency, capacity, seed).start()
+
+
+def _object_metadata(base_url, bucket, name, data, content_type):
+    import google_crc32c
+
+    now = datetime.now(timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+    return {
+        "kind": "storage#object",
+        "bucket": bucket,
+        "name": name,
+        "size": str(len(data)),
+        "contentType": content_type,
+        "generation": str(time.time_ns() // 1000),
+        "metageneration": "1",
+        "timeCreated": now,
+        "updated": now,
+        "md5Hash": base64.b64encode(hashlib.md5(data).digest()).decode(),
+        "crc32c": base64.b64encode(google_crc32c.value(data).to_bytes(4, "big")).decode(),
+        "mediaLink": f"{base_url}/download/storage/v1/b/{bucket}/o/{quote(name, safe='')}?alt=media",
+    }
+
+
+def _split_multipart(body, content_type):
+    """
+    (metadata, data) of a multipart/related upload: a JSON part, then the media.
+    """
+    boundary = re.search(r'boundary="?([^";]+)"?', content_type).group(1).encode()
+    parts = [part for part in body.split(b"--" + boundary) if part.strip(b"\r\n-")]
+    sections = [part.split(b"\r\n\r\n", 1)[1] for part in parts]
+    return json.loads(sections[0]), sections[1][:-2] if sections[1].endswith(b"\r\n") else sections[1]
+
+
+def _tei_document(rng, references, works, service):
+    cited = rng.sample(range(works), references)
+    bibl = "".join(
+        f"<biblStruct><analytic><title level=\"a\">{escape(_title(work))}</title>"
+        f"<author><persName><forename>A</forename><surname>{_surname(work)}</surname></persName></author>"
+        f"</analytic><monogr><title level=\"j\">Journal of Stubs</title>"
+        f"<imprint><date when=\"{1990 + work % 30}\"/></imprint></monogr></biblStruct>"
+        for work in cited
+    )
+    own = rng.randrange(works)
+    header = (
+        "<teiHeader><fileDesc>"
+        f"<titleStmt><title>{escape(_title(own))}</title></titleStmt>"
+        f"<sourceDesc><biblStruct><analytic><author><persName><surname>{_surname(own)}</surname></persName>"
+        f"</author></analytic><monogr><imprint><date when=\"{1990 + own % 30}\"/></imprint></monogr>"
+        "</biblStruct></sourceDesc></fileDesc></teiHeader>"
+    )
+    body = (
+        "<text><body>"
+        "<div type=\"methods\"><head>Methods</head><p>We enrolled 40 patients and measured outcomes.</p></div>"
+        f"</body><back><div type=\"references\"><listBibl>{bibl}</listBibl></div></back></text>"
+    )
+    if service == "processReferences":
+        header = "<teiHeader/>"
+        body = f"<text><back><div type=\"references\"><listBibl>{bibl}</listBibl></div></back></text>"
+    elif service == "processHeaderDocument":
+        body = ""
+    return f"<TEI xmlns=\"http://www.tei-c.org/ns/1.0\">{header}{body}</TEI>"
+
+
+def _title(work):
+    words = ["adaptive", "neural", "clinical", "outcomes", "sparse", "bayesian", "models", "trial",
+             "inference", "cohort", "learning", "graphs", "robust", "estimation", "survival", "networks"]
+    return " ".join(words[(work * 7 + i * 3) % len(words)] for i in range(6 + work % 5)).capitalize() + f" {work}"
+
+
+def _surname(work):
+    return ["Smith", "Garcia", "Chen", "Okafor", "Novak", "Ivanova", "Tanaka", "Haddad"][work % 8]
@@ -1,22 +1,35 @@
+import hashlib
+import io
 import os
-import tabula
-import pandas as pd
+import tempfile
+from collections import deque
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
 
 # If your methods extraction logic is in a separate file (e.g., advanced_methods_extraction.py),
 # import it here. We'll assume you have a function named `grobid_extract_methods`.
 # Adjust the import path as necessary.
 from .advanced_methods_extraction import grobid_extract_methods
+from .grobid_limiter import GrobidSaturated
+from .metrics import describe, inc, stage_timer
+from .ocr import ocr_methods_fallback
+from .process_pool import get_process_pool, shutdown_process_pool
+from .table_formats import encode_table, write_encoded_tables
+from .table_prepass import find_table_pages, parse_page_range
 
 
-def parse_methods_and_tables(pdf_path, pages="all"):
+def parse_methods_and_tables(pdf_path, pages="all", pdf_hash=None):
     """
     High-level function that:
-      1) Extracts methods text from GROBID (grobid_extract_methods).
-      2) Extracts tables from the same PDF using Tabula
-         (parse_tables_comprehensive).
-      3) Returns a tuple: (methods_text, df_list)
+      1) Extracts methods text from GROBID (grobid_extract_methods),
+         falling back to OCR of scanned pages (ocr.py; cached by pdf_hash).
+      2) Sets up table extraction from the same PDF using Tabula
+         (iter_tables).
+      3) Returns a tuple: (methods_text, tables)
          where 'methods_text' is a string,
-         and 'df_list' is a list of DataFrames with table data.
+         and 'tables' is an iterator of DataFrames, extracted as it is
+         consumed (e.g. by tables_to_json).
     """
 
     # 1) Parse methods text via GROBID
@@ -24,46 +37,183 @@ def parse_methods_and_tables(pdf_path, pages="all"):
     if os.path.exists(pdf_path):
         try:
             methods_text = grobid_extract_methods(pdf_path)
+        except GrobidSaturated:
+            # Let the view answer 503 instead of silently dropping the methods
+            raise
         except Exception as e:
             print(f"ERROR extracting methods: {e}")
+        if not methods_text:
+            # Scanned PDFs have no text layer for GROBID to work with
+            methods_text = ocr_methods_fallback(pdf_path, pdf_hash)
     else:
         raise FileNotFoundError(f"PDF file not found: {pdf_path}")
 
     # 2) Parse tables comprehensively
-    df_list = parse_tables_comprehensive(pdf_path, pages=pages)
+    tables = iter_tables(pdf_path, pages=pages)
+
+    return methods_text, tables
+
 
-    return methods_text, df_list
+def parse_tables_comprehensive(pdf_path, pages="all", workers=None):
+    """
+    All tables of the PDF as a list of DataFrames (see iter_tables). Holds
+    every table at once: prefer iter_tables wherever the tables are consumed
+    one by one.
+    """
+    return list(iter_tables(pdf_path, pages=pages, workers=workers))
 
 
-def parse_tables_comprehensive(pdf_path, pages="all"):
+def iter_tables(pdf_path, pages="all", workers=None):
     """
     A 'kitchen sink' approach to table extraction using tabula,
     attempting multiple modes (lattice & stream) with rotation off/on.
 
-    Returns a list of DataFrame objects from all attempts combined.
+    Returns an iterator of DataFrames from all attempts, yielded one at a
+    time: tabula runs pass by pass over chunks of TABULA_CHUNK_PAGES pages,
+    so only one chunk's tables are held at a time however many the PDF has.
+    Tables identical to one already yielded (the passes often find the same
+    table) are dropped.
+
+    With TABLE_PREPASS on, only the pages flagged by the cheap table-presence
+    check (table_prepass.py) go to tabula. With more than one worker
+    (TABULA_WORKERS unless `workers` is given), long documents' chunks run on
+    a process pool, a bounded number at a time; the tables come out in the
+    same order as from a single-process run.
     """
     if not os.path.exists(pdf_path):
         raise FileNotFoundError(f"PDF file not found: {pdf_path}")
 
-    all_tables = []
+    if getattr(settings, "TABLE_PREPASS", True):
+        candidate_pages = find_table_pages(pdf_path, pages)
+        if candidate_pages is not None:
+            print(f"DEBUG: table pre-pass => tabula on pages {candidate_pages}")
+            if not candidate_pages:
+                return iter(())
+            pages = candidate_pages
+
+    width = workers if workers is not None else getattr(settings, "TABULA_WORKERS", 1)
+    return _dedupe_tables(_extract_tables(pdf_path, pages, width))
+
+
+# (lattice, stream, rotate) for each tabula attempt, in result order
+TABULA_PASSES = (
+    (True, False, False),   # Attempt 1: Lattice (no rotation)
+    (False, True, False),   # Attempt 2: Stream (no rotation)
+    (True, False, True),    # Attempt 3: Lattice (rotate)
+    (False, True, True),    # Attempt 4: Stream (rotate)
+)
+
+
+def _extract_tables(pdf_path, pages, width):
+    try:
+        page_numbers = _resolve_pages(pdf_path, pages)
+    except Exception as e:
+        # Can't count the pages: let tabula take them all in one call per pass
+        print(f"ERROR resolving pages of {pdf_path}, not chunking: {e}")
+        for pass_index in range(len(TABULA_PASSES)):
+            yield from _run_tabula_pass(pdf_path, pages, pass_index)
+        return
 
-    # Attempt 1: Lattice (no rotation)
-    df_list1 = _read_pdf_tabula(pdf_path, pages=pages, lattice=True, stream=False, rotate=False)
-    all_tables.extend(df_list1)
+    chunk = max(1, getattr(settings, "TABULA_CHUNK_PAGES", 8))
+    if width > 1 and len(page_numbers) >= getattr(settings, "TABULA_SHARD_MIN_PAGES", 8):
+        # Enough chunks per pass to keep every worker busy
+        chunk = min(chunk, -(-len(page_numbers) // width))
+        units = _tabula_units(page_numbers, chunk)
+        yield from _extract_tables_pooled(pdf_path, units, width)
+        return
 
-    # Attempt 2: Stream (no rotation)
-    df_list2 = _read_pdf_tabula(pdf_path, pages=pages, lattice=False, stream=True, rotate=False)
-    all_tables.extend(df_list2)
+    for pass_index, chunk_pages in _tabula_units(page_numbers, chunk):
+        yield from _run_tabula_pass(pdf_path, chunk_pages, pass_index)
 
-    # Attempt 3: Lattice (rotate)
-    df_list3 = _read_pdf_tabula(pdf_path, pages=pages, lattice=True, stream=False, rotate=True)
-    all_tables.extend(df_list3)
 
-    # Attempt 4: Stream (rotate)
-    df_list4 = _read_pdf_tabula(pdf_path, pages=pages, lattice=False, stream=True, rotate=True)
-    all_tables.extend(df_list4)
+def _tabula_units(page_numbers, chunk):
+    """
+    (pass index, pages) work units in result order: pass by pass, pages in order.
+    """
+    return [
+        (pass_index, page_numbers[start:start + chunk])
+        for pass_index in range(len(TABULA_PASSES))
+        for start in range(0, len(page_numbers), chunk)
+    ]
 
-    return all_tables
+
+def _run_tabula_pass(pdf_path, pages, pass_index):
+    """
+    One tabula pass over `pages`; returns its DataFrames. Also the unit of
+    work of a pool worker.
+    """
+    lattice, stream, rotate = TABULA_PASSES[pass_index]
+    return _read_pdf_tabula(pdf_path, pages=pages, lattice=lattice, stream=stream, rotate=rotate)
+
+
+def _extract_tables_pooled(pdf_path, units, width):
+    """
+    Runs the work units on the process pool, at most two per worker queued
+    or running at a time, and yields their tables in unit order.
+    """
+    print(f"DEBUG: tabula => {len(units)} chunks on {width} processes")
+    pending = deque()
+    submitted = done = 0
+    try:
+        pool = get_process_pool("tabula", width)
+        while pending or submitted < len(units):
+            while submitted < len(units) and len(pending) < width * 2:
+                pass_index, pages = units[submitted]
+                pending.append(pool.submit(_run_tabula_pass, pdf_path, pages, pass_index))
+                submitted += 1
+            with stage_timer("tabula_sharded"):
+                tables = pending.popleft().result()
+            done += 1
+            yield from tables
+    except BrokenProcessPool as e:
+        # A worker died (e.g. the JVM ran out of memory): start afresh next time
+        print(f"ERROR in tabula process pool, parsing the rest in-process instead: {e}")
+        shutdown_process_pool("tabula")
+        pending.clear()
+        for pass_index, pages in units[done:]:
+            yield from _run_tabula_pass(pdf_path, pages, pass_index)
+    finally:
+        # The consumer stopped early (or failed): don't leave work queued
+        for future in pending:
+            future.cancel()
+
+
+def _dedupe_tables(tables):
+    seen = set()
+    for df in tables:
+        digest = _table_digest(df)
+        if digest in seen:
+            inc("tabula_duplicate_tables_total")
+            continue
+        seen.add(digest)
+        yield df
+
+
+def _table_digest(df):
+    """
+    Digest of a table's shape, column labels and cells.
+    """
+    import pandas as pd
+
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr((df.shape, [str(c) for c in df.columns])).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return digest.digest()
+
+
+def _resolve_pages(pdf_path, pages):
+    """
+    Turns a tabula `pages` argument ("all", 3, [1, 2], "1-3,7") into a sorted
+    list of page numbers.
+    """
+    if pages in (None, "all"):
+        import pypdfium2
+        document = pypdfium2.PdfDocument(pdf_path)
+        try:
+            return list(range(1, len(document) + 1))
+        finally:
+            document.close()
+    return sorted(set(parse_page_range(pages)))
 
 
 def _read_pdf_tabula(pdf_path, pages="all", lattice=True, stream=False, rotate=False):
@@ -72,37 +222,65 @@ def _read_pdf_tabula(pdf_path, pages="all", lattice=True, stream=False, rotate=F
     Returns a list of DataFrame objects.
     """
     print(f"DEBUG: tabula.read_pdf => pages={pages}, lattice={lattice}, stream={stream}, rotate={rotate}")
+    import tabula  # with pandas, ~0.4 s: only paid by workers that extract tables
 
     try:
-        df_list = tabula.read_pdf(
-            input_path=pdf_path,
-            pages=pages,
-            multiple_tables=True,
-            lattice=lattice,
-            stream=stream,
-            guess=True,
-            pandas_options={"header": None},  # or tweak if you have known headers
-            #rotate=rotate
-        )
+        with stage_timer("tabula_lattice" if lattice else "tabula_stream"):
+            df_list = tabula.read_pdf(
+                input_path=pdf_path,
+                pages=pages,
+                multiple_tables=True,
+                lattice=lattice,
+                stream=stream,
+                guess=True,
+                pandas_options={"header": None},  # or tweak if you have known headers
+                #rotate=rotate
+            )
         return df_list
     except Exception as e:
         print(f"ERROR in tabula.read_pdf (lattice={lattice}, stream={stream}, rotate={rotate}): {e}")
         return []
 
 
-def tables_to_json(df_list):
+def warm_tabula(_=None):
+    """
+    Runs tabula once on a blank page, which starts the JVM and loads tabula's
+    classes in this process (the first real extraction otherwise pays for
+    both). Unlike _read_pdf_tabula, errors (e.g. no Java) are raised.
+    The unused argument lets it be mapped over the pool's workers.
+    """
+    import pypdfium2
+    import tabula
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        pdf_path = os.path.join(tmpdir, "blank.pdf")
+        document = pypdfium2.PdfDocument.new()
+        document.new_page(612, 792)
+        document.save(pdf_path)
+        document.close()
+        tabula.read_pdf(input_path=pdf_path, pages=1, multiple_tables=True, lattice=True, guess=True)
+
+
+def tables_to_json(tables, out=None):
     """
-    Convert a list of DataFrames into a JSON string for easy display or API returning.
-    Each table is stored as a list of dicts (records).
+    Convert DataFrames (a list, or an iterator such as iter_tables) into the
+    JSON string stored on Paper.tables_json, one table at a time: each is
+    encoded, written out and released before the next is extracted.
+    Given a text stream `out`, the JSON is written there instead of returned.
+    Uses the compact columnar layout (see table_formats.py); the records layout
+    it replaced is still readable through table_formats.load_tables.
     """
-    import json
-    output = []
-    for df in df_list:
-        # Fill NaN with empty strings for cleaner JSON
-        table_data = df.fillna("").to_dict(orient="records")
-        output.append(table_data)
+    buffer = out if out is not None else io.StringIO()
+    write_encoded_tables(_encode_each(tables), buffer)
+    if out is None:
+        return buffer.getvalue()
+
 
-    return json.dumps(output, indent=2)
+def _encode_each(tables):
+    for df in tables:
+        with stage_timer("tables_serialize"):
+            encoded = encode_table(df)
+        yield encoded
 
 
 def tables_to_csv(df_list):
@@ -115,3 +293,7 @@ def tables_to_csv(df_list):
         csv_str = df.to_csv(index=False)
         csv_parts.append(f"--- Table {i} ---\n{csv_str}")
     return "\n\n".join(csv_parts)
+
+
+describe("tabula_duplicate_tables_total", "counter",
+         "Tables dropped because another tabula pass had already found the same table.")
@@ -0,0 +1,224 @@
+import io
+import json
+import zipfile
+
+# Stored tables_json layout (compact, columnar):
+#   {"format": "columnar-v1",
+#    "tables": [{"columns": ["0", "1"], "types": ["str", "int"],
+#                "rows": [["Dose", 5], ["Age", null]]}]}
+# Column names are kept once per table instead of once per cell, duplicate
+# column names survive, and numbers/booleans stay typed. The original layout
+# (a list of record lists) is still read by `load_tables`.
+#
+# numpy and pandas are imported where they're used: the JSON side (and the
+# views that import this module) must not cost a cold start pandas' import.
+COLUMNAR_FORMAT = "columnar-v1"
+
+EXPORT_FORMATS = {
+    # format -> (content type, file extension)
+    "csv": ("text/csv", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.file", "arrow"),
+}
+
+
+def encode_tables(df_list):
+    """
+    Serializes a list of DataFrames to the compact columnar JSON layout.
+    """
+    return join_encoded_tables([encode_table(df) for df in df_list])
+
+
+def encode_table(df):
+    """
+    One table's entry of the columnar layout, as JSON text. Lets callers
+    encode tables as they are extracted instead of holding them all.
+    """
+    columns, types, data = [], [], []
+    for name, column in df.items():
+        column_type = _column_type(column)
+        columns.append(str(name))
+        types.append(column_type)
+        data.append(_json_values(column, column_type))
+    table = {"columns": columns, "types": types, "rows": [list(row) for row in zip(*data)]}
+    return json.dumps(table, separators=(",", ":"))
+
+
+def join_encoded_tables(encoded):
+    """
+    The stored tables_json for tables encoded with encode_table, in order.
+    """
+    out = io.StringIO()
+    write_encoded_tables(encoded, out)
+    return out.getvalue()
+
+
+def write_encoded_tables(encoded, out):
+    """
+    Writes the stored tables_json for tables encoded with encode_table to the
+    text stream `out`, each as it arrives from the `encoded` iterable.
+    """
+    out.write('{"format":"%s","tables":[' % COLUMNAR_FORMAT)
+    for i, table in enumerate(encoded):
+        if i:
+            out.write(",")
+        out.write(table)
+    out.write("]}")
+
+
+def load_tables(tables_json):
+    """
+    Parses stored tables_json (columnar or the older records layout) into a
+    list of {"columns", "types", "rows"} dicts without going through pandas.
+    """
+    if not tables_json:
+        return []
+    try:
+        data = json.loads(tables_json)
+    except ValueError:
+        return []
+
+    if isinstance(data, dict) and data.get("format") == COLUMNAR_FORMAT:
+        return data.get("tables", [])
+
+    # Records layout: one list of {column: value} dicts per table
+    tables = []
+    for records in data if isinstance(data, list) else []:
+        if not records:
+            tables.append({"columns": [], "types": [], "rows": []})
+            continue
+        columns = list(records[0].keys())
+        tables.append({
+            "columns": columns,
+            "types": ["str"] * len(columns),
+            "rows": [[record.get(column, "") for column in columns] for record in records],
+        })
+    return tables
+
+
+def decode_tables(tables_json):
+    """
+    Rebuilds the DataFrames from stored tables_json, restoring column types.
+    """
+    return [table_to_dataframe(table) for table in load_tables(tables_json)]
+
+
+def table_to_dataframe(table):
+    import pandas as pd
+
+    columns = table["columns"]
+    values = list(zip(*table["rows"])) if table["rows"] else [()] * len(columns)
+    frame = pd.DataFrame({
+        i: pd.array(list(values[i]), dtype=_PANDAS_TYPES.get(column_type, object))
+        for i, column_type in enumerate(table["types"])
+    })
+    frame.columns = columns
+    return frame
+
+
+def export_table(df, fmt):
+    """
+    Encodes one DataFrame as CSV, Parquet or an Arrow IPC file; returns bytes.
+    Parquet and Arrow need pyarrow.
+    """
+    if fmt == "csv":
+        return df.to_csv(index=False).encode("utf-8")
+
+    import pyarrow as pa
+
+    arrow_table = pa.Table.from_pandas(_with_unique_column_names(df), preserve_index=False)
+    buffer = io.BytesIO()
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+        pq.write_table(arrow_table, buffer)
+    elif fmt == "arrow":
+        with pa.ipc.new_file(buffer, arrow_table.schema) as writer:
+            writer.write_table(arrow_table)
+    else:
+        raise ValueError(f"Unknown table export format: {fmt}")
+    return buffer.getvalue()
+
+
+def export_tables_zip(df_list, fmt):
+    """
+    All of a paper's tables in one zip archive (table_1.<ext>, table_2.<ext>...),
+    since each table has its own columns and cannot share one file schema.
+    """
+    extension = EXPORT_FORMATS[fmt][1]
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for number, df in enumerate(df_list, start=1):
+            archive.writestr(f"table_{number}.{extension}", export_table(df, fmt))
+    return buffer.getvalue()
+
+
+_PANDAS_TYPES = {
+    "int": "Int64",
+    "float": "float64",
+    "bool": "boolean",
+    "str": object,
+}
+
+
+def _column_type(column):
+    # Works on the numpy values: pandas' per-call overhead dominates for the
+    # small tables tabula returns
+    import numpy as np
+    import pandas as pd
+
+    dtype = column.dtype
+    if pd.api.types.is_bool_dtype(dtype):
+        return "bool"
+    if pd.api.types.is_integer_dtype(dtype):
+        return "int"
+    if pd.api.types.is_float_dtype(dtype):
+        # tabula reads integer columns with blanks as floats
+        values = column.to_numpy(dtype="float64", na_value=np.nan)
+        values = values[~np.isnan(values)]
+        if values.size and np.array_equal(values, np.round(values)) and np.abs(values).max() < 2 ** 53:
+            return "int"
+        return "float"
+    return "str"
+
+
+def _json_values(column, column_type):
+    """
+    The column as JSON-ready Python values, None for missing cells.
+    """
+    import numpy as np
+    import pandas as pd
+
+    if column_type == "str":
+        return [None if value is None or value != value or value is pd.NA
+                else value if isinstance(value, str) else str(value)
+                for value in column.tolist()]
+    if pd.api.types.is_extension_array_dtype(column.dtype):
+        # Nullable Int64/boolean columns (e.g. decoded tables)
+        return [None if value is pd.NA else value for value in column.tolist()]
+    values = column.to_numpy()
+    if column_type == "int" and values.dtype.kind == "f":
+        missing = np.isnan(values)
+        ints = np.where(missing, 0, values).astype("int64").tolist()
+        return [None if blank else value for value, blank in zip(ints, missing.tolist())] if missing.any() else ints
+    if values.dtype.kind == "f":
+        return [None if value != value else value for value in values.tolist()]
+    return values.tolist()
+
+
+def _with_unique_column_names(df):
+    # Arrow and Parquet reject duplicate names, which tabula produces regularly
+    import pandas as pd
+
+    seen = {}
+    names = []
+    for name in map(str, df.columns):
+        count = seen.get(name, 0)
+        seen[name] = count + 1
+        names.append(name if count == 0 else f"{name}.{count}")
+    renamed = df.copy(deep=False)
+    renamed.columns = names
+    # Mixed-type object columns (e.g. numbers and text) are exported as text
+    for name in names:
+        if renamed[name].dtype == object:
+            renamed[name] = renamed[name].map(lambda v: None if pd.isna(v) else str(v))
+    return renamed
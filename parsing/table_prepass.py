@@ -0,0 +1,130 @@
+import re
+from collections import Counter, defaultdict
+
+from .metrics import describe, inc, stage_timer
+
+# "Table 3", "TABLE IV", "Tab. 2" at the start of a text line
+CAPTION_RE = re.compile(r"^(table|tab\.)\s*([0-9]+|[ivxlc]+)\b", re.IGNORECASE)
+
+# A horizontal rule counts when it spans at least this share of the page width
+MIN_RULE_WIDTH = 0.15
+# Rules needed to flag a page (a ruled table has a top, header and bottom rule)
+MIN_RULES = 3
+
+# Words further apart than this (points) on one line start a new cell
+CELL_GAP = 10.0
+# A line with this many cells looks like a table row (two-column prose has two)
+MIN_ROW_CELLS = 3
+# Words whose tops are within this many points are on one text line
+LINE_TOLERANCE = 3.0
+# Cell starts within this many points are treated as one column
+COLUMN_TOLERANCE = 4.0
+# Row-like lines sharing column positions needed to flag a page
+MIN_ALIGNED_ROWS = 3
+
+
+def find_table_pages(pdf_path, pages="all"):
+    """
+    Cheap pre-pass over the PDF's text layer and vector graphics that returns
+    the pages likely to hold a table, so the tabula passes can skip prose.
+
+    A page is a candidate when it has a "Table N" caption, several horizontal
+    rules, or at least MIN_ALIGNED_ROWS lines whose cells line up in columns.
+    Pages without a text layer are skipped: tabula finds nothing on scans.
+    Returns None (meaning "check every page") if the PDF can't be analysed.
+    """
+    try:
+        import pdfplumber
+    except ImportError:
+        return None
+
+    wanted = None if pages in (None, "all") else set(parse_page_range(pages))
+    candidates = []
+    checked = 0
+    try:
+        with stage_timer("table_prepass"), pdfplumber.open(pdf_path) as pdf:
+            for number, page in enumerate(pdf.pages, start=1):
+                if wanted is not None and number not in wanted:
+                    continue
+                checked += 1
+                signals = page_signals(
+                    page.extract_words(use_text_flow=False, keep_blank_chars=False),
+                    [edge["x1"] - edge["x0"] for edge in page.horizontal_edges],
+                    page.width,
+                )
+                if is_table_candidate(signals):
+                    candidates.append(number)
+                page.flush_cache()
+    except Exception as e:
+        print(f"ERROR in table pre-pass for {pdf_path}, checking every page: {e}")
+        return None
+
+    inc("table_prepass_pages_total", len(candidates), result="kept")
+    inc("table_prepass_pages_total", checked - len(candidates), result="skipped")
+    return candidates
+
+
+def page_signals(words, rule_widths, page_width):
+    """
+    Table evidence on one page, from its words (pdfplumber dicts with text,
+    x0, x1 and top) and the widths of its horizontal edges.
+    """
+    lines = defaultdict(list)
+    for word in words:
+        lines[round(word["top"] / LINE_TOLERANCE)].append(word)
+
+    caption = False
+    row_starts = []
+    for top in sorted(lines):
+        line = sorted(lines[top], key=lambda w: w["x0"])
+        if CAPTION_RE.match(line[0]["text"] + " " + (line[1]["text"] if len(line) > 1 else "")):
+            caption = True
+        starts = [line[0]["x0"]]
+        for previous, word in zip(line, line[1:]):
+            if word["x0"] - previous["x1"] > CELL_GAP:
+                starts.append(word["x0"])
+        if len(starts) >= MIN_ROW_CELLS:
+            row_starts.append(starts)
+
+    # Column positions shared by several row-like lines
+    column_hits = Counter(round(x / COLUMN_TOLERANCE) for starts in row_starts for x in set(starts))
+    columns = {bucket for bucket, hits in column_hits.items() if hits >= MIN_ALIGNED_ROWS}
+    aligned_rows = sum(
+        1 for starts in row_starts
+        if sum(1 for x in starts if round(x / COLUMN_TOLERANCE) in columns) >= 2
+    )
+
+    return {
+        "has_text": bool(words),
+        "caption": caption,
+        "rules": sum(1 for width in rule_widths if width >= MIN_RULE_WIDTH * page_width),
+        "aligned_rows": aligned_rows,
+    }
+
+
+def is_table_candidate(signals):
+    if not signals["has_text"]:
+        return False
+    return (signals["caption"]
+            or signals["rules"] >= MIN_RULES
+            or signals["aligned_rows"] >= MIN_ALIGNED_ROWS)
+
+
+def parse_page_range(pages):
+    """
+    Page numbers of a tabula-style `pages` argument other than "all":
+    3, [1, 2] or "1-3,7".
+    """
+    if isinstance(pages, int):
+        return [pages]
+    if isinstance(pages, str):
+        numbers = []
+        for part in pages.split(","):
+            start, _, end = part.strip().partition("-")
+            numbers.extend(range(int(start), int(end or start) + 1))
+        return numbers
+    return list(pages)
+
+
+describe("table_prepass_pages_total", "counter",
+         "Pages the table pre-pass sent to tabula (kept) or let it skip (skipped).")
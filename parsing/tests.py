@@ -1,3 +1,1384 @@
-from django.test import TestCase
+import hashlib
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import pandas as pd
+import pypdfium2
+import requests
+from PIL import Image
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from ResearchParsing.papers.models import Paper, PdfBlob
+from . import ai_postprocess, metrics, ocr, table_extraction, warmup
+from .consolidation import expire_stalled_consolidations
+from .advanced_references_extraction import grobid_extract_bibliography, grobid_extract_header
+from .table_prepass import is_table_candidate, page_signals
+from .grobid_client import post_pdf_to_grobid
+from .grobid_limiter import AdaptiveLimiter, GrobidSaturated
+from .grobid_pool import GrobidEndpointPool
+from .grobid_profiles import DEFAULT_PROFILE, GROBID_PROFILES, defers_consolidation, get_grobid_call
+from .lanes import admissible_waiters, current_lane, parse_lane
+from .models import CanonicalReference, OcrPage, ParseLease
+from .pipeline import Degraded, Pipeline, Stage
+from .rate_limits import charge_tokens
+from .stubs import start_gcs_stub, start_grobid_stub, start_openai_stub
+from .reference_index import ReferenceIndex, canonicalize_references
+
+
+class LatencyInjectingGrobid:
+    """
+    Stand-in for the GROBID service: it serves `capacity` requests at `base`
+    latency, slows down quadratically past that and answers 503 once more than
+    `overload_at` requests are in flight.
+    """
+
+    def __init__(self, capacity=3, base=0.02, overload_at=6):
+        self.capacity = capacity
+        self.base = base
+        self.overload_at = overload_at
+        self.inflight = 0
+        self.max_inflight = 0
+        self.calls = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def process(self):
+        with self._lock:
+            self.inflight += 1
+            self.calls += 1
+            self.max_inflight = max(self.max_inflight, self.inflight)
+            current = self.inflight
+        try:
+            time.sleep(self.base * max(1.0, current / self.capacity) ** 2)
+            if current > self.overload_at:
+                with self._lock:
+                    self.errors += 1
+                return 503
+            return 200
+        finally:
+            with self._lock:
+                self.inflight -= 1
+
+
+class AdaptiveLimiterSimulationTests(SimpleTestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.state_path = os.path.join(self.tmpdir.name, "grobid_limiter.json")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _limiter(self, **kwargs):
+        options = dict(min_limit=1, max_limit=8, initial_limit=8,
+                       target_latency=0.05, queue_timeout=10.0, poll_interval=0.002)
+        options.update(kwargs)
+        return AdaptiveLimiter(self.state_path, **options)
+
+    def _burst(self, stub, requests_per_worker, workers, limiters=None):
+        """
+        Fires `workers` x `requests_per_worker` requests at once. When
+        `limiters` is given, worker i goes through limiters[i % len(limiters)],
+        mimicking gunicorn workers that share one state file.
+        """
+        results = {"ok": 0, "rejected": 0}
+        lock = threading.Lock()
+
+        def run(i):
+            for _ in range(requests_per_worker):
+                try:
+                    if limiters is None:
+                        status = stub.process()
+                    else:
+                        with limiters[i % len(limiters)].slot() as outcome:
+                            status = stub.process()
+                            outcome["error"] = status >= 500
+                except GrobidSaturated:
+                    with lock:
+                        results["rejected"] += 1
+                    continue
+                if status == 200:
+                    with lock:
+                        results["ok"] += 1
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(workers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return results
+
+    def test_unprotected_burst_overloads_the_stub(self):
+        stub = LatencyInjectingGrobid()
+        self._burst(stub, requests_per_worker=3, workers=20)
+        self.assertGreater(stub.errors, 0)
+
+    def test_limiter_backs_off_to_service_capacity(self):
+        stub = LatencyInjectingGrobid()
+        # Four "gunicorn workers", each with its own limiter on the shared state file
+        limiters = [self._limiter() for _ in range(4)]
+        results = self._burst(stub, requests_per_worker=6, workers=20, limiters=limiters)
+
+        self.assertEqual(results["rejected"], 0)
+        self.assertEqual(results["ok"] + stub.errors, 120)
+        # The cap never lets more than max_limit requests through...
+        self.assertLessEqual(stub.max_inflight, 8)
+        # ...and AIMD settles it around what the stub can serve under target latency
+        self.assertLessEqual(limiters[0].current_limit(), 5)
+        self.assertLess(stub.errors, 12)
+
+    def test_limiter_grows_back_when_latency_recovers(self):
+        stub = LatencyInjectingGrobid(capacity=8)
+        limiter = self._limiter(initial_limit=1)
+        self._burst(stub, requests_per_worker=10, workers=8, limiters=[limiter])
+        self.assertGreater(limiter.current_limit(), 1)
+
+    def test_fails_fast_when_saturated(self):
+        limiter = self._limiter(initial_limit=2, max_limit=2, queue_timeout=0)
+        held = [limiter.acquire(), limiter.acquire()]
+
+        start = time.monotonic()
+        with self.assertRaises(GrobidSaturated):
+            limiter.acquire()
+        self.assertLess(time.monotonic() - start, 0.5)
+
+        for slot_id, started in held:
+            limiter.release(slot_id, started, 0.01, False)
+        slot_id, started = limiter.acquire()
+        limiter.release(slot_id, started, 0.01, False)
+
+    def test_slots_of_dead_workers_are_reclaimed(self):
+        limiter = self._limiter(initial_limit=1, max_limit=1, queue_timeout=0)
+        with limiter._locked_state() as state:
+            # A pid that cannot exist: the worker holding this slot is gone
+            state["inflight"]["stale"] = {"pid": 2 ** 22 + 1, "started": time.time()}
+        slot_id, started = limiter.acquire()
+        limiter.release(slot_id, started, 0.01, False)
+
+
+class PriorityLaneTests(TestCase):
+    setUp = AdaptiveLimiterSimulationTests.setUp
+    tearDown = AdaptiveLimiterSimulationTests.tearDown
+    _limiter = AdaptiveLimiterSimulationTests._limiter
+
+    def test_interactive_calls_overtake_a_bulk_backlog(self):
+        metrics.reset()
+        limiter = self._limiter(initial_limit=4, max_limit=4, target_latency=10.0, reserve=0.25)
+        lanes = {"interactive": 0, "bulk": 0}
+        peak = {"bulk": 0}
+        lock = threading.Lock()
+
+        def call(lane, user, seconds):
+            with parse_lane(lane, user), limiter.slot():
+                with lock:
+                    lanes[lane] += 1
+                    peak["bulk"] = max(peak["bulk"], lanes["bulk"])
+                time.sleep(seconds)
+                with lock:
+                    lanes[lane] -= 1
+
+        # A 40-call backfill (about half a second of work for 3 slots)...
+        with ThreadPoolExecutor(max_workers=43) as pool:
+            backfill = [pool.submit(call, "bulk", "user:1", 0.04) for _ in range(40)]
+            time.sleep(0.1)
+            # ...doesn't hold up uploads arriving in the middle of it
+            start = time.perf_counter()
+            uploads = [pool.submit(call, "interactive", f"user:{n}", 0.01) for n in (2, 3, 4)]
+            for future in uploads:
+                future.result()
+            upload_seconds = time.perf_counter() - start
+            for future in backfill:
+                future.result()
+            backfill_seconds = time.perf_counter() - start
+
+        # Done while most of the backlog was still queued
+        self.assertLess(upload_seconds, backfill_seconds / 2)
+        self.assertEqual(peak["bulk"], 3)
+        summaries = metrics.snapshot()["summaries"]
+        waits = {dict(labels)["lane"]: value for (name, labels), value in summaries.items()
+                 if name == "parse_lane_wait_seconds"}
+        self.assertEqual((waits["interactive"][0], waits["bulk"][0]), (3, 40))
+        self.assertLess(max(waits["interactive"][2]), max(waits["bulk"][2]))
+        gauges = metrics.snapshot()["gauges"]
+        self.assertEqual(gauges[("parse_lane_queue_depth", (("lane", "bulk"), ("service", "grobid")))], 0)
+
+    @override_settings(PARSE_USER_WEIGHTS={"user:2": 3})
+    def test_users_share_a_lane_by_weight(self):
+        # user:1 queued first, but user:2 has three times the weight
+        waiting = {f"{user}-{n}": {"lane": "bulk", "user": user, "since": since + n}
+                   for user, since in (("user:1", 0), ("user:2", 100)) for n in range(4)}
+        admitted = admissible_waiters(waiting, {}, cap=5, reserve=0.2)
+        self.assertEqual([waiting[t]["user"] for t in admitted], ["user:2", "user:2", "user:1", "user:2"])
+
+        # Nothing left for bulk beyond the cap minus the reserve; interactive still fits
+        inflight = {t: waiting.pop(t) for t in admitted}
+        waiting["upload"] = {"lane": "interactive", "user": "user:3", "since": 1000}
+        self.assertEqual(admissible_waiters(waiting, inflight, cap=5, reserve=0.2), ["upload"])
+
+    def test_requests_and_their_pipeline_stages_run_in_the_asked_lane(self):
+        caches["ratelimit"].clear()
+        caches["pipeline"].clear()
+        seen = []
+
+        def methods(path):
+            seen.append(current_lane())
+            return "Methods"
+
+        with mock.patch("ResearchParsing.parsing.stages.grobid_extract_methods", side_effect=methods):
+            for n, headers in enumerate(({}, {"HTTP_X_PARSE_LANE": "bulk"})):
+                self.client.post("/api/parsing/parse-methods-html/", {
+                    "pdf_file": SimpleUploadedFile("paper.pdf", f"%PDF-1.4 lane {n}".encode()),
+                }, REMOTE_ADDR="10.0.0.9", **headers)
+        self.assertEqual(seen, [("interactive", "ip:10.0.0.9"), ("bulk", "ip:10.0.0.9")])
+
+
+class SingleFlightStressTests(TransactionTestCase):
+    """
+    Dozens of simultaneous uploads of the same PDF must end up as one parse,
+    one Paper per owner and one stored blob.
+    """
+    PDF_BYTES = b"%PDF-1.4 single flight stress test"
+    REFERENCES = [{"first_name": "Ada", "last_name": "Lovelace", "title": "Notes on the Engine",
+                   "year": "1843", "journal": "Taylor's Scientific Memoirs"}]
+
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        storages = {
+            "default": {"BACKEND": "django.core.files.storage.FileSystemStorage",
+                        "OPTIONS": {"location": self.media}},
+            "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+        }
+        self.settings_override = override_settings(
+            STORAGES=storages, GROBID_DEFER_CONSOLIDATION=False, PARSE_LEASE_WAIT_TIMEOUT=60,
+            # These bursts are the point of the test, not abuse to throttle
+            PARSE_RATE_LIMITS={},
+        )
+        self.settings_override.enable()
+        caches["pipeline"].clear()
+        self.grobid_calls = 0
+        self.calls_lock = threading.Lock()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media, ignore_errors=True)
+
+    def _slow_grobid(self, pdf_path, profile=None):
+        with self.calls_lock:
+            self.grobid_calls += 1
+        time.sleep(0.3)
+        return list(self.REFERENCES), {"title": "", "last_name": "", "year": ""}
+
+    def _upload_concurrently(self, users, uploads):
+        barrier = threading.Barrier(uploads)
+        statuses, bodies = [], []
+        lock = threading.Lock()
+
+        def upload(i):
+            client = Client()
+            client.force_login(users[i % len(users)])
+            barrier.wait()
+            try:
+                response = client.post("/api/parsing/parse-references-html/", {
+                    "pdf_file": SimpleUploadedFile("paper.pdf", self.PDF_BYTES, content_type="application/pdf"),
+                })
+                with lock:
+                    statuses.append(response.status_code)
+                    bodies.append(response.content.decode())
+            finally:
+                connection.close()
+
+        with mock.patch("ResearchParsing.parsing.stages.grobid_extract_bibliography", side_effect=self._slow_grobid), \
+                mock.patch("ResearchParsing.parsing.stages.grobid_extract_header", return_value=None), \
+                mock.patch("ResearchParsing.parsing.stages.check_references_with_chatgpt",
+                           side_effect=lambda refs: (refs, True)):
+            threads = [threading.Thread(target=upload, args=(i,)) for i in range(uploads)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        return statuses, bodies
+
+    def test_double_submits_by_one_user_parse_once(self):
+        user = User.objects.create_user("stress")
+        statuses, bodies = self._upload_concurrently([user], uploads=30)
+
+        self.assertEqual(statuses, [200] * 30)
+        self.assertTrue(all("Notes on the Engine" in body for body in bodies))
+        self.assertEqual(self.grobid_calls, 1)
+        self.assertEqual(Paper.objects.count(), 1)
+        blob = PdfBlob.objects.get()
+        self.assertEqual(blob.ref_count, 1)
+        self.assertEqual(len(os.listdir(os.path.join(self.media, "pdf_blobs", blob.sha256))), 1)
+        self.assertFalse(ParseLease.objects.exists())
+
+    def test_identical_uploads_across_users_share_one_parse(self):
+        users = [User.objects.create_user(f"stress{i}") for i in range(3)]
+        statuses, bodies = self._upload_concurrently(users, uploads=24)
+
+        self.assertEqual(statuses, [200] * 24)
+        self.assertTrue(all("Notes on the Engine" in body for body in bodies))
+        self.assertEqual(self.grobid_calls, 1)
+        self.assertEqual(Paper.objects.count(), 3)
+        self.assertEqual(PdfBlob.objects.get().ref_count, 3)
+        self.assertFalse(ParseLease.objects.exists())
+
+
+@override_settings(TABLE_PREPASS=False)
+class ShardedTableExtractionTests(SimpleTestCase):
+
+    def _fake_tabula(self, pdf_path, pages="all", lattice=True, stream=False, rotate=False):
+        # One single-cell "table" per page and pass, labelled with both
+        pages = range(1, 24) if pages == "all" else pages
+        return [pd.DataFrame([[f"p{page} {lattice}/{stream}/{rotate}"]]) for page in pages]
+
+    def test_sharded_result_matches_single_process_order(self):
+        with mock.patch.object(table_extraction, "_read_pdf_tabula", side_effect=self._fake_tabula), \
+                mock.patch.object(table_extraction, "_resolve_pages", return_value=list(range(1, 24))), \
+                mock.patch.object(table_extraction, "get_process_pool",
+                                  side_effect=lambda name, width: ThreadPoolExecutor(width)), \
+                mock.patch("os.path.exists", return_value=True):
+            serial = table_extraction.parse_tables_comprehensive("paper.pdf", workers=1)
+            sharded = table_extraction.parse_tables_comprehensive("paper.pdf", workers=4)
+
+        self.assertEqual(len(sharded), 23 * len(table_extraction.TABULA_PASSES))
+        self.assertEqual([df.iat[0, 0] for df in sharded], [df.iat[0, 0] for df in serial])
+
+    @override_settings(TABULA_CHUNK_PAGES=5)
+    def test_tables_stream_chunk_by_chunk_without_duplicates(self):
+        calls = []
+
+        def fake_tabula(pdf_path, pages="all", lattice=True, stream=False, rotate=False):
+            calls.append(list(pages))
+            # The rotated passes find the unrotated passes' tables again
+            return [pd.DataFrame([[f"p{page} {lattice}"]]) for page in pages]
+
+        with mock.patch.object(table_extraction, "_read_pdf_tabula", side_effect=fake_tabula), \
+                mock.patch.object(table_extraction, "_resolve_pages", return_value=list(range(1, 24))), \
+                mock.patch("os.path.exists", return_value=True):
+            tables = table_extraction.iter_tables("paper.pdf", workers=1)
+            next(tables)
+            self.assertEqual(calls, [[1, 2, 3, 4, 5]])
+            rest = list(tables)
+
+        self.assertEqual(len(calls), 5 * len(table_extraction.TABULA_PASSES))
+        self.assertEqual(1 + len(rest), 23 * 2)
+        self.assertEqual(json.loads(table_extraction.tables_to_json(iter(rest[:2])))["tables"][1]["rows"],
+                         [["p3 True"]])
+
+    def test_tables_are_written_out_as_they_are_extracted(self):
+        out = io.StringIO()
+        written = []
+
+        def tables():
+            for i in range(3):
+                written.append(len(out.getvalue()))
+                yield pd.DataFrame({"Dose": [f"{i} mg"]})
+
+        table_extraction.tables_to_json(tables(), out)
+        # Each table reached the stream before the next one was pulled
+        self.assertEqual(written, sorted(set(written)))
+        self.assertEqual([t["rows"] for t in json.loads(out.getvalue())["tables"]],
+                         [[["0 mg"]], [["1 mg"]], [["2 mg"]]])
+
+
+class TablePrepassSignalTests(SimpleTestCase):
+
+    @staticmethod
+    def _line(top, cells):
+        # Words of one text line: (x0, text) pairs, 6pt per character
+        return [{"text": text, "x0": x0, "x1": x0 + 6 * len(text), "top": top} for x0, text in cells]
+
+    def test_two_column_prose_is_skipped(self):
+        words = []
+        for i in range(20):
+            words += self._line(100 + 12 * i, [(50, "the"), (74, "model"), (110, "was"),
+                                               (320, "and"), (344, "results"), (392, "were")])
+        self.assertFalse(is_table_candidate(page_signals(words, [500, 40], 612)))
+
+    def test_aligned_columns_are_flagged(self):
+        words = []
+        for i in range(6):
+            words += self._line(100 + 12 * i, [(50, f"Variable{i}"), (200, "12.4"), (300, "8.1"), (400, "0.03")])
+        signals = page_signals(words, [], 612)
+        self.assertGreaterEqual(signals["aligned_rows"], 6)
+        self.assertTrue(is_table_candidate(signals))
+
+    def test_caption_or_rules_flag_a_page(self):
+        prose = self._line(100, [(50, "We"), (70, "measured")])
+        self.assertTrue(is_table_candidate(page_signals(self._line(90, [(50, "Table"), (90, "2.")]) + prose, [], 612)))
+        self.assertTrue(is_table_candidate(page_signals(prose, [400, 400, 400], 612)))
+        self.assertFalse(is_table_candidate(page_signals(prose, [400, 30, 30], 612)))
+        self.assertFalse(is_table_candidate(page_signals([], [400, 400, 400], 612)))
+
+
+@override_settings(OCR_WORKERS=1)
+class OcrFallbackTests(TestCase):
+    OCR_TEXT = "A Scanned Study\n\n2. Methods\nWe enrolled 40 patients.\n\n3. Results\nIt worked."
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.pdf_path = os.path.join(self.tmpdir.name, "scan.pdf")
+        document = pypdfium2.PdfDocument.new()
+        for _ in range(3):
+            page = document.new_page(612, 792)
+            image = pypdfium2.PdfImage.new(document)
+            image.set_bitmap(pypdfium2.PdfBitmap.from_pil(Image.new("L", (306, 396), 255)))
+            image.set_matrix(pypdfium2.PdfMatrix().scale(612, 792))
+            page.insert_obj(image)
+            page.gen_content()
+        document.save(self.pdf_path)
+        document.close()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_scanned_pages_are_ocrd_once_and_feed_methods(self):
+        with mock.patch.object(ocr, "_ocr_page", side_effect=lambda path, page, dpi, lang:
+                               self.OCR_TEXT if page == 2 else f"page {page}") as ocr_page:
+            first = ocr.ocr_methods_fallback(self.pdf_path, "c" * 64)
+            second = ocr.ocr_methods_fallback(self.pdf_path, "c" * 64)
+
+        self.assertEqual(first, "We enrolled 40 patients.")
+        self.assertEqual(second, first)
+        self.assertEqual(ocr_page.call_count, 3)
+        self.assertEqual(OcrPage.objects.filter(pdf_hash="c" * 64).count(), 3)
+
+    def test_methods_heading_variants(self):
+        self.assertEqual(ocr.extract_methods_from_text("MATERIALS AND METHODS\nMice were used.\nDISCUSSION\nx"),
+                         "Mice were used.")
+        self.assertEqual(ocr.extract_methods_from_text("Intro about methods in general.\nResults\n1"), "")
+
+
+class StreamingReferencesTests(TestCase):
+    REFERENCES = [{"title": "Notes on the Engine", "last_name": "Lovelace"},
+                  {"title": "asdf qwer", "last_name": ""},
+                  {"title": "On Computable Numbers", "last_name": "Turing"}]
+
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            STORAGES={"default": {"BACKEND": "django.core.files.storage.FileSystemStorage",
+                                  "OPTIONS": {"location": self.media}},
+                      "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"}},
+            GROBID_DEFER_CONSOLIDATION=False,
+        )
+        self.settings_override.enable()
+        caches["pipeline"].clear()
+        # The references call carries the header (as with the "full" profile)
+        self.enterContext(mock.patch("ResearchParsing.parsing.stages.grobid_extract_header", return_value=None))
+        self.client.force_login(User.objects.create_user("streamer"))
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media, ignore_errors=True)
+
+    def _verdicts(self, references):
+        # Two LLM chunks: the first rejects the gibberish entry, the second call fails
+        yield 0, references[:2], [dict(references[0], valid=True), dict(references[1], valid=False)]
+        yield 2, references[2:], None
+
+    def test_references_stream_before_verdicts(self):
+        header = {"title": "Thinking Machines", "last_name": "Hopper", "year": "1952"}
+        with mock.patch("ResearchParsing.parsing.stages.grobid_extract_bibliography",
+                        return_value=([dict(r) for r in self.REFERENCES], header)), \
+                mock.patch("ResearchParsing.parsing.views.iter_reference_verdicts", side_effect=self._verdicts):
+            response = self.client.post("/api/parsing/parse-references-html/", {
+                "pdf_file": SimpleUploadedFile("paper.pdf", b"%PDF-1.4 stream", content_type="application/pdf"),
+                "stream": "1",
+            })
+            self.assertTrue(response.streaming)
+            chunks = [chunk.decode() for chunk in response.streaming_content]
+
+        self.assertIn("Extracting references", chunks[0])
+        self.assertIn("On Computable Numbers", chunks[1])
+        self.assertNotIn("valid", chunks[1].replace("class=\"verdict\"", ""))
+        self.assertIn('#ref-1 .verdict::after { content: "valid"', chunks[2])
+        self.assertIn("#ref-2 { opacity", chunks[2])
+        self.assertIn("#ref-3 { opacity", chunks[3])
+        self.assertIn("1 reference kept", chunks[-1])
+        paper = Paper.objects.get()
+        stored = json.loads(paper.references_json)
+        self.assertEqual([r["title"] for r in stored], ["Notes on the Engine"])
+        self.assertEqual(paper.title, "Thinking Machines")
+        self.assertTrue(paper.canonical_id)
+        # The second chunk went unchecked: parsed again on the next upload
+        self.assertNotIn("references", json.loads(paper.artifact_versions_json))
+
+
+class StreamingSummaryTests(TestCase):
+    setUp = StreamingReferencesTests.setUp
+    tearDown = StreamingReferencesTests.tearDown
+
+    def _post(self, pieces):
+        self.enterContext(mock.patch("ResearchParsing.parsing.stages.grobid_extract_methods",
+                                     return_value="We used <b>PCR</b>."))
+        self.enterContext(mock.patch("ResearchParsing.parsing.stages.iter_tables", return_value=iter(())))
+        self.enterContext(mock.patch("ResearchParsing.parsing.views.stream_summary_of_methods_and_tables",
+                                     return_value=iter(pieces)))
+        response = self.client.post("/api/parsing/parse-methods-and-tables-summary/", {
+            "pdf_file": SimpleUploadedFile("paper.pdf", b"%PDF-1.4 summary", content_type="application/pdf"),
+            "stream": "1",
+        })
+        self.assertTrue(response.streaming)
+        return response
+
+    def test_summary_saved_once_stream_completes(self):
+        chunks = [chunk.decode() for chunk in self._post(["PCR ", "on <5> samples."]).streaming_content]
+
+        self.assertIn("Summary of Methods", chunks[0])
+        self.assertEqual(chunks[1:3], ["PCR ", "on &lt;5&gt; samples."])
+        paper = Paper.objects.get()
+        self.assertEqual(paper.summary_text, "PCR on <5> samples.")
+        self.assertEqual(paper.methods_text, "We used <b>PCR</b>.")
+
+    def test_disconnect_keeps_parsed_sections_but_not_partial_summary(self):
+        response = self._post(["PCR ", "never sent"])
+        chunks = response.streaming_content
+        next(chunks), next(chunks)
+        # The client goes away: the server closes the body iterator (here the
+        # test client's wrapper, which closes the response without closing the test database)
+        response._iterator.close()
+
+        paper = Paper.objects.get()
+        self.assertEqual(paper.summary_text, "")
+        self.assertEqual(paper.methods_text, "We used <b>PCR</b>.")
+
+
+class DegradedResultTests(TestCase):
+    """
+    Results standing in for a failed step are shown and stored, but not
+    stamped as current, so the next upload of the PDF parses it again.
+    """
+    setUp = StreamingReferencesTests.setUp
+    tearDown = StreamingReferencesTests.tearDown
+
+    def _post_summary(self):
+        return self.client.post("/api/parsing/parse-methods-and-tables-summary/", {
+            "pdf_file": SimpleUploadedFile("paper.pdf", b"%PDF-1.4 degraded", content_type="application/pdf"),
+        })
+
+    def test_failed_methods_extraction_is_parsed_again(self):
+        grobid = self.enterContext(mock.patch("ResearchParsing.parsing.stages.grobid_extract_methods",
+                                              side_effect=ValueError("no TEI body")))
+        self.enterContext(mock.patch("ResearchParsing.parsing.stages.ocr_methods_fallback", return_value=""))
+        self.enterContext(mock.patch("ResearchParsing.parsing.stages.iter_tables", side_effect=lambda *a, **k: iter(())))
+        self.enterContext(mock.patch("ResearchParsing.parsing.stages.summarize_methods_and_tables_with_chatgpt",
+                                     return_value="No methods found."))
+
+        self.assertEqual(self._post_summary().status_code, 200)
+        paper = Paper.objects.get()
+        self.assertEqual(paper.methods_text, "")
+        self.assertEqual(set(json.loads(paper.artifact_versions_json)), {"tables"})
+
+        grobid.side_effect, grobid.return_value = None, "We used PCR."
+        self._post_summary()
+        self.assertEqual(grobid.call_count, 2)
+        paper.refresh_from_db()
+        self.assertEqual(paper.methods_text, "We used PCR.")
+        self.assertEqual(set(json.loads(paper.artifact_versions_json)), {"methods", "tables", "summary"})
+
+
+    def test_references_are_parsed_again_after_an_openai_outage(self):
+        references = [{"title": "Notes on the Engine", "last_name": "Lovelace"}]
+        grobid = self.enterContext(mock.patch("ResearchParsing.parsing.stages.grobid_extract_bibliography",
+                                              side_effect=lambda path: ([dict(r) for r in references], {})))
+        post = lambda: self.client.post("/api/parsing/parse-references-html/", {
+            "pdf_file": SimpleUploadedFile("paper.pdf", b"%PDF-1.4 outage", content_type="application/pdf"),
+        })
+
+        with mock.patch.object(ai_postprocess, "get_openai_client", side_effect=RuntimeError("OpenAI is down")):
+            self.assertEqual(post().status_code, 200)
+        paper = Paper.objects.get()
+        self.assertEqual(json.loads(paper.references_json), [])
+        self.assertNotIn("references", json.loads(paper.artifact_versions_json))
+
+        # Next upload, on a worker without this one's stage cache (no
+        # PIPELINE_REDIS_URL): the stored [] isn't served, the PDF is parsed
+        caches["pipeline"].clear()
+        message = mock.Mock(content=json.dumps([dict(references[0], valid=True)]))
+        reply = mock.Mock(usage=None, choices=[mock.Mock(message=message)])
+        with mock.patch.object(ai_postprocess, "get_openai_client") as client:
+            client.return_value.chat.completions.create.return_value = reply
+            self.assertContains(post(), "Notes on the Engine")
+        self.assertEqual(grobid.call_count, 2)
+        client.return_value.chat.completions.create.assert_called_once()
+        paper.refresh_from_db()
+        self.assertEqual([r["title"] for r in json.loads(paper.references_json)], ["Notes on the Engine"])
+        self.assertIn("references", json.loads(paper.artifact_versions_json))
+
+
+    def test_header_failure_keeps_the_references(self):
+        grobid = self.enterContext(mock.patch(
+            "ResearchParsing.parsing.stages.grobid_extract_bibliography",
+            return_value=([{"title": "Notes on the Engine"}], {"title": "", "last_name": "", "year": ""})))
+        header = self.enterContext(mock.patch("ResearchParsing.parsing.stages.grobid_extract_header",
+                                              side_effect=requests.Timeout("header timed out")))
+        self.enterContext(mock.patch("ResearchParsing.parsing.stages.check_references_with_chatgpt",
+                                     side_effect=lambda refs: (refs, True)))
+
+        response = self.client.post("/api/parsing/parse-references-html/", {
+            "pdf_file": SimpleUploadedFile("paper.pdf", b"%PDF-1.4 headless", content_type="application/pdf"),
+        })
+
+        self.assertContains(response, "Notes on the Engine")
+        # The header is retried once, on its own; the references call isn't repeated
+        self.assertEqual((grobid.call_count, header.call_count), (1, 2))
+        paper = Paper.objects.get()
+        self.assertEqual(paper.title, "")
+        self.assertIn("references", json.loads(paper.artifact_versions_json))
+
+    def test_openai_saturation_answers_503_and_stores_nothing(self):
+        self.enterContext(mock.patch("ResearchParsing.parsing.stages.grobid_extract_bibliography",
+                                     return_value=([{"title": "Notes on the Engine"}], {})))
+        self.enterContext(mock.patch("ResearchParsing.parsing.stages.grobid_extract_methods",
+                                     return_value="We used PCR."))
+        self.enterContext(mock.patch("ResearchParsing.parsing.stages.iter_tables", side_effect=lambda *a, **k: iter(())))
+        limiter = self.enterContext(mock.patch.object(ai_postprocess, "get_openai_limiter"))
+        limiter.return_value.slot.side_effect = ai_postprocess.OpenAISaturated(retry_after=7)
+        limiter.return_value.acquire.side_effect = ai_postprocess.OpenAISaturated(retry_after=7)
+
+        references = self.client.post("/api/parsing/parse-references-html/", {
+            "pdf_file": SimpleUploadedFile("paper.pdf", b"%PDF-1.4 busy", content_type="application/pdf"),
+        })
+        self.assertEqual((references.status_code, references["Retry-After"]), (503, "7"))
+        self.assertEqual(self._post_summary()["Retry-After"], "7")
+        streamed = self.client.post("/api/parsing/parse-methods-and-tables-summary/", {
+            "pdf_file": SimpleUploadedFile("paper.pdf", b"%PDF-1.4 degraded", content_type="application/pdf"),
+            "stream": "1",
+        })
+        self.assertIn("busy", b"".join(streamed.streaming_content).decode())
+
+        # Neither "no valid references" nor the failed summary was kept
+        for paper in Paper.objects.all():
+            self.assertEqual((paper.references_json, paper.summary_text), ("", ""))
+            self.assertFalse({"references", "summary"} & set(json.loads(paper.artifact_versions_json or "{}")))
+
+
+class ReferenceCanonicalizationTests(TestCase):
+    TITLE = "Attention is all you need: transformers for sequence transduction"
+
+    def test_variants_of_one_work_share_an_id(self):
+        index = ReferenceIndex()
+        ids = {index.assign(ref) for ref in [
+            {"title": self.TITLE, "last_name": "Vaswani", "year": "2017"},
+            {"title": self.TITLE.upper() + ".", "last_name": "A. Vaswani", "year": "2017-06"},
+            {"title": "Attention is all you need: transformers for seq", "last_name": "Vaswani, A.", "year": "2017"},
+            {"title": "Attention is all you nede: transformers for sequence transduction",
+             "last_name": "VASWANI", "year": "2017"},
+        ]}
+        self.assertEqual(len(ids), 1)
+        # Same title, but another first author or year is another work
+        self.assertNotIn(index.assign({"title": self.TITLE, "last_name": "Shazeer", "year": "2017"}), ids)
+        self.assertNotIn(index.assign({"title": self.TITLE, "last_name": "Vaswani", "year": "2018"}), ids)
+        self.assertIsNone(index.assign({"title": "", "last_name": "Vaswani", "year": "2017"}))
+
+    def test_ids_are_stored_and_reused_by_later_papers(self):
+        first = canonicalize_references([
+            {"title": self.TITLE, "last_name": "Vaswani", "year": "2017"},
+            {"title": "Deep residual learning for image recognition", "last_name": "He", "year": "2016"},
+        ])
+        self.assertEqual(CanonicalReference.objects.count(), 2)
+
+        later = canonicalize_references([
+            {"title": "Deep Residual Learning for Image Recognition.", "last_name": "K. He", "year": "2016"},
+            {"title": "Adam: a method for stochastic optimization", "last_name": "Kingma", "year": "2015"},
+        ])
+        self.assertEqual(later[0]["canonical_id"], first[1]["canonical_id"])
+        self.assertEqual(CanonicalReference.objects.count(), 3)
+
+
+def _bibl(title, forename, surname, year, journal=""):
+    journal = f"<title level=\"j\">{journal}</title>" if journal else ""
+    return (f"<biblStruct><analytic><title level=\"a\">{title}</title><author><persName>"
+            f"<forename>{forename}</forename><surname>{surname}</surname></persName></author></analytic>"
+            f"<monogr>{journal}<imprint><date when=\"{year}\"/></imprint></monogr></biblStruct>")
+
+
+class ReferenceConsolidationTests(TestCase):
+    # GROBID's consolidated answer: richer metadata for two of the stored
+    # references, and one the LLM had filtered out
+    CONSOLIDATED_TEI = (
+        "<TEI xmlns=\"http://www.tei-c.org/ns/1.0\"><teiHeader/><text><back><div type=\"references\"><listBibl>"
+        + _bibl("Deep Learning for Adaptive Trials", "Alice", "Smith", "2019", "Nature Medicine")
+        + _bibl("Bayesian inference of survival", "Bo", "Chen", "2020")
+        + _bibl("Acknowledged software", "Carl", "Doe", "2021", "Zenodo")
+        + "</listBibl></div></back></text></TEI>"
+    )
+
+    def setUp(self):
+        self.owner = User.objects.create_user("consolidator")
+        self.stored = [
+            # Matched by title (case and punctuation aside)
+            {"first_name": "A", "last_name": "smith", "title": "Deep learning for adaptive trials.",
+             "year": "2019", "journal": "", "valid": True},
+            # Matched by first author and year
+            {"first_name": "B", "last_name": "Chen", "title": "Bayes for survival (preprint)",
+             "year": "2020", "journal": "arXiv", "valid": True},
+            {"first_name": "E", "last_name": "Nobody", "title": "Unmatched", "year": "1999",
+             "journal": "", "valid": True},
+        ]
+        self.blob = PdfBlob.objects.create(sha256="c" * 64, pdf_file="blobs/cc/paper.pdf", ref_count=2,
+                                           references_json=json.dumps(self.stored))
+        self.paper = Paper.objects.create(owner=self.owner, pdf_file=self.blob.pdf_file.name, blob=self.blob,
+                                          pdf_hash=self.blob.sha256, references_json=json.dumps(self.stored))
+        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as pdf:
+            pdf.write(b"%PDF-1.4 consolidate")
+        self.pdf_path = pdf.name
+        self.addCleanup(lambda: os.path.exists(self.pdf_path) and os.remove(self.pdf_path))
+
+    def schedule(self):
+        from .consolidation import schedule_reference_consolidation
+        with mock.patch("ResearchParsing.parsing.consolidation.run_in_background") as queued:
+            schedule_reference_consolidation(self.paper, self.pdf_path)
+        task, *args = queued.call_args.args
+        return task, args
+
+    def states(self):
+        return [Paper.objects.get(pk=self.paper.pk).references_consolidation,
+                PdfBlob.objects.get(pk=self.blob.pk).references_consolidation]
+
+    def adopter(self):
+        # Another owner adopts the unconsolidated, pending references meanwhile
+        return Paper.objects.create(owner=User.objects.create_user("adopter"), pdf_file=self.blob.pdf_file.name,
+                                    blob=self.blob, pdf_hash=self.blob.sha256,
+                                    references_json=json.dumps(self.stored), references_consolidation="pending",
+                                    references_consolidation_started=timezone.now())
+
+    def test_consolidated_metadata_is_merged_and_shared(self):
+        task, args = self.schedule()
+        self.assertEqual(self.states(), ["pending", "pending"])
+        sibling = self.adopter()
+
+        with mock.patch("ResearchParsing.parsing.advanced_references_extraction.post_pdf_to_grobid",
+                        return_value=self.CONSOLIDATED_TEI) as post:
+            task(*args)
+
+        self.assertEqual(post.call_args.args[1:3], ("processReferences", {"consolidateCitations": 1}))
+        self.assertFalse(os.path.exists(self.pdf_path))
+        self.assertEqual(self.states(), ["done", "done"])
+        merged = json.loads(Paper.objects.get(pk=self.paper.pk).references_json)
+        self.assertEqual(merged, [
+            # Every non-empty consolidated field wins
+            {"first_name": "Alice", "last_name": "Smith", "title": "Deep Learning for Adaptive Trials",
+             "year": "2019", "journal": "Nature Medicine", "valid": True},
+            # An empty one (no journal) keeps the stored value
+            {"first_name": "Bo", "last_name": "Chen", "title": "Bayesian inference of survival",
+             "year": "2020", "journal": "arXiv", "valid": True},
+            # Unmatched references are kept as they were; none are added
+            self.stored[2],
+        ])
+        self.assertEqual(json.loads(PdfBlob.objects.get(pk=self.blob.pk).references_json), merged)
+        sibling.refresh_from_db()
+        self.assertEqual((sibling.references_consolidation, json.loads(sibling.references_json)), ("done", merged))
+
+    def test_grobid_failure_is_recorded(self):
+        task, args = self.schedule()
+        sibling = self.adopter()
+        with mock.patch("ResearchParsing.parsing.advanced_references_extraction.post_pdf_to_grobid",
+                        side_effect=requests.ConnectionError("GROBID down")), \
+                self.assertRaises(requests.ConnectionError):
+            task(*args)
+
+        self.assertEqual(self.states(), ["failed", "failed"])
+        sibling.refresh_from_db()
+        self.assertEqual(sibling.references_consolidation, "failed")
+        self.assertFalse(os.path.exists(self.pdf_path))
+        self.assertEqual(json.loads(Paper.objects.get(pk=self.paper.pk).references_json), self.stored)
+
+    def test_adopters_are_enriched_when_the_paper_was_deleted(self):
+        task, args = self.schedule()
+        sibling = self.adopter()
+        self.paper.delete()
+
+        with mock.patch("ResearchParsing.parsing.advanced_references_extraction.post_pdf_to_grobid",
+                        return_value=self.CONSOLIDATED_TEI):
+            task(*args)
+
+        sibling.refresh_from_db()
+        self.assertEqual(sibling.references_consolidation, "done")
+        self.assertEqual(json.loads(sibling.references_json)[0]["journal"], "Nature Medicine")
+        self.assertEqual(PdfBlob.objects.get(pk=self.blob.pk).references_consolidation, "done")
+
+    def test_lost_passes_stop_refreshing_the_page(self):
+        self.schedule()  # queued, but the worker never runs it
+        self.client.force_login(self.owner)
+        page = lambda: self.client.get(f"/papers/detail/{self.paper.pk}/").content.decode()
+        self.assertIn('http-equiv="refresh"', page())
+
+        Paper.objects.filter(pk=self.paper.pk).update(
+            references_consolidation_started=timezone.now() - timedelta(hours=1))
+        with override_settings(GROBID_CONSOLIDATION_TIMEOUT=600):
+            self.assertNotIn('http-equiv="refresh"', page())
+        self.assertEqual(self.states(), ["failed", "pending"])
+        # The blob's own pass started as long ago: the sweep fails it too
+        PdfBlob.objects.filter(pk=self.blob.pk).update(
+            references_consolidation_started=timezone.now() - timedelta(hours=1))
+        with override_settings(GROBID_CONSOLIDATION_TIMEOUT=600):
+            expire_stalled_consolidations()
+        self.assertEqual(self.states(), ["failed", "failed"])
+
+
+@override_settings(PARSE_RATE_LIMITS={"parsing:parse_methods_html": (2, 1)},
+                   DAILY_PAGE_QUOTA=5, DAILY_TOKEN_QUOTA=1000)
+class RateLimitTests(TestCase):
+    def setUp(self):
+        caches["ratelimit"].clear()
+        metrics.reset()
+        self.enterContext(mock.patch("ResearchParsing.parsing.stages.grobid_extract_methods", return_value="Methods"))
+
+    def _pdf(self, pages):
+        document = pypdfium2.PdfDocument.new()
+        for _ in range(pages):
+            document.new_page(612, 792)
+        path = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), "paper.pdf")
+        document.save(path)
+        document.close()
+        with open(path, "rb") as f:
+            return SimpleUploadedFile("paper.pdf", f.read(), content_type="application/pdf")
+
+    def _post(self, pages=1, address="10.0.0.1"):
+        return self.client.post("/api/parsing/parse-methods-html/", {"pdf_file": self._pdf(pages)}, REMOTE_ADDR=address)
+
+    def _rejections(self, reason):
+        return sum(value for (name, labels), value in metrics.snapshot()["counters"].items()
+                   if name == "rate_limit_rejections_total" and ("reason", reason) in labels)
+
+    def test_burst_then_429_with_retry_after(self):
+        self.assertEqual([self._post().status_code for _ in range(3)], [200, 200, 429])
+        response = self._post()
+        self.assertEqual(int(response["Retry-After"]), 60)
+        self.assertEqual(self._rejections("rate"), 2)
+        # Buckets are per client
+        self.assertEqual(self._post(address="10.0.0.2").status_code, 200)
+
+    def test_daily_page_and_token_quotas(self):
+        self.assertEqual(self._post(pages=3).status_code, 200)
+        rejected = self._post(pages=3)
+        self.assertEqual(rejected.status_code, 429)
+        self.assertGreater(int(rejected["Retry-After"]), 0)
+        self.assertEqual(self._rejections("pages"), 1)
+
+        charge_tokens("ip:10.0.0.2", 1000)
+        self.assertEqual(self._post(address="10.0.0.2").status_code, 429)
+        self.assertEqual(self._rejections("tokens"), 1)
+
+    def test_tokens_used_during_the_request_are_charged(self):
+        def spend_tokens(path):
+            metrics.record_token_usage("summary", mock.Mock(prompt_tokens=800, completion_tokens=400))
+            return "Methods"
+
+        with mock.patch("ResearchParsing.parsing.stages.grobid_extract_methods", side_effect=spend_tokens):
+            self.assertEqual(self._post().status_code, 200)
+        self.assertEqual(self._post().status_code, 429)
+        self.assertEqual(self._rejections("tokens"), 1)
+
+
+class StartupTests(TestCase):
+    def setUp(self):
+        self.enterContext(mock.patch.dict(warmup._status, clear=True))
+
+    def test_views_import_without_heavy_dependencies(self):
+        code = ("import sys, django; django.setup(); import ResearchParsing.urls; "
+                "print(sorted(m for m in ('openai', 'pandas', 'numpy', 'tabula', 'lxml', 'google.auth') "
+                "if m in sys.modules))")
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE="ResearchParsing.settings")
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, env=env, check=True)
+        self.assertEqual(output.stdout.strip(), "[]")
+
+    @override_settings(STARTUP_WARMUP=["jvm", "grobid", "nope"])
+    def test_probe_starts_warmup_once_and_waits_for_it_on_request(self):
+        tasks = {"jvm": mock.Mock(__name__="warm_jvm"),
+                 "grobid": mock.Mock(__name__="warm_grobid", side_effect=OSError("no route"))}
+        self.enterContext(mock.patch.dict(warmup.WARMUP_TASKS, tasks))
+        with mock.patch.object(warmup, "run_in_background") as background:
+            self.assertEqual(self.client.get("/startup").status_code, 200)
+            response = self.client.get("/startup?warm=1")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()["warmup"], {"jvm": "running", "grobid": "running", "nope": "unknown task"})
+        self.assertEqual([c.args for c in background.call_args_list],
+                         [(warmup._run_warmup, "jvm"), (warmup._run_warmup, "grobid")])
+
+        for name in ("jvm", "grobid"):
+            warmup._run_warmup(name)
+        response = self.client.get("/startup?warm=1")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"ready": True, "warmup": {
+            "jvm": "done", "grobid": "failed: no route", "nope": "unknown task"}})
+        tasks["jvm"].assert_called_once_with()
+
+
+class GrobidProfileTests(SimpleTestCase):
+    def extract(self, profile=None):
+        """
+        [(endpoint, params, stage)] of the GROBID calls the references and
+        methods extractions make.
+        """
+        calls = []
+
+        def post(pdf_path, endpoint, params, stage, timeout=None):
+            calls.append((endpoint, params, stage))
+            return "<TEI xmlns=\"http://www.tei-c.org/ns/1.0\"/>"
+
+        with mock.patch("ResearchParsing.parsing.advanced_references_extraction.post_pdf_to_grobid", post), \
+                mock.patch("ResearchParsing.parsing.advanced_methods_extraction.post_pdf_to_grobid", post):
+            from .advanced_methods_extraction import grobid_extract_methods
+            grobid_extract_bibliography("paper.pdf", profile=profile)
+            grobid_extract_header("paper.pdf", profile=profile)
+            grobid_extract_methods("paper.pdf", profile=profile)
+        return calls
+
+    def test_setting_picks_the_calls_of_each_endpoint(self):
+        with override_settings(GROBID_PROFILE="standard"):
+            self.assertEqual(self.extract(), [
+                ("processReferences", {"consolidateCitations": 0}, "grobid_references"),
+                ("processHeaderDocument", {"consolidateHeader": 0}, "grobid_header"),
+                ("processFulltextDocument", {"consolidateHeader": 0, "consolidateCitations": 0, "generateIDs": 1},
+                 "grobid_methods"),
+            ])
+            self.assertTrue(defers_consolidation())
+        with override_settings(GROBID_PROFILE="fast"):
+            # Neither the header call nor the background pass: untitled, unconsolidated
+            self.assertEqual([call[0] for call in self.extract()],
+                             ["processReferences", "processFulltextDocument"])
+            self.assertFalse(defers_consolidation())
+        with override_settings(GROBID_PROFILE="full"):
+            # The full text carries the header: no processHeaderDocument call
+            self.assertEqual([call[0] for call in self.extract()],
+                             ["processFulltextDocument", "processFulltextDocument"])
+            self.assertFalse(defers_consolidation())
+
+    def test_explicit_profile_wins_over_the_setting(self):
+        with override_settings(GROBID_PROFILE="full"):
+            self.assertEqual(self.extract("fast")[0][:2], ("processReferences", {"consolidateCitations": 0}))
+
+    def test_default_profile_without_setting(self):
+        with override_settings():
+            del settings.GROBID_PROFILE
+            self.assertEqual(get_grobid_call("references"), GROBID_PROFILES[DEFAULT_PROFILE]["references"])
+            self.assertEqual(get_grobid_call("methods"), GROBID_PROFILES[DEFAULT_PROFILE]["methods"])
+
+    def test_unknown_profile_is_refused(self):
+        with override_settings(GROBID_PROFILE="fastest"), self.assertRaisesMessage(ValueError, "'fastest'"):
+            get_grobid_call("references")
+
+    def test_callers_get_their_own_params(self):
+        endpoint, params = get_grobid_call("references", "full")
+        params["consolidateCitations"] = 0
+        self.assertEqual(GROBID_PROFILES["full"]["references"][1]["consolidateCitations"], 1)
+
+
+class LoadTestStubTests(SimpleTestCase):
+    def setUp(self):
+        self.grobid = start_grobid_stub(latency=0.01)
+        self.openai = start_openai_stub(latency=0.01)
+        self.addCleanup(self.grobid.stop)
+        self.addCleanup(self.openai.stop)
+
+    def test_app_parses_through_the_stubs(self):
+        with tempfile.NamedTemporaryFile(suffix=".pdf") as pdf, \
+                override_settings(GROBID_BASE_URL=self.grobid.url, GROBID_AUTH=False):
+            pdf.write(b"%PDF-1.4 stub")
+            pdf.flush()
+            references, header = grobid_extract_bibliography(pdf.name, profile="standard")
+            # processReferences has an empty header: it comes from processHeaderDocument
+            self.assertEqual((len(references), header["title"]), (25, ""))
+            self.assertTrue(grobid_extract_header(pdf.name, profile="standard")["title"])
+            # The full-text call of the "full" profile carries it
+            self.assertTrue(grobid_extract_bibliography(pdf.name, profile="full")[1]["title"])
+            self.assertIsNone(grobid_extract_header(pdf.name, profile="full"))
+            self.assertEqual(self.grobid.requests_served, 3)
+
+            # GROBID answers 204 when it finds no header
+            with mock.patch("ResearchParsing.parsing.grobid_client.get_grobid_session") as session:
+                session.return_value.post.return_value = mock.Mock(status_code=204, text="", content=b"")
+                self.assertEqual(grobid_extract_header(pdf.name, profile="standard"),
+                                 {"title": "", "last_name": "", "year": ""})
+
+        from openai import OpenAI
+        with mock.patch.object(ai_postprocess, "_client", OpenAI(api_key="stub", base_url=f"{self.openai.url}/v1")):
+            self.assertEqual(ai_postprocess.filter_grobid_references_with_chatgpt(references[:12]), references[:12])
+            summary = ai_postprocess.summarize_methods_and_tables_with_chatgpt("Methods", "[]")
+            streamed = "".join(ai_postprocess.stream_summary_of_methods_and_tables("Methods", "[]"))
+        self.assertNotEqual(summary, ai_postprocess.SUMMARY_FAILED_MESSAGE)
+        self.assertEqual(streamed, summary)
+
+
+class GrobidPoolTests(SimpleTestCase):
+    URLS = ["http://grobid-a", "http://grobid-b", "http://grobid-c"]
+
+    def setUp(self):
+        self.tmpdir = self.enterContext(tempfile.TemporaryDirectory())
+
+    def _pool(self, **kwargs):
+        options = dict(eject_after=2, eject_seconds=0.2, probe_slow=0.05)
+        options.update(kwargs)
+        return GrobidEndpointPool(os.path.join(self.tmpdir, "grobid_pool.json"), self.URLS, **options)
+
+    def test_calls_go_to_the_least_busy_instance(self):
+        pool = self._pool()
+        with pool.route() as first, pool.route() as second:
+            with pool.route() as third:
+                pass
+            # `third`'s instance is idle again; the other two are busy
+            with pool.route() as fourth:
+                self.assertEqual(fourth["url"], third["url"])
+        self.assertEqual(len({first["url"], second["url"], third["url"]}), 3)
+
+        # Another worker (same state file) sees this one's outstanding calls
+        other_worker = self._pool()
+        for _ in range(3):
+            with pool.route() as busy, other_worker.route() as elsewhere:
+                self.assertNotEqual(busy["url"], elsewhere["url"])
+
+    def test_failing_and_slow_instances_are_ejected_until_healthy(self):
+        pool = self._pool()
+        for _ in range(2):
+            for _ in self.URLS:  # ties go round robin: one call each
+                with pool.route() as instance:
+                    instance["error"] = instance["url"] == self.URLS[0]
+        routed = set()
+        for _ in range(6):
+            with pool.route() as instance:
+                routed.add(instance["url"])
+        self.assertNotIn(self.URLS[0], routed)
+        self.assertEqual(pool.healthy_count(), 2)
+
+        # Probes: b answers too slowly twice and goes; a recovers once its time is up
+        def get(url, audience, timeout):
+            if url == self.URLS[1]:
+                time.sleep(0.1)
+            return mock.Mock(status_code=200)
+
+        pool.probe(get)
+        time.sleep(0.25)
+        pool.probe(get)
+        self.assertEqual([s["healthy"] for s in pool.status()], [True, False, True])
+
+        # With every instance ejected, calls still go somewhere
+        pool.probe(lambda url, audience, timeout: mock.Mock(status_code=503))
+        pool.probe(lambda url, audience, timeout: mock.Mock(status_code=503))
+        self.assertFalse(any(s["healthy"] for s in pool.status()))
+        with pool.route() as instance:
+            self.assertIn(instance["url"], self.URLS)
+
+    def test_limiter_cap_scales_with_healthy_instances(self):
+        instances = {"count": 1}
+        limiter = AdaptiveLimiter(os.path.join(self.tmpdir, "grobid_limiter.json"), initial_limit=4, max_limit=4,
+                                  scale=lambda: instances["count"])
+        self.assertEqual(limiter.current_limit(), 4)
+        instances["count"] = 3
+        self.assertEqual(limiter.current_limit(), 12)
+        instances["count"] = 2
+        self.assertEqual(limiter.current_limit(), 8)
+
+    def test_calls_spread_over_stub_instances_with_their_own_token_audience(self):
+        stubs = [start_grobid_stub(latency=0.05, capacity=2, seed=n) for n in range(2)]
+        for stub in stubs:
+            self.addCleanup(stub.stop)
+        pdf_path = os.path.join(self.tmpdir, "paper.pdf")
+        with open(pdf_path, "wb") as f:
+            f.write(b"%PDF-1.4 pool")
+
+        # This test's own limiter and pool, with their state in tmpdir
+        self.enterContext(mock.patch("ResearchParsing.parsing.grobid_limiter._limiter", None))
+        self.enterContext(mock.patch("ResearchParsing.parsing.grobid_pool._pool", None))
+        audiences = {stubs[1].url: "https://grobid-b.a.run.app"}
+        with override_settings(GROBID_BASE_URLS=[stub.url for stub in stubs], GROBID_TOKEN_AUDIENCES=audiences,
+                               GROBID_AUTH=True, GROBID_LIMITER_STATE_DIR=self.tmpdir, GROBID_PROBE_INTERVAL=0), \
+                mock.patch("ResearchParsing.parsing.grobid_client.get_id_token",
+                           side_effect=lambda audience: f"token for {audience}") as get_id_token:
+            with ThreadPoolExecutor(max_workers=4) as pool:
+                list(pool.map(lambda _: post_pdf_to_grobid(pdf_path, "processReferences", {}, stage="test"),
+                              range(12)))
+
+        self.assertEqual(sum(stub.requests_served for stub in stubs), 12)
+        self.assertTrue(all(stub.requests_served >= 4 for stub in stubs))
+        self.assertEqual({call.args[0] for call in get_id_token.call_args_list},
+                         {stubs[0].url, "https://grobid-b.a.run.app"})
+
+
+class DirectUploadTests(TestCase):
+    """
+    Browser -> bucket uploads, against the Cloud Storage stand-in: the PDF is
+    PUT to the session URL in chunks and the parse form only gets the token.
+    """
+    PDF_BYTES = b"%PDF-1.4 direct upload " + b"x" * 3000
+
+    def setUp(self):
+        self.gcs = start_gcs_stub()
+        self.addCleanup(self.gcs.stop)
+        self.enterContext(mock.patch.dict(os.environ, {"STORAGE_EMULATOR_HOST": self.gcs.url}))
+        self.enterContext(override_settings(
+            STORAGES={"default": {"BACKEND": "storages.backends.gcloud.GoogleCloudStorage",
+                                  "OPTIONS": {"project_id": "test", "bucket_name": "uploads-test"}},
+                      "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"}},
+            GROBID_DEFER_CONSOLIDATION=False, DIRECT_UPLOADS=True,
+        ))
+        caches["pipeline"].clear()
+        self.enterContext(mock.patch("ResearchParsing.parsing.stages.grobid_extract_bibliography",
+                                     return_value=([{"title": "Notes on the Engine", "last_name": "Lovelace"}],
+                                                   {"title": ""})))
+        self.enterContext(mock.patch("ResearchParsing.parsing.stages.check_references_with_chatgpt",
+                                     side_effect=lambda refs: (refs, True)))
+        self.enterContext(mock.patch("ResearchParsing.parsing.stages.grobid_extract_header", return_value=None))
+
+    def _upload(self, user, data=PDF_BYTES):
+        self.client.force_login(user)
+        started = self.client.post("/api/parsing/uploads/", {"filename": "my paper.pdf", "size": len(data)},
+                                   content_type="application/json")
+        self.assertEqual(started.status_code, 200)
+        upload = started.json()
+        first = requests.put(upload["upload_url"], data=data[:1000],
+                             headers={"Content-Range": f"bytes 0-999/{len(data)}"})
+        self.assertEqual((first.status_code, first.headers["Range"]), (308, "bytes=0-999"))
+        last = requests.put(upload["upload_url"], data=data[1000:],
+                            headers={"Content-Range": f"bytes 1000-{len(data) - 1}/{len(data)}"})
+        self.assertEqual(last.status_code, 200)
+        return upload
+
+    def _parse(self, upload, sha256=None):
+        return self.client.post("/api/parsing/parse-references-html/", {
+            "upload_token": upload["upload_token"],
+            "sha256": sha256 or hashlib.sha256(self.PDF_BYTES).hexdigest(),
+        })
+
+    def _stored_objects(self):
+        return sorted(name for _, name in self.gcs.objects)
+
+    def test_uploaded_object_becomes_the_shared_blob(self):
+        upload = self._upload(User.objects.create_user("direct1"))
+        self.assertTrue(upload["object_name"].endswith("/my_paper.pdf"))
+        response = self._parse(upload)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Notes on the Engine")
+        blob = PdfBlob.objects.get()
+        self.assertEqual((blob.pdf_file.name, blob.size), (upload["object_name"], len(self.PDF_BYTES)))
+        self.assertEqual(Paper.objects.get().pdf_file.name, upload["object_name"])
+
+        # The same PDF from someone else: their copy is dropped, the blob shared
+        self._parse(self._upload(User.objects.create_user("direct2")))
+        self.assertEqual(PdfBlob.objects.get().ref_count, 2)
+        self.assertEqual(self._stored_objects(), [upload["object_name"]])
+
+    def test_used_upload_tokens_are_refused(self):
+        upload = self._upload(User.objects.create_user("direct5"))
+        self.assertEqual(self._parse(upload).status_code, 200)
+
+        with mock.patch("ResearchParsing.parsing.views.charge_upload_pages") as charge:
+            replayed = self._parse(upload)
+        self.assertEqual(replayed.status_code, 409)
+        charge.assert_not_called()
+        self.assertEqual((PdfBlob.objects.get().ref_count, Paper.objects.count()), (1, 1))
+        self.assertEqual(self._stored_objects(), [upload["object_name"]])
+
+    def test_uploads_are_checked_before_they_are_kept(self):
+        owner = User.objects.create_user("direct3")
+        upload = self._upload(owner)
+
+        self.client.force_login(User.objects.create_user("direct4"))
+        self.assertEqual(self._parse(upload).status_code, 403)
+        self.client.force_login(owner)
+        self.assertEqual(self._parse(dict(upload, upload_token=upload["upload_token"] + "x")).status_code, 400)
+
+        # Claiming another PDF's hash must not pass: the object is deleted
+        forged = self._parse(upload, sha256=hashlib.sha256(b"someone else's paper").hexdigest())
+        self.assertEqual(forged.status_code, 400)
+        self.assertEqual(self._stored_objects(), [])
+        self.assertFalse(Paper.objects.exists())
+
+
+class MetricsTests(SimpleTestCase):
+    def setUp(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+
+    def test_rendering_and_labels(self):
+        metrics.describe("test_jobs_total", "counter", "Jobs by queue.")
+        metrics.inc("test_jobs_total", 2, queue='say "hi"\n')
+        metrics.inc("test_jobs_total", queue="bulk")
+        metrics.set_gauge("test_jobs_waiting", 3)
+        for seconds in (1.0, 2.0, 3.0, 4.0):
+            metrics.observe("test_job_seconds", seconds, queue="bulk", kind="parse")
+
+        self.assertEqual(metrics.render_prometheus().splitlines(), [
+            "# HELP test_job_seconds test_job_seconds",
+            "# TYPE test_job_seconds summary",
+            # Labels in name order, then the quantile
+            'test_job_seconds{kind="parse",queue="bulk",quantile="0.5"} 3.0',
+            'test_job_seconds{kind="parse",queue="bulk",quantile="0.95"} 4.0',
+            'test_job_seconds{kind="parse",queue="bulk",quantile="0.99"} 4.0',
+            'test_job_seconds_sum{kind="parse",queue="bulk"} 10.0',
+            'test_job_seconds_count{kind="parse",queue="bulk"} 4',
+            "# HELP test_jobs_total Jobs by queue.",
+            "# TYPE test_jobs_total counter",
+            'test_jobs_total{queue="bulk"} 1',
+            'test_jobs_total{queue="say \\"hi\\"\\n"} 2',
+            "# HELP test_jobs_waiting test_jobs_waiting",
+            "# TYPE test_jobs_waiting gauge",
+            "test_jobs_waiting 3",
+        ])
+
+    def test_client_disconnect_is_not_a_failure(self):
+        def stream():
+            with metrics.stage_timer("test_stream"):
+                yield "first"
+                yield "second"
+
+        streamed = stream()
+        next(streamed)
+        streamed.close()  # what Django does when the client goes away
+        with self.assertRaises(ValueError), metrics.stage_timer("test_stream"):
+            raise ValueError("bad PDF")
+
+        counters = metrics.snapshot()["counters"]
+        self.assertEqual(counters[("parse_stage_cancellations_total", (("stage", "test_stream"),))], 1)
+        self.assertEqual(counters[("parse_stage_failures_total", (("stage", "test_stream"),))], 1)
+        # Only the failed run has a duration: the cancelled one was cut short
+        self.assertEqual(metrics.snapshot()["summaries"][
+            ("parse_stage_duration_seconds", (("stage", "test_stream"),))][0], 1)
+
+    def test_workers_share_series_through_metrics_dir(self):
+        directory = self.enterContext(tempfile.TemporaryDirectory())
+        exited = subprocess.Popen([sys.executable, "-c", ""])
+        exited.wait()
+        # Files as the flusher threads of two other workers wrote them, and of
+        # an exited one whose pid the first of them reused
+        for pid, written in ((os.getppid(), 100.0), (os.getppid(), 200.0), (exited.pid, 300.0)):
+            with open(os.path.join(directory, f"metrics-{pid}-{written:.0f}.json"), "w") as f:
+                json.dump({"pid": pid, "process": f"{pid}-{written:.0f}", "written": written,
+                           "summaries": [["test_job_seconds", [["queue", "bulk"]], 2, 30.0, [10.0, 20.0]]],
+                           "counters": [["test_jobs_total", [["queue", "bulk"]], 5]],
+                           "gauges": [["test_jobs_waiting", [], pid, written]]}, f)
+        metrics.inc("test_jobs_total", queue="bulk")
+        metrics.observe("test_job_seconds", 1.0, queue="bulk")
+        metrics.set_gauge("test_jobs_waiting", 7)
+        # This worker's own file is never counted on top of its live series
+        metrics.write_process_series(directory)
+
+        snap = metrics.shared_snapshot(directory)
+        key = (("queue", "bulk"),)
+        # Counts and sums of every worker, including those that exited; samples of the live ones
+        self.assertEqual(snap["counters"][("test_jobs_total", key)], 16)
+        self.assertEqual(snap["summaries"][("test_job_seconds", key)], (7, 91.0, [1.0, 10.0, 20.0]))
+        # Gauges of live workers only; this one set it last
+        self.assertEqual(snap["gauges"][("test_jobs_waiting", ())], 7)
+
+        with override_settings(METRICS_DIR=directory):
+            self.assertIn('test_jobs_total{queue="bulk"} 16', metrics.render_prometheus())
+
+    def test_endpoint_needs_the_token(self):
+        metrics.inc("test_jobs_total", queue="bulk")
+        with override_settings(METRICS_TOKEN=""):
+            self.assertEqual(self.client.get("/metrics").status_code, 404)
+        with override_settings(METRICS_TOKEN="s3cret"):
+            self.assertEqual(self.client.get("/metrics").status_code, 401)
+            self.assertEqual(self.client.get("/metrics", headers={"Authorization": "Bearer guess"}).status_code, 401)
+            response = self.client.get("/metrics", headers={"Authorization": "Bearer s3cret"})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'test_jobs_total{queue="bulk"} 1')
+
+
+class PipelineTests(SimpleTestCase):
+    def setUp(self):
+        caches["pipeline"].clear()
+        self.calls = []
+        self.calls_lock = threading.Lock()
+
+    def _stage(self, name, inputs, func=None, **options):
+        def run(**kwargs):
+            with self.calls_lock:
+                self.calls.append(name)
+            return func(**kwargs) if func else "+".join([name] + [kwargs[i] for i in inputs])
+        return Stage(name, run, inputs=inputs, returns=str, **options)
+
+    def test_independent_stages_overlap_and_results_are_cached_by_content(self):
+        barrier = threading.Barrier(2, timeout=5)
+
+        def slow(name):
+            # Both branches must be running at once to get past the barrier
+            return lambda doc: (barrier.wait(), f"{name}({doc})")[1]
+
+        pipeline = Pipeline([
+            self._stage("left", ["doc"], slow("left")),
+            self._stage("right", ["doc"], slow("right")),
+            self._stage("both", ["left", "right"]),
+        ], given={"doc": str})
+
+        result = pipeline.run(["both"], {"doc": "pdf-1"})
+        self.assertEqual(result["both"], "both+left(pdf-1)+right(pdf-1)")
+        self.assertEqual(result.ran, {"left", "right", "both"})
+
+        # Same content: served from the cache without running anything upstream
+        self.calls.clear()
+        self.assertEqual(pipeline.run(["both"], {"doc": "pdf-1"}).cached, {"both"})
+        self.assertEqual(self.calls, [])
+        # A given value stands in for its stage, and keys the ones after it
+        result = pipeline.run(["both"], {"doc": "pdf-1", "left": "stored"})
+        self.assertEqual((result["both"], sorted(self.calls)), ("both+stored+right(pdf-1)", ["both"]))
+
+    def test_retries_fallbacks_and_failures(self):
+        attempts = []
+
+        def flaky(doc):
+            attempts.append(doc)
+            if len(attempts) < 3:
+                raise requests.ConnectionError("reset")
+            return doc
+
+        def broken(doc):
+            raise ValueError("unparseable")
+
+        pipeline = Pipeline([
+            self._stage("flaky", ["doc"], flaky, retries=2, retry_on=[requests.RequestException], backoff=0),
+            self._stage("optional", ["doc"], broken, fallback=""),
+            self._stage("required", ["doc"], broken),
+            self._stage("after", ["required"]),
+            self._stage("saturated", ["doc"], lambda doc: (_ for _ in ()).throw(GrobidSaturated(3))),
+        ], given={"doc": str})
+
+        result = pipeline.run(["flaky", "optional", "after"], {"doc": "d"})
+        self.assertEqual((result["flaky"], result["optional"]), ("d", ""))
+        self.assertEqual(len(attempts), 3)
+        self.assertEqual(set(result.errors), {"required", "after"})
+        self.assertNotIn("after", self.calls)
+        # Fallback values aren't cached
+        self.assertEqual(result.degraded, {"optional"})
+        self.assertEqual(pipeline.run(["optional"], {"doc": "d"}).cached, set())
+        with self.assertRaises(GrobidSaturated):
+            pipeline.run(["saturated", "flaky"], {"doc": "e"})
+
+        with self.assertRaisesRegex(ValueError, "cycle"):
+            Pipeline([self._stage("a", ["b"]), self._stage("b", ["a"])], given={})
+
+    def test_degraded_values_taint_what_is_built_on_them(self):
+        pipeline = Pipeline([
+            self._stage("partial", ["doc"], lambda doc: Degraded(f"part({doc})")),
+            self._stage("after", ["partial"]),
+            self._stage("vetoed", ["doc"], lambda doc: "", cache_if=bool),
+        ], given={"doc": str})
+
+        result = pipeline.run(["after", "vetoed"], {"doc": "d"})
+        self.assertEqual((result["after"], result["vetoed"]), ("after+part(d)", ""))
+        self.assertEqual(result.degraded, {"partial", "after", "vetoed"})
+        # Nothing built on the degraded value was cached
+        self.calls.clear()
+        self.assertEqual(pipeline.run(["after"], {"doc": "d"}).cached, set())
+        self.assertEqual(sorted(self.calls), ["after", "partial"])
@@ -8,6 +8,8 @@ urlpatterns = [
     path('parse-references-html/', views.parse_references_html, name='parse_references_html'),
     path('parse-methods-html/', views.parse_methods_html, name='parse_methods_html'),
     path('upload-form/', views.upload_pdf_form, name='upload_pdf_form'),
+    # Direct-to-storage upload: open a resumable session, then post the token to a parse form
+    path('uploads/', views.start_direct_upload, name='start_direct_upload'),
     path('parse-methods-and-tables/', views.parse_methods_and_tables_html, name='parse_methods_and_tables_html'),
     path('parse-methods-and-tables-summary/', views.parse_methods_and_tables_summarize,
          name='parse_methods_and_tables_summarize'),
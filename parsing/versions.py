@@ -0,0 +1,162 @@
+import json
+
+from django.conf import settings
+
+from .grobid_profiles import DEFAULT_PROFILE
+from .metrics import describe, inc
+
+# Version of the code that produces each stored artifact. Bump the number when
+# a change to the extraction (TEI parsing, tabula passes, LLM prompts...) should
+# invalidate results already stored on Paper records; only the artifacts whose
+# version changed are recomputed on the next upload.
+PIPELINE_VERSIONS = {
+    "references": 2,   # GROBID references + LLM validity filter (2: failed checks were stamped)
+    "methods": 2,      # GROBID full text -> methods section (2: failed extractions were stamped)
+    "tables": 2,       # tabula passes (deduplicated) + serialization
+    "summary": 1,      # LLM summary of methods + tables
+}
+
+# Artifacts whose content also depends on the GROBID extraction profile
+PROFILE_DEPENDENT = {"references", "methods"}
+
+# An artifact is stale whenever one of its inputs is recomputed
+DEPENDS_ON = {
+    "summary": ("methods", "tables"),
+}
+
+
+# Field holding each artifact on Paper (per owner) and PdfBlob (shared)
+ARTIFACT_FIELDS = {
+    "references": "references_json",
+    "methods": "methods_text",
+    "tables": "tables_json",
+    "summary": "summary_text",
+}
+
+
+def current_version(artifact):
+    """
+    Version stamp for an artifact produced by this deployment, e.g. "1/standard".
+    """
+    version = str(PIPELINE_VERSIONS[artifact])
+    if artifact in PROFILE_DEPENDENT:
+        version += "/" + getattr(settings, "GROBID_PROFILE", DEFAULT_PROFILE)
+    return version
+
+
+def stored_versions(paper):
+    if not paper.artifact_versions_json:
+        return {}
+    try:
+        return json.loads(paper.artifact_versions_json)
+    except ValueError:
+        return {}
+
+
+def stale_artifacts(paper, artifacts, force=False):
+    """
+    Returns the subset of `artifacts` that must be recomputed for this paper:
+    everything when `force` is set, otherwise the artifacts stored by an older
+    pipeline version (or never stored), plus anything that depends on them.
+    """
+    if force:
+        return set(artifacts)
+    versions = stored_versions(paper)
+    stale = {a for a in artifacts if versions.get(a) != current_version(a)}
+    for artifact in artifacts:
+        if any(dep in stale for dep in DEPENDS_ON.get(artifact, ())):
+            stale.add(artifact)
+    return stale
+
+
+def stamp_versions(paper, artifacts):
+    """
+    Records that `artifacts` on this paper were produced by the current pipeline.
+    An artifact built on inputs that aren't current (a summary of methods
+    that failed to extract) is left unstamped. The caller saves the paper.
+    """
+    versions = stored_versions(paper)
+    for artifact in artifacts:
+        if all(versions.get(dep) == current_version(dep) for dep in DEPENDS_ON.get(artifact, ())):
+            versions[artifact] = current_version(artifact)
+    paper.artifact_versions_json = json.dumps(versions, sort_keys=True)
+
+
+def clear_versions(paper, artifacts):
+    """
+    Records that `artifacts` on this paper are degraded results (see
+    stages.py), so the next upload recomputes them rather than serving them.
+    The caller saves the paper.
+    """
+    versions = stored_versions(paper)
+    for artifact in artifacts:
+        versions.pop(artifact, None)
+    paper.artifact_versions_json = json.dumps(versions, sort_keys=True)
+
+
+def adopt_shared_artifacts(paper, artifacts):
+    """
+    Copies onto the paper any of `artifacts` that its shared blob holds at the
+    current version while the paper itself doesn't, so a PDF another user
+    already parsed isn't parsed again. Returns the adopted artifacts; the
+    caller saves the paper.
+    """
+    blob = paper.blob
+    if blob is None:
+        return []
+    blob_versions = stored_versions(blob)
+    paper_versions = stored_versions(paper)
+    adopted = []
+    for artifact in artifacts:
+        version = current_version(artifact)
+        if blob_versions.get(artifact) == version and paper_versions.get(artifact) != version:
+            field = ARTIFACT_FIELDS[artifact]
+            setattr(paper, field, getattr(blob, field))
+            adopted.append(artifact)
+    if adopted:
+        if "references" in adopted:
+            paper.references_consolidation = blob.references_consolidation
+            paper.references_consolidation_started = blob.references_consolidation_started
+            paper.title = paper.title or blob.title
+            paper.canonical_id = blob.canonical_id
+        stamp_versions(paper, adopted)
+        inc("shared_artifact_hits_total", len(adopted))
+    return adopted
+
+
+def publish_shared_artifacts(paper, artifacts):
+    """
+    Copies the paper's current-version `artifacts` to its shared blob so later
+    uploads of the same PDF, by any owner, can adopt them. Only results of a
+    complete parse carry the current stamp: degraded ones (see stages.py),
+    and anything depending on a stale artifact, stay with the paper.
+    """
+    blob = paper.blob
+    if blob is None:
+        return
+    stale = stale_artifacts(paper, artifacts)
+    blob_versions = stored_versions(blob)
+    fields = []
+    for artifact in artifacts:
+        version = current_version(artifact)
+        if artifact not in stale:
+            field = ARTIFACT_FIELDS[artifact]
+            setattr(blob, field, getattr(paper, field))
+            blob_versions[artifact] = version
+            fields.append(field)
+    if not fields:
+        return
+    if "references_json" in fields:
+        blob.references_consolidation = paper.references_consolidation
+        blob.references_consolidation_started = paper.references_consolidation_started
+        blob.title = paper.title
+        blob.canonical_id = paper.canonical_id
+        fields.extend(["references_consolidation", "references_consolidation_started", "title", "canonical_id"])
+    blob.artifact_versions_json = json.dumps(blob_versions, sort_keys=True)
+    blob.save(update_fields=fields + ["artifact_versions_json"])
+
+
+describe("shared_artifact_hits_total", "counter",
+         "Artifacts copied from the shared PDF blob instead of being recomputed.")
+describe("parse_cache_hits_total", "counter",
+         "Uploads answered from stored results because they matched the current pipeline version.")
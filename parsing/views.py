@@ -1,16 +1,32 @@
+from django.conf import settings
 from django.shortcuts import render
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.template.loader import render_to_string
+from django.utils.html import escape
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.decorators import login_required
-import tempfile
+from django.db import IntegrityError, transaction
 from ResearchParsing.papers.models import Paper, compute_file_hash
-
-from .advanced_references_extraction import grobid_extract_references
-from .ai_postprocess import filter_grobid_references_with_chatgpt
-from .advanced_methods_extraction import grobid_extract_methods
-from .table_extraction import parse_methods_and_tables, tables_to_json, parse_tables_comprehensive
-from .ai_postprocess import summarize_methods_and_tables_with_chatgpt
+from ResearchParsing.papers.blobs import acquire_blob, adopt_stored_pdf, release_blob
+
+from .ai_postprocess import iter_reference_verdicts, valid_references
+from .table_extraction import tables_to_json
+from .ai_postprocess import stream_summary_of_methods_and_tables, SUMMARY_FAILED_MESSAGE
+from .metrics import collect_timings, render_prometheus, inc, observe, describe
+from .grobid_limiter import ServiceSaturated
+from .grobid_profiles import defers_consolidation
+from .consolidation import schedule_reference_consolidation
+from .single_flight import parse_lease
+from .reference_index import canonicalize_references
+from .stages import paper_header, run_parse
+from .versions import stale_artifacts, stamp_versions, clear_versions, adopt_shared_artifacts, \
+    publish_shared_artifacts, ARTIFACT_FIELDS
+from .warmup import start_warmup, warmup_pending, warmup_status
+from .direct_upload import DirectUploadError, direct_uploads_enabled, discard_upload, finish_upload, start_upload
+from .rate_limits import charge_upload_pages
 import os
-import hashlib, json
+import time
+import hashlib, hmac, json
 
 # @login_required
 # def parse_references_html(request):
@@ -55,54 +71,26 @@ import hashlib, json
 @login_required
 def parse_references_html(request):
     if request.method == 'POST':
-        pdf_file = request.FILES.get('pdf_file')
-        if not pdf_file:
+        # Create or find existing Paper object (sharing the stored PDF across owners)
+        paper_obj, error = _uploaded_paper(request, 'references_only')
+        if error is not None:
+            return error
+        if paper_obj is None:
             return render(request, 'parsing/references_table.html', {"references": []})
 
-        # Create or find existing Paper object as before (no change)
-        temp_hash = _compute_temp_file_hash(pdf_file)
-        requested_parse = 'references_only'
-        existing_paper = Paper.objects.filter(owner=request.user, pdf_hash=temp_hash).first()
-
-        if existing_paper:
-            merged = _merge_parse_types(existing_paper.parse_type, requested_parse)
-            existing_paper.parse_type = merged
-            existing_paper.save()
-            paper_obj = existing_paper
-        else:
-            paper_obj = Paper.objects.create(
-                owner=request.user,
-                pdf_file=pdf_file,
-                pdf_hash=temp_hash,
-                parse_type=requested_parse
-            )
-
         #print("DEBUG => paper_obj.pdf_file.storage:", paper_obj.pdf_file.storage)
         #print("DEBUG => storage class:", type(paper_obj.pdf_file.storage))
 
-        # Instead of using pdf_file.path, open the file from storage, copy to a NamedTemporaryFile
-        references_list = []
-        try:
-            # 1) Open the file from GCS (or local if you're still in dev)
-            paper_obj.pdf_file.open('rb')  # ensure file-like object is ready
-            with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as tmp:
-                for chunk in paper_obj.pdf_file.chunks():
-                    tmp.write(chunk)
-                tmp_path = tmp.name
-            paper_obj.pdf_file.close()
-
-            # 2) Pass tmp_path to grobid_extract_references
-            references_list = grobid_extract_references(tmp_path)
-            references_list = filter_grobid_references_with_chatgpt(references_list)
-
-        except Exception as e:
-            print("Error extracting references:", e)
+        # Progressive page: references appear before the LLM has checked them
+        if request.POST.get('stream'):
+            return _streaming_references_response(request, paper_obj, _wants_refresh(request))
 
-        # 3) Store references in the Paper record
-        paper_obj.references_json = json.dumps(references_list)
-        paper_obj.save()
-
-        return render(request, 'parsing/references_table.html', {"references": references_list})
+        # One parse per PDF at a time across workers: duplicates (double submits,
+        # other tabs or users) wait for it and then get the stored result
+        with parse_lease(paper_obj.pdf_hash) as lease:
+            paper_obj.refresh_from_db()
+            # A refresh forced by a duplicate that waited is already satisfied
+            return _references_response(request, paper_obj, _wants_refresh(request) and not lease["waited"])
 
     return render(request, 'parsing/upload_pdf_form.html')
 
@@ -116,6 +104,29 @@ def upload_pdf_form(request):
     return render(request, 'parsing/upload_pdf_form.html')
 
 
+@login_required
+def start_direct_upload(request):
+    """
+    Opens a direct upload of a PDF to the bucket (see direct_upload.py).
+    POST {"filename": ..., "size": ...} as JSON; answers with the session
+    URL to PUT the file to and the token to post with the parse form
+    (501 when storage can't take direct uploads: post the file instead).
+    """
+    if request.method != 'POST':
+        return JsonResponse({"error": "POST a JSON body with filename and size."}, status=405)
+    if not direct_uploads_enabled():
+        return JsonResponse({"error": "Direct uploads are not available."}, status=501)
+    try:
+        body = json.loads(request.body or b"{}")
+        upload = start_upload(request.user, str(body.get("filename") or ""), int(body.get("size") or 0),
+                              request.headers.get("Origin"))
+    except (ValueError, TypeError, AttributeError):
+        return JsonResponse({"error": "POST a JSON body with filename and size."}, status=400)
+    except DirectUploadError as e:
+        return JsonResponse({"error": str(e)}, status=e.status)
+    return JsonResponse(upload)
+
+
 @csrf_exempt
 def parse_methods_html(request):
     if request.method == 'POST':
@@ -123,18 +134,13 @@ def parse_methods_html(request):
         if not pdf_file:
             return render(request, 'parsing/methods_text.html', {"methods_text": ""})
 
-        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
-            tmp.write(pdf_file.read())
-            tmp_path = tmp.name
-
         try:
-            # Basic extraction of methods text (including GROBID's formula text)
-            methods_text = grobid_extract_methods(tmp_path)
-        except Exception as e:
-            print(f"Error extracting methods: {e}")
-            methods_text = ""
+            # Methods text (including GROBID's formula text; OCR for scanned PDFs)
+            result = run_parse(["methods"], pdf_file, _compute_temp_file_hash(pdf_file))
+        except ServiceSaturated as e:
+            return _busy_response(e)
 
-        return render(request, 'parsing/methods_text.html', {"methods_text": methods_text})
+        return render(request, 'parsing/methods_text.html', {"methods_text": result.get("methods", "")})
     else:
         return render(request, 'parsing/upload_pdf_form.html')
 
@@ -150,15 +156,9 @@ def parse_tables_html(request):
         if not pdf_file:
             return render(request, 'parsing/tables_view.html', {"tables_json": "No file uploaded."})
 
-        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
-            tmp.write(pdf_file.read())
-            tmp_path = tmp.name
-
-        df_list = parse_tables_comprehensive(tmp_path, pages="all")
-        # Convert to JSON for demonstration
-        tables_json = tables_to_json(df_list)
+        result = run_parse(["tables"], pdf_file, _compute_temp_file_hash(pdf_file))
 
-        return render(request, 'parsing/tables_view.html', {"tables_json": tables_json})
+        return render(request, 'parsing/tables_view.html', {"tables_json": result.get("tables", tables_to_json([]))})
     else:
         return render(request, 'parsing/upload_pdf_form.html')
 
@@ -179,24 +179,15 @@ def parse_methods_and_tables_html(request):
                 "tables_json": "No file uploaded."
             })
 
-        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
-            tmp.write(pdf_file.read())
-            tmp_path = tmp.name
-
-        methods_text = ""
-        df_list = []
-
         try:
-            methods_text, df_list = parse_methods_and_tables(tmp_path, pages="all")
-        except Exception as e:
-            print(f"Error parsing methods/tables: {e}")
-
-        # Convert DataFrames to JSON for easy viewing
-        tables_json = tables_to_json(df_list)
+            # GROBID and tabula run side by side
+            result = run_parse(["methods", "tables"], pdf_file, _compute_temp_file_hash(pdf_file))
+        except ServiceSaturated as e:
+            return _busy_response(e)
 
         return render(request, 'parsing/methods_and_tables.html', {
-            "methods_text": methods_text,
-            "tables_json": tables_json
+            "methods_text": result.get("methods", ""),
+            "tables_json": result.get("tables", tables_to_json([])),
         })
     else:
         return render(request, 'parsing/upload_pdf_form.html')
@@ -254,67 +245,496 @@ def parse_methods_and_tables_html(request):
 @login_required
 def parse_methods_and_tables_summarize(request):
     if request.method == 'POST':
-        pdf_file = request.FILES.get('pdf_file')
-        if not pdf_file:
+        paper_obj, error = _uploaded_paper(request, 'methods_tables_only')
+        if error is not None:
+            return error
+        if paper_obj is None:
             return render(request, 'parsing/methods_tables_summary.html', {
                 "summary_text": "No file uploaded."
             })
 
-        temp_hash = _compute_temp_file_hash(pdf_file)
-        requested_parse = 'methods_tables_only'
-        existing_paper = Paper.objects.filter(owner=request.user, pdf_hash=temp_hash).first()
-
-        if existing_paper:
-            merged = _merge_parse_types(existing_paper.parse_type, requested_parse)
-            existing_paper.parse_type = merged
-            existing_paper.save()
-            paper_obj = existing_paper
-        else:
-            paper_obj = Paper.objects.create(
-                owner=request.user,
-                pdf_file=pdf_file,
-                pdf_hash=temp_hash,
-                parse_type=requested_parse
-            )
-
         # === DEBUG PRINT: Check storage backend being used ===
         #print("DEBUG => paper_obj.pdf_file.storage:", paper_obj.pdf_file.storage)
         #print("DEBUG => storage class:", type(paper_obj.pdf_file.storage))
 
-        methods_text, df_list = "", []
+        if request.POST.get('stream'):
+            return _streaming_summary_response(request, paper_obj, _wants_refresh(request))
+
+        with parse_lease(paper_obj.pdf_hash) as lease:
+            paper_obj.refresh_from_db()
+            return _summary_response(request, paper_obj, _wants_refresh(request) and not lease["waited"])
+
+    # For GET or no file
+    return render(request, 'parsing/upload_pdf_form.html')
+
+
+
+def _references_response(request, paper_obj, force_refresh):
+    """
+    Parses (or serves the stored) references of `paper_obj`. Runs under the
+    paper's single-flight lease, so no other worker is parsing this PDF.
+    """
+    # Re-upload of a paper whose references came from the current pipeline:
+    # serve the stored result instead of running GROBID and the LLM again
+    if not force_refresh:
+        # Another upload of the same PDF (by anyone) may already have parsed it
+        adopt_shared_artifacts(paper_obj, ["references"])
+    if not stale_artifacts(paper_obj, ["references"], force=force_refresh):
+        paper_obj.save()
+        inc("parse_cache_hits_total", artifact="references")
+        return render(request, 'parsing/references_table.html', {
+            "references": _load_json_list(paper_obj.references_json),
+            "paper": paper_obj,
+        })
+
+    # 1) Fetch the PDF from storage, 2) GROBID (references, plus the paper's
+    #    own title/author/year), then the LLM validity check
+    references_list = []
+    header = None
+    with collect_timings() as timings:
+        try:
+            result = run_parse(_references_needs(), paper_obj.pdf_file, paper_obj.pdf_hash, refresh=force_refresh)
+        except ServiceSaturated as e:
+            # Keep whatever was stored before and ask the client to retry
+            return _busy_response(e)
+    if "references" in result:
+        references_list, header = result["references"], paper_header(result)
+    complete = "references" in result and "references" not in result.degraded
+
+    _store_references(paper_obj, references_list, timings, result.get("pdf_path"), header, complete)
+
+    return render(request, 'parsing/references_table.html', {
+        "references": references_list,
+        "paper": paper_obj,
+    })
+
+
+def _store_references(paper_obj, references_list, timings, tmp_path, header=None, complete=False):
+    # 3) Give each reference the corpus-wide ID of the work it cites, and the
+    #    paper that of the work it is, which links papers in the citation graph
+    if header and header.get("title"):
+        paper_obj.title = header["title"][:255]
+    if getattr(settings, "REFERENCE_CANONICALIZATION", True):
         try:
-            # 1) Open the PDF from GCS (or local if dev), copy to a NamedTemporaryFile
-            paper_obj.pdf_file.open('rb')
-            with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as tmp:
-                for chunk in paper_obj.pdf_file.chunks():
-                    tmp.write(chunk)
-                tmp_path = tmp.name
-            paper_obj.pdf_file.close()
-
-            # 2) Parse methods & tables from tmp_path
-            methods_text, df_list = parse_methods_and_tables(tmp_path, pages="all")
-
-            # 3) Summarize with the LLM
-            tables_str = tables_to_json(df_list)
-            summary = summarize_methods_and_tables_with_chatgpt(methods_text, tables_str)
-
-            # 4) Save the results in the Paper record
-            paper_obj.methods_text = methods_text
-            paper_obj.tables_json = tables_str
-            paper_obj.summary_text = summary
+            if references_list:
+                canonicalize_references(references_list)
+            if header and header.get("title"):
+                paper_obj.canonical_id = canonicalize_references([dict(header)])[0]["canonical_id"] or ""
+        except Exception as e:
+            print(f"ERROR canonicalizing references: {e}")
+
+    # 4) Store references (and how long each stage took) in the Paper record.
+    #    Only a `complete` check (every LLM chunk answered) is stamped as
+    #    current; anything less is shown and stored, but parsed again next time
+    paper_obj.references_json = json.dumps(references_list)
+    paper_obj.references_consolidation = ''
+    paper_obj.parse_timings_json = _merge_timings(paper_obj.parse_timings_json, timings)
+    if complete:
+        stamp_versions(paper_obj, ["references"])
+    else:
+        clear_versions(paper_obj, ["references"])
+    paper_obj.save()
+    publish_shared_artifacts(paper_obj, ["references"])
+
+    # 5) The fast profiles skip GROBID's citation lookups; enrich the stored
+    #    references in the background so this response isn't held up by them
+    if complete and references_list and tmp_path and defers_consolidation():
+        schedule_reference_consolidation(paper_obj, tmp_path)
+
+
+def _references_needs(*artifacts):
+    """
+    What a references parse asks the pipeline for: the checked references
+    (or only `artifacts`), plus a local copy of the PDF for the background
+    consolidation pass when it runs.
+    """
+    needs = list(artifacts or ("bibliography", "header", "references"))
+    return needs + ["pdf_path"] if defers_consolidation() else needs
+
+
+def _streaming_references_response(request, paper_obj, force_refresh):
+    """
+    Chunked-HTML variant of the references page: the page shell goes out at
+    once, the references as soon as GROBID returns them, and a verdict for
+    each LLM chunk as it arrives. The parse itself is the same as in
+    _references_response and runs under the single-flight lease; if the
+    client goes away mid-stream the remaining LLM chunks are not requested.
+    """
+    response = StreamingHttpResponse(
+        _stream_references(request, paper_obj, force_refresh),
+        content_type="text/html; charset=utf-8",
+    )
+    # Keep proxies (nginx, Cloud Run's front end) from buffering the chunks
+    response["X-Accel-Buffering"] = "no"
+    response["Cache-Control"] = "no-cache"
+    return response
+
+
+def _stream_references(request, paper_obj, force_refresh):
+    started = time.monotonic()
+    yield render_to_string('parsing/references_stream_head.html', {"paper": paper_obj}, request)
+
+    with parse_lease(paper_obj.pdf_hash) as lease:
+        paper_obj.refresh_from_db()
+        force_refresh = force_refresh and not lease["waited"]
+        if not force_refresh:
+            adopt_shared_artifacts(paper_obj, ["references"])
+        if not stale_artifacts(paper_obj, ["references"], force=force_refresh):
             paper_obj.save()
+            inc("parse_cache_hits_total", artifact="references")
+            stored = _load_json_list(paper_obj.references_json)
+            yield render_to_string('parsing/references_stream_rows.html', {"references": stored})
+            yield render_to_string('parsing/references_stream_verdicts.html', {"valid": range(1, len(stored) + 1)})
+            yield render_to_string('parsing/references_stream_tail.html', {"paper": paper_obj, "kept": len(stored)})
+            return
 
-        except Exception as e:
-            print("Error parsing PDF for methods & tables:", e)
+        references_list = []
+        tmp_path = None
+        header = None
+        complete = False
+        with collect_timings() as timings:
+            try:
+                # GROBID's references (the LLM checks them below, chunk by chunk)
+                result = run_parse(_references_needs("bibliography", "header"), paper_obj.pdf_file,
+                                   paper_obj.pdf_hash, refresh=force_refresh)
+                tmp_path = result.get("pdf_path")
+                extracted, header = result["bibliography"][0], paper_header(result)
+
+                yield render_to_string('parsing/references_stream_rows.html', {"references": extracted})
+                observe("references_first_content_seconds", time.monotonic() - started)
+
+                complete = True
+                for start, chunk, validated_chunk in iter_reference_verdicts(extracted):
+                    # A chunk whose call failed is dropped unchecked
+                    complete = complete and validated_chunk is not None
+                    valid, invalid = _chunk_verdicts(start, chunk, validated_chunk)
+                    references_list.extend(valid_references(validated_chunk))
+                    yield render_to_string('parsing/references_stream_verdicts.html', {
+                        "valid": valid, "invalid": invalid,
+                    })
+
+            except ServiceSaturated as e:
+                yield render_to_string('parsing/references_stream_tail.html', {
+                    "paper": paper_obj, "busy": True, "retry_after": e.retry_after,
+                })
+                return
+            except Exception as e:
+                print("Error extracting references:", e)
+                complete = False
+
+        _store_references(paper_obj, references_list, timings, tmp_path, header, complete)
+    yield render_to_string('parsing/references_stream_tail.html', {"paper": paper_obj, "kept": len(references_list)})
+
+
+def _chunk_verdicts(start, chunk, validated_chunk):
+    """
+    Row numbers (1-based, in GROBID order) of one chunk that the LLM kept and
+    rejected. ChatGPT echoes the chunk in order, so verdicts are matched by
+    position, or by title when it dropped or merged entries. A chunk whose
+    call failed is rejected as a whole, like in the non-streaming filter.
+    """
+    rows = range(start + 1, start + len(chunk) + 1)
+    if validated_chunk is None:
+        return [], list(rows)
+    verdicts = [isinstance(ref, dict) and ref.get("valid") is True for ref in validated_chunk]
+    if len(validated_chunk) != len(chunk):
+        kept_titles = {_normalize_title(ref.get("title"))
+                       for ref, keep in zip(validated_chunk, verdicts) if keep}
+        verdicts = [_normalize_title(ref.get("title")) in kept_titles for ref in chunk]
+    valid = [row for row, keep in zip(rows, verdicts) if keep]
+    invalid = [row for row, keep in zip(rows, verdicts) if not keep]
+    return valid, invalid
+
+
+def _normalize_title(title):
+    return "".join(ch for ch in (title or "").lower() if ch.isalnum())
 
+
+def _summary_response(request, paper_obj, force_refresh):
+    """
+    Parses (or serves the stored) methods, tables and summary of `paper_obj`.
+    Runs under the paper's single-flight lease.
+    """
+    # Only recompute the artifacts stored by an older pipeline version
+    # (all of them for a new paper or when a refresh is forced)
+    if not force_refresh:
+        adopt_shared_artifacts(paper_obj, ["methods", "tables", "summary"])
+    stale = stale_artifacts(paper_obj, ["methods", "tables", "summary"], force=force_refresh)
+    if not stale:
+        paper_obj.save()
+        inc("parse_cache_hits_total", artifact="summary")
         return render(request, 'parsing/methods_tables_summary.html', {
             "summary_text": paper_obj.summary_text
         })
 
-    # For GET or no file
-    return render(request, 'parsing/upload_pdf_form.html')
+    with collect_timings() as timings:
+        try:
+            # Methods and tables (side by side) where stale, then the LLM summary
+            result = _parse_stale(paper_obj, stale, force_refresh)
+        except ServiceSaturated as e:
+            return _busy_response(e)
+        if "summary" in result:
+            paper_obj.summary_text = result["summary"]
+        if "summary" in result and "summary" not in result.degraded:
+            stamp_versions(paper_obj, ["summary"])
+        else:
+            clear_versions(paper_obj, ["summary"])
+
+    paper_obj.parse_timings_json = _merge_timings(paper_obj.parse_timings_json, timings)
+    paper_obj.save()
+    publish_shared_artifacts(paper_obj, ["methods", "tables", "summary"])
+
+    return render(request, 'parsing/methods_tables_summary.html', {
+        "summary_text": paper_obj.summary_text
+    })
+
+
+def _parse_stale(paper_obj, stale, force_refresh):
+    """
+    Runs the pipeline for the `stale` artifacts of `paper_obj`, feeding it the
+    stored (current) methods and tables, and puts the new methods and tables
+    on the paper, stamped unless degraded; the caller handles the summary
+    and saves. Returns the PipelineResult; raises ServiceSaturated.
+    """
+    stored = {artifact: getattr(paper_obj, ARTIFACT_FIELDS[artifact])
+              for artifact in ("methods", "tables") if artifact not in stale}
+    result = run_parse(sorted(stale), paper_obj.pdf_file, paper_obj.pdf_hash, stored, refresh=force_refresh)
+    for artifact in ("methods", "tables"):
+        if artifact in stale and artifact in result:
+            setattr(paper_obj, ARTIFACT_FIELDS[artifact], result[artifact])
+        if artifact in stale and artifact in result and artifact not in result.degraded:
+            stamp_versions(paper_obj, [artifact])
+        elif artifact in stale:
+            clear_versions(paper_obj, [artifact])
+    return result
+
+
+def _streaming_summary_response(request, paper_obj, force_refresh):
+    """
+    Chunked-HTML variant of the summary page: the summary is sent token by
+    token as the LLM generates it and saved on the paper once complete. If
+    the client disconnects, the OpenAI stream is closed so generation (and
+    billing) stops; the methods and tables parsed so far are still saved.
+    """
+    response = StreamingHttpResponse(
+        _stream_summary(request, paper_obj, force_refresh),
+        content_type="text/html; charset=utf-8",
+    )
+    response["X-Accel-Buffering"] = "no"
+    response["Cache-Control"] = "no-cache"
+    return response
+
+
+def _stream_summary(request, paper_obj, force_refresh):
+    yield render_to_string('parsing/summary_stream_head.html', {}, request)
+
+    with parse_lease(paper_obj.pdf_hash) as lease:
+        paper_obj.refresh_from_db()
+        force_refresh = force_refresh and not lease["waited"]
+        if not force_refresh:
+            adopt_shared_artifacts(paper_obj, ["methods", "tables", "summary"])
+        stale = stale_artifacts(paper_obj, ["methods", "tables", "summary"], force=force_refresh)
+        if not stale:
+            paper_obj.save()
+            inc("parse_cache_hits_total", artifact="summary")
+            yield escape(paper_obj.summary_text)
+            yield render_to_string('parsing/summary_stream_tail.html', {})
+            return
+
+        pieces = []
+        completed = False
+        with collect_timings() as timings:
+            try:
+                try:
+                    _parse_stale(paper_obj, stale - {"summary"}, force_refresh)
+                except ServiceSaturated as e:
+                    yield render_to_string('parsing/summary_stream_tail.html', {
+                        "busy": True, "retry_after": e.retry_after,
+                    })
+                    return
+
+                # 3) Summarize with the LLM, forwarding the text as it arrives
+                try:
+                    for piece in stream_summary_of_methods_and_tables(paper_obj.methods_text, paper_obj.tables_json):
+                        pieces.append(piece)
+                        yield escape(piece)
+                    completed = True
+                except ServiceSaturated as e:
+                    yield render_to_string('parsing/summary_stream_tail.html', {
+                        "busy": True, "retry_after": e.retry_after,
+                    })
+                    return
+                except Exception as e:
+                    print(f"Error calling OpenAI for methods/tables summary: {e}")
+                    paper_obj.summary_text = SUMMARY_FAILED_MESSAGE
+                    yield escape(SUMMARY_FAILED_MESSAGE)
+            finally:
+                # Also runs when the client went away (GeneratorExit at a yield);
+                # a partial summary is never stored. stamp_versions leaves a
+                # summary of degraded methods or tables unstamped.
+                if completed:
+                    paper_obj.summary_text = "".join(pieces).strip()
+                    stamp_versions(paper_obj, ["summary"])
+                else:
+                    clear_versions(paper_obj, ["summary"])
+                paper_obj.parse_timings_json = _merge_timings(paper_obj.parse_timings_json, timings)
+                paper_obj.save()
+                publish_shared_artifacts(paper_obj, ["methods", "tables", "summary"])
+
+    yield render_to_string('parsing/summary_stream_tail.html', {})
+
+
+def metrics(request):
+    """
+    Prometheus scrape endpoint: per-stage latency summaries (p50/p95/p99),
+    payload sizes and OpenAI token usage, of every worker with METRICS_DIR
+    set (see metrics.py). Only served with METRICS_TOKEN set, to scrapes
+    sending it as a bearer token.
+    """
+    token = getattr(settings, "METRICS_TOKEN", "")
+    if not token:
+        raise Http404
+    if not hmac.compare_digest(request.headers.get("Authorization", "").encode(), f"Bearer {token}".encode()):
+        response = HttpResponse("Unauthorized", status=401, content_type="text/plain; charset=utf-8")
+        response["WWW-Authenticate"] = "Bearer"
+        return response
+    return HttpResponse(render_prometheus(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def startup(request):
+    """
+    Startup/readiness probe: answers as soon as the worker can serve requests
+    and, on first call, starts the STARTUP_WARMUP tasks (JVM, GROBID token and
+    connection, heavy imports) in the background. With ?warm=1 (e.g. as Cloud
+    Run's startup probe) it answers 503 until they have finished, so traffic
+    only arrives once the worker is warm; failed tasks don't hold it back.
+    """
+    start_warmup()
+    ready = not (request.GET.get("warm") and warmup_pending())
+    return JsonResponse({"ready": ready, "warmup": warmup_status()}, status=200 if ready else 503)
 
 
+def _busy_response(exc):
+    """
+    503 returned when the GROBID or OpenAI admission limiter has no free slot.
+    """
+    response = HttpResponse("The parsing service is busy right now. Please retry shortly.", status=503)
+    response["Retry-After"] = str(exc.retry_after)
+    return response
+
+
+def _wants_refresh(request):
+    """
+    True when the client asked to ignore stored results ("Force re-parse"
+    checkbox on the upload form, or ?refresh=1).
+    """
+    value = request.POST.get('force_refresh') or request.GET.get('refresh') or ''
+    return value.lower() in ('1', 'true', 'on', 'yes')
+
+
+def _load_json_list(raw):
+    if not raw:
+        return []
+    try:
+        return json.loads(raw)
+    except ValueError:
+        return []
+
+
+def _merge_timings(existing_json, timings):
+    """
+    Merges this run's stage timings into the ones already stored on the paper,
+    so a references parse doesn't wipe out the timings of an earlier
+    methods/tables parse (and vice versa).
+    """
+    merged = {}
+    if existing_json:
+        try:
+            merged = json.loads(existing_json)
+        except ValueError:
+            merged = {}
+    merged.update(timings)
+    return json.dumps(merged)
+
+
+def _uploaded_paper(request, requested_parse):
+    """
+    The Paper for the PDF posted with a parse form, as (paper, None): either
+    the file itself (pdf_file) or a finished direct upload (upload_token and
+    sha256, see direct_upload.py). (None, None) without either, and
+    (None, response) when a direct upload is refused.
+    """
+    pdf_file = request.FILES.get('pdf_file')
+    if pdf_file:
+        return _get_or_create_paper(request.user, pdf_file, requested_parse), None
+    if not request.POST.get('upload_token'):
+        return None, None
+
+    try:
+        upload = finish_upload(request.user, request.POST['upload_token'], request.POST.get('sha256'))
+    except DirectUploadError as e:
+        return None, HttpResponse(str(e), status=e.status, content_type="text/plain; charset=utf-8")
+    try:
+        # The middleware couldn't count the pages of a file it never saw
+        rejection = charge_upload_pages(request, upload.path)
+    finally:
+        os.remove(upload.path)
+    if rejection is not None:
+        discard_upload(upload.object_name)
+        return None, rejection
+
+    paper_obj = _get_or_create_paper_for_hash(
+        request.user, upload.sha256, requested_parse,
+        lambda: adopt_stored_pdf(upload.sha256, upload.object_name, upload.size),
+    )
+    if paper_obj.pdf_file.name != upload.object_name:
+        # The PDF was already stored (for this owner or anyone): keep one copy
+        discard_upload(upload.object_name)
+    return paper_obj, None
+
+
+def _get_or_create_paper(owner, pdf_file, requested_parse):
+    """
+    Finds the owner's Paper for this upload (merging the requested parse type)
+    or creates one pointing at the shared content-addressed blob, so the PDF is
+    only stored once however many users upload it.
+    """
+    temp_hash = _compute_temp_file_hash(pdf_file)
+    return _get_or_create_paper_for_hash(owner, temp_hash, requested_parse,
+                                         lambda: acquire_blob(temp_hash, pdf_file))
+
+
+def _get_or_create_paper_for_hash(owner, temp_hash, requested_parse, acquire):
+    """
+    _get_or_create_paper for a PDF known by its hash; `acquire()` returns the
+    blob (with one more reference) when a new Paper is needed.
+    """
+    while True:
+        with transaction.atomic():
+            existing_paper = Paper.objects.select_for_update().filter(owner=owner, pdf_hash=temp_hash).first()
+            if existing_paper:
+                merged = _merge_parse_types(existing_paper.parse_type, requested_parse)
+                if merged != existing_paper.parse_type:
+                    existing_paper.parse_type = merged
+                    existing_paper.save(update_fields=['parse_type', 'updated_at'])
+                return existing_paper
+
+        blob = acquire()
+        try:
+            with transaction.atomic():
+                return Paper.objects.create(
+                    owner=owner,
+                    pdf_file=blob.pdf_file.name,
+                    pdf_hash=temp_hash,
+                    blob=blob,
+                    parse_type=requested_parse
+                )
+        except IntegrityError:
+            # A concurrent upload of the same PDF by this owner created the
+            # Paper first (unique owner + pdf_hash); drop our blob reference
+            # and merge into theirs on the next pass
+            release_blob(blob.pk)
+
 
 def _merge_parse_types(existing_type, new_type):
     if existing_type == new_type:
@@ -332,3 +752,7 @@ def _compute_temp_file_hash(uploaded_file):
     for chunk in uploaded_file.chunks():
         hasher.update(chunk)
     return hasher.hexdigest()
+
+
+describe("references_first_content_seconds", "summary",
+         "Streaming references page: time from request to the extracted references being sent.")
@@ -0,0 +1,101 @@
+import threading
+
+from django.conf import settings
+
+from .background import run_in_background
+from .metrics import describe, inc, stage_timer
+
+_status = {}
+_status_lock = threading.Lock()
+
+
+def warm_imports():
+    """
+    The heavy modules the parse paths import lazily, and the OpenAI client.
+    """
+    import google.auth  # noqa: F401
+    import lxml.etree  # noqa: F401
+    import pandas  # noqa: F401
+    import tabula  # noqa: F401
+
+    from .ai_postprocess import get_openai_client
+    from .reference_index import minhash_signature
+
+    get_openai_client()
+    minhash_signature({"warm"})
+
+
+def warm_jvm():
+    """
+    Starts tabula's JVM where tables will be extracted: in each pool worker
+    with TABULA_WORKERS > 1, else in this process.
+    """
+    from .process_pool import get_process_pool
+    from .table_extraction import warm_tabula
+
+    width = getattr(settings, "TABULA_WORKERS", 1)
+    if width > 1:
+        # One task per worker; the pool spawns as many workers as tasks queued
+        list(get_process_pool("tabula", width).map(warm_tabula, range(width)))
+    else:
+        warm_tabula()
+
+
+def warm_grobid():
+    """
+    The GROBID ID token and a pooled connection to GROBID (see grobid_client.py).
+    """
+    from .grobid_client import warm_grobid_connection
+
+    warm_grobid_connection()
+
+
+WARMUP_TASKS = {
+    "imports": warm_imports,
+    "jvm": warm_jvm,
+    "grobid": warm_grobid,
+}
+
+
+def start_warmup():
+    """
+    Starts the STARTUP_WARMUP tasks on the background pool, once per worker
+    (later calls only report on them). Unknown task names are reported as
+    such rather than failing the probe that triggered the warm-up.
+    """
+    with _status_lock:
+        tasks = [name for name in getattr(settings, "STARTUP_WARMUP", []) if name not in _status]
+        for name in tasks:
+            _status[name] = "running" if name in WARMUP_TASKS else "unknown task"
+    for name in tasks:
+        if name in WARMUP_TASKS:
+            run_in_background(_run_warmup, name)
+
+
+def warmup_status():
+    """
+    {task: "running" | "done" | "failed: <error>" | "unknown task"}
+    """
+    with _status_lock:
+        return dict(_status)
+
+
+def warmup_pending():
+    return any(state == "running" for state in warmup_status().values())
+
+
+def _run_warmup(name):
+    try:
+        with stage_timer(f"warmup_{name}"):
+            WARMUP_TASKS[name]()
+        state = "done"
+        inc("startup_warmup_total", task=name, outcome="ok")
+    except Exception as e:
+        print(f"Warm-up task {name} failed: {e}")
+        state = f"failed: {e}"
+        inc("startup_warmup_total", task=name, outcome="error")
+    with _status_lock:
+        _status[name] = state
+
+
+describe("startup_warmup_total", "counter", "Startup warm-up tasks run by this worker, by task and outcome.")
@@ -27,7 +27,7 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = os.environ.get('DJANGO_SECRET_KEY', 'fallback_key')
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = os.environ.get("DJANGO_DEBUG", "1") == "1"
 
 ALLOWED_HOSTS = ["*"]
 
@@ -91,6 +91,9 @@ MIDDLEWARE = [
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'allauth.account.middleware.AccountMiddleware',
+    # Needs request.user, so after AuthenticationMiddleware
+    'ResearchParsing.parsing.rate_limits.RateLimitMiddleware',
+    'ResearchParsing.parsing.lanes.ParseLaneMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -122,7 +125,17 @@ WSGI_APPLICATION = 'ResearchParsing.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.environ.get('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+        'OPTIONS': {
+            # Concurrent uploads (and the parse leases) write from several workers:
+            # wait for the write lock instead of failing with "database is locked"
+            'timeout': 20,
+            'transaction_mode': 'IMMEDIATE',
+        },
+        'TEST': {
+            # A file rather than in-memory, so threaded tests get real locking
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
@@ -137,6 +150,37 @@ DATABASES = {
 #     }
 # }
 
+# Rendered paper page fragments (papers/fragments.py). Entries are keyed by the
+# paper's updated_at, so a per-worker cache never serves a stale rendering.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'researchparsing',
+        'OPTIONS': {'MAX_ENTRIES': 2000},
+    },
+    # Rate-limit buckets and quotas (parsing/rate_limits.py) must be shared by
+    # every worker: Redis when RATE_LIMIT_REDIS_URL is set, else a database
+    # table (created by `manage.py createcachetable`, which the Docker image
+    # runs on start)
+    'ratelimit': (
+        {'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+         'LOCATION': os.environ['RATE_LIMIT_REDIS_URL']}
+        if os.environ.get('RATE_LIMIT_REDIS_URL') else
+        {'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+         'LOCATION': 'rate_limit_cache'}
+    ),
+    # Parse pipeline stage results (parsing/pipeline.py), keyed by content;
+    # per worker unless PIPELINE_REDIS_URL points all workers at one Redis
+    'pipeline': (
+        {'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+         'LOCATION': os.environ['PIPELINE_REDIS_URL']}
+        if os.environ.get('PIPELINE_REDIS_URL') else
+        {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+         'LOCATION': 'parse-pipeline',
+         'OPTIONS': {'MAX_ENTRIES': 500}}
+    ),
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -175,7 +219,7 @@ USE_TZ = True
 STATIC_URL = 'static/'
 
 MEDIA_URL = '/media/'
-MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+MEDIA_ROOT = os.environ.get('MEDIA_ROOT', os.path.join(BASE_DIR, 'media'))
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
@@ -195,8 +239,175 @@ STORAGES = {
     }
 }
 
+# Local runs (e.g. the load test) keep uploads on disk under MEDIA_ROOT instead of GCS
+if os.environ.get("LOCAL_MEDIA_STORAGE") == "1":
+    STORAGES["default"] = {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+        "OPTIONS": {"location": MEDIA_ROOT},
+    }
+
+# Direct-to-GCS uploads (parsing/direct_upload.py): the upload form sends PDFs
+# straight to the bucket over a resumable session the app opens, then posts a
+# signed token for the object (valid DIRECT_UPLOAD_TTL seconds) with the PDF's
+# sha256. Needs the GCS backend, or its local stand-in with STORAGE_EMULATOR_HOST
+# (parsing/stubs.py), and a bucket CORS rule allowing PUT from the site's origin
+# with "Range" among the response headers.
+DIRECT_UPLOADS = os.environ.get("DIRECT_UPLOADS", "1") == "1"
+DIRECT_UPLOAD_MAX_BYTES = int(os.environ.get("DIRECT_UPLOAD_MAX_BYTES", str(200 * 2 ** 20)))
+DIRECT_UPLOAD_TTL = int(os.environ.get("DIRECT_UPLOAD_TTL", "86400"))
+
 SECURE_PROXY_SSL_HEADER = ("HTTP_X_FORWARDED_PROTO", "https")
 SESSION_COOKIE_SECURE = True
 CSRF_COOKIE_SECURE = True
 
-GROBID_BASE_URL = "https://grobid-service-86753116809.us-east1.run.app"
+GROBID_BASE_URL = os.environ.get("GROBID_BASE_URL", "https://grobid-service-86753116809.us-east1.run.app")
+# Several GROBID instances (parsing/grobid_pool.py), comma-separated; calls go
+# to the healthy one with the fewest outstanding. Defaults to GROBID_BASE_URL.
+# GROBID_TOKEN_AUDIENCES ("<base URL>=<audience>,...") sets an instance's ID
+# token audience when it isn't its base URL.
+GROBID_BASE_URLS = [u.strip() for u in os.environ.get("GROBID_BASE_URLS", "").split(",") if u.strip()]
+GROBID_TOKEN_AUDIENCES = {
+    url.strip(): audience.strip()
+    for url, _, audience in (a.partition("=") for a in os.environ.get("GROBID_TOKEN_AUDIENCES", "").split(","))
+    if url.strip() and audience.strip()
+}
+# With several instances, one worker at a time probes them every
+# GROBID_PROBE_INTERVAL seconds (0 = only ejected by failing calls); an
+# instance failing GROBID_EJECT_AFTER probes or calls in a row, or answering
+# probes slower than GROBID_PROBE_SLOW, is left out for GROBID_EJECT_SECONDS
+# (doubling while it keeps failing)
+GROBID_PROBE_INTERVAL = float(os.environ.get("GROBID_PROBE_INTERVAL", "10"))
+GROBID_PROBE_TIMEOUT = float(os.environ.get("GROBID_PROBE_TIMEOUT", "5"))
+GROBID_PROBE_SLOW = float(os.environ.get("GROBID_PROBE_SLOW", "2"))
+GROBID_EJECT_AFTER = int(os.environ.get("GROBID_EJECT_AFTER", "2"))
+GROBID_EJECT_SECONDS = float(os.environ.get("GROBID_EJECT_SECONDS", "30"))
+# Send a Google ID token with GROBID calls (the Cloud Run service is private);
+# off for a local GROBID
+GROBID_AUTH = os.environ.get("GROBID_AUTH", "1") == "1"
+
+# GROBID extraction profile: "fast", "standard" or "full" (see parsing/grobid_profiles.py)
+GROBID_PROFILE = os.environ.get("GROBID_PROFILE", "standard")
+
+# Return unconsolidated references right away and run GROBID's citation
+# consolidation as a background enrichment pass (parsing/consolidation.py)
+GROBID_DEFER_CONSOLIDATION = os.environ.get("GROBID_DEFER_CONSOLIDATION", "1") == "1"
+BACKGROUND_WORKERS = int(os.environ.get("BACKGROUND_WORKERS", "2"))
+# A consolidation still pending after this many seconds was lost (worker
+# recycled, CPU throttled) and is shown as failed
+GROBID_CONSOLIDATION_TIMEOUT = int(os.environ.get("GROBID_CONSOLIDATION_TIMEOUT", "1800"))
+
+# Admission control in front of GROBID (see parsing/grobid_limiter.py).
+# The cap is shared by all gunicorn workers through a state file in this directory
+# and adapts (AIMD) between the min and max from observed latency and errors;
+# the initial and max values are per healthy GROBID instance.
+GROBID_LIMITER_STATE_DIR = os.environ.get("GROBID_LIMITER_STATE_DIR", "")
+GROBID_CONCURRENCY_MIN = int(os.environ.get("GROBID_CONCURRENCY_MIN", "1"))
+GROBID_CONCURRENCY_MAX = int(os.environ.get("GROBID_CONCURRENCY_MAX", "16"))
+GROBID_CONCURRENCY_INITIAL = int(os.environ.get("GROBID_CONCURRENCY_INITIAL", "4"))
+GROBID_TARGET_LATENCY = float(os.environ.get("GROBID_TARGET_LATENCY", "30"))
+GROBID_QUEUE_TIMEOUT = float(os.environ.get("GROBID_QUEUE_TIMEOUT", "30"))
+
+# Single-flight parsing (parsing/single_flight.py): how long a duplicate upload
+# waits for the in-progress parse of the same PDF, and when a lease left by a
+# crashed worker may be taken over
+PARSE_LEASE_WAIT_TIMEOUT = float(os.environ.get("PARSE_LEASE_WAIT_TIMEOUT", "600"))
+PARSE_LEASE_SECONDS = int(os.environ.get("PARSE_LEASE_SECONDS", "900"))
+
+# Page-sharded table extraction (parsing/table_extraction.py): processes in the
+# tabula pool (1 = parse in the request's process) and the page count below
+# which a document isn't worth splitting. Every pool process hosts its own JVM.
+TABULA_WORKERS = int(os.environ.get("TABULA_WORKERS", "1"))
+TABULA_SHARD_MIN_PAGES = int(os.environ.get("TABULA_SHARD_MIN_PAGES", "8"))
+# Pages per tabula call: tables are extracted, serialized and released chunk
+# by chunk, so this bounds the DataFrames held at once (smaller = less memory,
+# more calls)
+TABULA_CHUNK_PAGES = int(os.environ.get("TABULA_CHUNK_PAGES", "8"))
+
+# Only send pages with table evidence (captions, ruling lines, aligned columns)
+# to tabula; see parsing/table_prepass.py and `manage.py evaluate_table_prepass`
+TABLE_PREPASS = os.environ.get("TABLE_PREPASS", "1") == "1"
+
+# OCR fallback for scanned PDFs (parsing/ocr.py): image-only pages (fewer text
+# characters than OCR_MIN_CHARS) are rasterized at OCR_DPI and run through
+# tesseract on a pool of OCR_WORKERS processes; results are cached per page
+OCR_ENABLED = os.environ.get("OCR_ENABLED", "1") == "1"
+OCR_WORKERS = int(os.environ.get("OCR_WORKERS", "2"))
+OCR_DPI = int(os.environ.get("OCR_DPI", "300"))
+OCR_LANGUAGE = os.environ.get("OCR_LANGUAGE", "eng")
+OCR_MIN_CHARS = int(os.environ.get("OCR_MIN_CHARS", "20"))
+
+# Give every stored reference the corpus-wide canonical_id of the work it cites
+# (MinHash/LSH over titles, blocked by year and first-author surname; see
+# parsing/reference_index.py and `manage.py benchmark_reference_index`)
+REFERENCE_CANONICALIZATION = os.environ.get("REFERENCE_CANONICALIZATION", "1") == "1"
+
+# JSON API (papers/views.py api_*): largest bulk request, and compression of
+# responses of at least COMPRESS_MIN_BYTES (brotli needs the Brotli package)
+API_MAX_PAPERS = int(os.environ.get("API_MAX_PAPERS", "500"))
+COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", "1024"))
+BROTLI_QUALITY = int(os.environ.get("BROTLI_QUALITY", "5"))
+
+# Admission control for the parse endpoints (parsing/rate_limits.py): a token
+# bucket per user (or client address) and endpoint, as (burst, refills per
+# minute), plus daily quotas of uploaded PDF pages and OpenAI tokens (0 = off).
+# RATE_LIMIT_PROXY_HOPS: proxies in front of the app that append the client
+# address to X-Forwarded-For (1 on Cloud Run)
+_parse_burst = int(os.environ.get("RATE_LIMIT_BURST", "5"))
+_parse_per_minute = float(os.environ.get("RATE_LIMIT_PER_MINUTE", "10"))
+PARSE_RATE_LIMITS = {
+    'parsing:parse_references_html': (_parse_burst, _parse_per_minute),
+    'parsing:parse_methods_html': (_parse_burst, _parse_per_minute),
+    'parsing:parse_methods_and_tables_html': (_parse_burst, _parse_per_minute),
+    # Every request runs an OpenAI summary
+    'parsing:parse_methods_and_tables_summarize': (_parse_burst, _parse_per_minute / 2),
+}
+DAILY_PAGE_QUOTA = int(os.environ.get("DAILY_PAGE_QUOTA", "3000"))
+DAILY_TOKEN_QUOTA = int(os.environ.get("DAILY_TOKEN_QUOTA", "2000000"))
+RATE_LIMIT_CACHE = os.environ.get("RATE_LIMIT_CACHE", "ratelimit")
+RATE_LIMIT_PROXY_HOPS = int(os.environ.get("RATE_LIMIT_PROXY_HOPS", "0"))
+
+# Prometheus metrics (parsing/metrics.py): /metrics is only served to scrapes
+# sending METRICS_TOKEN as a bearer token. With METRICS_DIR, every gunicorn
+# worker writes its series there every METRICS_FLUSH_SECONDS and a scrape
+# renders them all; without it, a scrape only sees the worker serving it
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+METRICS_DIR = os.environ.get("METRICS_DIR", "")
+METRICS_FLUSH_SECONDS = float(os.environ.get("METRICS_FLUSH_SECONDS", "5"))
+
+# Warm-up started by the first call of the /startup probe (parsing/warmup.py),
+# comma-separated: "imports" (pandas, tabula, openai...), "jvm" (tabula's JVM,
+# in each pool worker with TABULA_WORKERS > 1) and "grobid" (ID token and a
+# pooled connection). GROBID ID tokens are reused for GROBID_TOKEN_TTL seconds.
+STARTUP_WARMUP = [t.strip() for t in os.environ.get("STARTUP_WARMUP", "").split(",") if t.strip()]
+GROBID_TOKEN_TTL = int(os.environ.get("GROBID_TOKEN_TTL", "3000"))
+
+# Parse pipeline (parsing/pipeline.py, stages in parsing/stages.py): threads
+# running independent stages side by side (1 = one stage at a time), and the
+# cache alias and lifetime of stage results
+PIPELINE_WORKERS = int(os.environ.get("PIPELINE_WORKERS", "4"))
+PIPELINE_CACHE = os.environ.get("PIPELINE_CACHE", "pipeline")
+PIPELINE_CACHE_TTL = int(os.environ.get("PIPELINE_CACHE_TTL", "86400"))
+
+# Priority lanes (parsing/lanes.py): GROBID and OpenAI slots go to interactive
+# requests first, and bulk work (background tasks, requests sent with
+# "X-Parse-Lane: bulk" or by PARSE_BULK_USERS) never takes the reserved share
+# of the cap. Within a lane slots are shared between users by weight
+# ("user:7=4,user:12=0.5"; identities are "user:<pk>" or "ip:<address>",
+# default weight 1). Bulk calls wait up to
+# PARSE_BULK_QUEUE_TIMEOUT seconds for a slot.
+PARSE_INTERACTIVE_RESERVE = float(os.environ.get("PARSE_INTERACTIVE_RESERVE", "0.25"))
+PARSE_BULK_QUEUE_TIMEOUT = float(os.environ.get("PARSE_BULK_QUEUE_TIMEOUT", "600"))
+PARSE_BULK_USERS = [u.strip() for u in os.environ.get("PARSE_BULK_USERS", "").split(",") if u.strip()]
+PARSE_USER_WEIGHTS = {
+    user.strip(): float(weight)
+    for user, _, weight in (w.rpartition("=") for w in os.environ.get("PARSE_USER_WEIGHTS", "").split(","))
+    if user.strip()
+}
+
+# Admission control in front of OpenAI, like GROBID's (state file in
+# GROBID_LIMITER_STATE_DIR)
+OPENAI_CONCURRENCY_MIN = int(os.environ.get("OPENAI_CONCURRENCY_MIN", "1"))
+OPENAI_CONCURRENCY_MAX = int(os.environ.get("OPENAI_CONCURRENCY_MAX", "32"))
+OPENAI_CONCURRENCY_INITIAL = int(os.environ.get("OPENAI_CONCURRENCY_INITIAL", "8"))
+OPENAI_TARGET_LATENCY = float(os.environ.get("OPENAI_TARGET_LATENCY", "60"))
+OPENAI_QUEUE_TIMEOUT = float(os.environ.get("OPENAI_QUEUE_TIMEOUT", "60"))
@@ -17,12 +17,15 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 from .views import home
+from .parsing.views import metrics, startup
 from django.conf import settings
 from django.conf.urls.static import static
 
 urlpatterns = [
     path('', home, name='home'),  # root URL
     path('admin/', admin.site.urls),
+    path('metrics', metrics, name='metrics'),  # Prometheus scrape endpoint
+    path('startup', startup, name='startup'),  # startup/readiness probe (optional warm-up)
     # Include the parsing app's URLs
     path('api/parsing/', include('ResearchParsing.parsing.urls')),
     path('accounts/', include('allauth.urls')),